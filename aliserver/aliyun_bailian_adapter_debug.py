@@ -1,7 +1,8 @@
 import os
 import json
+import inspect
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
 from langchain_community.vectorstores import FAISS
 from langchain_core.example_selectors import SemanticSimilarityExampleSelector
 from dotenv import load_dotenv
@@ -12,6 +13,21 @@ from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import threading
 from datetime import datetime
+from itertools import islice
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from server_common.command_loader import CommandTable, load_command_file
+from server_common.command_types import parse_command_types
+from server_common.pagination import list_response
+from server_common.single_flight import SingleFlight
+from server_common.responses import (INDEX_VERSION_HEADER, enable_compression, enable_server_timing,
+                                    install_fast_json, record_timing, wants_compact)
+from server_common.admission import AdmissionController, DeadlineExceeded, admission_required, expired, remaining
+from server_common.popularity import PopularityStore
+from server_common.index_generations import (
+    GenerationStore, commands_digest, evaluate, load_eval_queries, passes_eval, sample_eval_queries
+)
 
 # 加载环境变量
 load_dotenv()
@@ -24,16 +40,67 @@ logger = logging.getLogger(__name__)
 
 # 初始化嵌入模型 - 使用DashScope
 DASHSCOPE_API_KEY = os.getenv('DASHSCOPE_API_KEY')
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-v2')
+
+# 查询嵌入持久化缓存配置
+QUERY_EMBEDDING_CACHE_FILE = os.getenv(
+    'QUERY_EMBEDDING_CACHE_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_embeddings.sqlite3')
+)
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('QUERY_EMBEDDING_CACHE_MAX_ENTRIES', '20000'))
+
+# 索引版本与模型迁移配置
+INDEX_DIR = os.getenv('INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embeddings'))
+EVAL_QUERIES_FILE = os.getenv(
+    'EVAL_QUERIES_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'eval_queries.txt')
+)  # 每行: 查询文本|期望命令名
+EVAL_TOP_K = 5
+MIGRATION_MAX_REGRESSION = float(os.getenv('MIGRATION_MAX_REGRESSION', '0.02'))
+
+# 较新的 langchain-community 加载 FAISS 索引时必须传 allow_dangerous_deserialization（索引文件由本服务生成），
+# requirements.txt 固定的旧版本不认识这个参数，传入会抛出 TypeError
+FAISS_LOAD_KWARGS = (
+    {'allow_dangerous_deserialization': True}
+    if 'allow_dangerous_deserialization' in inspect.signature(FAISS.load_local).parameters else {}
+)
+
+# 响应编码：orjson 序列化 + gzip/deflate 压缩
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))  # 小于该字节数的响应不压缩
+install_fast_json(app)
+enable_server_timing(app)
+enable_compression(app, min_size=COMPRESS_MIN_SIZE)
+
+# 查询准入控制：超过并发数的查询排队，队列满或排队超时返回 429
+QUERY_MAX_CONCURRENT = int(os.getenv('QUERY_MAX_CONCURRENT', '4'))
+QUERY_MAX_QUEUE = int(os.getenv('QUERY_MAX_QUEUE', '16'))
+QUERY_QUEUE_TIMEOUT = float(os.getenv('QUERY_QUEUE_TIMEOUT', '5'))  # 最长排队时间（秒）
+QUERY_DEADLINE_SECONDS = float(os.getenv('QUERY_DEADLINE_SECONDS', '30'))  # 单个查询的截止时间（秒）
+query_admission = AdmissionController(QUERY_MAX_CONCURRENT, QUERY_MAX_QUEUE, QUERY_QUEUE_TIMEOUT)
+
+# 命令热度：使用次数和反馈计数，检索时可按热度先验调整排序
+POPULARITY_DB = os.getenv(
+    'POPULARITY_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user_codes', 'popularity.sqlite3')
+)
+POPULARITY_WEIGHT = float(os.getenv('POPULARITY_WEIGHT', '0'))  # 热度先验的权重，0 表示只按相似度排序
+POPULARITY_POOL_FACTOR = 3  # 启用热度先验时多取的候选倍数
+POPULAR_TOP_N = int(os.getenv('POPULAR_TOP_N', '100'))  # 每个分类预先排好的热门命令数
+popularity = PopularityStore(POPULARITY_DB, top_n=POPULAR_TOP_N)
 
 if DASHSCOPE_API_KEY:
     # 显式设置DashScope API密钥
     import dashscope
     dashscope.api_key = DASHSCOPE_API_KEY
     
-    # 使用DashScope的嵌入模型
+    # 使用DashScope的嵌入模型，查询向量经过持久化缓存，相同查询不重复计费
     from langchain_community.embeddings import DashScopeEmbeddings
-    embeddings = DashScopeEmbeddings(model="text-embedding-v2")
-    logger.info("使用 DashScope 嵌入模型")
+    from query_embedding_cache import QueryEmbeddingCache, CachedQueryEmbeddings
+    query_embedding_cache = QueryEmbeddingCache(QUERY_EMBEDDING_CACHE_FILE, QUERY_EMBEDDING_CACHE_MAX_ENTRIES)
+    embeddings = CachedQueryEmbeddings(
+        DashScopeEmbeddings(model=EMBEDDING_MODEL), EMBEDDING_MODEL, query_embedding_cache
+    )
+    logger.info(f"使用 DashScope 嵌入模型: {EMBEDDING_MODEL}（查询缓存: {QUERY_EMBEDDING_CACHE_FILE}）")
 else:
     # 如果没有DASHSCOPE_API_KEY，抛出错误
     logger.error("DASHSCOPE_API_KEY 环境变量未设置")
@@ -52,68 +119,50 @@ class FileChangeHandler(FileSystemEventHandler):
             time.sleep(0.5)
             self.update_callback()
 
+# 用户代码的命令类型名（本地 Ollama 服务端的 user_code 对应这里的 user_program）
+USER_CODE_TYPE = 'user_program'
+
 class CommandVectorDB:
-    def __init__(self, file_paths):
+    """命令向量库
+
+    FAISS 索引按版本保存在 INDEX_DIR 下，每个版本记录所用的嵌入模型；启动时直接加载当前版本，
+    不再每次重新调用 DashScope 建库。更换 EMBEDDING_MODEL 后旧版本继续服务，
+    新模型的版本在后台建立并通过评测后再切换。
+    """
+
+    def __init__(self, file_paths, index_dir=None):
         self.file_paths = file_paths
-        self.db = None
-        self.commands_data = {}  # 存储完整的命令数据
-        self.load_and_create_vector_db()
+        self.store = GenerationStore(index_dir or INDEX_DIR)
+        self.db = None  # 命令类型 -> FAISS 子索引
+        self.commands_data = []  # 存储完整的命令数据（按命令名+描述去重）
+        self.table = CommandTable()
+        self.model = EMBEDDING_MODEL  # 当前版本使用的嵌入模型
+        self.generation = None  # 当前版本ID
+        self.migration = {'status': 'idle'}  # 模型迁移进度
+        self.flights = SingleFlight()  # 合并同时到达的相同查询
+        self._embedders = {EMBEDDING_MODEL: embeddings}
+        self._state_lock = threading.Lock()  # 保护 db/model/commands_data 的整体替换
+        self._build_lock = threading.Lock()  # 重建、迁移、回滚互斥
+        self._load_or_create_vector_db()
         self.start_watching_files()
 
-    def load_and_create_vector_db(self):
-        texts = []
-        metadatas = []
-        
-        # 记录找到的命令数量
-        total_commands = 0
-        
+    def _embedder(self, model):
+        """指定模型的嵌入对象（查询向量同样经过持久化缓存）"""
+        embedder = self._embedders.get(model)
+        if embedder is None:
+            embedder = CachedQueryEmbeddings(DashScopeEmbeddings(model=model), model, query_embedding_cache)
+            self._embedders[model] = embedder
+        return embedder
+
+    def _load_table(self):
+        """加载所有命令库文件"""
+        table = CommandTable()
         for file_path in self.file_paths:
             abs_file_path = os.path.abspath(file_path)
-            logger.info(f"正在检查文件: {abs_file_path} (存在: {os.path.exists(abs_file_path)})")
-            
             if os.path.exists(abs_file_path):
-                logger.info(f"文件存在，开始读取...")
-                with open(abs_file_path, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    logger.info(f"文件 {abs_file_path} 包含 {len(lines)} 行")
-                    
-                    for line_num, line in enumerate(lines, 1):
-                        line = line.strip()
-                        if line and not line.startswith('#'):  # 忽略注释行
-                            logger.debug(f"处理第 {line_num} 行: {line[:50]}...")  # 只打印前50个字符
-                            
-                            # 解析命令行 - 优先处理竖线分隔符
-                            parsed_data = self._parse_line_detailed(line)
-                            
-                            if parsed_data['command'] and parsed_data['description']:
-                                logger.info(f"成功解析命令: {parsed_data['command']} - {parsed_data['description'][:30]}...")
-                                
-                                # 创建更丰富的文本表示以提高搜索准确性
-                                base_text = f"{parsed_data['command']} {parsed_data['description']}"
-                                
-                                # 根据描述添加相关关键词
-                                enhanced_text = self._enhance_text_with_keywords(base_text, parsed_data['description'])
-                                
-                                texts.append(enhanced_text)
-                                
-                                metadata = {
-                                    'command': parsed_data['command'],
-                                    'description': parsed_data['description'],
-                                    'filename': parsed_data['filename'],
-                                    'timestamp': parsed_data['timestamp'],
-                                    'command_type': parsed_data.get('command_type', 'basic'),
-                                    'source_file': file_path,
-                                    'line_number': line_num
-                                }
-                                metadatas.append(metadata)
-                                
-                                # 保存完整数据用于后续检索
-                                cmd_key = f"{parsed_data['command']}_{parsed_data['description']}"
-                                self.commands_data[cmd_key] = metadata
-                                
-                                total_commands += 1
-                            else:
-                                logger.warning(f"无法解析第 {line_num} 行: {line}")
+                loaded_before = len(table)
+                load_command_file(abs_file_path, table)
+                logger.info(f"已加载 {abs_file_path}: {len(table) - loaded_before} 个命令")
             else:
                 logger.warning(f"文件不存在: {abs_file_path}")
                 # 检查当前目录下的所有文件
@@ -121,31 +170,231 @@ class CommandVectorDB:
                 logger.info(f"当前工作目录: {current_dir}")
                 logger.info(f"当前目录内容: {os.listdir(current_dir) if os.path.exists(current_dir) else '目录不存在'}")
                 
-                # 检查上级目录
-                parent_dir = os.path.dirname(current_dir)
-                logger.info(f"上级目录内容: {os.listdir(parent_dir) if os.path.exists(parent_dir) else '目录不存在'}")
-                
                 # 检查 user_codes 目录
                 user_codes_dir = os.path.join(current_dir, 'user_codes')
                 if os.path.exists(user_codes_dir):
                     logger.info(f"user_codes 目录内容: {os.listdir(user_codes_dir)}")
                 else:
                     logger.info(f"user_codes 目录不存在: {user_codes_dir}")
+        return table
+
+    def _build_documents(self, table):
+        """按命令类型分组生成建库文本和元数据，并返回去重后的命令数据"""
+        texts_by_type = {}
+        metadatas_by_type = {}
+        commands_data = {}
         
-        if texts:
-            logger.info(f"开始创建向量数据库，共 {len(texts)} 个命令...")
-            self.db = FAISS.from_texts(texts, embeddings, metadatas=metadatas)
-            logger.info(f"向量数据库创建完成，包含 {len(texts)} 个命令")
+        for i in range(len(table)):
+            command = table.commands[i]
+            description = table.descriptions[i]
+            command_type = table.types[i]
             
-            # 输出所有加载的命令供调试
-            logger.info("已加载的命令列表:")
-            for i, meta in enumerate(metadatas[:10]):  # 只显示前10个
-                logger.info(f"  {i+1}. {meta['command']} - {meta['description'][:50]}...")
-            if len(metadatas) > 10:
-                logger.info(f"  ... 还有 {len(metadatas) - 10} 个命令")
-        else:
+            # 创建更丰富的文本表示以提高搜索准确性，根据描述添加相关关键词
+            enhanced_text = self._enhance_text_with_keywords(f"{command} {description}", description)
+            texts_by_type.setdefault(command_type, []).append(enhanced_text)
+            
+            metadata = {
+                'command': command,
+                'description': description,
+                'filename': table.filenames[i],
+                'timestamp': table.timestamps[i],
+                'command_type': command_type,
+                'source_file': table.source_file(i)
+            }
+            metadatas_by_type.setdefault(command_type, []).append(metadata)
+            
+            # 保存完整数据用于后续检索
+            commands_data[f"{command}_{description}"] = metadata
+        
+        return texts_by_type, metadatas_by_type, list(commands_data.values())
+
+    def _set_index(self, table, type_dbs, commands_data, model, generation):
+        """整体替换检索所用的数据，检索线程只会看到完整的旧版本或新版本"""
+        with self._state_lock:
+            self.table = table
+            self.db = type_dbs
+            self.commands_data = commands_data
+            self.model = model
+            self.generation = generation
+
+    def _snapshot(self):
+        with self._state_lock:
+            return self.table, self.db, self.model
+
+    def _build_generation(self, table, model):
+        """用指定模型为命令库建立一个新的索引版本（不切换），返回 (版本ID, 子索引)，失败返回 (None, None)"""
+        texts_by_type, metadatas_by_type, _ = self._build_documents(table)
+        if not texts_by_type:
             logger.warning("没有找到任何命令数据")
-            self.db = None
+            return None, None
+        
+        generation, path = self.store.new_generation(model)
+        try:
+            logger.info(f"开始创建向量数据库（模型: {model}），共 {len(table)} 个命令...")
+            embedder = self._embedder(model)
+            type_dbs = {}
+            for command_type, texts in texts_by_type.items():
+                type_dbs[command_type] = FAISS.from_texts(texts, embedder, metadatas=metadatas_by_type[command_type])
+                type_dbs[command_type].save_local(path, index_name=command_type)
+                logger.info(f"  子索引 {command_type}: {len(texts)} 个命令")
+        except Exception as e:
+            logger.error(f"向量数据库创建失败: {e}")
+            self.store.discard(generation)
+            return None, None
+        
+        self.store.write_meta(generation, {
+            'model': model,
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'count': len(table),
+            'types': sorted(type_dbs),
+            'commands_digest': commands_digest(table)
+        })
+        logger.info(f"索引版本 {generation} 已保存（模型: {model}）")
+        return generation, type_dbs
+
+    def _load_generation(self, generation):
+        """从磁盘加载一个索引版本，返回 (元信息, 子索引)"""
+        meta = self.store.read_meta(generation)
+        embedder = self._embedder(meta['model'])
+        path = self.store.path(generation)
+        type_dbs = {
+            command_type: FAISS.load_local(path, embedder, index_name=command_type, **FAISS_LOAD_KWARGS)
+            for command_type in meta['types']
+        }
+        return meta, type_dbs
+
+    def _load_or_create_vector_db(self):
+        """加载当前索引版本；没有可用版本时同步建立，命令库或模型变化时在后台处理"""
+        table = self._load_table()
+        _, _, commands_data = self._build_documents(table)
+        generation = self.store.current()
+        
+        stale = False
+        if generation is not None:
+            try:
+                meta, type_dbs = self._load_generation(generation)
+                self._set_index(table, type_dbs, commands_data, meta['model'], generation)
+                logger.info(f"已加载索引版本 {generation}（模型: {meta['model']}），共 {meta['count']} 个命令")
+                stale = meta.get('commands_digest') != commands_digest(table)
+                if stale:
+                    logger.info("命令库已变化，将在后台重建索引")
+            except Exception as e:
+                logger.error(f"索引版本 {generation} 加载失败: {e}")
+                generation = None
+        
+        if generation is None:
+            generation, type_dbs = self._build_generation(table, EMBEDDING_MODEL)
+            if generation is None:
+                self._set_index(table, None, commands_data, EMBEDDING_MODEL, None)
+                return
+            self.store.activate(generation)
+            self._set_index(table, type_dbs, commands_data, EMBEDDING_MODEL, generation)
+            logger.info(f"向量数据库创建完成，包含 {len(table)} 个命令")
+        
+        migrate = self.model != EMBEDDING_MODEL
+        if migrate and self.store.is_rejected(EMBEDDING_MODEL):
+            logger.warning(f"模型 {EMBEDDING_MODEL} 的索引曾未通过评测或被回滚，继续使用 {self.model}；"
+                           f"如需切换请调用 /api/index/migrate 并指定 force")
+            migrate = False
+        
+        if stale or migrate:
+            def background():
+                if stale:
+                    self.load_and_create_vector_db()
+                if migrate:
+                    self.migrate(EMBEDDING_MODEL)
+            threading.Thread(target=background, daemon=True).start()
+
+    def load_and_create_vector_db(self):
+        """重新加载命令库并用当前模型建立新的索引版本，建好后再切换，期间继续使用旧索引"""
+        with self._build_lock:
+            table = self._load_table()
+            model = self.model
+            _, _, commands_data = self._build_documents(table)
+            generation, type_dbs = self._build_generation(table, model)
+            if generation is not None:
+                self.store.activate(generation)
+                self._set_index(table, type_dbs, commands_data, model, generation)
+                logger.info(f"向量数据库创建完成，包含 {len(table)} 个命令")
+            elif len(table) == 0:
+                self._set_index(table, None, commands_data, model, None)
+            else:
+                logger.error(f"向量数据库重建失败，继续使用版本 {self.generation}")
+
+    def migrate(self, model, force=False):
+        """迁移到新的嵌入模型
+
+        在后台用新模型建立索引版本，期间继续使用当前版本检索；建好后在评测查询集上
+        对比两个版本，新版本没有明显变差（或 force）时切换，否则保留当前版本。
+        """
+        with self._build_lock:
+            table, old_dbs, old_model = self._snapshot()
+            self.migration = {'status': 'building', 'model': model, 'from_model': old_model,
+                              'started_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+            logger.info(f"开始迁移嵌入模型: {old_model} -> {model}")
+            
+            generation, new_dbs = self._build_generation(table, model)
+            if generation is None:
+                self.migration.update(status='failed', reason='新模型索引创建失败')
+                logger.error(f"迁移失败: 新模型索引创建失败，继续使用 {old_model}")
+                return self.migration
+            
+            self.migration['status'] = 'evaluating'
+            queries = load_eval_queries(EVAL_QUERIES_FILE) or sample_eval_queries(table)
+            old_eval = evaluate(lambda q: self._rank_commands(old_dbs, old_model, q), queries)
+            new_eval = evaluate(lambda q: self._rank_commands(new_dbs, model, q), queries)
+            self.store.update_meta(generation, eval={'baseline': old_eval, 'candidate': new_eval})
+            self.migration.update(eval={'baseline': old_eval, 'candidate': new_eval})
+            logger.info(f"评测 {len(queries)} 条查询: {old_model} recall@{EVAL_TOP_K}={old_eval['recall_at_k']:.3f} "
+                        f"MRR={old_eval['mrr']:.3f} / {model} recall@{EVAL_TOP_K}={new_eval['recall_at_k']:.3f} "
+                        f"MRR={new_eval['mrr']:.3f}")
+            
+            if force or passes_eval(old_eval, new_eval, MIGRATION_MAX_REGRESSION):
+                self.store.activate(generation)
+                _, _, commands_data = self._build_documents(table)
+                self._set_index(table, new_dbs, commands_data, model, generation)
+                self.migration.update(status='cut_over', generation=generation)
+                logger.info(f"已切换到索引版本 {generation}（模型: {model}）")
+            else:
+                self.store.reject(generation, '评测结果低于当前版本')
+                self.migration.update(status='rejected', reason='评测结果低于当前版本')
+                logger.warning(f"新模型评测结果低于当前版本，继续使用 {old_model}")
+            return self.migration
+
+    def rollback(self):
+        """回滚到磁盘上保留的上一版本
+
+        Raises:
+            ValueError: 没有上一版本，或上一版本与当前命令库不对应
+        """
+        with self._build_lock:
+            table, _, current_model = self._snapshot()
+            previous = self.store.previous()
+            if not previous:
+                raise ValueError('没有可回滚的上一版本')
+            try:
+                meta, type_dbs = self._load_generation(previous)
+            except Exception as e:
+                raise ValueError(f"上一版本 {previous} 加载失败: {e}")
+            if meta.get('commands_digest') != commands_digest(table):
+                raise ValueError(f"上一版本 {previous} 与当前命令库不对应，无法回滚")
+            
+            current = self.store.rollback()
+            _, _, commands_data = self._build_documents(table)
+            self._set_index(table, type_dbs, commands_data, meta['model'], current)
+            if meta['model'] != current_model:
+                # 记录被回滚的模型，重启后不会再自动迁移到该模型
+                self.store.reject(self.store.previous(), '已回滚')
+            logger.info(f"已回滚到索引版本 {current}（模型: {meta['model']}）")
+            return current
+
+    def index_status(self):
+        """索引版本与迁移状态"""
+        status = self.store.status()
+        status['serving_model'] = self.model
+        status['configured_model'] = EMBEDDING_MODEL
+        status['migration'] = self.migration
+        return status
 
     def _enhance_text_with_keywords(self, base_text, description):
         """根据描述增强文本，添加相关关键词"""
@@ -184,79 +433,83 @@ class CommandVectorDB:
         
         return enhanced_text
 
-    def _parse_line_detailed(self, line):
-        """详细解析命令行，优先处理竖线分隔符
-        统一格式: 命令名|描述|文件名|时间戳|命令类型
-        命令类型: basic(基本命令), lisp(CAD扩展命令), user_program(用户编程)
-        """
-        if '|' in line:
-            parts = line.split('|')
-            if len(parts) >= 2:
-                if len(parts) >= 5:
-                    # 统一格式: 命令名|描述|文件名|时间戳|命令类型
-                    command = parts[0].strip()
-                    description = parts[1].strip()
-                    filename = parts[2].strip()
-                    timestamp = parts[3].strip()
-                    command_type = parts[4].strip().lower()  # 第5个字段是命令类型
-                elif len(parts) == 4:
-                    # 命令名|描述|文件名|时间戳 (无命令类型)
-                    command = parts[0].strip()
-                    description = parts[1].strip()
-                    filename = parts[2].strip()
-                    timestamp = parts[3].strip()
-                    command_type = "basic"  # 默认
-                elif len(parts) == 3:
-                    command = parts[0].strip()
-                    description = parts[1].strip()
-                    filename = parts[2].strip()
-                    timestamp = "Unknown"
-                    command_type = "basic"
-                elif len(parts) == 2:
-                    command = parts[0].strip()
-                    description = parts[1].strip()
-                    filename = "Unknown"
-                    timestamp = "Unknown"
-                    command_type = "basic"
-                else:
-                    command = None
-                    description = None
-                    filename = "Unknown"
-                    timestamp = "Unknown"
-                    command_type = "basic"
-            else:
-                command = None
-                description = None
-                filename = "Unknown"
-                timestamp = "Unknown"
-                command_type = "basic"
-        else:
-            # 没有竖线分隔符
-            command = None
-            description = line
-            filename = "Unknown"
-            timestamp = "Unknown"
-            command_type = "basic"
-        
-        return {
-            'command': command,
-            'description': description,
-            'filename': filename,
-            'timestamp': timestamp,
-            'command_type': command_type
-        }
+    def _search_dbs(self, type_dbs, model, query, k, types=None, flight=None):
+        """在选中的子索引中检索，返回按距离排序的 (文档, 距离) 列表
 
-    def search_similar_commands(self, query, k=5):
-        if self.db is None:
-            logger.error("向量数据库未初始化")
+        flight 为合并查询的状态：查询嵌入调用的超时取仍在等待的请求中最晚的截止时间。
+        """
+        selected_dbs = [type_dbs[t] for t in (types or type_dbs.keys()) if t in type_dbs]
+        if not selected_dbs:
             return []
         
         # 对查询也进行关键词增强
         enhanced_query = self._enhance_text_with_keywords(query, query)
-        logger.info(f"原始查询: {query}, 增强后查询: {enhanced_query}")
         
-        # 搜索相似命令
-        docs = self.db.similarity_search_with_score(enhanced_query, k=k)
+        # 查询向量只计算一次（使用建立该索引的模型），再在各子索引中检索并按距离合并
+        query_vector = self._query_vector(model, enhanced_query, flight)
+        docs = []
+        for db in selected_dbs:
+            docs.extend(db.similarity_search_with_score_by_vector(query_vector, k=k))
+        docs.sort(key=lambda item: item[1])
+        return docs[:k]
+
+    def _query_vector(self, model, text, flight=None):
+        """计算查询向量；所有请求都已放弃时不再调用 DashScope（抛出 DeadlineExceeded），
+        调用期间有截止时间更晚的请求加入而本次调用失败时，按新的截止时间重新调用
+        """
+        embedder = self._embedder(model)
+        if flight is None:
+            return embedder.embed_query(text)
+        while True:
+            deadline = flight.deadline()
+            timeout = remaining(deadline)
+            if timeout is not None and timeout <= 0:
+                logger.warning(f"已没有请求在等待，跳过查询嵌入: {text}")
+                raise DeadlineExceeded()
+            try:
+                return embedder.embed_query(text, timeout=timeout)
+            except Exception:
+                if flight.deadline() != deadline:
+                    continue
+                raise
+
+    def _rank_commands(self, type_dbs, model, query):
+        """评测用：返回最相似的 EVAL_TOP_K 个命令名"""
+        if not type_dbs:
+            return []
+        return [doc.metadata.get('command', '') for doc, _ in self._search_dbs(type_dbs, model, query, EVAL_TOP_K)]
+
+    def search_similar_commands(self, query, k=5, types=None, deadline=None):
+        """检索相似命令，types 为命令类型列表时只检索对应的子索引
+
+        同时到达的相同查询只检索一次（一次 DashScope 调用），其余请求共享结果。
+        deadline（time.monotonic）：本请求等到截止时间为止，超过后抛出 DeadlineExceeded；
+        合并的检索按仍在等待的请求中最晚的截止时间限制 DashScope 调用，所有请求都放弃后不再调用。
+        """
+        if expired(deadline):
+            logger.warning(f"查询已超过截止时间，跳过检索: {query}")
+            raise DeadlineExceeded()
+        key = (query, k, tuple(types) if types else None, self.generation)
+        try:
+            results, shared = self.flights.do(
+                key, lambda flight: self._search_similar_commands(query, k, types, flight), deadline=deadline)
+        except TimeoutError:
+            raise DeadlineExceeded()
+        if shared:
+            logger.info(f"合并相同查询: {query}")
+        # 每个请求拿到独立的副本，避免共享结果被调用方修改
+        return [dict(result) for result in results]
+
+    def _search_similar_commands(self, query, k, types, flight=None):
+        """检索实现，flight 为合并查询的状态（限制查询嵌入调用的耗时）"""
+        # 取快照，避免重建或迁移线程在检索过程中替换索引
+        _, type_dbs, model = self._snapshot()
+        if type_dbs is None:
+            logger.error("向量数据库未初始化")
+            return []
+        
+        logger.info(f"原始查询: {query}, 类型: {types or '全部'}, 模型: {model}")
+        docs = self._search_dbs(type_dbs, model, query, k, types, flight)
         
         results = []
         for doc, score in docs:
@@ -310,6 +563,7 @@ class CommandVectorDB:
         if hasattr(self, 'observer'):
             self.observer.stop()
             self.observer.join()
+        query_embedding_cache.close()
 
 # 初始化向量数据库 - 使用绝对路径
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -324,7 +578,47 @@ logger.info(f"正在尝试加载以下文件: {file_paths}")
 
 vector_db = CommandVectorDB(file_paths)
 
+def parse_popularity_weight(data):
+    """请求中的 popularity_weight（0~1），未指定时使用 POPULARITY_WEIGHT"""
+    value = data.get('popularity_weight')
+    if value is None:
+        return POPULARITY_WEIGHT
+    try:
+        return min(max(float(value), 0.0), 1.0)
+    except (TypeError, ValueError):
+        raise ValueError('popularity_weight 必须是 0~1 之间的数字')
+
+def ranked_search(query, k, types, weight):
+    """检索相似命令，weight 大于 0 时多取候选并按相似度 + 热度先验重新排序"""
+    if weight <= 0:
+        return vector_db.search_similar_commands(query, k=k, types=types, deadline=g.deadline)
+    results = vector_db.search_similar_commands(query, k=k * POPULARITY_POOL_FACTOR, types=types,
+                                                deadline=g.deadline)
+    return popularity.apply_prior(results, weight, score_key='similarity_score')[:k]
+
+# 带索引版本响应头的接口，客户端据此让本地缓存的旧结果失效
+VERSIONED_ENDPOINTS = ('query_command', 'search_commands', 'get_index_version')
+
+@app.before_request
+def capture_index_version():
+    """检索前记下索引版本，结果不会被标记为比实际使用的索引更新的版本"""
+    if request.endpoint in VERSIONED_ENDPOINTS and vector_db is not None:
+        g.index_version = vector_db.generation
+
+@app.after_request
+def add_index_version(response):
+    version = g.get('index_version')
+    if version and response.status_code == 200:
+        response.headers[INDEX_VERSION_HEADER] = version
+    return response
+
+@app.route('/api/index/version', methods=['GET'])
+def get_index_version():
+    """当前索引版本（客户端据此判断本地缓存是否过期）"""
+    return jsonify({'index_version': g.get('index_version')})
+
 @app.route('/api/search', methods=['POST'])
+@admission_required(query_admission, QUERY_DEADLINE_SECONDS)
 def search_commands():
     """搜索命令接口 - 保持与现有客户端兼容"""
     try:
@@ -339,13 +633,23 @@ def search_commands():
         if vector_db is None:
             return jsonify({'query': requirement, 'results': []})
         
+        try:
+            types = parse_command_types(data.get('types'), USER_CODE_TYPE)
+            weight = parse_popularity_weight(data)
+        except ValueError as e:
+            return jsonify({'query': requirement, 'results': [], 'error': str(e)}), 400
+        
         # 搜索相似命令
-        results = vector_db.search_similar_commands(requirement, k=5)
+        search_start = time.perf_counter()
+        results = ranked_search(requirement, 5, types, weight)
+        record_timing('search', (time.perf_counter() - search_start) * 1000)
         
         return jsonify({
             'query': requirement,
             'results': results
         })
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"搜索命令时出错: {str(e)}")
         return jsonify({
@@ -355,6 +659,7 @@ def search_commands():
         })
 
 @app.route('/api/query', methods=['POST'])
+@admission_required(query_admission, QUERY_DEADLINE_SECONDS)
 def query_command():
     """兼容多种客户端的查询接口"""
     try:
@@ -369,12 +674,22 @@ def query_command():
                 'error': '缺少requirement参数'
             })
         
+        try:
+            types = parse_command_types(data.get('types'), USER_CODE_TYPE)
+            weight = parse_popularity_weight(data)
+        except ValueError as e:
+            return jsonify({'matched': False, 'error': str(e)}), 400
+        
         # 搜索前3个最相似的命令
-        results = vector_db.search_similar_commands(requirement, k=3)
+        search_start = time.perf_counter()
+        results = ranked_search(requirement, 3, types, weight)
+        record_timing('search', (time.perf_counter() - search_start) * 1000)
         
         if results:
             # 返回第一个最佳匹配结果，但包含前3个结果供客户端参考
             top_result = results[0]
+            popularity.record_usage(top_result['command'], top_result.get('command_type', ''),
+                                    top_result['description'])
             
             # 根据command_type字段判断命令来源（最优先）
             # 其次使用timestamp字段作为备用判断
@@ -421,6 +736,21 @@ def query_command():
                 'source_file': source_file  # 添加源文件信息
             }
             
+            # 精简响应：顶层的 code、all_results 和命令字段都是 result 中内容的重复，只返回 result
+            if wants_compact(request, data):
+                for key in ('lisp_code', 'usage_count', 'success_rate'):
+                    code_obj.pop(key)
+                return jsonify({
+                    'matched': True,
+                    'result': {
+                        'code': code_obj,
+                        'confidence': top_result['similarity_score'],
+                        'llm_used': False,
+                        'reason': '找到匹配命令',
+                        'rag_results': results
+                    }
+                })
+            
             # 返回一个非常兼容的响应格式，包含客户端可能需要的所有字段
             response = {
                 'matched': True,
@@ -451,6 +781,8 @@ def query_command():
                     'rag_results': []
                 }
             })
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"查询命令时出错: {str(e)}")
         return jsonify({
@@ -464,17 +796,26 @@ def query_command():
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """获取服务统计信息"""
-    if vector_db is None or vector_db.db is None:
+    type_dbs = vector_db.db if vector_db else None
+    if type_dbs is None:
         total_commands = 0
+        type_counts = {}
     else:
-        total_commands = len(vector_db.db.index_to_docstore_key) if hasattr(vector_db.db, 'index_to_docstore_key') else 0
+        type_counts = {command_type: len(db.index_to_docstore_id) for command_type, db in type_dbs.items()}
+        total_commands = sum(type_counts.values())
     
     return jsonify({
         'total_commands': int(total_commands),  # 确保是Python原生类型
+        'type_counts': type_counts,
         'indexed_files': vector_db.file_paths if vector_db else [],
         'status': 'running',
         'rag_enabled': True,
-        'embedding_model': 'dashscope-text-embedding-v2',
+        'embedding_model': f'dashscope-{vector_db.model if vector_db else EMBEDDING_MODEL}',
+        'index_generation': vector_db.generation if vector_db else None,
+        'query_embedding_cache': query_embedding_cache.stats(),
+        'single_flight': vector_db.flights.stats() if vector_db else {},
+        'admission': query_admission.stats(),
+        'popularity': popularity.stats(),
         'loaded_commands_count': len(vector_db.commands_data) if vector_db else 0,
         'working_directory': os.getcwd(),
         'script_directory': os.path.dirname(os.path.abspath(__file__))
@@ -576,7 +917,7 @@ def save_user_code():
 
 @app.route('/debug/files', methods=['GET'])
 def debug_files():
-    """调试接口：列出所有相关文件信息"""
+    """调试接口：列出所有相关文件信息（user_codes 目录内容支持 cursor/limit 分页和 format=ndjson 流式输出）"""
     script_dir = os.path.dirname(os.path.abspath(__file__))
     result = {
         'working_directory': os.getcwd(),
@@ -596,9 +937,11 @@ def debug_files():
     
     # 检查 user_codes 目录
     user_codes_dir = os.path.join(script_dir, 'user_codes')
+    total = 0
     if os.path.exists(user_codes_dir):
         result['user_codes_dir']['exists'] = True
-        result['user_codes_dir']['contents'] = os.listdir(user_codes_dir)
+        with os.scandir(user_codes_dir) as entries:
+            total = sum(1 for _ in entries)
         
         # 检查 user_codes.txt
         user_codes_file = os.path.join(user_codes_dir, 'user_codes.txt')
@@ -610,26 +953,138 @@ def debug_files():
     else:
         result['user_codes_dir']['exists'] = False
     
-    return jsonify(result)
+    def rows(start, stop):
+        # 逐项遍历目录，不构造完整的文件列表
+        if stop <= start:
+            return
+        with os.scandir(user_codes_dir) as entries:
+            for entry in islice(entries, start, stop):
+                try:
+                    size = entry.stat().st_size if entry.is_file() else 0
+                except OSError:
+                    size = 0
+                yield {'name': entry.name, 'is_file': entry.is_file(), 'size': size}
+    
+    try:
+        return list_response(request, 'contents', total, rows, extra=result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 @app.route('/debug/commands', methods=['GET'])
 def debug_commands():
-    """调试接口：列出所有加载的命令"""
-    if vector_db and vector_db.commands_data:
-        commands_list = []
-        for key, data in list(vector_db.commands_data.items())[:20]:  # 只返回前20个
-            commands_list.append({
+    """调试接口：列出所有加载的命令（支持 cursor/limit 分页和 format=ndjson 流式输出）"""
+    commands_data = vector_db.commands_data if vector_db else []
+    
+    def rows(start, stop):
+        for i in range(start, stop):
+            data = commands_data[i]
+            yield {
                 'command': data.get('command', ''),
                 'description': data.get('description', ''),
+                'command_type': data.get('command_type', ''),
                 'source_file': data.get('source_file', ''),
                 'timestamp': data.get('timestamp', '')
-            })
-        return jsonify({
-            'total_loaded': len(vector_db.commands_data),
-            'commands': commands_list
-        })
-    else:
-        return jsonify({'total_loaded': 0, 'commands': []})
+            }
+    
+    try:
+        return list_response(request, 'commands', len(commands_data), rows,
+                             extra={'total_loaded': len(commands_data)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/index/status', methods=['GET'])
+def index_status():
+    """索引版本与模型迁移状态"""
+    return jsonify(vector_db.index_status())
+
+@app.route('/api/index/migrate', methods=['POST'])
+def migrate_index():
+    """在后台迁移到新的嵌入模型（建库、评测、切换），迁移期间继续使用当前版本"""
+    data = request.get_json(silent=True) or {}
+    model = data.get('model') or EMBEDDING_MODEL
+    force = bool(data.get('force', False))
+    
+    if vector_db.migration.get('status') in ('building', 'evaluating'):
+        return jsonify({'success': False, 'error': '已有迁移正在进行', 'migration': vector_db.migration}), 409
+    if model == vector_db.model and not force:
+        return jsonify({'success': False, 'error': f'当前已在使用模型 {model}'}), 400
+    
+    threading.Thread(target=vector_db.migrate, args=(model, force), daemon=True).start()
+    return jsonify({'success': True, 'message': f'已开始迁移到 {model}'}), 202
+
+@app.route('/api/index/rollback', methods=['POST'])
+def rollback_index():
+    """回滚到上一索引版本"""
+    try:
+        generation = vector_db.rollback()
+        return jsonify({'success': True, 'generation': generation, 'embedding_model': vector_db.model})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/feedback', methods=['POST'])
+def submit_feedback():
+    """记录用户对匹配结果的反馈（成功/失败），计入命令的成功率"""
+    data = request.get_json(silent=True) or {}
+    command = str(data.get('command') or '').strip()
+    success = data.get('success')
+    if not command:
+        return jsonify({'success': False, 'error': '缺少 command'}), 400
+    if not isinstance(success, bool):
+        return jsonify({'success': False, 'error': 'success 必须是 true 或 false'}), 400
+    
+    counts = popularity.record_feedback(command, success, data.get('requirement', ''), data.get('feedback'))
+    logger.info(f"反馈: {command} {'成功' if success else '失败'}")
+    return jsonify({
+        'success': True,
+        'command': counts['command'],
+        'usage_count': counts['usage_count'],
+        'success_count': counts['success_count'],
+        'failure_count': counts['failure_count'],
+        'success_rate': counts['success_rate']
+    })
+
+@app.route('/api/popular', methods=['GET'])
+@app.route('/api/popular_codes', methods=['GET'])
+def popular_codes():
+    """热门命令（使用次数和成功率），从预先排好的列表中截取
+
+    参数: limit（默认 10）、keyword（按命令名和描述过滤）、category（命令类型）
+    """
+    try:
+        limit = int(request.args.get('limit', 10))
+        categories = parse_command_types(request.args.get('category'), USER_CODE_TYPE)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if categories and len(categories) > 1:
+        return jsonify({'success': False, 'error': 'category 只能指定一个类型'}), 400
+    
+    codes = popularity.top(max(limit, 0), categories[0] if categories else None,
+                           keyword=request.args.get('keyword', ''))
+    return jsonify({
+        'success': True,
+        'codes': [
+            {
+                'command': entry['command'],
+                'description': entry['description'],
+                'type': entry['type'],
+                'usage_count': entry['usage_count'],
+                'success_count': entry['success_count'],
+                'failure_count': entry['failure_count'],
+                'success_rate': entry['success_rate']
+            }
+            for entry in codes
+        ],
+        'total': len(codes)
+    })
+
+@app.route('/api/health', methods=['GET'])
+def api_health_check():
+    """健康检查（与其他服务端相同的路径，客户端配置多个服务端时用它探测延迟）"""
+    return jsonify({
+        'status': 'ok',
+        'embedding_model': vector_db.model if vector_db else None,
+        'rag_enabled': vector_db is not None
+    })
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -637,4 +1092,7 @@ def health_check():
     return jsonify({'status': 'healthy', 'message': 'Server is running'})
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    try:
+        app.run(host='0.0.0.0', port=5000, debug=False)
+    finally:
+        popularity.close()
\ No newline at end of file
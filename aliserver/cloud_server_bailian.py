@@ -9,9 +9,24 @@ import json
 import threading
 import time
 from typing import Dict, List, Optional
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify, send_file
 from flask_cors import CORS
 import requests
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from server_common.command_types import parse_command_types
+from server_common.pagination import list_response
+from server_common.blob_store import BlobStore
+from server_common.user_code_store import UserCodeStore, record_etag
+from server_common.single_flight import SingleFlight
+from server_common.bulk_import import import_user_codes
+from server_common.responses import (INDEX_VERSION_HEADER, enable_compression, enable_server_timing,
+                                    install_fast_json, record_timing, wants_compact)
+from server_common.jobs import JobConflict, JobManager
+from server_common.shards import request_namespace
+from server_common.admission import AdmissionController, DeadlineExceeded, admission_required, expired
+from server_common.popularity import PopularityStore
 
 # 百炼平台配置
 BAILIAN_APP_ID = os.getenv('BAILIAN_APP_ID', 'your-app-id-here')
@@ -21,10 +36,28 @@ BAILIAN_API_KEY = os.getenv('DASHSCOPE_API_KEY')
 BASIC_COMMANDS_FILE = 'autocad_basic_commands.txt'
 LISP_COMMANDS_FILE = 'lisp_commands.txt'
 USER_CODES_DIR = 'user_codes'
-USER_CODES_FILE = os.path.join(USER_CODES_DIR, 'user_codes.txt')
+USER_CODES_FILE = os.path.join(USER_CODES_DIR, 'user_codes.txt')  # 旧版索引文件，启动时一次性导入数据库
+USER_CODES_DB = os.getenv('USER_CODES_DB', os.path.join(USER_CODES_DIR, 'user_codes.sqlite3'))
+USER_CODES_BLOB_DIR = os.getenv('USER_CODES_BLOB_DIR', os.path.join(USER_CODES_DIR, 'blobs'))  # 按内容哈希保存的 LISP 代码
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))  # 小于该字节数的响应不压缩
+
+# 查询准入控制：超过并发数的查询排队，队列满或排队超时返回 429
+QUERY_MAX_CONCURRENT = int(os.getenv('QUERY_MAX_CONCURRENT', '4'))
+QUERY_MAX_QUEUE = int(os.getenv('QUERY_MAX_QUEUE', '16'))
+QUERY_QUEUE_TIMEOUT = float(os.getenv('QUERY_QUEUE_TIMEOUT', '5'))  # 最长排队时间（秒）
+QUERY_DEADLINE_SECONDS = float(os.getenv('QUERY_DEADLINE_SECONDS', '30'))  # 单个查询的截止时间（秒）
+
+# 命令热度：使用次数和反馈计数，检索时可按热度先验调整排序
+POPULARITY_DB = os.getenv('POPULARITY_DB', os.path.join(USER_CODES_DIR, 'popularity.sqlite3'))
+POPULARITY_WEIGHT = float(os.getenv('POPULARITY_WEIGHT', '0'))  # 热度先验的权重，0 表示只按相似度排序
+POPULARITY_POOL_FACTOR = 3  # 启用热度先验时多取的候选倍数
+POPULAR_TOP_N = int(os.getenv('POPULAR_TOP_N', '100'))  # 每个分类预先排好的热门命令数
 
 app = Flask(__name__)
 CORS(app)
+install_fast_json(app)
+enable_server_timing(app)
+enable_compression(app, min_size=COMPRESS_MIN_SIZE)
 
 # 导入百炼适配器
 try:
@@ -34,10 +67,116 @@ except ImportError as e:
     print("[提示] 请确保已安装dashscope: pip install dashscope")
     raise
 
+# 初始化用户代码存储（首次启动时导入旧的 user_codes.txt）
+user_code_store = UserCodeStore(USER_CODES_DB, BlobStore(USER_CODES_BLOB_DIR))
+_imported = user_code_store.import_txt(USER_CODES_FILE)
+if _imported:
+    print(f"[用户代码] 已从 {USER_CODES_FILE} 导入 {_imported} 条记录到 {USER_CODES_DB}")
+_backfilled = user_code_store.backfill_blobs(USER_CODES_DIR)
+if _backfilled:
+    print(f"[用户代码] 已将 {_backfilled} 条代码移入内容存储: {USER_CODES_BLOB_DIR}")
+
 # 初始化百炼命令嵌入管理器
 command_embeddings = BailianCommandEmbeddings(BAILIAN_APP_ID, BAILIAN_API_KEY)
 
+# 命令库版本：启动或重建索引时更新
+library_version = time.strftime('%Y%m%d-%H%M%S')
+
+# 用户代码的命令类型名（本地 Ollama 服务端的 user_code 对应这里的 user_program）
+USER_CODE_TYPE = 'user_program'
+
+# 合并同时到达的相同查询，只调用一次百炼检索
+search_flights = SingleFlight()
+
+# 后台任务（重建索引），同一时刻只运行一个重建任务
+jobs = JobManager()
+
+# 查询接口的准入控制
+query_admission = AdmissionController(QUERY_MAX_CONCURRENT, QUERY_MAX_QUEUE, QUERY_QUEUE_TIMEOUT)
+
+# 命令热度计数（后台定期写入数据库）
+popularity = PopularityStore(POPULARITY_DB, top_n=POPULAR_TOP_N)
+
+def _search(requirement: str, top_k: int, types: Optional[List[str]], deadline: Optional[float] = None) -> List[Dict]:
+    """检索命令，相同的并发查询共享一次检索结果
+    
+    Raises:
+        DeadlineExceeded: 超过截止时间（每个请求只按自己的截止时间放弃等待；
+            合并的检索在开始前检查仍在等待的请求中最晚的截止时间，所有请求都已放弃时不再调用百炼检索）
+    """
+    if expired(deadline):
+        raise DeadlineExceeded()
+    
+    def run(flight):
+        # 检索模块不接受超时参数，只能在调用前检查
+        if expired(flight.deadline()):
+            raise DeadlineExceeded()
+        if types:
+            return command_embeddings.search(requirement, top_k=top_k, types=types)
+        return command_embeddings.search(requirement, top_k=top_k)
+    
+    try:
+        results, shared = search_flights.do((requirement, top_k, tuple(types) if types else None), run,
+                                            deadline=deadline)
+    except TimeoutError:
+        raise DeadlineExceeded()
+    if shared:
+        print(f"[查询] 合并相同查询: {requirement}")
+    return [dict(cmd) for cmd in results]
+
+def _popularity_weight(data: dict) -> float:
+    """请求中的 popularity_weight（0~1），未指定时使用 POPULARITY_WEIGHT
+    
+    Raises:
+        ValueError: 不是数字
+    """
+    value = data.get('popularity_weight')
+    if value is None:
+        return POPULARITY_WEIGHT
+    try:
+        return min(max(float(value), 0.0), 1.0)
+    except (TypeError, ValueError):
+        raise ValueError('popularity_weight 必须是 0~1 之间的数字')
+
+def _ranked_search(requirement: str, top_k: int, types: Optional[List[str]], weight: float,
+                   deadline: Optional[float] = None) -> List[Dict]:
+    """检索命令，weight 大于 0 时多取候选并按相似度 + 热度先验重新排序"""
+    if weight <= 0:
+        return _search(requirement, top_k, types, deadline)
+    results = _search(requirement, top_k * POPULARITY_POOL_FACTOR, types, deadline)
+    return popularity.apply_prior(results, weight)[:top_k]
+
+def _index_version(namespace: str) -> str:
+    """索引版本：命令库版本 + 命名空间用户代码的数据版本"""
+    return f"{library_version}.{user_code_store.version(namespace)}"
+
+# 带索引版本响应头的接口（查询结果对应的命令库 + 用户代码版本）
+VERSIONED_ENDPOINTS = ('query_requirement', 'get_index_version')
+
+@app.before_request
+def capture_index_version():
+    """检索前记下索引版本，结果不会被标记为比实际使用的索引更新的版本"""
+    if request.endpoint in VERSIONED_ENDPOINTS:
+        try:
+            g.index_version = _index_version(request_namespace(request, request.get_json(silent=True)))
+        except ValueError:
+            pass
+
+@app.after_request
+def add_index_version(response):
+    version = g.get('index_version')
+    if version and response.status_code == 200:
+        response.headers[INDEX_VERSION_HEADER] = version
+    return response
+
+@app.route('/api/index/version', methods=['GET'])
+def get_index_version():
+    """当前索引版本（客户端据此判断本地缓存是否过期）"""
+    return jsonify({'index_version': g.get('index_version')})
+
+
 @app.route('/api/query', methods=['POST'])
+@admission_required(query_admission, QUERY_DEADLINE_SECONDS)
 def query_requirement():
     """查询需求，返回匹配的命令（百炼RAG方式）"""
     data = request.json
@@ -46,13 +185,20 @@ def query_requirement():
     if not requirement:
         return jsonify({'error': '需求不能为空'}), 400
     
+    try:
+        types = parse_command_types(data.get('types'), USER_CODE_TYPE)
+        weight = _popularity_weight(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     print(f"[查询] 用户需求: {requirement}")
     
-    # 使用百炼平台进行RAG检索
+    # 使用百炼平台进行RAG检索（指定类型时只检索对应的子索引）
     print(f"[百炼RAG] 步骤 1/2: 检索...")
     rag_start_time = time.time()
-    rag_results = command_embeddings.search(requirement, top_k=3)
+    rag_results = _ranked_search(requirement, 3, types, weight, g.deadline)
     rag_time = (time.time() - rag_start_time) * 1000
+    record_timing('search', rag_time)
     
     if not rag_results:
         print(f"[性能] 步骤1 - 百炼RAG检索: {rag_time:.2f}ms")
@@ -72,39 +218,50 @@ def query_requirement():
     # 返回最佳匹配结果
     best_command = rag_results[0]
     category = 'LISP 命令' if best_command.get('type') == 'lisp' else '基本命令'
+    popularity.record_usage(best_command.get('command', ''), best_command.get('type', ''),
+                            best_command.get('description', ''))
 
     print(f"[性能] 步骤1 - 百炼RAG检索: {rag_time:.2f}ms")
     print(f"[性能] 总耗时: {rag_time:.2f}ms")
 
+    code = {
+        'id': -1,
+        'type': 'basic_command',
+        'command': best_command.get('command', ''),
+        'description': best_command.get('description', ''),
+        'alias': best_command.get('alias', ''),
+        'final_alias': best_command.get('alias', ''),
+        'category': category,
+        'is_basic_command': best_command.get('type') == 'basic',
+        'source': 'bailian_rag'
+    }
+    result = {
+        'code': code,
+        'confidence': best_command.get('similarity', 0.0),
+        'reason': '百炼平台RAG检索',
+        'llm_used': True,
+        'is_basic_command': best_command.get('type') == 'basic',
+        'rag_results': [
+            {
+                'command': cmd.get('command', ''),
+                'description': cmd.get('description', ''),
+                'similarity': cmd.get('similarity', 0.0),
+                'score': cmd.get('score', cmd.get('similarity', 0.0)),
+                'source_type': cmd.get('type', 'unknown')
+            }
+            for cmd in rag_results
+        ]
+    }
+    
+    # 精简响应：去掉重复字段（final_alias 同 alias，外层 is_basic_command 同 code 中的值）和回显的需求
+    if wants_compact(request, data):
+        del code['type'], code['final_alias'], result['is_basic_command']
+        return jsonify({'matched': True, 'result': result})
+
     return jsonify({
         'requirement': requirement,
         'matched': True,
-        'result': {
-            'code': {
-                'id': -1,
-                'type': 'basic_command',
-                'command': best_command.get('command', ''),
-                'description': best_command.get('description', ''),
-                'alias': best_command.get('alias', ''),
-                'final_alias': best_command.get('alias', ''),
-                'category': category,
-                'is_basic_command': best_command.get('type') == 'basic',
-                'source': 'bailian_rag'
-            },
-            'confidence': best_command.get('similarity', 0.0),
-            'reason': '百炼平台RAG检索',
-            'llm_used': True,
-            'is_basic_command': best_command.get('type') == 'basic',
-            'rag_results': [
-                {
-                    'command': cmd.get('command', ''),
-                    'description': cmd.get('description', ''),
-                    'similarity': cmd.get('similarity', 0.0),
-                    'source_type': cmd.get('type', 'unknown')
-                }
-                for cmd in rag_results
-            ]
-        }
+        'result': result
     })
 
 @app.route('/api/stats', methods=['GET'])
@@ -114,13 +271,28 @@ def get_stats():
     
     return jsonify({
         'total_codes': len(commands),
-        'total_usage': 0,
+        'total_usage': popularity.total_usage,
         'total_commands': len(commands),
         'rag_enabled': True,
         'rag_provider': 'aliyun_bailian',
+        'single_flight': search_flights.stats(),
+        'admission': query_admission.stats(),
+        'popularity': popularity.stats(),
+        'namespaces': user_code_store.namespaces(),
         'file_watcher_enabled': True
     })
 
+def _get_namespaced_code(code_id: str) -> Optional[Dict]:
+    """按代码ID查找当前请求命名空间中的代码，其他命名空间的代码视为不存在
+    
+    Raises:
+        ValueError: 命名空间不合法
+    """
+    row = user_code_store.get(code_id)
+    if row is None or row['namespace'] != request_namespace(request):
+        return None
+    return row
+
 @app.route('/api/user_codes/save', methods=['POST'])
 def save_user_code():
     """保存用户代码"""
@@ -133,56 +305,62 @@ def save_user_code():
         if not code or not command_name:
             return jsonify({'error': '代码和命令名称不能为空'}), 400
         
-        # 创建用户代码目录
-        if not os.path.exists(USER_CODES_DIR):
-            os.makedirs(USER_CODES_DIR)
-        
-        # 生成代码ID
-        import uuid
-        code_id = str(uuid.uuid4())
+        try:
+            namespace = request_namespace(request, data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # 写入用户代码文件
-        user_code_entry = f"{code_id}|{command_name}|{description}||{code}\n"
+        # 代码按内容哈希保存，代码ID由内容生成；重复提交直接返回已有记录
+        record, created = user_code_store.save_code(command_name, description, code, namespace)
+        code_id = record['id']
         
-        with open(USER_CODES_FILE, 'a', encoding='utf-8') as f:
-            f.write(user_code_entry)
-        
-        print(f"[用户代码] 已保存: {command_name} (ID: {code_id})")
+        print(f"[用户代码] {'已保存' if created else '已存在'}: {command_name} (ID: {code_id})")
         
         return jsonify({
             'success': True,
             'code_id': code_id,
-            'message': '用户代码已保存'
+            'message': '用户代码已保存' if created else '相同代码已存在'
         })
         
     except Exception as e:
         print(f"[错误] 保存用户代码失败: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/user_codes/import', methods=['POST'])
+def import_user_codes_bulk():
+    """批量导入用户代码（zip 包或 NDJSON），所有条目在一个事务中保存"""
+    try:
+        result = import_user_codes(request, user_code_store, request_namespace(request))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"[错误] 批量导入用户代码失败: {e}")
+        return jsonify({'success': False, 'message': f'导入失败: {e}'}), 500
+    
+    print(f"[导入] 共 {result['total']} 条: 新增 {result['created']}，已存在 {result['existing']}，失败 {result['failed']}")
+    return jsonify(result)
+
+
 @app.route('/api/user_codes/list', methods=['GET'])
 def list_user_codes():
-    """列出用户代码"""
+    """列出用户代码（当前命名空间）"""
     try:
-        if not os.path.exists(USER_CODES_FILE):
-            return jsonify({'codes': []})
-        
-        codes = []
-        with open(USER_CODES_FILE, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    parts = line.split('|')
-                    if len(parts) >= 4:
-                        codes.append({
-                            'id': parts[0],
-                            'command': parts[1],
-                            'description': parts[2],
-                            'filename': parts[3] if len(parts) > 3 else '',
-                            'timestamp': os.path.getctime(USER_CODES_FILE) if os.path.exists(USER_CODES_FILE) else time.time()
-                        })
+        namespace = request_namespace(request)
+        codes = [
+            {
+                'id': row['id'],
+                'command': row['command'],
+                'description': row['description'],
+                'filename': row['filename'],
+                'timestamp': row['created_at']
+            }
+            for row in user_code_store.iter_codes(namespace=namespace)
+        ]
         
         return jsonify({'codes': codes})
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"[错误] 获取用户代码列表失败: {e}")
         return jsonify({'error': str(e)}), 500
@@ -190,78 +368,110 @@ def list_user_codes():
 
 @app.route('/api/user_codes/get/<code_id>', methods=['GET'])
 def get_user_code(code_id):
-    """获取用户代码内容"""
+    """获取用户代码内容（ETag 为代码ID + 内容哈希）"""
     try:
-        if not os.path.exists(USER_CODES_FILE):
+        row = _get_namespaced_code(code_id)
+        if row is None:
             return jsonify({'success': False, 'message': '代码不存在'}), 404
         
-        with open(USER_CODES_FILE, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    parts = line.split('|')
-                    if len(parts) >= 4 and parts[0] == code_id:
-                        filename = parts[3]
-                        filepath = os.path.join(USER_CODES_DIR, filename)
-                        if os.path.exists(filepath):
-                            with open(filepath, 'r', encoding='utf-8') as f:
-                                code_content = f.read()
-                            return jsonify({
-                                'success': True,
-                                'code': code_content,
-                                'command': parts[1],
-                                'description': parts[2]
-                            })
-                        else:
-                            # 如果文件不存在，返回存储在索引中的代码内容
-                            if len(parts) >= 5:
-                                return jsonify({
-                                    'success': True,
-                                    'code': parts[4],  # 代码内容存储在第5个字段
-                                    'command': parts[1],
-                                    'description': parts[2]
-                                })
+        etag = record_etag(row)
+        if etag and request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
         
-        return jsonify({'success': False, 'message': '代码不存在'}), 404
+        code_content = user_code_store.read_code(row)
+        if code_content is None:
+            return jsonify({'success': False, 'message': '代码不存在'}), 404
+        
+        response = jsonify({
+            'success': True,
+            'code': code_content,
+            'command': row['command'],
+            'description': row['description']
+        })
+        if etag:
+            response.set_etag(etag)
+        return response
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         print(f"[错误] 获取用户代码失败: {e}")
         return jsonify({'success': False, 'message': f'获取失败: {e}'}), 500
 
 
+@app.route('/api/user_codes/raw/<code_id>', methods=['GET'])
+def get_user_code_raw(code_id):
+    """直接返回代码文件（text/plain，ETag 为代码内容哈希，支持 If-None-Match）"""
+    try:
+        row = _get_namespaced_code(code_id)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if row is None or not row['blob']:
+        return jsonify({'success': False, 'message': '代码不存在'}), 404
+    
+    path = user_code_store.blobs.path(row['blob'])
+    if not os.path.exists(path):
+        return jsonify({'success': False, 'message': '代码不存在'}), 404
+    
+    return send_file(os.path.abspath(path), mimetype='text/plain', etag=row['blob'], conditional=True,
+                     download_name=f"{row['command']}.lsp")
+
+
+@app.route('/api/user_codes/by_command/<path:command>', methods=['GET'])
+def get_user_code_by_command(command):
+    """按命令名获取最新的用户代码（先查当前命名空间，再查共享代码库）
+    
+    ETag 为代码ID + 内容哈希（代码ID随命令名、描述变化），客户端带 If-None-Match 请求时记录未变返回 304。
+    """
+    try:
+        namespace = request_namespace(request)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    row = user_code_store.latest_by_command(command, (namespace, '') if namespace else ('',))
+    if row is None:
+        return jsonify({'success': False, 'message': '未找到命令对应的用户代码'}), 404
+    
+    etag = record_etag(row)
+    if etag and request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
+    code_content = user_code_store.read_code(row)
+    if code_content is None:
+        return jsonify({'success': False, 'message': '代码不存在'}), 404
+    
+    response = jsonify({
+        'success': True,
+        'code_id': row['id'],
+        'command': row['command'],
+        'description': row['description'],
+        'namespace': row['namespace'],
+        'code': code_content
+    })
+    if etag:
+        response.set_etag(etag)
+    return response
+
+
 @app.route('/api/user_codes/delete/<code_id>', methods=['DELETE'])
 def delete_user_code(code_id):
     """删除用户代码"""
     try:
-        if not os.path.exists(USER_CODES_FILE):
+        try:
+            if _get_namespaced_code(code_id) is None:
+                return jsonify({'success': False, 'message': '代码不存在'}), 404
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        row = user_code_store.delete(code_id)
+        if row is None:
             return jsonify({'success': False, 'message': '代码不存在'}), 404
         
-        lines = []
-        deleted = False
-        filename_to_delete = ''
-        
-        with open(USER_CODES_FILE, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    parts = line.split('|')
-                    if len(parts) >= 4 and parts[0] == code_id:
-                        if len(parts) > 3:
-                            filename_to_delete = parts[3]
-                        deleted = True
-                        continue  # 跳过要删除的行
-                    lines.append(line)
-        
-        if not deleted:
-            return jsonify({'success': False, 'message': '代码不存在'}), 404
-        
-        # 重写用户代码文件
-        with open(USER_CODES_FILE, 'w', encoding='utf-8') as f:
-            for line in lines:
-                f.write(line + '\n')
-        
         # 删除对应的LISP文件（如果存在）
-        if filename_to_delete:
-            filepath = os.path.join(USER_CODES_DIR, filename_to_delete)
+        if row['filename']:
+            filepath = os.path.join(USER_CODES_DIR, row['filename'])
             if os.path.exists(filepath):
                 os.remove(filepath)
         
@@ -288,21 +498,60 @@ def health_check():
 
 @app.route('/api/rebuild_embeddings', methods=['POST'])
 def rebuild_embeddings():
-    """重建嵌入索引"""
-    try:
+    """重建嵌入索引：提交后台任务后立即返回任务ID，通过 /api/jobs/<job_id> 查询进度"""
+    def run(job):
+        # 百炼适配器的重建不分步报告进度，整个重建计为一步；取消只在开始前生效
+        job.set_total(1)
+        job.check_cancelled()
         print("[索引] 开始重建嵌入索引...")
-        command_embeddings.rebuild_index()
+        global library_version
+        try:
+            command_embeddings.rebuild_index()
+        except Exception as e:
+            print(f"[错误] 重建嵌入索引失败: {e}")
+            raise
+        library_version = time.strftime('%Y%m%d-%H%M%S')
+        job.advance()
         print("[索引] 嵌入索引重建完成")
-        return jsonify({
-            'success': True,
-            'message': '嵌入索引重建完成'
-        })
-    except Exception as e:
-        print(f"[错误] 重建嵌入索引失败: {e}")
-        return jsonify({
-            'success': False,
-            'message': str(e)
-        }), 500
+    
+    try:
+        job = jobs.submit('rebuild', run)
+    except JobConflict as e:
+        return jsonify({'success': False, 'message': str(e), 'job': e.job.to_dict()}), 409
+    
+    return jsonify({
+        'success': True,
+        'message': '已开始重建嵌入索引',
+        'job_id': job.id,
+        'status_url': f'/api/jobs/{job.id}'
+    }), 202
+
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """最近的后台任务"""
+    return jsonify({'jobs': [job.to_dict() for job in jobs.list(request.args.get('kind'))]})
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """任务状态和进度"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """取消任务"""
+    try:
+        job = jobs.cancel(job_id)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e), 'job': jobs.get(job_id).to_dict()}), 409
+    if job is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()}), 202
 
 
 @app.route('/api/user_codes/preview', methods=['POST'])
@@ -336,13 +585,14 @@ def preview_user_code():
 
 @app.route('/api/codes', methods=['GET'])
 def list_codes():
-    """获取所有代码列表"""
+    """获取代码列表（支持 cursor/limit 分页和 format=ndjson 流式输出）"""
     try:
         commands = command_embeddings.get_all_commands()
         
-        return jsonify({
-            'codes': [
-                {
+        def rows(start: int, stop: int):
+            for i in range(start, stop):
+                cmd = commands[i]
+                yield {
                     'id': i,
                     'command': cmd.get('command', ''),
                     'description': cmd.get('description', ''),
@@ -350,11 +600,11 @@ def list_codes():
                     'category': 'basic' if cmd.get('type') == 'basic' else 'lisp',
                     'source': 'bailian_rag'
                 }
-                for i, cmd in enumerate(commands)
-            ],
-            'total': len(commands)
-        })
         
+        return list_response(request, 'codes', len(commands), rows)
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"[错误] 获取代码列表失败: {e}")
         return jsonify({'error': str(e)}), 500
@@ -373,21 +623,11 @@ def create_code():
         if not code_content or not command_name:
             return jsonify({'error': '代码内容和命令名称不能为空'}), 400
         
-        # 对于阿里云服务端，我们将其保存为用户代码
-        import uuid
-        code_id = str(uuid.uuid4())
-        
-        # 创建用户代码目录
-        if not os.path.exists(USER_CODES_DIR):
-            os.makedirs(USER_CODES_DIR)
-        
-        # 写入用户代码文件
-        user_code_entry = f"{code_id}|{command_name}|{description}||{code_content}\n"
+        # 对于阿里云服务端，我们将其保存为用户代码（按内容哈希存储，重复提交返回已有记录）
+        record, created = user_code_store.save_code(command_name, description, code_content)
+        code_id = record['id']
         
-        with open(USER_CODES_FILE, 'a', encoding='utf-8') as f:
-            f.write(user_code_entry)
-        
-        print(f"[代码] 已创建: {command_name} (ID: {code_id})")
+        print(f"[代码] {'已创建' if created else '已存在'}: {command_name} (ID: {code_id})")
         
         return jsonify({
             'success': True,
@@ -400,6 +640,94 @@ def create_code():
         return jsonify({'error': str(e)}), 500
 
 
+def _feedback_target(data: dict, namespace: str) -> Optional[Dict]:
+    """反馈对应的命令：优先使用 command 字段，其次按 code_id 查找用户代码
+    
+    返回 {'command', 'namespace'}；当前命名空间中有同名用户代码时计入该命名空间，否则计入共享命令。
+    """
+    command = str(data.get('command') or '').strip()
+    if command:
+        if namespace and user_code_store.find_by_command(command, namespace):
+            return {'command': command, 'namespace': namespace}
+        return {'command': command, 'namespace': ''}
+    
+    code_id = data.get('code_id')
+    if code_id is None or str(code_id) == '-1':
+        return None
+    row = user_code_store.get(str(code_id))
+    if row is None or row['namespace'] not in ('', namespace):
+        return None
+    return {'command': row['command'], 'namespace': row['namespace']}
+
+
+@app.route('/api/feedback', methods=['POST'])
+def submit_feedback():
+    """记录用户对匹配结果的反馈（成功/失败），计入命令的成功率"""
+    data = request.get_json(silent=True) or {}
+    success = data.get('success')
+    if not isinstance(success, bool):
+        return jsonify({'success': False, 'error': 'success 必须是 true 或 false'}), 400
+    
+    try:
+        namespace = request_namespace(request, data)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    target = _feedback_target(data, namespace)
+    if target is None:
+        return jsonify({'success': False, 'error': '缺少 command，或 code_id 对应的代码不存在'}), 400
+    
+    counts = popularity.record_feedback(target['command'], success, data.get('requirement', ''),
+                                        data.get('feedback'), target['namespace'])
+    print(f"[反馈] {target['command']}: {'成功' if success else '失败'}")
+    return jsonify({
+        'success': True,
+        'command': counts['command'],
+        'namespace': counts['namespace'],
+        'usage_count': counts['usage_count'],
+        'success_count': counts['success_count'],
+        'failure_count': counts['failure_count'],
+        'success_rate': counts['success_rate']
+    })
+
+
+@app.route('/api/popular', methods=['GET'])
+@app.route('/api/popular_codes', methods=['GET'])
+def popular_codes():
+    """热门命令（使用次数和成功率），从预先排好的列表中截取
+    
+    参数: limit（默认 10）、keyword（按命令名和描述过滤）、category（命令类型）
+    """
+    try:
+        limit = int(request.args.get('limit', 10))
+        categories = parse_command_types(request.args.get('category'), USER_CODE_TYPE)
+        namespace = request_namespace(request)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if categories and len(categories) > 1:
+        return jsonify({'success': False, 'error': 'category 只能指定一个类型'}), 400
+    
+    codes = popularity.top(max(limit, 0), categories[0] if categories else None, namespace,
+                           request.args.get('keyword', ''))
+    return jsonify({
+        'success': True,
+        'codes': [
+            {
+                'command': entry['command'],
+                'description': entry['description'],
+                'type': entry['type'],
+                'namespace': entry['namespace'],
+                'usage_count': entry['usage_count'],
+                'success_count': entry['success_count'],
+                'failure_count': entry['failure_count'],
+                'success_rate': entry['success_rate']
+            }
+            for entry in codes
+        ],
+        'total': len(codes)
+    })
+
+
 @app.route('/api/codes/<int:code_id>', methods=['GET'])
 def get_code_by_id(code_id):
     """根据ID获取代码"""
@@ -428,6 +756,8 @@ def get_code_by_id(code_id):
 def cleanup():
     """清理资源"""
     command_embeddings.stop_file_watcher()
+    popularity.close()
+    user_code_store.close()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,179 @@
+"""
+CADChat 查询嵌入持久化缓存
+DashScope 嵌入接口按调用计费，常见查询的向量缓存在本地 SQLite 中，服务重启后仍然有效
+"""
+
+import re
+import math
+import logging
+import sqlite3
+import threading
+import time
+import hashlib
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    """规范化查询文本：全角转半角、统一大小写、合并空白"""
+    text = unicodedata.normalize('NFKC', text or '')
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.lower()
+
+
+class QueryEmbeddingCache:
+    """查询嵌入缓存（SQLite，按最近使用时间淘汰）"""
+
+    def __init__(self, db_path: str, max_entries: int = 20000):
+        """
+        Args:
+            db_path: SQLite 数据库文件路径
+            max_entries: 最多缓存的向量条数，超出后淘汰最久未使用的条目
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pending_touches = {}  # key -> 最近使用时间，批量写回
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                query TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings(last_used)')
+        self._conn.commit()
+        self._count = self._conn.execute('SELECT COUNT(*) FROM query_embeddings').fetchone()[0]
+
+    @staticmethod
+    def _make_key(model: str, query: str) -> str:
+        return hashlib.sha1(f"{model}\0{query}".encode('utf-8')).hexdigest()
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """读取缓存的查询向量，未命中返回 None"""
+        key = self._make_key(model, normalize_query(text))
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT vector FROM query_embeddings WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._pending_touches[key] = time.time()
+            if len(self._pending_touches) >= 64:
+                self._flush_touches()
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def put(self, model: str, text: str, vector: List[float]):
+        """写入查询向量，超出容量时淘汰最久未使用的条目"""
+        query = normalize_query(text)
+        key = self._make_key(model, query)
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        with self._lock:
+            now = time.time()
+            cursor = self._conn.execute(
+                'INSERT OR IGNORE INTO query_embeddings (key, model, query, dim, vector, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, model, query, len(vector), blob, now)
+            )
+            if cursor.rowcount:
+                self._count += 1
+            else:
+                self._conn.execute(
+                    'UPDATE query_embeddings SET dim = ?, vector = ?, last_used = ? WHERE key = ?',
+                    (len(vector), blob, now, key)
+                )
+            self._flush_touches()
+            if self._count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _flush_touches(self):
+        """批量写回命中条目的最近使用时间（调用方持有锁）"""
+        if not self._pending_touches:
+            return
+        self._conn.executemany(
+            'UPDATE query_embeddings SET last_used = ? WHERE key = ?',
+            [(used, key) for key, used in self._pending_touches.items()]
+        )
+        self._pending_touches.clear()
+        self._conn.commit()
+
+    def _evict(self):
+        """淘汰到容量的 90%，避免每次写入都触发淘汰（调用方持有锁）"""
+        target = int(self.max_entries * 0.9)
+        self._conn.execute('''
+            DELETE FROM query_embeddings WHERE key IN (
+                SELECT key FROM query_embeddings ORDER BY last_used ASC LIMIT ?
+            )
+        ''', (self._count - target,))
+        self._count = self._conn.execute('SELECT COUNT(*) FROM query_embeddings').fetchone()[0]
+        logger.info(f"查询嵌入缓存已淘汰至 {self._count} 条")
+
+    def stats(self) -> Dict:
+        """缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            'entries': self._count,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+    def close(self):
+        """写回未保存的使用时间并关闭连接"""
+        with self._lock:
+            self._flush_touches()
+            self._conn.close()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """为嵌入模型加上查询向量缓存
+
+    文档向量在建库时批量计算，只有 embed_query 走缓存。
+    """
+
+    def __init__(self, embeddings, model: str, cache: QueryEmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str, timeout: Optional[float] = None) -> List[float]:
+        """查询向量，未缓存时调用嵌入接口
+
+        给出 timeout（秒）时只调用一次 DashScope 并限制请求耗时（不经过 langchain 的重试），
+        调用方放弃等待后不再占用后端。
+        """
+        vector = self.cache.get(self.model, text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text) if timeout is None else self._embed_within(text, timeout)
+            self.cache.put(self.model, text, vector)
+        return vector
+
+    def _embed_within(self, text: str, timeout: float) -> List[float]:
+        client = getattr(self.embeddings, 'client', None)
+        if client is None:
+            # 不是 DashScope 嵌入，无法限制请求耗时
+            return self.embeddings.embed_query(text)
+        response = client.call(model=self.model, input=text, text_type='query',
+                               request_timeout=max(1, math.ceil(timeout)))
+        if response.status_code != 200:
+            raise RuntimeError(f"DashScope 嵌入失败: {response.status_code} {response.message}")
+        return response.output['embeddings'][0]['embedding']
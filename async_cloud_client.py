@@ -0,0 +1,174 @@
+"""
+CADChat 云端客户端 - asyncio 版本
+AsyncCloudClient 提供与 CloudClient 相同的方法（协程），共用 CloudClient 的本地缓存、连接池和重试设置；
+阻塞的 HTTP 和缓存调用在专用线程池中执行，max_concurrency 限制同时进行的请求数，
+批处理脚本可以一次并发发出大量查询、统计和保存请求。
+BackgroundLoop 在后台线程中运行事件循环，供 Tkinter 等同步界面提交协程。
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Coroutine, Dict, Iterable, List, Optional
+
+from cloud_client import CloudClient
+from requirement_normalizer import normalize_requirement
+
+
+class AsyncCloudClient:
+    """CloudClient 的 asyncio 版本
+
+    用法:
+        async with AsyncCloudClient() as client:
+            results = await client.query_many(['画一个圆', '画一条直线'])
+
+    传入已有的 client 时共用它的缓存和连接池，关闭时不关闭该 client 的连接。
+    """
+
+    def __init__(self, server_url: str = None, env_file: str = '.env', max_concurrency: Optional[int] = None,
+                 client: Optional[CloudClient] = None):
+        self._owns_client = client is None
+        self.client = client if client is not None else CloudClient(server_url=server_url, env_file=env_file)
+        # 并发数默认等于连接池大小，超出时多余的连接用完即丢，失去复用的意义
+        self.max_concurrency = max_concurrency or self.client.transport.pool_size
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='cadchat-async')
+        self._closed = False
+
+    @property
+    def server_url(self) -> str:
+        return self.client.server_url
+
+    @property
+    def namespace(self) -> str:
+        return self.client.namespace
+
+    async def _call(self, func, *args, **kwargs):
+        if self._closed:
+            raise RuntimeError('AsyncCloudClient 已关闭')
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    # ---- 与 CloudClient 相同的方法 ----
+
+    async def query_requirement(self, requirement: str, use_cache: bool = True, types: List[str] = None,
+                                on_update: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """on_update 在 CloudClient 的后台刷新线程中调用，不在事件循环中"""
+        return await self._call(self.client.query_requirement, requirement, use_cache=use_cache, types=types,
+                                on_update=on_update)
+
+    async def submit_code(self, lisp_code: str, description: str, tags: List[str] = None) -> Dict:
+        return await self._call(self.client.submit_code, lisp_code, description, tags)
+
+    async def save_user_code(self, code: str, command: str, description: str) -> Dict:
+        return await self._call(self.client.save_user_code, code, command, description)
+
+    async def submit_feedback(self, code_id: int, requirement: str, success: bool, feedback: str = None,
+                              command: str = None) -> Dict:
+        return await self._call(self.client.submit_feedback, code_id, requirement, success, feedback, command)
+
+    async def get_popular_codes(self, limit: int = 10) -> List[Dict]:
+        return await self._call(self.client.get_popular_codes, limit)
+
+    async def get_stats(self) -> Dict:
+        return await self._call(self.client.get_stats)
+
+    async def search_codes(self, search_term: str = '', limit: int = 10) -> List[Dict]:
+        return await self._call(self.client.search_codes, search_term, limit)
+
+    async def get_user_code_by_command(self, command: str) -> Optional[Dict]:
+        return await self._call(self.client.get_user_code_by_command, command)
+
+    async def get_ollama_models(self) -> List[str]:
+        return await self._call(self.client.get_ollama_models)
+
+    async def sync_catalog(self) -> Dict:
+        return await self._call(self.client.sync_catalog)
+
+    async def clear_cache(self):
+        await self._call(self.client.clear_cache)
+
+    # ---- 批量 ----
+
+    async def query_many(self, requirements: Iterable[str], use_cache: bool = True,
+                         types: List[str] = None) -> List[Dict]:
+        """并发查询多个需求，结果顺序与输入相同
+
+        使用缓存时，需求模板相同的一组只先查询第一个，其余的在它完成后再查询（匹配成功时直接命中本地缓存），
+        与逐个串行调用 query_requirement 的结果一致。
+        """
+        requirements = list(requirements)
+        if not use_cache:
+            return list(await asyncio.gather(
+                *(self.query_requirement(r, use_cache=False, types=types) for r in requirements)
+            ))
+
+        leaders: Dict[str, int] = {}
+        for i, requirement in enumerate(requirements):
+            template = normalize_requirement(requirement)[0]
+            leaders.setdefault(template or requirement, i)
+        first = sorted(leaders.values())
+        leader_set = set(first)
+        rest = [i for i in range(len(requirements)) if i not in leader_set]
+
+        results: List[Optional[Dict]] = [None] * len(requirements)
+        for batch in (first, rest):
+            batch_results = await asyncio.gather(
+                *(self.query_requirement(requirements[i], types=types) for i in batch)
+            )
+            for i, result in zip(batch, batch_results):
+                results[i] = result
+        return results
+
+    # ---- 生命周期 ----
+
+    async def aclose(self):
+        """等待进行中的调用完成，提交缓存写入；自己创建的 CloudClient 同时等待后台刷新并关闭连接池"""
+        if self._closed:
+            return
+        self._closed = True
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(self._executor.shutdown, wait=True))
+        if self._owns_client:
+            await loop.run_in_executor(None, self.client.close)
+        else:
+            await loop.run_in_executor(None, self.client.cache.flush)
+
+    async def __aenter__(self) -> 'AsyncCloudClient':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+
+class BackgroundLoop:
+    """在后台守护线程中运行的事件循环
+
+    同步代码（如 Tkinter 回调）用 submit 提交协程，返回 concurrent.futures.Future，
+    可 add_done_callback 或在工作线程中 result() 等待；不要在界面线程中阻塞等待。
+    """
+
+    def __init__(self, name: str = 'cadchat-loop'):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=name)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None):
+        """提交协程并等待结果（只能在事件循环以外的线程中调用）"""
+        return self.submit(coro).result(timeout)
+
+    def stop(self, timeout: float = 5.0):
+        """停止事件循环并等待后台线程退出"""
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self.loop.close()
@@ -0,0 +1,134 @@
+"""
+客户端缓存基准测试
+对比旧的“每次调用新建并关闭 sqlite3 连接”实现与 client_cache.LocalCache（线程内长连接 + 批量提交）
+在命中查找、写入和多线程查找下的单次耗时
+
+用法: python benchmarks/bench_client_cache.py [--entries 2000] [--lookups 20000] [--threads 4]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from client_cache import LocalCache
+
+
+class LegacyCache:
+    """旧实现：与原 CloudClient._get_from_cache / _save_to_cache 相同"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        conn = sqlite3.connect(db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                requirement TEXT UNIQUE NOT NULL,
+                matched_code TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def get(self, key: str):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('SELECT matched_code FROM cache WHERE requirement = ?', (key,))
+        result = cursor.fetchone()
+        conn.close()
+        return json.loads(result[0]) if result else None
+
+    def put(self, key: str, result):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('INSERT OR REPLACE INTO cache (requirement, matched_code) VALUES (?, ?)',
+                       (key, json.dumps(result)))
+        conn.commit()
+        conn.close()
+
+    def flush(self):
+        pass
+
+
+def sample_result(i: int):
+    """与 /api/query 精简响应大小相近的结果"""
+    return {
+        'matched': True,
+        'result': {
+            'code': {'id': -1, 'command': f'CMD{i}', 'description': f'绘制第{i}个图形对象', 'alias': f'C{i}',
+                     'category': '基本命令', 'is_basic_command': True, 'source': 'rag'},
+            'confidence': 0.83,
+            'rag_results': [{'command': f'CMD{i + j}', 'description': f'候选命令{j}', 'similarity': 0.8 - j / 10}
+                            for j in range(3)]
+        }
+    }
+
+
+def per_op_us(start: float, count: int) -> float:
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def bench(name: str, cache, entries: int, lookups: int, threads: int):
+    keys = [f'画第{i}个圆' for i in range(entries)]
+
+    start = time.perf_counter()
+    for i, key in enumerate(keys):
+        cache.put(key, sample_result(i))
+    cache.flush()
+    put_us = per_op_us(start, entries)
+
+    rng = random.Random(0)
+    order = [rng.choice(keys) for _ in range(lookups)]
+    start = time.perf_counter()
+    for key in order:
+        cache.get(key)
+    get_us = per_op_us(start, lookups)
+
+    start = time.perf_counter()
+    for i in range(lookups // 10):
+        cache.get(f'未缓存的需求{i}')
+    miss_us = per_op_us(start, lookups // 10)
+
+    per_thread = lookups // threads
+
+    def worker():
+        for key in order[:per_thread]:
+            cache.get(key)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    threaded_us = per_op_us(start, per_thread * threads)
+
+    print(f"{name:<12} 写入 {put_us:8.1f} µs  命中 {get_us:8.1f} µs  未命中 {miss_us:8.1f} µs  "
+          f"{threads} 线程查找 {threaded_us:8.1f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='客户端缓存基准测试')
+    parser.add_argument('--entries', type=int, default=2000, help='写入的缓存条数')
+    parser.add_argument('--lookups', type=int, default=20000, help='查找次数')
+    parser.add_argument('--threads', type=int, default=4, help='并发查找的线程数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{args.entries} 条缓存，{args.lookups} 次查找（单次耗时）")
+        print("")
+        bench('每次新建连接', LegacyCache(os.path.join(tmp_dir, 'legacy.db')), args.entries, args.lookups, args.threads)
+        cache = LocalCache(os.path.join(tmp_dir, 'local.db'))
+        bench('LocalCache', cache, args.entries, args.lookups, args.threads)
+        cache.close()
+
+
+if __name__ == '__main__':
+    main()
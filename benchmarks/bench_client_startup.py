@@ -0,0 +1,120 @@
+"""
+客户端启动耗时剖析
+在新进程中分别测量：导入 main_gui_cloud 的耗时及最耗时的模块（python -X importtime）、
+get_config 首次加载与之后调用的耗时、创建 CloudClient 的耗时，
+有图形界面时（Windows 或设置了 DISPLAY）再测量从进程启动到主窗口就绪的耗时。
+每项运行 --runs 次取中位数。
+
+用法: python benchmarks/bench_client_startup.py [--runs 5] [--top 12]
+"""
+
+import os
+import sys
+import statistics
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+# 不应在启动时导入的重量级模块（第一次使用时才导入）
+LAZY_MODULES = ('cad_connector', 'win32com', 'pythoncom', 'kimi_browser', 'playwright', 'numpy')
+
+CONFIG_SCRIPT = '''
+import time
+from client_config import get_config
+t = time.perf_counter(); get_config(); first = time.perf_counter() - t
+t = time.perf_counter()
+for _ in range(1000):
+    get_config()
+print(first * 1e6, (time.perf_counter() - t) / 1000 * 1e6)
+'''
+
+CLIENT_SCRIPT = '''
+import time
+t = time.perf_counter()
+from cloud_client import CloudClient
+imported = time.perf_counter() - t
+t = time.perf_counter(); CloudClient(); created = time.perf_counter() - t
+print(imported * 1000, created * 1000)
+'''
+
+WINDOW_SCRIPT = '''
+import main_gui_cloud, time, tkinter as tk
+root = tk.Tk(); app = main_gui_cloud.CADChatGUI(root); root.update_idletasks()
+print((time.perf_counter() - main_gui_cloud._START) * 1000)
+app._on_close()
+'''
+
+
+TEMP_DIR = tempfile.mkdtemp(prefix='cadchat-startup-')
+ENV = dict(os.environ, CADCHAT_SERVER_URL='http://127.0.0.1:9',
+           CACHE_DB_PATH=os.path.join(TEMP_DIR, 'cache.db'), MIRROR_DB_PATH=os.path.join(TEMP_DIR, 'mirror.db'))
+
+
+def run(script: str, *args: str) -> subprocess.CompletedProcess:
+    proc = subprocess.run([sys.executable, *args, '-c', script], cwd=ROOT, env=ENV, capture_output=True, text=True)
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else '子进程失败')
+    return proc
+
+
+def measure(script: str) -> tuple:
+    """运行脚本，返回最后一行输出中的数值"""
+    return tuple(map(float, run(script).stdout.strip().splitlines()[-1].split()))
+
+
+def import_profile(runs: int):
+    """返回 {模块: 累计耗时(µs) 的中位数} 和 {模块: 导入层级}"""
+    samples, depth = {}, {}
+    for _ in range(runs):
+        for line in run('import main_gui_cloud', '-X', 'importtime').stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            module = name.strip()
+            samples.setdefault(module, []).append(int(cumulative))
+            depth[module] = (len(name) - len(name.lstrip())) // 2
+    return {m: statistics.median(v) for m, v in samples.items()}, depth
+
+
+def main():
+    parser = argparse.ArgumentParser(description='客户端启动耗时剖析')
+    parser.add_argument('--runs', type=int, default=5, help='每项测量的次数（取中位数）')
+    parser.add_argument('--top', type=int, default=12, help='列出最耗时的模块数')
+    args = parser.parse_args()
+
+    print(f"每项 {args.runs} 次，取中位数")
+    print("")
+    try:
+        profile, depth = import_profile(args.runs)
+    except RuntimeError as e:
+        print(f"导入 main_gui_cloud 失败: {e}")
+    else:
+        print(f"导入 main_gui_cloud: {profile['main_gui_cloud'] / 1000:.1f} ms")
+        direct = sorted((m for m in profile if depth[m] == 1), key=profile.get, reverse=True)
+        for module in direct[:args.top]:
+            print(f"  {module:<28} {profile[module] / 1000:7.1f} ms")
+        loaded = [m for m in LAZY_MODULES if m in profile]
+        print(f"启动时导入的重量级模块: {', '.join(loaded) if loaded else '无'}")
+    print("")
+
+    config = [measure(CONFIG_SCRIPT) for _ in range(args.runs)]
+    print(f"get_config 首次加载 {statistics.median(c[0] for c in config):8.1f} µs  "
+          f"之后每次 {statistics.median(c[1] for c in config):6.2f} µs")
+
+    client = [measure(CLIENT_SCRIPT) for _ in range(args.runs)]
+    print(f"导入 cloud_client {statistics.median(c[0] for c in client):6.1f} ms  "
+          f"创建 CloudClient {statistics.median(c[1] for c in client):6.1f} ms")
+
+    if sys.platform == 'win32' or os.environ.get('DISPLAY'):
+        window = [measure(WINDOW_SCRIPT)[0] for _ in range(args.runs)]
+        print(f"进程启动到主窗口就绪 {statistics.median(window):6.1f} ms")
+    else:
+        print("没有图形界面（DISPLAY 未设置），跳过主窗口就绪耗时")
+
+
+if __name__ == '__main__':
+    main()
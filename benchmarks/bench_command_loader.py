@@ -0,0 +1,117 @@
+"""
+命令库加载器基准测试
+生成一个 100 万行的命令库，对比旧的逐行字典解析与 server_common 列式加载器的耗时和常驻内存
+
+用法: python benchmarks/bench_command_loader.py [--lines 1000000] [--repeat 3]
+"""
+
+import gc
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from server_common.command_loader import load_command_file
+
+
+def generate_library(path: str, lines: int):
+    """生成测试用命令库（与 autocad_basic_commands.txt 相同的6字段格式）"""
+    types = ('basic', 'lisp', 'user_program')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("# 格式: 命令名|描述|文件名|时间戳|命令类型\n")
+        for i in range(lines):
+            cmd_type = types[i % len(types)]
+            f.write(f"CMD{i}|绘制第{i}个图形对象并设置图层属性||{cmd_type}_commands.lsp|2024-01-01|{cmd_type}\n")
+
+
+def legacy_load(path: str):
+    """旧实现：每行一个字典，并额外保存拼接好的 text 字段"""
+    commands = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                parts = line.split('|')
+                if len(parts) >= 4:
+                    commands.append({
+                        'command': parts[0],
+                        'description': parts[1],
+                        'alias': parts[2],
+                        'type': parts[-1],
+                        'text': f"{parts[1]} {parts[0]} {parts[2]}"
+                    })
+    return commands
+
+
+def legacy_load_logged(path: str):
+    """旧实现 + 每行一条 INFO 日志（aliserver 原先的行为），日志输出到空设备"""
+    logger = logging.getLogger('bench_legacy')
+    commands = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                parts = line.split('|')
+                if len(parts) >= 4:
+                    commands.append({
+                        'command': parts[0],
+                        'description': parts[1],
+                        'alias': parts[2],
+                        'type': parts[-1],
+                        'text': f"{parts[1]} {parts[0]} {parts[2]}"
+                    })
+                    logger.info(f"成功解析命令: {parts[0]} - {parts[1][:30]}...")
+    return commands
+
+
+def measure(name: str, loader, path: str, repeat: int):
+    """分别测量加载耗时（不开启 tracemalloc，取多次中的最好成绩）和加载结果的常驻内存"""
+    elapsed = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = loader(path)
+        elapsed = min(elapsed, time.perf_counter() - start)
+        rows = len(result)
+        del result
+
+    tracemalloc.start()
+    result = loader(path)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    print(f"{name:<10} {rows:>10} 行  {elapsed:8.2f} s  常驻 {retained / 1024 / 1024:8.1f} MB  峰值 {peak / 1024 / 1024:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='命令库加载器基准测试')
+    parser.add_argument('--lines', type=int, default=1_000_000, help='生成的命令行数')
+    parser.add_argument('--repeat', type=int, default=3, help='计时重复次数')
+    args = parser.parse_args()
+
+    null_stream = open(os.devnull, 'w', encoding='utf-8')
+    handler = logging.StreamHandler(null_stream)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    bench_logger = logging.getLogger('bench_legacy')
+    bench_logger.addHandler(handler)
+    bench_logger.setLevel(logging.INFO)
+    bench_logger.propagate = False
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'commands.txt')
+        print(f"生成 {args.lines} 行命令库...")
+        generate_library(path, args.lines)
+        print(f"文件大小: {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+        print("")
+        measure('逐行字典+日志', legacy_load_logged, path, 1)
+        measure('逐行字典', legacy_load, path, args.repeat)
+        measure('列式加载器', load_command_file, path, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
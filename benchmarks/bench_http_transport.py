@@ -0,0 +1,92 @@
+"""
+客户端 HTTP 传输基准测试
+在本机启动一个支持 HTTP/1.1 长连接的测试服务端（相当于部署时服务端前面的反向代理），
+对比每次调用 requests.get（每次新建连接）与 client_transport.HttpTransport（长连接池）
+的单次请求耗时和服务端看到的新建连接数。
+本机回环上没有网络延迟和 TLS，--handshake-ms 在每个新连接上模拟远程服务端 TCP+TLS 握手的耗时。
+
+用法: python benchmarks/bench_http_transport.py [--requests 1000] [--threads 4] [--handshake-ms 0]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from client_transport import HttpTransport
+
+BODY = json.dumps({'total_codes': 211, 'rag_enabled': True, 'embedding_model': 'bge-m3'}).encode('utf-8')
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # 响应头和响应体分开写出，不关闭 Nagle 时长连接上会等待延迟确认
+    connections = []
+    handshake_seconds = 0.0
+
+    def setup(self):
+        self.connections.append(self.client_address)
+        time.sleep(self.handshake_seconds)
+        super().setup()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def bench(name: str, call, count: int, threads: int):
+    call()
+    KeepAliveHandler.connections.clear()
+    per_thread = count // threads
+
+    def worker():
+        for _ in range(per_thread):
+            assert call().status_code == 200
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    per_call_ms = (time.perf_counter() - start) / (per_thread * threads) * 1000
+    print(f"{name:<16} 单次 {per_call_ms:6.3f} ms  新建连接 {len(KeepAliveHandler.connections):5d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='客户端 HTTP 传输基准测试')
+    parser.add_argument('--requests', type=int, default=1000, help='每种方式的请求次数')
+    parser.add_argument('--threads', type=int, default=4, help='并发请求的线程数')
+    parser.add_argument('--handshake-ms', type=float, default=0, help='每个新连接模拟的握手耗时（毫秒）')
+    args = parser.parse_args()
+    KeepAliveHandler.handshake_seconds = args.handshake_ms / 1000
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    transport = HttpTransport(base_url)
+
+    print(f"每种方式 {args.requests} 次 GET，{args.threads} 个线程，模拟握手 {args.handshake_ms:g} ms")
+    print("")
+    bench('requests.get', lambda: requests.get(f'{base_url}/api/stats', timeout=10), args.requests, args.threads)
+    bench('HttpTransport', lambda: transport.get('/api/stats'), args.requests, args.threads)
+
+    transport.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+需求规范化基准测试
+按常见需求句式生成只有数值参数、全角/半角、空白和标点不同的需求，
+对比按原文和按规范化模板作为缓存键时的命中率，以及规范化本身的单次耗时
+
+用法: python benchmarks/bench_requirement_normalizer.py [--requests 20000] [--seed 0]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from requirement_normalizer import normalize_requirement
+
+PATTERNS = [
+    '画一个半径为{}的圆',
+    '画一个{}x{}的矩形',
+    '把选中的对象偏移{}个单位',
+    '旋转{}度',
+    '画一条长{}mm的直线',
+    '阵列复制{}行{}列，间距{}',
+    '倒圆角，半径{}',
+    '把文字高度改成{}',
+]
+
+_FULL_WIDTH = str.maketrans('0123456789x', '０１２３４５６７８９ｘ')
+
+
+def sample_requirement(rng: random.Random) -> str:
+    """随机选一个句式，填入随机参数，再随机改变写法"""
+    pattern = rng.choice(PATTERNS)
+    values = [str(rng.choice([rng.randint(1, 500), round(rng.uniform(0.5, 100), 1)]))
+              for _ in range(pattern.count('{}'))]
+    text = pattern.format(*(f' {v} ' if rng.random() < 0.3 else v for v in values))
+    if rng.random() < 0.2:
+        text = text.translate(_FULL_WIDTH)
+    if rng.random() < 0.3:
+        text = text.replace('，', ',')
+    if rng.random() < 0.3:
+        text += rng.choice(['。', '！', ' ', '.'])
+    return text
+
+
+def hit_rate(keys) -> float:
+    """每个键第一次出现算未命中，之后算命中"""
+    seen = set()
+    hits = 0
+    for key in keys:
+        if key in seen:
+            hits += 1
+        seen.add(key)
+    return hits / len(keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='需求规范化基准测试')
+    parser.add_argument('--requests', type=int, default=20000, help='生成的需求条数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    requirements = [sample_requirement(rng) for _ in range(args.requests)]
+
+    start = time.perf_counter()
+    templates = [normalize_requirement(text)[0] for text in requirements]
+    normalize_us = (time.perf_counter() - start) / len(requirements) * 1e6
+
+    print(f"{args.requests} 条需求，{len(PATTERNS)} 种句式")
+    print("")
+    print(f"{'按原文缓存':<10} 不同的键 {len(set(requirements)):6d}  命中率 {hit_rate(requirements):6.1%}")
+    print(f"{'按模板缓存':<10} 不同的键 {len(set(templates)):6d}  命中率 {hit_rate(templates):6.1%}")
+    print(f"规范化单次耗时 {normalize_us:.1f} µs")
+
+
+if __name__ == '__main__':
+    main()
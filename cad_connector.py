@@ -1,5 +1,5 @@
 import win32com.client
-from typing import Optional, Any, Tuple
+from typing import Dict, Optional, Any, Tuple
 import pythoncom
 import os
 import re
@@ -208,12 +208,22 @@ class CADConnector:
         finally:
             pythoncom.CoUninitialize()
     
-    def execute_lisp_code(self, lisp_code: str) -> Tuple[bool, Optional[str], Optional[str]]:
+    def execute_lisp_code(self, lisp_code: str,
+                          timings: Optional[Dict[str, float]] = None) -> Tuple[bool, Optional[str], Optional[str]]:
         """执行LISP代码
+        timings: 给出时记录各阶段耗时（毫秒）：cad_prepare（检查连接、写文件）、cad_load（加载LSP）、cad_run（运行命令）
         返回: (是否成功, 错误信息, CAD命令行输出)
         """
         temp_file = None
         cad_output = []
+        stage_start = time.perf_counter()
+        
+        def mark(stage: str):
+            nonlocal stage_start
+            now = time.perf_counter()
+            if timings is not None:
+                timings[stage] = (now - stage_start) * 1000
+            stage_start = now
         
         try:
             # 初始化COM（确保在当前线程中）
@@ -271,6 +281,7 @@ class CADConnector:
             # 方法2: 使用双反斜杠
             lisp_path_double = temp_file.replace('\\', '\\\\')
             
+            mark('cad_prepare')
             print(f"尝试加载LSP文件...")
             cad_output.append("正在加载LSP文件...")
             
@@ -316,6 +327,7 @@ class CADConnector:
             # 等待CAD处理
             time.sleep(2)
             cad_output.append("加载完成")
+            mark('cad_load')
             
             # 从LISP代码中提取命令名称并在CAD命令行输入
             command_name = self._extract_command_name(lisp_code)
@@ -327,6 +339,7 @@ class CADConnector:
                     print(f"已在CAD命令行输入命令: {command_name}")
                 except Exception as e:
                     print(f"发送命令到CAD失败: {e}")
+            mark('cad_run')
             
             return True, None, "\n".join(cad_output)
         
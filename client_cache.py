@@ -0,0 +1,311 @@
+"""
+CADChat 客户端本地缓存
+查询结果和用户代码内容保存在一个 SQLite 文件中（WAL 模式）。
+读取时每个线程复用自己的长连接，写入只用一个专用连接；语句使用固定的 SQL 文本，由连接的语句缓存复用预编译结果。
+写入先放在内存中，攒够一批或等待片刻后由常驻的后台线程在一个事务中提交；读取只记下访问时间，随下一批写入提交。
+查询结果带服务端的索引版本，版本变化、超过有效期的条目在读取时失效；条目数超过上限时淘汰最久未访问的。
+lookup 不删除这些过期条目而是标记为过期返回，供先返回旧结果、再在后台刷新（stale-while-revalidate）使用。
+"""
+
+import os
+import json
+import atexit
+import sqlite3
+import time
+import threading
+from typing import Dict, Optional, Tuple
+
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_FLUSH_INTERVAL = 1.0  # 秒
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+QUERY_TABLE = 'cache'
+USER_CODE_TABLE = 'user_code_cache'
+
+_SELECT_QUERY = 'SELECT matched_code, version, created_at FROM cache WHERE requirement = ?'
+_UPSERT_QUERY = ('INSERT OR REPLACE INTO cache (requirement, matched_code, version, created_at, last_access) '
+                 'VALUES (?, ?, ?, ?, ?)')
+_DELETE_QUERY = 'DELETE FROM cache WHERE requirement = ?'
+_TOUCH_QUERY = 'UPDATE cache SET last_access = ? WHERE requirement = ?'
+_EXPIRE_QUERY = 'DELETE FROM cache WHERE created_at < ?'
+_EVICT_QUERY = ('DELETE FROM cache WHERE requirement IN '
+                '(SELECT requirement FROM cache ORDER BY COALESCE(last_access, created_at, 0) LIMIT ?)')
+_SELECT_USER_CODE = 'SELECT etag, body FROM user_code_cache WHERE cache_key = ?'
+_UPSERT_USER_CODE = 'INSERT OR REPLACE INTO user_code_cache (cache_key, etag, body) VALUES (?, ?, ?)'
+_DELETE_USER_CODE = 'DELETE FROM user_code_cache WHERE cache_key = ?'
+
+_DELETED = object()  # 待写入的删除标记
+
+
+class LocalCache:
+    """线程安全的本地缓存
+
+    读操作先查未提交的写入，再查数据库；写操作最多延迟 flush_interval 秒提交，
+    程序退出时自动提交剩余写入。max_entries / ttl_seconds 为 0 时不限制。
+    """
+
+    def __init__(self, db_path: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evicted = 0
+        self.invalidated = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], object] = {}
+        self._touched: Dict[str, float] = {}  # 查询结果的最近访问时间，随下一批写入提交
+        self._writer: Optional[sqlite3.Connection] = None  # 写入专用连接，只在持有 _write_lock 时使用
+        self._wakeup = threading.Event()  # 有待写入的内容，唤醒后台提交线程
+        self._flusher: Optional[Tuple[threading.Thread, threading.Event]] = None  # (线程, 停止标记)
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        with self._write_lock:
+            self._init_schema(self._writer_conn())
+        atexit.register(self.flush)
+
+    def _init_schema(self, conn: sqlite3.Connection):
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                requirement TEXT UNIQUE NOT NULL,
+                matched_code TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE IF NOT EXISTS user_code_cache (
+                cache_key TEXT PRIMARY KEY,
+                etag TEXT NOT NULL,
+                body TEXT NOT NULL,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(cache)')}
+        for column, column_type in (('version', 'TEXT'), ('created_at', 'REAL'), ('last_access', 'REAL')):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE cache ADD COLUMN {column} {column_type}')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache(last_access)')
+        conn.commit()
+
+    def _connect(self, **kwargs) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, cached_statements=32, **kwargs)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        """当前线程的读连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _writer_conn(self) -> sqlite3.Connection:
+        """写入专用连接（调用方持有 _write_lock），提交线程、调用 flush 的线程共用这一个连接"""
+        if self._writer is None:
+            self._writer = self._connect(check_same_thread=False)
+        return self._writer
+
+    # ---- 查询结果 ----
+
+    def get(self, key: str, version: Optional[str] = None) -> Optional[Dict]:
+        """读取查询结果
+
+        version 为服务端当前的索引版本：条目的版本与之不同（或条目超过有效期）时视为未命中并删除；
+        为 None（还不知道服务端版本）时不比较版本。
+        """
+        found = self.lookup(key, version)
+        if found is None:
+            return None
+        result, stale = found
+        if stale:
+            self.invalidated += 1
+            self.delete(key)
+            return None
+        return result
+
+    def lookup(self, key: str, version: Optional[str] = None,
+               max_age: Optional[float] = None) -> Optional[Tuple[Dict, bool]]:
+        """读取查询结果，返回 (结果, 是否过期)，未缓存时返回 None
+
+        版本不同、超过有效期或（给出 max_age 时）保存已超过 max_age 秒的条目标记为过期，但不删除。
+        """
+        pending = self._pending_value(QUERY_TABLE, key)
+        if pending is _DELETED:
+            return None
+        row = pending if pending is not None else self._conn().execute(_SELECT_QUERY, (key,)).fetchone()
+        if row is None:
+            return None
+
+        body, entry_version, created_at = row
+        now = time.time()
+        age = now - created_at if created_at is not None else None
+        stale = (version is not None and entry_version != version) or \
+            (age is not None and bool(self.ttl_seconds) and age > self.ttl_seconds) or \
+            (age is not None and max_age is not None and age > max_age)
+
+        # 只记下访问时间，随下一批写入提交；积累的访问记录够一批时才单独提交
+        with self._lock:
+            self._touched[key] = now
+            if len(self._touched) >= self.batch_size:
+                self._schedule()
+        return json.loads(body), stale
+
+    def put(self, key: str, result: Dict, version: Optional[str] = None):
+        """保存查询结果，version 为产生该结果的服务端索引版本"""
+        self._write(QUERY_TABLE, key, (json.dumps(result), version, time.time()))
+
+    def delete(self, key: str):
+        self._write(QUERY_TABLE, key, _DELETED)
+
+    def clear(self):
+        """清空查询结果缓存（用户代码缓存保留）"""
+        with self._write_lock:
+            with self._lock:
+                for pending_key in [k for k in self._pending if k[0] == QUERY_TABLE]:
+                    del self._pending[pending_key]
+                self._touched.clear()
+            conn = self._writer_conn()
+            conn.execute('DELETE FROM cache')
+            conn.commit()
+
+    # ---- 用户代码内容 ----
+
+    def get_user_code(self, key: str) -> Optional[Tuple[str, Dict]]:
+        """返回 (etag, 代码信息)，未缓存时返回 None"""
+        pending = self._pending_value(USER_CODE_TABLE, key)
+        if pending is not None:
+            return None if pending is _DELETED else (pending[0], json.loads(pending[1]))
+        row = self._conn().execute(_SELECT_USER_CODE, (key,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def put_user_code(self, key: str, etag: str, result: Dict):
+        self._write(USER_CODE_TABLE, key, (etag, json.dumps(result)))
+
+    def delete_user_code(self, key: str):
+        self._write(USER_CODE_TABLE, key, _DELETED)
+
+    # ---- 批量提交 ----
+
+    def _pending_value(self, table: str, key: str):
+        with self._lock:
+            return self._pending.get((table, key))
+
+    def _write(self, table: str, key: str, value):
+        with self._lock:
+            self._pending[(table, key)] = value
+            if len(self._pending) < self.batch_size:
+                self._schedule()
+                return
+        self.flush()
+
+    def _schedule(self):
+        """唤醒后台提交线程，flush_interval 秒后提交（调用方持有 _lock）
+
+        提交线程常驻，第一次需要时启动，之后只通过事件唤醒，不为每次写入创建线程。
+        """
+        if self._flusher is None:
+            stop = threading.Event()
+            thread = threading.Thread(target=self._flush_loop, args=(stop,), daemon=True, name='cache-flusher')
+            self._flusher = (thread, stop)
+            thread.start()
+        self._wakeup.set()
+
+    def _flush_loop(self, stop: threading.Event):
+        while not stop.is_set():
+            self._wakeup.wait()
+            if stop.is_set():
+                break
+            # 等待片刻，把这段时间的写入攒成一批
+            stop.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"[缓存] 提交失败: {e}")
+
+    def flush(self) -> int:
+        """在一个事务中提交所有待写入的内容，返回提交的条数
+
+        提交完成前这些内容仍留在待写入表中，其他线程读到的始终是最新值。
+        """
+        with self._write_lock:
+            with self._lock:
+                pending = dict(self._pending)
+                touched = self._touched
+                self._touched = {}
+            if not pending and not touched:
+                return 0
+
+            upserts = {QUERY_TABLE: [], USER_CODE_TABLE: []}
+            deletes = {QUERY_TABLE: [], USER_CODE_TABLE: []}
+            for (table, key), value in pending.items():
+                if value is _DELETED:
+                    deletes[table].append((key,))
+                elif table == QUERY_TABLE:
+                    body, version, created_at = value
+                    upserts[table].append((key, body, version, created_at, touched.pop(key, created_at)))
+                else:
+                    upserts[table].append((key,) + value)
+
+            conn = self._writer_conn()
+            with conn:
+                conn.executemany(_UPSERT_QUERY, upserts[QUERY_TABLE])
+                conn.executemany(_DELETE_QUERY, deletes[QUERY_TABLE])
+                conn.executemany(_UPSERT_USER_CODE, upserts[USER_CODE_TABLE])
+                conn.executemany(_DELETE_USER_CODE, deletes[USER_CODE_TABLE])
+                conn.executemany(_TOUCH_QUERY, [(ts, key) for key, ts in touched.items()])
+                if upserts[QUERY_TABLE]:
+                    self._evict(conn)
+
+            # 只移除已提交的值，提交期间被再次修改的键留到下一批
+            with self._lock:
+                for pending_key, value in pending.items():
+                    if self._pending.get(pending_key) is value:
+                        del self._pending[pending_key]
+                if self._pending:
+                    self._schedule()
+        return len(pending)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """删除过期条目；条目数超过上限时删除最久未访问的（调用方持有 _write_lock 并在事务中）"""
+        if self.ttl_seconds:
+            self.evicted += conn.execute(_EXPIRE_QUERY, (time.time() - self.ttl_seconds,)).rowcount
+        if self.max_entries:
+            count = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+            if count > self.max_entries:
+                self.evicted += conn.execute(_EVICT_QUERY, (count - self.max_entries,)).rowcount
+
+    def stats(self) -> Dict:
+        return {
+            'entries': self._conn().execute('SELECT COUNT(*) FROM cache').fetchone()[0],
+            'pending': len(self._pending),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'evicted': self.evicted,
+            'invalidated': self.invalidated
+        }
+
+    def close(self):
+        """停止后台提交线程，提交剩余写入，关闭写入连接和当前线程的读连接"""
+        with self._lock:
+            flusher, self._flusher = self._flusher, None
+        if flusher is not None:
+            thread, stop = flusher
+            stop.set()
+            self._wakeup.set()
+            thread.join()
+        self.flush()
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
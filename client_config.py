@@ -4,9 +4,11 @@ CADCHAT 客户端配置管理器
 """
 
 import os
+import threading
+from pathlib import Path
 from dotenv import load_dotenv
 import json
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 
 
 class ClientConfig:
@@ -20,30 +22,58 @@ class ClientConfig:
             env_file: 环境变量文件路径
         """
         # 加载环境变量文件 - 使用绝对路径
-        import os
-        from pathlib import Path
         env_path = Path(__file__).parent / env_file
         self.env_file = str(env_path)
         load_dotenv(dotenv_path=self.env_file, override=True)
         
         # 服务端配置
         self.server_url = os.getenv('CADCHAT_SERVER_URL', 'http://localhost:5000')
+        # 多个服务端（逗号分隔）：按探测延迟选择，失败时自动切换；为空时只使用 CADCHAT_SERVER_URL
+        self.server_urls = [u.strip() for u in os.getenv('CADCHAT_SERVER_URLS', '').split(',') if u.strip()] \
+            or [self.server_url]
+        self.endpoint_probe_interval = float(os.getenv('ENDPOINT_PROBE_INTERVAL', '30'))  # 健康探测间隔（秒）
+        self.namespace = os.getenv('CADCHAT_NAMESPACE', '')  # 团队/项目命名空间，为空时使用共享代码库
         
         # 百炼平台配置
         self.bailian_app_id = os.getenv('BAILIAN_APP_ID')
         self.dashscope_api_key = os.getenv('DASHSCOPE_API_KEY')
         
         # 请求配置
-        self.request_timeout = int(os.getenv('REQUEST_TIMEOUT', '30'))
+        self.request_timeout = int(os.getenv('REQUEST_TIMEOUT', '30'))  # 读取超时
+        self.connect_timeout = float(os.getenv('CONNECT_TIMEOUT', '5'))
+        self.http_retries = int(os.getenv('HTTP_RETRIES', '2'))  # 连接失败、网关错误的重试次数
+        self.http_backoff = float(os.getenv('HTTP_BACKOFF', '0.3'))  # 重试退避基数（秒）
+        self.http_pool_size = int(os.getenv('HTTP_POOL_SIZE', '10'))  # 保持的长连接数
+        self.http_compression = os.getenv('HTTP_COMPRESSION', 'true').lower() == 'true'  # 接受压缩的响应
         
         # 缓存配置
         self.cache_enabled = os.getenv('CACHE_ENABLED', 'true').lower() == 'true'
         self.cache_db_path = os.getenv('CACHE_DB_PATH', 'local_cache.db')
+        self.cache_max_entries = int(os.getenv('CACHE_MAX_ENTRIES', '5000'))  # 超出后淘汰最久未访问的查询结果
+        self.cache_ttl_seconds = int(os.getenv('CACHE_TTL_SECONDS', str(7 * 24 * 3600)))  # 查询结果的有效期
+        self.cache_revalidate = os.getenv('CACHE_REVALIDATE', 'true').lower() == 'true'  # 先返回缓存结果，再在后台刷新
+        self.cache_revalidate_after = int(os.getenv('CACHE_REVALIDATE_AFTER', '300'))  # 缓存结果保存超过该秒数即刷新
+        
+        # 本地命令目录镜像配置
+        self.mirror_enabled = os.getenv('MIRROR_ENABLED', 'true').lower() == 'true'
+        self.mirror_db_path = os.getenv('MIRROR_DB_PATH', 'catalog_mirror.db')
+        self.mirror_search = os.getenv('MIRROR_SEARCH', 'auto').lower()  # auto: 离线或本地更快时检索镜像；offline: 仅离线时；off: 不检索
+        self.mirror_embedding_host = os.getenv('MIRROR_EMBEDDING_HOST', '')  # 本机 Ollama 地址，为空时离线只能关键词匹配
         
         # 日志配置
         self.log_level = os.getenv('LOG_LEVEL', 'INFO')
         
-        print(f"[配置] 服务端URL: {self.server_url}")
+        # 耗时记录配置（python client_telemetry.py 导出报告）
+        self.telemetry_enabled = os.getenv('TELEMETRY_ENABLED', 'true').lower() == 'true'
+        self.telemetry_db_path = os.getenv('TELEMETRY_DB_PATH', 'telemetry.db')
+        self.telemetry_retention_days = float(os.getenv('TELEMETRY_RETENTION_DAYS', '30'))  # 超过该天数的记录自动删除
+        
+        if len(self.server_urls) > 1:
+            print(f"[配置] 服务端URL: {', '.join(self.server_urls)}")
+        else:
+            print(f"[配置] 服务端URL: {self.server_url}")
+        if self.namespace:
+            print(f"[配置] 命名空间: {self.namespace}")
         print(f"[配置] 缓存状态: {'启用' if self.cache_enabled else '禁用'}")
         print(f"[配置] 请求超时: {self.request_timeout}秒")
     
@@ -51,14 +81,35 @@ class ClientConfig:
         """获取服务端配置"""
         return {
             'server_url': self.server_url,
-            'timeout': self.request_timeout
+            'server_urls': self.server_urls,
+            'probe_interval': self.endpoint_probe_interval,
+            'namespace': self.namespace,
+            'timeout': self.request_timeout,
+            'connect_timeout': self.connect_timeout,
+            'retries': self.http_retries,
+            'backoff': self.http_backoff,
+            'pool_size': self.http_pool_size,
+            'compression': self.http_compression
         }
     
     def get_cache_config(self) -> Dict[str, Any]:
         """获取缓存配置"""
         return {
             'enabled': self.cache_enabled,
-            'db_path': self.cache_db_path
+            'db_path': self.cache_db_path,
+            'max_entries': self.cache_max_entries,
+            'ttl_seconds': self.cache_ttl_seconds,
+            'revalidate': self.cache_revalidate,
+            'revalidate_after': self.cache_revalidate_after
+        }
+    
+    def get_mirror_config(self) -> Dict[str, Any]:
+        """获取本地命令目录镜像配置"""
+        return {
+            'enabled': self.mirror_enabled,
+            'db_path': self.mirror_db_path,
+            'search': self.mirror_search,
+            'embedding_host': self.mirror_embedding_host
         }
     
     def get_bailian_config(self) -> Optional[Dict[str, str]]:
@@ -81,12 +132,31 @@ class ClientConfig:
         """保存当前配置到环境文件"""
         config_data = {
             'CADCHAT_SERVER_URL': self.server_url,
+            'CADCHAT_SERVER_URLS': ','.join(self.server_urls) if len(self.server_urls) > 1 else '',
+            'ENDPOINT_PROBE_INTERVAL': str(self.endpoint_probe_interval),
+            'CADCHAT_NAMESPACE': self.namespace,
             'BAILIAN_APP_ID': self.bailian_app_id or '',
             'DASHSCOPE_API_KEY': self.dashscope_api_key or '',
             'REQUEST_TIMEOUT': str(self.request_timeout),
+            'CONNECT_TIMEOUT': str(self.connect_timeout),
+            'HTTP_RETRIES': str(self.http_retries),
+            'HTTP_BACKOFF': str(self.http_backoff),
+            'HTTP_POOL_SIZE': str(self.http_pool_size),
+            'HTTP_COMPRESSION': str(self.http_compression).lower(),
             'CACHE_ENABLED': str(self.cache_enabled).lower(),
             'CACHE_DB_PATH': self.cache_db_path,
-            'LOG_LEVEL': self.log_level
+            'CACHE_MAX_ENTRIES': str(self.cache_max_entries),
+            'CACHE_TTL_SECONDS': str(self.cache_ttl_seconds),
+            'CACHE_REVALIDATE': str(self.cache_revalidate).lower(),
+            'CACHE_REVALIDATE_AFTER': str(self.cache_revalidate_after),
+            'MIRROR_ENABLED': str(self.mirror_enabled).lower(),
+            'MIRROR_DB_PATH': self.mirror_db_path,
+            'MIRROR_SEARCH': self.mirror_search,
+            'MIRROR_EMBEDDING_HOST': self.mirror_embedding_host,
+            'LOG_LEVEL': self.log_level,
+            'TELEMETRY_ENABLED': str(self.telemetry_enabled).lower(),
+            'TELEMETRY_DB_PATH': self.telemetry_db_path,
+            'TELEMETRY_RETENTION_DAYS': str(self.telemetry_retention_days)
         }
         
         with open(self.env_file, 'w', encoding='utf-8') as f:
@@ -96,10 +166,32 @@ class ClientConfig:
         print(f"[配置] 配置已保存到 {self.env_file}")
 
 
-def get_config(env_file: str = '.env') -> ClientConfig:
-    """获取配置实例（每次都重新加载）
+# 配置文件路径 -> (加载时的修改时间, 配置实例)
+_config_cache: Dict[str, Tuple[Optional[float], ClientConfig]] = {}
+_config_lock = threading.Lock()
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_config(env_file: str = '.env', reload: bool = False) -> ClientConfig:
+    """获取配置实例
+    
+    同一配置文件只加载一次，之后返回同一实例；文件修改时间变化（如 save_config 后）或 reload 为 True 时重新加载。
     
     Args:
         env_file: 环境配置文件，默认为'.env'
+        reload: 是否强制重新加载
     """
-    return ClientConfig(env_file=env_file)
\ No newline at end of file
+    path = str(Path(__file__).parent / env_file)
+    mtime = _mtime(path)
+    with _config_lock:
+        cached = _config_cache.get(path)
+        if cached is None or reload or cached[0] != mtime:
+            cached = (mtime, ClientConfig(env_file=env_file))
+            _config_cache[path] = cached
+        return cached[1]
\ No newline at end of file
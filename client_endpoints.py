@@ -0,0 +1,264 @@
+"""
+CADChat 客户端多服务端选择
+配置了多个服务端地址时，后台线程定期请求各服务端的 /api/health（旧服务端没有时改用 /health），
+记录延迟（指数滑动平均）和健康状态；
+请求发往延迟最低的健康服务端，连接失败（GET 还包括超时和网关错误）时自动切换到下一个。
+EndpointPool 提供与 HttpTransport 相同的方法，可直接作为 CloudClient 的传输使用。
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import requests
+from requests import Response
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, NewConnectionError
+
+from client_transport import HttpTransport, RETRY_STATUS
+
+DEFAULT_PROBE_INTERVAL = 30  # 秒
+LATENCY_SMOOTHING = 0.3
+HEALTH_PATH = '/api/health'
+LEGACY_HEALTH_PATH = '/health'  # 旧版阿里云适配服务端只有这个路径
+
+# 不确定请求是否已被服务端处理时，只有这些方法可以换一个服务端重发
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+
+class Endpoint:
+    """一个服务端：传输、健康状态和延迟统计"""
+
+    def __init__(self, transport: HttpTransport):
+        self.transport = transport
+        self.healthy: Optional[bool] = None  # None 表示还未探测
+        # 秒；选择服务端只比较探测延迟（各服务端的 /api/health 耗时可比），请求耗时只做统计
+        self.latency: Optional[float] = None  # 探测耗时的指数滑动平均
+        self.min_latency: Optional[float] = None
+        self.last_latency: Optional[float] = None
+        self.request_latency: Optional[float] = None  # 请求耗时的指数滑动平均
+        self.probes = 0
+        self.probe_failures = 0
+        self.failovers = 0  # 请求失败后切换离开该服务端的次数
+        self.last_error: Optional[str] = None
+        self.last_probe: Optional[float] = None
+        self.health_path = HEALTH_PATH
+
+    @property
+    def url(self) -> str:
+        return self.transport.base_url
+
+    def record_probe(self, elapsed: float):
+        self.healthy = True
+        self.last_latency = elapsed
+        self.min_latency = elapsed if self.min_latency is None else min(self.min_latency, elapsed)
+        self.latency = _smooth(self.latency, elapsed)
+
+    def record_request(self, elapsed: float):
+        self.healthy = True
+        self.request_latency = _smooth(self.request_latency, elapsed)
+
+    def record_failure(self, error: str):
+        self.healthy = False
+        self.last_error = error
+
+    def stats(self) -> Dict:
+        def ms(value):
+            return round(value * 1000, 2) if value is not None else None
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'latency_ms': ms(self.latency),
+            'min_latency_ms': ms(self.min_latency),
+            'last_latency_ms': ms(self.last_latency),
+            'request_latency_ms': ms(self.request_latency),
+            'requests': self.transport.requests,
+            'failures': self.transport.failures,
+            'failovers': self.failovers,
+            'probes': self.probes,
+            'probe_failures': self.probe_failures,
+            'last_error': self.last_error
+        }
+
+
+class EndpointPool:
+    """按延迟选择服务端并自动切换的传输
+
+    排序：健康的在前（按延迟从低到高，未测出延迟的按配置顺序排在其后），不健康的最后；
+    所有服务端都不健康时仍按此顺序逐个尝试，服务端恢复后由下一次探测或成功的请求重新标记为健康。
+    """
+
+    def __init__(self, urls: List[str], transport_factory: Callable[[str], HttpTransport],
+                 probe_interval: float = DEFAULT_PROBE_INTERVAL, probe_timeout: float = 5):
+        if not urls:
+            raise ValueError('至少需要一个服务端地址')
+        self.endpoints = [Endpoint(transport_factory(url)) for url in urls]
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._active: Optional[Endpoint] = None
+
+    # ---- 与 HttpTransport 相同的属性 ----
+
+    @property
+    def base_url(self) -> str:
+        return self.ordered()[0].url
+
+    @property
+    def pool_size(self) -> int:
+        return self.endpoints[0].transport.pool_size
+
+    @property
+    def requests(self) -> int:
+        return sum(e.transport.requests for e in self.endpoints)
+
+    @property
+    def failures(self) -> int:
+        return sum(e.transport.failures for e in self.endpoints)
+
+    def url(self, path: str) -> str:
+        return self.ordered()[0].transport.url(path)
+
+    # ---- 选择和切换 ----
+
+    def ordered(self) -> List[Endpoint]:
+        """按优先顺序排列的服务端"""
+        with self._lock:
+            def key(item):
+                index, endpoint = item
+                if endpoint.healthy is False:
+                    return (2, 0.0, index)
+                if endpoint.latency is None:
+                    return (1, 0.0, index)
+                return (0, endpoint.latency, index)
+            return [e for _, e in sorted(enumerate(self.endpoints), key=key)]
+
+    def _note_active(self, endpoint: Endpoint):
+        if endpoint is not self._active:
+            if self._active is not None:
+                print(f"[服务端] 切换到 {endpoint.url}")
+            self._active = endpoint
+
+    def request(self, method: str, path: str, timeout: Optional[float] = None, **kwargs) -> Response:
+        """发往当前最优的服务端，失败时依次换下一个
+
+        连接失败（请求未送达）时所有方法都切换；超时和网关错误只对 GET/HEAD 切换，避免重复保存。
+
+        Raises:
+            requests.exceptions.RequestException: 所有服务端都无法完成请求
+        """
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        candidates = self.ordered()
+        last_error: Optional[Exception] = None
+        for i, endpoint in enumerate(candidates):
+            last = i == len(candidates) - 1
+            start = time.perf_counter()
+            try:
+                response = endpoint.transport.request(method, path, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if not (idempotent or _not_sent(e)):
+                    raise
+                self._failover(endpoint, str(e), last)
+                last_error = e
+                continue
+
+            if response.status_code in RETRY_STATUS:
+                if idempotent and not last:
+                    self._failover(endpoint, f'HTTP {response.status_code}', last)
+                    continue
+            else:
+                with self._lock:
+                    endpoint.record_request(time.perf_counter() - start)
+            self._note_active(endpoint)
+            return response
+        raise last_error
+
+    def _failover(self, endpoint: Endpoint, error: str, last: bool):
+        with self._lock:
+            endpoint.record_failure(error)
+            if not last:
+                endpoint.failovers += 1
+        if not last:
+            print(f"[服务端] {endpoint.url} 请求失败，尝试下一个服务端: {error}")
+
+    def get(self, path: str, **kwargs) -> Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> Response:
+        return self.request('POST', path, **kwargs)
+
+    # ---- 探测 ----
+
+    def probe(self, endpoint: Endpoint) -> bool:
+        """请求一次健康检查，更新健康状态和延迟
+
+        服务端没有 /api/health（404）时改用 /health，之后对该服务端一直使用 /health。
+        """
+        start = time.perf_counter()
+        try:
+            response = endpoint.transport.get(endpoint.health_path, timeout=self.probe_timeout)
+            if response.status_code == 404 and endpoint.health_path != LEGACY_HEALTH_PATH:
+                endpoint.health_path = LEGACY_HEALTH_PATH
+                start = time.perf_counter()
+                response = endpoint.transport.get(endpoint.health_path, timeout=self.probe_timeout)
+            ok = response.status_code == 200
+            error = None if ok else f'HTTP {response.status_code}'
+        except requests.exceptions.RequestException as e:
+            ok, error = False, str(e)
+        with self._lock:
+            endpoint.probes += 1
+            endpoint.last_probe = time.time()
+            if ok:
+                endpoint.record_probe(time.perf_counter() - start)
+            else:
+                endpoint.probe_failures += 1
+                endpoint.record_failure(error)
+        return ok
+
+    def probe_all(self):
+        for endpoint in self.endpoints:
+            self.probe(endpoint)
+
+    def start(self):
+        """启动后台探测线程（立即探测一轮，之后每 probe_interval 秒一轮）"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._probe_loop, daemon=True, name='cadchat-endpoint-probe')
+        self._thread.start()
+
+    def _probe_loop(self):
+        while not self._stop.is_set():
+            self.probe_all()
+            self._stop.wait(self.probe_interval)
+
+    def stats(self) -> Dict:
+        ordered = self.ordered()
+        with self._lock:
+            return {
+                'active': ordered[0].url,
+                'requests': self.requests,
+                'failures': self.failures,
+                'probe_interval': self.probe_interval,
+                'endpoints': [e.stats() for e in self.endpoints]
+            }
+
+    def close(self):
+        """停止探测并关闭所有连接"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.probe_timeout)
+        for endpoint in self.endpoints:
+            endpoint.transport.close()
+
+
+def _smooth(previous: Optional[float], sample: float) -> float:
+    return sample if previous is None else previous + LATENCY_SMOOTHING * (sample - previous)
+
+
+def _not_sent(error: requests.exceptions.RequestException) -> bool:
+    """请求是否确定没有送达服务端（建立连接失败或连接超时）"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = error.args[0].reason if error.args and isinstance(error.args[0], MaxRetryError) else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
@@ -0,0 +1,252 @@
+"""
+CADChat 客户端命令目录镜像
+把服务端的命令目录（基本命令、LISP 命令、共享用户代码和本命名空间的用户代码）及其向量保存在本地 SQLite，
+通过 /api/catalog/delta 按版本增量同步。服务端不可用或本地检索更快时在镜像上检索，
+相似度与服务端相同（查询向量与条目向量的余弦相似度），查询向量由本机 Ollama 按镜像的模型计算；
+本机没有可用的嵌入服务时退回按字符二元组重合度的关键词匹配。
+"""
+
+import os
+import array
+import base64
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+_np = False  # numpy 模块，第一次检索时导入（启动时不需要）；None 表示未安装
+
+
+def _numpy():
+    global _np
+    if _np is False:
+        try:
+            import numpy
+            _np = numpy
+        except ImportError:
+            _np = None
+    return _np
+
+# 服务端的命令类型别名（user_program 即 user_code）
+COMMAND_TYPE_ALIASES = {'user_program': 'user_code'}
+
+_ENTRY_FIELDS = ('id', 'namespace', 'command', 'description', 'alias', 'type', 'code_id')
+_INSERT_ENTRY = ('INSERT OR REPLACE INTO mirror_entries (id, namespace, command, description, alias, type, code_id, '
+                 'vector) VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+
+
+def decode_vector(value: str) -> bytes:
+    """服务端 base64 编码的 float32 向量 -> 原始字节"""
+    return base64.b64decode(value)
+
+
+def _bigrams(text: str) -> set:
+    text = ''.join(text.lower().split())
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+class CatalogMirror:
+    """本地命令目录镜像
+
+    共享条目的命名空间为空；各命名空间的条目整体替换。
+    检索数据（条目列表和向量矩阵）按命名空间在第一次检索时载入内存，同步后重新载入。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._loaded: Dict[str, tuple] = {}  # 命名空间 -> (条目列表, 向量矩阵, 范数)
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS mirror_entries (
+                id TEXT NOT NULL,
+                namespace TEXT NOT NULL DEFAULT '',
+                command TEXT NOT NULL,
+                description TEXT NOT NULL,
+                alias TEXT NOT NULL DEFAULT '',
+                type TEXT NOT NULL,
+                code_id TEXT NOT NULL DEFAULT '',
+                vector BLOB NOT NULL,
+                PRIMARY KEY (namespace, id)
+            );
+            CREATE TABLE IF NOT EXISTS mirror_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        ''')
+        self._db.commit()
+
+    # ---- 元数据 ----
+
+    def _meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        row = self._db.execute('SELECT value FROM mirror_meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key: str, value):
+        self._db.execute('INSERT OR REPLACE INTO mirror_meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    @property
+    def model(self) -> Optional[str]:
+        """镜像向量所用的嵌入模型"""
+        with self._lock:
+            return self._meta('model')
+
+    @property
+    def version(self) -> int:
+        """已同步到的目录版本，0 表示还未同步"""
+        with self._lock:
+            return int(self._meta('version', '0'))
+
+    @property
+    def index_version(self) -> Optional[str]:
+        """同步时服务端的索引版本，与服务端当前版本相同说明镜像是最新的"""
+        with self._lock:
+            return self._meta('index_version')
+
+    def namespace_version(self, namespace: str) -> Optional[str]:
+        with self._lock:
+            return self._meta(f'namespace_version:{namespace}')
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM mirror_entries LIMIT 1').fetchone() is None
+
+    # ---- 同步 ----
+
+    def apply(self, delta: Dict, namespace: str = '', index_version: Optional[str] = None) -> Dict:
+        """应用 /api/catalog/delta 的响应，返回 {'added', 'removed', 'entries'}"""
+        model = delta['model']
+        with self._lock, self._db:
+            model_changed = self._meta('model') != model
+            if model_changed:
+                # 模型变化：向量不可比较，所有命名空间的条目都作废
+                self._db.execute('DELETE FROM mirror_entries')
+                self._db.execute("DELETE FROM mirror_meta WHERE key LIKE 'namespace_version:%'")
+            elif delta.get('full'):
+                self._db.execute("DELETE FROM mirror_entries WHERE namespace = ''")
+            self._db.executemany("DELETE FROM mirror_entries WHERE namespace = '' AND id = ?",
+                                 [(eid,) for eid in delta.get('removed', [])])
+            self._insert(delta.get('added', []), '')
+
+            if 'namespace_entries' in delta:
+                self._db.execute('DELETE FROM mirror_entries WHERE namespace = ?', (namespace,))
+                self._insert(delta['namespace_entries'], namespace)
+            # 模型变化后命名空间条目已清空，只有同时带回条目时才记下版本
+            if 'namespace_version' in delta and ('namespace_entries' in delta or not model_changed):
+                self._set_meta(f'namespace_version:{namespace}', delta['namespace_version'])
+
+            self._set_meta('model', model)
+            self._set_meta('version', delta['version'])
+            self._set_meta('synced_at', time.strftime('%Y-%m-%d %H:%M:%S'))
+            if index_version:
+                self._set_meta('index_version', index_version)
+            entries = self._db.execute('SELECT COUNT(*) FROM mirror_entries').fetchone()[0]
+            self._loaded = {}
+        return {
+            'added': len(delta.get('added', [])) + len(delta.get('namespace_entries', [])),
+            'removed': len(delta.get('removed', [])),
+            'entries': entries
+        }
+
+    def _insert(self, entries: Sequence[Dict], namespace: str):
+        self._db.executemany(_INSERT_ENTRY, [
+            (e['id'], namespace, e['command'], e['description'], e.get('alias') or '', e['type'],
+             e.get('code_id') or '', decode_vector(e['vector']))
+            for e in entries
+        ])
+
+    # ---- 检索 ----
+
+    def _load(self, namespace: str):
+        """载入共享条目和指定命名空间的条目"""
+        with self._lock:
+            loaded = self._loaded.get(namespace)
+            if loaded is not None:
+                return loaded
+            rows = self._db.execute(
+                'SELECT id, namespace, command, description, alias, type, code_id, vector FROM mirror_entries '
+                "WHERE namespace IN ('', ?) ORDER BY namespace, rowid", (namespace,)
+            ).fetchall()
+            entries = [dict(zip(_ENTRY_FIELDS, row[:7])) for row in rows]
+            np = _numpy()
+            if np is not None:
+                matrix = np.array([np.frombuffer(row[7], dtype='<f4') for row in rows]) if rows else None
+                norms = np.linalg.norm(matrix, axis=1) if rows else None
+            else:
+                matrix = [array.array('f', row[7]) for row in rows]
+                norms = [sum(x * x for x in vector) ** 0.5 for vector in matrix]
+            loaded = (entries, matrix, norms)
+            self._loaded[namespace] = loaded
+            return loaded
+
+    @staticmethod
+    def _type_filter(types: Optional[List[str]]):
+        if not types:
+            return None
+        return {COMMAND_TYPE_ALIASES.get(t, t) for t in types}
+
+    def search(self, query_vector: Sequence[float], top_k: int = 3, types: Optional[List[str]] = None,
+               namespace: str = '') -> List[Dict]:
+        """按余弦相似度检索，返回与服务端检索结果相同字段的命令（含 similarity）"""
+        entries, matrix, norms = self._load(namespace)
+        if not entries:
+            return []
+        wanted = self._type_filter(types)
+        np = _numpy()
+        if np is not None:
+            query = np.asarray(query_vector, dtype=np.float32)
+            if query.shape[0] != matrix.shape[1]:
+                return []
+            similarities = matrix @ query / np.maximum(norms * np.linalg.norm(query), 1e-12)
+        else:
+            if len(query_vector) != len(matrix[0]):
+                return []
+            query_norm = sum(x * x for x in query_vector) ** 0.5
+            similarities = [sum(a * b for a, b in zip(vector, query_vector)) / max(norm * query_norm, 1e-12)
+                            for vector, norm in zip(matrix, norms)]
+        scored = [(float(similarities[i]), i) for i, entry in enumerate(entries)
+                  if wanted is None or entry['type'] in wanted]
+        return self._top(entries, scored, top_k)
+
+    def keyword_search(self, requirement: str, top_k: int = 3, types: Optional[List[str]] = None,
+                       namespace: str = '') -> List[Dict]:
+        """没有查询向量时的关键词匹配：需求的字符二元组在命令文本中出现的比例"""
+        entries, _, _ = self._load(namespace)
+        wanted = self._type_filter(types)
+        query = _bigrams(requirement)
+        scored = []
+        for i, entry in enumerate(entries):
+            if wanted is not None and entry['type'] not in wanted:
+                continue
+            text = _bigrams(f"{entry['description']} {entry['command']} {entry['alias']}")
+            score = len(query & text) / len(query)
+            if score > 0:
+                scored.append((score, i))
+        return self._top(entries, scored, top_k)
+
+    @staticmethod
+    def _top(entries: List[Dict], scored: List[tuple], top_k: int) -> List[Dict]:
+        scored.sort(key=lambda item: item[0], reverse=True)
+        results = []
+        for similarity, i in scored[:top_k]:
+            cmd = dict(entries[i])
+            cmd['similarity'] = similarity
+            results.append(cmd)
+        return results
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'model': self._meta('model'),
+                'version': int(self._meta('version', '0')),
+                'index_version': self._meta('index_version'),
+                'synced_at': self._meta('synced_at'),
+                'entries': self._db.execute('SELECT COUNT(*) FROM mirror_entries').fetchone()[0]
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,265 @@
+"""
+CADChat 客户端耗时记录
+按操作（查询、生成代码、执行代码等）记录各阶段的耗时：本地缓存查找、HTTP 往返、服务端报告的阶段耗时
+（Server-Timing）、网络耗时（HTTP 往返减去服务端总耗时）、Kimi 生成、CAD 加载和运行。
+记录保存在本地 SQLite，超过保留天数的自动删除；报告按时间窗口给出每个阶段的 p50/p95/p99。
+
+用法: python client_telemetry.py [--since 24h] [--until 2026-10-19] [--action query]
+                                 [--format table|csv|json] [--output report.csv] [--db telemetry.db]
+"""
+
+import os
+import csv
+import sys
+import json
+import atexit
+import sqlite3
+import argparse
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_FLUSH_INTERVAL = 2.0  # 秒
+PRUNE_INTERVAL = 3600  # 最多每隔这么久删除一次过期记录（秒）
+PERCENTILES = (50, 95, 99)
+
+_INSERT = 'INSERT INTO timings (ts, action, stage, ms) VALUES (?, ?, ?, ?)'
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """解析 Server-Timing 响应头，返回 {阶段: 毫秒}"""
+    timings = {}
+    for metric in (header or '').split(','):
+        name, _, params = metric.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur' and name:
+                try:
+                    timings[name] = float(value)
+                except ValueError:
+                    pass
+    return timings
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """最近秩百分位数（sorted_values 已升序且非空）"""
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class ActionTimer:
+    """一次操作的阶段耗时，finish 时写入存储（只写一次）"""
+
+    def __init__(self, store: 'TelemetryStore', action: str):
+        self.store = store
+        self.action = action
+        self.stages: Dict[str, float] = {}
+        self._started = time.perf_counter()
+        self._finished = False
+
+    def add(self, stage: str, ms: float):
+        """记录一个阶段的耗时（毫秒），同名阶段累加"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add_http(self, elapsed_ms: float, response):
+        """记录一次 HTTP 往返：http、服务端报告的阶段（server_ 前缀）和网络耗时（往返减去服务端总耗时）"""
+        self.add('http', elapsed_ms)
+        server = parse_server_timing(response.headers.get('Server-Timing'))
+        for stage, ms in server.items():
+            self.add(f'server_{stage}', ms)
+        if 'total' in server:
+            self.add('network', max(elapsed_ms - server['total'], 0.0))
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        self.add('total', (time.perf_counter() - self._started) * 1000)
+        self.store.write(self.action, self.stages)
+
+    def __enter__(self) -> 'ActionTimer':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish()
+
+
+class TelemetryStore:
+    """耗时记录存储
+
+    写入先放在内存中，攒够一批或等待片刻后在一个事务中提交；程序退出时提交剩余记录。
+    enabled 为 False 时不记录（action 仍可正常使用）。
+    """
+
+    def __init__(self, db_path: str, retention_days: float = DEFAULT_RETENTION_DAYS, enabled: bool = True,
+                 batch_size: int = DEFAULT_BATCH_SIZE, flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.retention_days = retention_days
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending: List[tuple] = []
+        self._timer: Optional[threading.Timer] = None
+        self._pruned_at = 0.0
+        self._db: Optional[sqlite3.Connection] = None
+        if enabled:
+            atexit.register(self.flush)
+
+    def _conn(self) -> sqlite3.Connection:
+        """写入和报告共用的连接（调用方持有 _write_lock），第一次使用时创建表"""
+        if self._db is None:
+            db_dir = os.path.dirname(os.path.abspath(self.db_path))
+            os.makedirs(db_dir, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.executescript('''
+                CREATE TABLE IF NOT EXISTS timings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts REAL NOT NULL,
+                    action TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    ms REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_timings_ts ON timings(ts);
+            ''')
+            self._db.commit()
+        return self._db
+
+    def action(self, name: str) -> ActionTimer:
+        """开始记录一次操作，可用作 with 语句（退出时写入）"""
+        return ActionTimer(self, name)
+
+    def write(self, action: str, stages: Dict[str, float]):
+        if not self.enabled or not stages:
+            return
+        now = time.time()
+        with self._lock:
+            self._pending.extend((now, action, stage, ms) for stage, ms in stages.items())
+            if len(self._pending) < self.batch_size:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.flush_interval, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def flush(self) -> int:
+        """提交待写入的记录并删除过期记录，返回提交的条数"""
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not pending:
+                return 0
+            conn = self._conn()
+            with conn:
+                conn.executemany(_INSERT, pending)
+                if self.retention_days and time.time() - self._pruned_at > PRUNE_INTERVAL:
+                    conn.execute('DELETE FROM timings WHERE ts < ?', (time.time() - self.retention_days * 86400,))
+                    self._pruned_at = time.time()
+            return len(pending)
+
+    def report(self, since: Optional[float] = None, until: Optional[float] = None,
+               action: Optional[str] = None) -> List[Dict]:
+        """时间窗口 [since, until)（Unix 时间，None 表示不限）内每个操作、每个阶段的耗时分布"""
+        self.flush()
+        sql = 'SELECT action, stage, ms FROM timings WHERE ts >= ? AND ts < ?'
+        params = [since if since is not None else 0.0, until if until is not None else float('inf')]
+        if action:
+            sql += ' AND action = ?'
+            params.append(action)
+        samples: Dict[tuple, List[float]] = {}
+        with self._write_lock:
+            for row_action, stage, ms in self._conn().execute(sql, params):
+                samples.setdefault((row_action, stage), []).append(ms)
+
+        rows = []
+        for (row_action, stage), values in sorted(samples.items()):
+            values.sort()
+            row = {'action': row_action, 'stage': stage, 'count': len(values)}
+            for p in PERCENTILES:
+                row[f'p{p}'] = round(percentile(values, p), 2)
+            row['max'] = round(values[-1], 2)
+            rows.append(row)
+        return rows
+
+    def close(self):
+        self.flush()
+        with self._write_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """时间参数：ISO 日期/时间（如 2026-10-19 或 2026-10-19T08:00），或相对现在的 30m / 24h / 7d"""
+    if not value:
+        return None
+    units = {'m': 60, 'h': 3600, 'd': 86400}
+    if value[-1] in units and value[:-1].replace('.', '', 1).isdigit():
+        return time.time() - float(value[:-1]) * units[value[-1]]
+    return datetime.fromisoformat(value).timestamp()
+
+
+def format_table(rows: List[Dict]) -> str:
+    header = f"{'操作':<12}{'阶段':<18}{'次数':>8}" + ''.join(f"{f'p{p}(ms)':>12}" for p in PERCENTILES) \
+        + f"{'max(ms)':>12}"
+    lines = [header]
+    for row in rows:
+        lines.append(f"{row['action']:<12}{row['stage']:<18}{row['count']:>8}"
+                     + ''.join(f"{row[f'p{p}']:>12.1f}" for p in PERCENTILES) + f"{row['max']:>12.1f}")
+    return '\n'.join(lines)
+
+
+def main():
+    from client_config import get_config
+
+    parser = argparse.ArgumentParser(description='导出客户端耗时报告（每个阶段的 p50/p95/p99）')
+    parser.add_argument('--since', help='开始时间：ISO 日期/时间，或相对现在的 30m / 24h / 7d（默认不限）')
+    parser.add_argument('--until', help='结束时间（格式同 --since，默认现在）')
+    parser.add_argument('--action', help='只统计该操作（如 query、generate、execute）')
+    parser.add_argument('--format', choices=('table', 'csv', 'json'), default='table', help='输出格式')
+    parser.add_argument('--output', help='输出文件（默认输出到终端）')
+    parser.add_argument('--db', help='耗时记录数据库（默认使用配置中的 TELEMETRY_DB_PATH）')
+    args = parser.parse_args()
+
+    store = TelemetryStore(args.db or get_config().telemetry_db_path, retention_days=0)
+    rows = store.report(parse_time(args.since), parse_time(args.until), args.action)
+    store.close()
+
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        if args.format == 'json':
+            json.dump(rows, out, ensure_ascii=False, indent=2)
+            out.write('\n')
+        elif args.format == 'csv':
+            writer = csv.DictWriter(out, fieldnames=['action', 'stage', 'count']
+                                    + [f'p{p}' for p in PERCENTILES] + ['max'])
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            out.write(format_table(rows) + '\n' if rows else '该时间范围内没有记录\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+            print(f"报告已保存到 {args.output}（{len(rows)} 行）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+CADChat 客户端 HTTP 传输层
+客户端所有访问服务端的请求都经过同一个 HttpTransport：
+长连接池复用 TCP/TLS 连接，连接失败和网关错误按退避重试，超时统一为（连接超时, 读取超时），
+可选择是否接受 gzip/deflate 压缩的响应。
+"""
+
+import threading
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.3  # 秒，第 n 次重试前等待 backoff × 2^(n-1)
+DEFAULT_POOL_SIZE = 10
+
+# 网关/服务暂时不可用时重试；429 由调用方按 Retry-After 处理，不自动重试
+RETRY_STATUS = (502, 503, 504)
+
+
+class HttpTransport:
+    """带连接池和重试的 HTTP 传输
+
+    连接失败（请求还未发出）时所有方法都重试；读取失败和 RETRY_STATUS 只对 GET/HEAD 重试，
+    避免重复保存代码、重复记录反馈。path 以 / 开头，相对于 base_url。
+    """
+
+    def __init__(self, base_url: str, read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+                 backoff: float = DEFAULT_BACKOFF, pool_size: int = DEFAULT_POOL_SIZE, compression: bool = True):
+        self.base_url = base_url.rstrip('/')
+        self.read_timeout = read_timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.compression = compression
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.session = self._new_session()
+
+    def _new_session(self) -> requests.Session:
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            status=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods=frozenset({'GET', 'HEAD'}),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate' if self.compression else 'identity'
+        return session
+
+    def url(self, path: str) -> str:
+        return f'{self.base_url}{path}'
+
+    def request(self, method: str, path: str, timeout: Optional[float] = None, **kwargs) -> requests.Response:
+        """发送请求，timeout 为读取超时（默认 read_timeout），连接超时固定为 connect_timeout
+
+        Raises:
+            requests.exceptions.RequestException: 重试后仍无法完成请求
+        """
+        read_timeout = self.read_timeout if timeout is None else timeout
+        with self._lock:
+            self.requests += 1
+        try:
+            return self.session.request(method, self.url(path), timeout=(self.connect_timeout, read_timeout),
+                                        **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self.failures += 1
+            raise
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
+
+    def stats(self) -> Dict:
+        return {
+            'base_url': self.base_url,
+            'requests': self.requests,
+            'failures': self.failures,
+            'pool_size': self.pool_size,
+            'retries': self.retries,
+            'compression': self.compression
+        }
+
+    def close(self):
+        """关闭连接池中的所有连接"""
+        self.session.close()
@@ -4,40 +4,103 @@ CADChat 云端客户端 - 云服务版本
 """
 
 import os
+import time
+import threading
 import requests
 import json
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from urllib.parse import quote
 from datetime import datetime
-import sqlite3
 
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from client_config import get_config
+from client_cache import LocalCache
+from client_transport import HttpTransport
+from client_endpoints import EndpointPool
+from client_mirror import CatalogMirror
+from client_telemetry import ActionTimer, TelemetryStore
+from requirement_normalizer import normalize_requirement, bind_parameters
+
+INDEX_VERSION_HEADER = 'X-CADChat-Index-Version'
+INDEX_VERSION_CHECK_INTERVAL = 60  # 只命中本地缓存时，最多每隔这么久向服务端确认一次索引版本（秒）
+LATENCY_SMOOTHING = 0.3  # 服务端查询和本地镜像检索耗时的指数滑动平均系数
 
 class CloudClient:
     """云端客户端（云服务版本）"""
     
     def __init__(self, server_url: str = None, env_file: str = '.env'):
-        # 使用配置管理器获取服务端URL
-        if server_url is None:
-            config = get_config(env_file=env_file)
-            server_url = config.server_url
-        self.server_url = server_url.rstrip('/')
+        # 使用配置管理器获取服务端URL（显式传入 server_url 时只使用该服务端）
+        config = get_config(env_file=env_file)
+        server_urls = [server_url] if server_url is not None else config.server_urls
+        self.server_url = server_urls[0].rstrip('/')
         
         # 使用配置管理器获取缓存配置
-        config = get_config(env_file=env_file)
         self.cache_db = config.cache_db_path
+        self.cache_max_entries = config.cache_max_entries
+        self.cache_ttl_seconds = config.cache_ttl_seconds
+        self.cache_revalidate = config.cache_revalidate
+        self.cache_revalidate_after = config.cache_revalidate_after
         self.timeout = config.request_timeout
+        
+        # 服务端最近报告的索引版本，版本不同的缓存结果视为过期
+        self.index_version = None
+        self._version_checked_at = 0.0
+        
+        # 命名空间通过请求头传给服务端，查询和用户代码接口只涉及该命名空间
+        self.namespace = config.namespace
+        self.headers = {'X-CADChat-Namespace': self.namespace} if self.namespace else {}
+        
+        # 所有请求共用一个带连接池和重试的传输；配置了多个服务端时按延迟选择并自动切换
+        def make_transport(url: str, retries: int = config.http_retries) -> HttpTransport:
+            return HttpTransport(
+                url,
+                read_timeout=self.timeout,
+                connect_timeout=config.connect_timeout,
+                retries=retries,
+                backoff=config.http_backoff,
+                pool_size=config.http_pool_size,
+                compression=config.http_compression
+            )
+        
+        if len(server_urls) > 1:
+            # 多服务端时由切换代替重试：单个服务端不再重试，失败后立即换下一个，探测也只请求一次
+            self.transport = EndpointPool(server_urls, lambda url: make_transport(url, retries=0),
+                                          probe_interval=config.endpoint_probe_interval,
+                                          probe_timeout=config.connect_timeout)
+            self.transport.start()
+        else:
+            self.transport = make_transport(self.server_url)
         self.init_cache()
+        
+        # 各操作分阶段的耗时记录
+        self.telemetry = TelemetryStore(config.telemetry_db_path, retention_days=config.telemetry_retention_days,
+                                        enabled=config.telemetry_enabled)
+        
+        # 本地命令目录镜像：服务端不可用或本地检索更快时在镜像上检索
+        self.mirror = CatalogMirror(config.mirror_db_path) if config.mirror_enabled else None
+        self.mirror_search = config.mirror_search
+        self.embedder = HttpTransport(
+            config.mirror_embedding_host,
+            read_timeout=10,
+            connect_timeout=1,
+            retries=0,
+            pool_size=2
+        ) if config.mirror_embedding_host else None
+        self._server_latency = None
+        self._mirror_latency = None
+        
+        # 后台刷新缓存结果的线程池（第一次需要时创建）和正在刷新的缓存键
+        self._revalidator: Optional[ThreadPoolExecutor] = None
+        self._revalidating = set()
+        self._revalidate_lock = threading.Lock()
     
     def get_ollama_models(self) -> List[str]:
         """获取可用的 Ollama 模型列表"""
         try:
-            response = requests.get(
-                f'{self.server_url}/api/models',
-                timeout=10
-            )
+            response = self.transport.get('/api/models')
             
             if response.status_code == 200:
                 return response.json().get('models', [])
@@ -50,64 +113,305 @@ class CloudClient:
             return []
     
     def init_cache(self):
-        """初始化本地缓存"""
-        conn = sqlite3.connect(self.cache_db)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS cache (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                requirement TEXT UNIQUE NOT NULL,
-                matched_code TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        """初始化本地缓存（每个线程复用一个连接，写入批量提交）"""
+        self.cache = LocalCache(self.cache_db, max_entries=self.cache_max_entries, ttl_seconds=self.cache_ttl_seconds)
+    
+    def query_requirement(self, requirement: str, use_cache: bool = True, types: List[str] = None,
+                          on_update: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """查询需求
         
-        conn.commit()
-        conn.close()
+        Args:
+            requirement: 功能需求
+            use_cache: 是否使用本地缓存
+            types: 命令类型过滤（basic/lisp/user_program），为空时检索全部
+            on_update: 后台刷新得到的排序与返回的缓存结果不同时，以新结果调用（在后台线程中）
+        
+        缓存按规范化后的需求模板保存，只有数值参数或写法不同的需求共用一条结果；
+        返回的结果中 requirement 为本次需求原文，parameters 为本次需求中的数值参数。
+        启用 stale-while-revalidate 时，过期（索引版本变化、超过有效期或保存超过 CACHE_REVALIDATE_AFTER 秒）
+        的缓存结果也立即返回（revalidating 为 True），同时在后台向服务端刷新。
+        """
+        with self.telemetry.action('query') as timer:
+            return self._query(requirement, use_cache, types, on_update, timer)
     
-    def query_requirement(self, requirement: str, use_cache: bool = True) -> Dict:
-        """查询需求"""
-        if use_cache:
-            cached = self._get_from_cache(requirement)
+    def _query(self, requirement: str, use_cache: bool, types: Optional[List[str]],
+               on_update: Optional[Callable[[Dict], None]], timer: ActionTimer) -> Dict:
+        """查询实现，timer 记录缓存查找、本地镜像检索和 HTTP 各阶段的耗时"""
+        template, parameters = normalize_requirement(requirement)
+        # 带类型过滤或命名空间的查询单独缓存
+        cache_key = template or requirement
+        if types:
+            cache_key = f"{cache_key}#types={','.join(sorted(types))}"
+        if self.namespace:
+            cache_key = f"{cache_key}#ns={self.namespace}"
+        
+        if use_cache and self.cache_revalidate:
+            # 命中时立即返回：按已知的索引版本判断是否过期，需要向服务端确认版本时放到后台刷新中进行
+            with timer.stage('cache'):
+                found = self.cache.lookup(cache_key, self.index_version, self.cache_revalidate_after)
+            if found:
+                cached, stale = found
+                print(f"[缓存] 找到缓存结果: {requirement}{'（后台刷新）' if stale else ''}")
+                result = bind_parameters(cached, requirement, parameters)
+                if stale:
+                    result['revalidating'] = self._revalidate(requirement, types, cache_key, cached, parameters,
+                                                              on_update)
+                elif self._version_check_due():
+                    self._revalidate(requirement, types, cache_key, cached, parameters, on_update,
+                                     check_version=True)
+                return result
+        elif use_cache:
+            with timer.stage('cache'):
+                cached = self._get_from_cache(cache_key)
             if cached:
                 print(f"[缓存] 找到缓存结果: {requirement}")
-                return cached
+                return bind_parameters(cached, requirement, parameters)
+        
+        if self._prefer_mirror():
+            with timer.stage('mirror'):
+                local = self._query_mirror(requirement, types, allow_keyword=False)
+            if local is not None:
+                print(f"[镜像] 本地检索: {requirement}")
+                return bind_parameters(local, requirement, parameters)
         
         try:
-            response = requests.post(
-                f'{self.server_url}/api/query',
-                json={'requirement': requirement},
-                timeout=self.timeout
-            )
+            response = self._post_query(requirement, types, timer)
             
             if response.status_code == 200:
                 result = response.json()
+                version = self._note_index_version(response)
                 
                 if use_cache and result.get('matched'):
-                    self._save_to_cache(requirement, result)
+                    self._save_to_cache(cache_key, result, version)
                 
-                return result
+                return bind_parameters(result, requirement, parameters)
+            elif response.status_code == 429:
+                retry_after = int(response.headers.get('Retry-After', '1'))
+                print(f"[错误] 服务端繁忙，请 {retry_after} 秒后重试")
+                return {'matched': False, 'error': f'服务端繁忙，请 {retry_after} 秒后重试', 'retry_after': retry_after}
             else:
                 print(f"[错误] API 调用失败: {response.status_code}")
+                with timer.stage('mirror'):
+                    local = self._query_mirror(requirement, types) if response.status_code >= 500 else None
+                if local is not None:
+                    print(f"[镜像] 服务端不可用，使用本地目录检索: {requirement}")
+                    return bind_parameters(local, requirement, parameters)
                 return {'matched': False, 'error': response.text}
         
         except requests.exceptions.RequestException as e:
             print(f"[错误] 网络请求失败: {e}")
+            with timer.stage('mirror'):
+                local = self._query_mirror(requirement, types)
+            if local is not None:
+                print(f"[镜像] 服务端不可用，使用本地目录检索: {requirement}")
+                return bind_parameters(local, requirement, parameters)
             print(f"[提示] 请确保 WSL 服务已启动: ./server/start_server.sh")
             return {'matched': False, 'error': str(e)}
     
+    def _post_query(self, requirement: str, types: List[str] = None,
+                    timer: Optional[ActionTimer] = None) -> requests.Response:
+        """向服务端发送查询，成功时记录服务端耗时；给出 timer 时记录 HTTP 和服务端各阶段耗时"""
+        # compact: 服务端不返回重复字段（旧服务端会忽略该参数）
+        payload = {'requirement': requirement, 'compact': True}
+        if types:
+            payload['types'] = list(types)
+        
+        # 告知服务端本地的等待时间，超时后服务端不再为该请求计算
+        start = time.perf_counter()
+        response = self.transport.post(
+            '/api/query',
+            json=payload,
+            headers=dict(self.headers, **{'X-Request-Timeout': str(self.timeout)})
+        )
+        elapsed = time.perf_counter() - start
+        if timer is not None:
+            timer.add_http(elapsed * 1000, response)
+        if response.status_code == 200:
+            self._server_latency = self._smooth(self._server_latency, elapsed)
+        return response
+    
+    def _timed_request(self, timer: ActionTimer, method: str, path: str, **kwargs) -> requests.Response:
+        """经传输发送请求，并把 HTTP 和服务端各阶段耗时记入 timer"""
+        start = time.perf_counter()
+        response = self.transport.request(method, path, **kwargs)
+        timer.add_http((time.perf_counter() - start) * 1000, response)
+        return response
+    
+    def _revalidate(self, requirement: str, types: Optional[List[str]], cache_key: str, cached: Dict,
+                    parameters: List, on_update: Optional[Callable[[Dict], None]],
+                    check_version: bool = False) -> bool:
+        """在后台向服务端刷新缓存结果，同一缓存键同时只刷新一次；返回是否已开始刷新
+
+        check_version 为 True 时先在后台确认服务端的索引版本，缓存结果按新版本仍有效时不再查询。
+        """
+        with self._revalidate_lock:
+            if cache_key in self._revalidating:
+                return False
+            self._revalidating.add(cache_key)
+            if self._revalidator is None:
+                self._revalidator = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cadchat-revalidate')
+        
+        def refresh():
+            try:
+                if check_version:
+                    found = self.cache.lookup(cache_key, self._server_index_version(), self.cache_revalidate_after)
+                    if found is not None and not found[1]:
+                        return
+                with self.telemetry.action('revalidate') as timer:
+                    response = self._post_query(requirement, types, timer)
+                if response.status_code != 200:
+                    return
+                result = response.json()
+                version = self._note_index_version(response)
+                if result.get('matched'):
+                    self._save_to_cache(cache_key, result, version)
+                else:
+                    self.cache.delete(cache_key)
+                if _ranking(result) != _ranking(cached):
+                    print(f"[缓存] 刷新后结果有变化: {requirement}")
+                    if on_update is not None:
+                        on_update(bind_parameters(result, requirement, parameters))
+            except requests.exceptions.RequestException as e:
+                print(f"[缓存] 后台刷新失败，保留缓存结果: {e}")
+            finally:
+                with self._revalidate_lock:
+                    self._revalidating.discard(cache_key)
+        
+        self._revalidator.submit(refresh)
+        return True
+    
+    def sync_catalog(self) -> Dict:
+        """从服务端增量同步本地命令目录镜像
+        
+        Returns:
+            {'success', 'added', 'removed', 'entries', 'version'}；服务端不支持或同步失败时 success 为 False
+        """
+        if self.mirror is None:
+            return {'success': False, 'error': '本地镜像未启用'}
+        params = {'since': self.mirror.version}
+        namespace_version = self.mirror.namespace_version(self.namespace) if self.namespace else None
+        if namespace_version is not None:
+            params['namespace_version'] = namespace_version
+        
+        try:
+            with self.telemetry.action('sync') as timer:
+                response = self._timed_request(timer, 'GET', '/api/catalog/delta', params=params,
+                                               headers=self.headers)
+        except requests.exceptions.RequestException as e:
+            print(f"[错误] 网络请求失败: {e}")
+            return {'success': False, 'error': str(e)}
+        
+        if response.status_code == 404:
+            return {'success': False, 'error': '服务端不支持命令目录同步'}
+        if response.status_code != 200:
+            print(f"[错误] 同步命令目录失败: {response.status_code}")
+            return {'success': False, 'error': response.text}
+        
+        delta = response.json()
+        version = self._note_index_version(response)
+        counts = self.mirror.apply(delta, self.namespace, version)
+        self._mirror_latency = None  # 镜像内容变化，重新测量本地检索耗时
+        print(f"[镜像] 同步到版本 {delta['version']}（{'全量' if delta.get('full') else '增量'}）: "
+              f"新增 {counts['added']} 条，删除 {counts['removed']} 条，共 {counts['entries']} 条")
+        return dict(counts, success=True, version=delta['version'], full=delta.get('full', False))
+    
+    def _prefer_mirror(self) -> bool:
+        """镜像是最新的、能计算查询向量，且本地检索比服务端快时优先本地检索
+        
+        两边耗时都测量过才比较：先由服务端应答一次，再在本地试一次。
+        """
+        if self.mirror is None or self.embedder is None or self.mirror_search != 'auto':
+            return False
+        if self._server_latency is None:
+            return False
+        if self._mirror_latency is not None and self._mirror_latency >= self._server_latency:
+            return False
+        index_version = self.mirror.index_version
+        return index_version is not None and index_version == self._server_index_version()
+    
+    def _embed(self, text: str, model: str) -> Optional[List[float]]:
+        """用本机 Ollama 计算查询向量，不可用时返回 None"""
+        if self.embedder is None:
+            return None
+        try:
+            response = self.embedder.post('/api/embeddings', json={'model': model, 'prompt': text})
+            if response.status_code == 200:
+                return response.json().get('embedding')
+            print(f"[镜像] 本地嵌入失败: {response.status_code}")
+        except requests.exceptions.RequestException as e:
+            print(f"[镜像] 本地嵌入服务不可用: {e}")
+        # 下次同步前不再优先本地检索
+        self._mirror_latency = float('inf')
+        return None
+    
+    def _query_mirror(self, requirement: str, types: List[str] = None, allow_keyword: bool = True) -> Optional[Dict]:
+        """在本地镜像上检索，结果格式与服务端精简响应相同（另有 local: True）
+        
+        能计算查询向量时按余弦相似度检索，否则 allow_keyword 为真时退回关键词匹配；
+        镜像为空或无法检索时返回 None。
+        """
+        if self.mirror is None or self.mirror_search == 'off' or self.mirror.is_empty():
+            return None
+        start = time.perf_counter()
+        vector = self._embed(requirement, self.mirror.model)
+        if vector is not None:
+            rag_results = self.mirror.search(vector, 3, types, self.namespace)
+            reason = '本地目录向量检索'
+            self._mirror_latency = self._smooth(self._mirror_latency, time.perf_counter() - start)
+        elif allow_keyword:
+            rag_results = self.mirror.keyword_search(requirement, 3, types, self.namespace)
+            reason = '本地目录关键词匹配'
+        else:
+            return None
+        
+        if not rag_results:
+            return {'matched': False, 'local': True,
+                    'result': {'reason': '未找到匹配的命令', 'suggestion': '请尝试更详细的需求描述'}}
+        best_command = rag_results[0]
+        code = {
+            'id': -1,
+            'command': best_command['command'],
+            'description': best_command['description'],
+            'alias': best_command['alias'],
+            'category': 'LISP 命令' if best_command['type'] == 'lisp' else '基本命令',
+            'is_basic_command': best_command['type'] == 'basic',
+            'source': 'mirror'
+        }
+        result = {
+            'code': code,
+            'confidence': best_command['similarity'],
+            'reason': reason,
+            'llm_used': False,
+            'rag_results': [
+                {
+                    'command': cmd['command'],
+                    'description': cmd['description'],
+                    'similarity': cmd['similarity'],
+                    'source_type': cmd['type'],
+                    'namespace': cmd['namespace'],
+                    'score': cmd['similarity']
+                }
+                for cmd in rag_results
+            ]
+        }
+        return {'matched': True, 'local': True, 'result': result}
+    
+    @staticmethod
+    def _smooth(previous: Optional[float], sample: float) -> float:
+        if previous is None:
+            return sample
+        return previous + LATENCY_SMOOTHING * (sample - previous)
+    
     def submit_code(self, lisp_code: str, description: str, tags: List[str] = None) -> Dict:
         """提交新代码到云端"""
         try:
-            response = requests.post(
-                f'{self.server_url}/api/submit_code',
+            response = self.transport.post(
+                '/api/submit_code',
                 json={
                     'lisp_code': lisp_code,
                     'description': description,
                     'tags': tags or []
-                },
-                timeout=self.timeout
+                }
             )
             
             if response.status_code == 200:
@@ -120,18 +424,56 @@ class CloudClient:
             print(f"[错误] 网络请求失败: {e}")
             return {'success': False, 'error': str(e)}
     
-    def submit_feedback(self, code_id: int, requirement: str, success: bool, feedback: str = None) -> Dict:
-        """提交用户反馈"""
+    def save_user_code(self, code: str, command: str, description: str) -> Dict:
+        """保存用户代码到当前命名空间
+        
+        等待响应超时时返回 pending=True：请求已送达，服务端可能仍在处理（如计算嵌入）。
+        """
         try:
-            response = requests.post(
-                f'{self.server_url}/api/feedback',
+            with self.telemetry.action('save') as timer:
+                response = self._timed_request(
+                    timer,
+                    'POST',
+                    '/api/user_codes/save',
+                    json={
+                        'code': code,
+                        'command': command,
+                        'description': description
+                    },
+                    headers=self.headers
+                )
+            
+            if response.status_code == 200:
+                return response.json()
+            else:
+                print(f"[错误] 保存用户代码失败: {response.status_code}")
+                return {'success': False, 'message': f'保存失败: {response.status_code}'}
+        
+        except requests.exceptions.Timeout:
+            return {'success': False, 'pending': True, 'message': '服务端处理中'}
+        except requests.exceptions.RequestException as e:
+            print(f"[错误] 网络请求失败: {e}")
+            return {'success': False, 'message': str(e)}
+    
+    def submit_feedback(self, code_id: int, requirement: str, success: bool, feedback: str = None,
+                        command: str = None) -> Dict:
+        """提交用户反馈
+        
+        Args:
+            code_id: 用户代码ID（基本命令和 LISP 命令为 -1，此时需提供 command）
+            command: 匹配到的命令名（查询结果中 result.code.command）
+        """
+        try:
+            response = self.transport.post(
+                '/api/feedback',
                 json={
                     'code_id': code_id,
+                    'command': command,
                     'requirement': requirement,
                     'success': success,
                     'feedback': feedback
                 },
-                timeout=10
+                headers=self.headers
             )
             
             if response.status_code == 200:
@@ -147,10 +489,10 @@ class CloudClient:
     def get_popular_codes(self, limit: int = 10) -> List[Dict]:
         """获取热门代码"""
         try:
-            response = requests.get(
-                f'{self.server_url}/api/popular',
+            response = self.transport.get(
+                '/api/popular',
                 params={'limit': limit},
-                timeout=10
+                headers=self.headers
             )
             
             if response.status_code == 200:
@@ -166,10 +508,7 @@ class CloudClient:
     def get_stats(self) -> Dict:
         """获取统计信息"""
         try:
-            response = requests.get(
-                f'{self.server_url}/api/stats',
-                timeout=10
-            )
+            response = self.transport.get('/api/stats')
             
             if response.status_code == 200:
                 return response.json()
@@ -184,10 +523,9 @@ class CloudClient:
     def search_codes(self, search_term: str = '', limit: int = 10) -> List[Dict]:
         """搜索代码"""
         try:
-            response = requests.get(
-                f'{self.server_url}/api/search',
-                params={'q': search_term, 'limit': limit},
-                timeout=10
+            response = self.transport.get(
+                '/api/search',
+                params={'q': search_term, 'limit': limit}
             )
             
             if response.status_code == 200:
@@ -200,45 +538,117 @@ class CloudClient:
             print(f"[错误] 网络请求失败: {e}")
             return []
     
-    def _get_from_cache(self, requirement: str) -> Optional[Dict]:
-        """从缓存获取"""
-        conn = sqlite3.connect(self.cache_db)
-        cursor = conn.cursor()
+    def get_user_code_by_command(self, command: str) -> Optional[Dict]:
+        """按命令名获取用户代码（含 code、code_id、description），不存在时返回 None
+        
+        本地缓存了该命令时带 If-None-Match 请求，内容未变（304）直接使用缓存；
+        网络不可用时返回缓存内容。
+        """
+        cache_key = f"{self.namespace}/{command}"
+        cached = self._get_user_code_cache(cache_key)
+        headers = dict(self.headers)
+        if cached:
+            headers['If-None-Match'] = cached[0]
         
-        cursor.execute('''
-            SELECT matched_code FROM cache WHERE requirement = ?
-        ''', (requirement,))
+        try:
+            response = self.transport.get(
+                f'/api/user_codes/by_command/{quote(command, safe="")}',
+                headers=headers
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"[错误] 网络请求失败: {e}")
+            return cached[1] if cached else None
         
-        result = cursor.fetchone()
-        conn.close()
+        if response.status_code == 304 and cached:
+            print(f"[缓存] 用户代码未变化: {command}")
+            return cached[1]
+        if response.status_code == 200:
+            result = response.json()
+            etag = response.headers.get('ETag')
+            if etag:
+                self._save_user_code_cache(cache_key, etag, result)
+            return result
+        if response.status_code == 404:
+            self._save_user_code_cache(cache_key, None, None)
+            return None
         
-        if result:
-            return json.loads(result[0])
-        return None
+        print(f"[错误] 获取用户代码失败: {response.status_code}")
+        return cached[1] if cached else None
     
-    def _save_to_cache(self, requirement: str, result: Dict):
-        """保存到缓存"""
-        conn = sqlite3.connect(self.cache_db)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO cache (requirement, matched_code)
-            VALUES (?, ?)
-        ''', (requirement, json.dumps(result)))
+    def _get_user_code_cache(self, cache_key: str):
+        """返回 (etag, 代码信息)，未缓存时返回 None"""
+        return self.cache.get_user_code(cache_key)
+    
+    def _save_user_code_cache(self, cache_key: str, etag: Optional[str], result: Optional[Dict]):
+        """保存代码缓存，etag 为 None 时删除"""
+        if etag is None:
+            self.cache.delete_user_code(cache_key)
+        else:
+            self.cache.put_user_code(cache_key, etag, result)
+    
+    def _note_index_version(self, response) -> Optional[str]:
+        """记下响应中的索引版本"""
+        version = response.headers.get(INDEX_VERSION_HEADER)
+        if version:
+            self.index_version = version
+            self._version_checked_at = time.time()
+        return version
+    
+    def _server_index_version(self) -> Optional[str]:
+        """服务端当前的索引版本
         
-        conn.commit()
-        conn.close()
+        最近的查询响应已带回版本时直接使用，否则最多每 INDEX_VERSION_CHECK_INTERVAL 秒查询一次；
+        无法连接或旧服务端不支持时沿用上次的值（None 表示不按版本判断过期）。
+        """
+        if not self._version_check_due():
+            return self.index_version
+        self._version_checked_at = time.time()
+        try:
+            response = self.transport.get(
+                '/api/index/version',
+                headers=self.headers,
+                timeout=min(self.timeout, 5)
+            )
+            if response.status_code == 200:
+                self.index_version = response.json().get('index_version') or self.index_version
+        except requests.exceptions.RequestException:
+            pass
+        return self.index_version
+    
+    def _version_check_due(self) -> bool:
+        """距上次确认索引版本是否已超过 INDEX_VERSION_CHECK_INTERVAL 秒"""
+        return time.time() - self._version_checked_at >= INDEX_VERSION_CHECK_INTERVAL
+    
+    def _get_from_cache(self, requirement: str) -> Optional[Dict]:
+        """从缓存获取（服务端索引版本变化或超过有效期的结果视为未命中）"""
+        return self.cache.get(requirement, self._server_index_version())
+    
+    def _save_to_cache(self, requirement: str, result: Dict, version: Optional[str] = None):
+        """保存到缓存，version 为产生该结果的索引版本"""
+        self.cache.put(requirement, result, version)
     
     def clear_cache(self):
         """清空缓存"""
-        conn = sqlite3.connect(self.cache_db)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM cache')
-        
-        conn.commit()
-        conn.close()
+        self.cache.clear()
         print("[缓存] 缓存已清空")
+    
+    def close(self):
+        """等待后台刷新完成，提交缓存写入并关闭连接"""
+        if self._revalidator is not None:
+            self._revalidator.shutdown(wait=True)
+        self.cache.flush()
+        self.telemetry.flush()
+        self.transport.close()
+        if self.embedder is not None:
+            self.embedder.close()
+
+
+def _ranking(result: Dict) -> List[tuple]:
+    """查询结果的候选排序（命令、来源类型、命名空间），用于判断刷新后的结果是否变化"""
+    if not result.get('matched'):
+        return []
+    return [(cmd.get('command'), cmd.get('source_type'), cmd.get('namespace', ''))
+            for cmd in result.get('result', {}).get('rag_results', [])]
 
 # 测试代码
 if __name__ == '__main__':
@@ -1,19 +1,21 @@
 """
 CADChat 主界面 - 云服务版本
 使用云端向量数据库进行命令匹配
+CAD 连接器（win32com）和 Kimi 浏览器（Playwright）在第一次使用时才导入，不影响窗口打开的速度。
 """
+import time
+_START = time.perf_counter()  # 启动计时起点（窗口就绪时记录耗时）
+
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
 import threading
-import requests
 import json
 import os
 import sys
 from datetime import datetime
 import re
-from cad_connector import CADConnector
-from kimi_browser import KimiBrowser
 from cloud_client import CloudClient
+from async_cloud_client import AsyncCloudClient, BackgroundLoop
 import sqlite3
 
 class CADChatGUI:
@@ -22,8 +24,8 @@ class CADChatGUI:
         self.root.title("CADChat - AI辅助CAD制图工具")
         self.root.geometry("1200x800")
         
-        # 初始化CAD连接器
-        self.cad_connector = CADConnector()
+        # CAD连接器在第一次使用时创建
+        self._cad_connector = None
         self.is_connected = False
         self.is_browser_ready = False
         self.kimi_browser = None
@@ -32,11 +34,23 @@ class CADChatGUI:
         self.cloud_client = CloudClient()
         self.is_cloud_connected = False
         
+        # 查询在后台事件循环中并发执行（共用 cloud_client 的缓存和连接池），不再每次新建线程
+        self.async_loop = BackgroundLoop()
+        self.async_client = AsyncCloudClient(client=self.cloud_client)
+        
         # 当前代码
         self.current_code = ""
         self.current_code_id = None
         self.current_requirement = ""
         
+        # 查询范围 -> 命令类型过滤
+        self.query_scopes = {
+            "全部": None,
+            "基本命令": ['basic'],
+            "LISP命令": ['lisp'],
+            "用户代码": ['user_program'],
+        }
+        
         self._setup_ui()
         self._check_cloud_connection()
     
@@ -87,7 +101,7 @@ class CADChatGUI:
         
         btn_frame = ttk.Frame(input_frame)
         btn_frame.grid(row=1, column=0, pady=(5, 0), sticky=(tk.W, tk.E))
-        btn_frame.columnconfigure(5, weight=1)
+        btn_frame.columnconfigure(7, weight=1)
         
         ttk.Button(btn_frame, text="智能查询（服务器）", command=self._query_cloud).grid(row=0, column=0, padx=5)
         ttk.Button(btn_frame, text="生成LISP文件", command=self._generate_lisp_only).grid(row=0, column=1, padx=5)
@@ -96,6 +110,11 @@ class CADChatGUI:
         ttk.Button(btn_frame, text="查看历史", command=self._show_history).grid(row=0, column=4, padx=5)
         ttk.Button(btn_frame, text="清空", command=self._clear_input).grid(row=0, column=5, padx=5)
         
+        ttk.Label(btn_frame, text="查询范围:").grid(row=0, column=6, padx=(15, 0))
+        self.query_scope_var = tk.StringVar(value="全部")
+        ttk.Combobox(btn_frame, textvariable=self.query_scope_var, values=list(self.query_scopes.keys()),
+                     state="readonly", width=10).grid(row=0, column=7, padx=5, sticky=tk.W)
+        
         # 服务器匹配结果框架
         match_frame = ttk.LabelFrame(main_frame, text="服务器匹配结果", padding="5")
         match_frame.grid(row=2, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
@@ -143,6 +162,14 @@ class CADChatGUI:
         # 绑定窗口关闭事件
         self.root.protocol("WM_DELETE_WINDOW", self._on_close)
     
+    @property
+    def cad_connector(self):
+        """CAD连接器（第一次使用时导入 win32com 并创建）"""
+        if self._cad_connector is None:
+            from cad_connector import CADConnector
+            self._cad_connector = CADConnector()
+        return self._cad_connector
+    
     def _on_enter_pressed(self, event):
         """回车键事件"""
         if event.state & 0x4:  # Ctrl+Enter
@@ -250,32 +277,19 @@ class CADChatGUI:
             self._show_code(f"; Basic Command: {command}\n; Description: {description}\n\n; Basic command implementation here...")
     
     def _load_user_code_by_command(self, command: str):
-        """根据命令名称加载用户代码"""
+        """根据命令名称加载用户代码（本地按 ETag 缓存，内容未变时只发一次条件请求）"""
         self._log(f"正在加载用户代码: {command}")
         
         try:
-            response = requests.get(
-                f"{self.cloud_client.server_url}/api/user_codes/list",
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('success'):
-                    codes = result.get('codes', [])
-                    for code_info in codes:
-                        if code_info.get('command') == command:
-                            lisp_code = code_info.get('lisp_code', '')
-                            self.current_code = lisp_code
-                            self.current_code_id = code_info.get('id')
-                            self.root.after(0, lambda: self._show_code(lisp_code))
-                            self._log(f"成功加载用户代码: {command}")
-                            return
-                    self._log(f"未找到命令对应的用户代码: {command}")
-                else:
-                    self._log("获取用户代码列表失败", "ERROR")
+            result = self.cloud_client.get_user_code_by_command(command)
+            if result and result.get('success'):
+                lisp_code = result.get('code', '')
+                self.current_code = lisp_code
+                self.current_code_id = result.get('code_id')
+                self.root.after(0, lambda: self._show_code(lisp_code))
+                self._log(f"成功加载用户代码: {command}")
             else:
-                self._log(f"获取用户代码列表失败: {response.status_code}", "ERROR")
+                self._log(f"未找到命令对应的用户代码: {command}")
         except Exception as e:
             self._log(f"加载用户代码时出错: {e}", "ERROR")
     
@@ -296,6 +310,11 @@ class CADChatGUI:
                     
                     self._log(f"引擎: {stats.get('engine', 'unknown')}, 模型: {stats.get('model', 'unknown')}")
                     self._log(f"LLM可用: {'是' if stats.get('llm_available', False) else '否'}")
+                    endpoints = self.cloud_client.transport.stats().get('endpoints')
+                    if endpoints:
+                        self._log(f"已配置 {len(endpoints)} 个服务端，当前使用: "
+                                  f"{self.cloud_client.transport.stats()['active']}")
+                    self._sync_catalog()
                 else:
                     self.is_cloud_connected = False
                     self.root.after(0, lambda: self._update_cloud_status(False))
@@ -307,6 +326,23 @@ class CADChatGUI:
         
         threading.Thread(target=check, daemon=True).start()
     
+    def _sync_catalog(self):
+        """在后台同步本地命令目录镜像（服务端不可用时查询在镜像上进行）"""
+        if self.cloud_client.mirror is None:
+            return
+        
+        def on_synced(future):
+            if future.exception() is not None:
+                self._log(f"同步本地命令目录失败: {future.exception()}", "WARNING")
+                return
+            result = future.result()
+            if result.get('success'):
+                self._log(f"本地命令目录已同步: 共 {result['entries']} 条")
+            else:
+                self._log(f"未同步本地命令目录: {result.get('error')}", "WARNING")
+        
+        self.async_loop.submit(self.async_client.sync_catalog()).add_done_callback(on_synced)
+    
     def _update_cloud_status(self, connected):
         """更新本地状态"""
         if connected:
@@ -326,16 +362,33 @@ class CADChatGUI:
             return
         
         self.current_requirement = requirement
+        types = self.query_scopes.get(self.query_scope_var.get())
         
-        def query():
-            self._log(f"正在查询服务器代码库: {requirement[:50]}...")
-            self._show_match_result({"rag_results": []})
-            
-            result = self.cloud_client.query_requirement(requirement)
-            
+        self._log(f"正在查询服务器代码库: {requirement[:50]}...")
+        self._show_match_result({"rag_results": []})
+        
+        def on_result(future):
+            if future.exception() is not None:
+                self._log(f"查询失败: {future.exception()}", "ERROR")
+                return
+            show_result(future.result())
+        
+        def on_update(result):
+            # 后台刷新得到不同的排序；期间已开始新的查询时不覆盖其显示
+            if self.current_requirement == requirement:
+                self._log("服务端结果有更新，已刷新显示")
+                show_result(result)
+        
+        def show_result(result):
             if result.get('matched'):
                 # 显示前3个匹配结果
                 self.root.after(0, lambda: self._show_match_result(result))
+                if result.get('parameters'):
+                    params = ', '.join(str(p) for p in result['parameters'])
+                    self.root.after(0, lambda: self._log(f"需求参数: {params}"))
+                if result.get('local'):
+                    reason = result['result'].get('reason', '本地目录检索')
+                    self.root.after(0, lambda: self._log(f"结果来自本地命令目录（{reason}）"))
                 
                 # 检查是否找到了匹配结果
                 all_results = result.get('all_results', [])
@@ -419,12 +472,18 @@ class CADChatGUI:
                 self.root.after(0, lambda: self._show_match_result({"rag_results": []}))
                 self.root.after(0, lambda: self._log(f"未找到匹配代码: {reason}"))
 
-        threading.Thread(target=query, daemon=True).start()
+        future = self.async_loop.submit(
+            self.async_client.query_requirement(requirement, types=types, on_update=on_update)
+        )
+        future.add_done_callback(on_result)
     
     def _connect_cad(self):
         """连接CAD"""
         def connect():
-            if self.cad_connector.connect():
+            with self.cloud_client.telemetry.action('cad_connect') as timer:
+                with timer.stage('cad_connect'):
+                    connected = self.cad_connector.connect()
+            if connected:
                 self.is_connected = True
                 cad_info = self.cad_connector.get_cad_info()
                 self.root.after(0, lambda: self._update_cad_status(True, cad_info))
@@ -452,7 +511,8 @@ class CADChatGUI:
     
     def _disconnect_cad(self):
         """断开CAD连接"""
-        self.cad_connector.disconnect()
+        if self._cad_connector is not None:
+            self.cad_connector.disconnect()
         self.is_connected = False
         self._update_cad_status(False)
         self._log("已断开CAD连接")
@@ -460,6 +520,7 @@ class CADChatGUI:
     def _start_browser(self):
         """启动浏览器并自动打开Kimi"""
         self._log("正在启动浏览器...")
+        from kimi_browser import KimiBrowser
         self.kimi_browser = KimiBrowser(headless=False)
         
         def login_needed_callback():
@@ -513,7 +574,9 @@ class CADChatGUI:
         self._log(f"正在生成LISP代码: {requirement[:50]}...")
         
         try:
-            code = self.kimi_browser.generate_lisp_code(requirement)
+            with self.cloud_client.telemetry.action('generate') as timer:
+                with timer.stage('kimi_generate'):
+                    code = self.kimi_browser.generate_lisp_code(requirement)
             if code:
                 self.current_code = code
                 self._show_code(code)
@@ -541,13 +604,14 @@ class CADChatGUI:
         self._log(f"正在生成并执行代码: {requirement[:50]}...")
         
         try:
-            code = self.kimi_browser.generate_lisp_code(requirement)
+            with self.cloud_client.telemetry.action('generate_execute') as timer:
+                with timer.stage('kimi_generate'):
+                    code = self.kimi_browser.generate_lisp_code(requirement)
+                if code:
+                    self.current_code = code
+                    self._show_code(code)
+                    success, error, cad_output = self._execute_lisp(code, timer)
             if code:
-                self.current_code = code
-                self._show_code(code)
-                
-                success, error, cad_output = self.cad_connector.execute_lisp_code(code)
-                
                 if success:
                     self._log(f"代码执行成功: {cad_output}")
                 else:
@@ -570,7 +634,8 @@ class CADChatGUI:
         
         def execute():
             self._log("正在执行当前代码...")
-            success, error, cad_output = self.cad_connector.execute_lisp_code(code)
+            with self.cloud_client.telemetry.action('execute') as timer:
+                success, error, cad_output = self._execute_lisp(code, timer)
             
             if success:
                 self.root.after(0, lambda: self._log(f"代码执行成功: {cad_output}"))
@@ -579,6 +644,15 @@ class CADChatGUI:
         
         threading.Thread(target=execute, daemon=True).start()
     
+    def _execute_lisp(self, code: str, timer):
+        """在CAD中执行代码，各阶段耗时（cad_prepare / cad_load / cad_run）记入 timer"""
+        timings = {}
+        try:
+            return self.cad_connector.execute_lisp_code(code, timings)
+        finally:
+            for stage, ms in timings.items():
+                timer.add(stage, ms)
+    
     def _save_to_server(self):
         """保存代码到服务器（先调用Kimi分析代码）"""
         code = self.code_text.get(1.0, tk.END).strip()
@@ -593,7 +667,9 @@ class CADChatGUI:
         self._log("正在调用Kimi分析代码...")
         
         try:
-            result = self.kimi_browser.analyze_code(code)
+            with self.cloud_client.telemetry.action('analyze') as timer:
+                with timer.stage('kimi_analyze'):
+                    result = self.kimi_browser.analyze_code(code)
             
             if result:
                 command = result.get('command', '')
@@ -656,30 +732,18 @@ class CADChatGUI:
         self._log("正在保存代码...")
         
         try:
-            response = requests.post(
-                f"{self.cloud_client.server_url}/api/user_codes/save",
-                json={
-                    "code": code,
-                    "command": command,
-                    "description": description
-                },
-                timeout=30
-            )
+            result = self.cloud_client.save_user_code(code, command, description)
             
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('success'):
-                    self._log(f"代码保存成功，命令: {command}")
-                    messagebox.showinfo("成功", f"代码保存成功！\n\n命令名称: {command}\n功能描述: {description}")
-                else:
-                    self._log(f"保存失败: {result.get('message')}", "ERROR")
-                    messagebox.showerror("失败", result.get('message', '保存失败'))
+            if result.get('success'):
+                self._log(f"代码保存成功，命令: {command}")
+                self._sync_catalog()
+                messagebox.showinfo("成功", f"代码保存成功！\n\n命令名称: {command}\n功能描述: {description}")
+            elif result.get('pending'):
+                self._log("代码已保存（服务端处理中）", "INFO")
+                messagebox.showinfo("成功", f"代码已提交保存（服务端正在处理）\n\n命令名称: {command}\n功能描述: {description}")
             else:
-                self._log(f"保存失败: {response.status_code}", "ERROR")
-                messagebox.showerror("失败", f"保存失败: {response.status_code}")
-        except requests.exceptions.Timeout:
-            self._log("代码已保存（服务端处理中）", "INFO")
-            messagebox.showinfo("成功", f"代码已提交保存（服务端正在处理）\n\n命令名称: {command}\n功能描述: {description}")
+                self._log(f"保存失败: {result.get('message')}", "ERROR")
+                messagebox.showerror("失败", result.get('message', '保存失败'))
         except Exception as e:
             self._log(f"保存失败: {e}", "ERROR")
             messagebox.showerror("失败", f"保存失败: {e}")
@@ -778,10 +842,10 @@ class CADChatGUI:
             
             try:
                 # 从服务器获取热门代码
-                response = requests.get(
-                    f"{self.cloud_client.server_url}/api/popular_codes",
+                response = self.cloud_client.transport.get(
+                    "/api/popular_codes",
                     params={"limit": 50, "keyword": keyword},
-                    timeout=10
+                    headers=self.cloud_client.headers
                 )
                 
                 if response.status_code == 200:
@@ -854,6 +918,11 @@ class CADChatGUI:
         """关闭应用程序"""
         if self.kimi_browser:
             self.kimi_browser.close()
+        try:
+            self.async_loop.run(self.async_client.aclose(), timeout=5)
+        except Exception as e:
+            print(f"[警告] 仍有查询未完成，不再等待: {e}")
+        self.async_loop.stop()
         self.root.quit()
         self.root.destroy()
 
@@ -861,6 +930,8 @@ class CADChatGUI:
 def main():
     root = tk.Tk()
     app = CADChatGUI(root)
+    root.update_idletasks()
+    app._log(f"窗口就绪，启动耗时 {(time.perf_counter() - _START) * 1000:.0f} ms")
     root.mainloop()
 
 
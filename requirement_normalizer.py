@@ -0,0 +1,91 @@
+"""
+CADChat 需求文本规范化
+查询前把需求统一成模板：全角转半角、英文转小写、去掉空白和标点，独立的数值参数替换为占位符。
+只有参数或写法不同的需求（如“画一个半径为50的圆”和“画一个半径为 60 的圆”）得到相同的模板，
+共用一条缓存结果，返回前把结果绑定到本次需求：回显的需求改为本次的原文，parameters 字段为本次需求的实际参数。
+表示个数的数字（如“3点画圆”“画6边形”中的 3、6）决定了用哪种画法，保留在模板中，不作为参数。
+"""
+
+import re
+import unicodedata
+from typing import Dict, List, Tuple, Union
+
+PLACEHOLDER = '#'
+
+Number = Union[int, float]
+
+# 紧跟在数字后表示个数的量词：“3点画圆”和“2点画圆”是不同的画法，数字不能替换为占位符
+_COUNT_WORDS = ('点', '个', '边', '条', '段', '次', '层', '份', '倍', '等分', '行', '列')
+
+# 独立的数值参数，可带常用单位，尺寸写法 50x30（50*30、50 × 30 统一为 50x30）中的两个数都是参数；
+# 紧挨字母或数字的（如 3d、r2018、2p）是名称的一部分，后面跟量词的是个数，都不作为参数
+_NUMBER_RE = re.compile(r'(?:(?<![a-z0-9.])|(?<=[0-9]x))-?[0-9]+(?:\.[0-9]+)?'
+                        r'(?![0-9]|\.[0-9]|\s*(?:' + '|'.join(_COUNT_WORDS) + r'))'
+                        r'(?=(?:mm|cm|m|°|度)?(?:x[0-9]|(?![a-z0-9])))')
+_DIMENSION_RE = re.compile(r'(?<=[0-9])\s*[x*×]\s*(?=[0-9])')
+
+
+def _strip(text: str) -> str:
+    """去掉空白和标点"""
+    return ''.join(ch for ch in text if not ch.isspace() and unicodedata.category(ch)[0] not in 'PZ')
+
+
+def _to_number(text: str) -> Number:
+    return float(text) if '.' in text else int(text)
+
+
+def normalize_requirement(requirement: str) -> Tuple[str, List[Number]]:
+    """返回 (模板, 参数列表)，参数按在需求中出现的顺序排列
+
+    只有标点和空白的需求模板为空，此时调用方应直接使用原文。
+    """
+    text = _DIMENSION_RE.sub('x', unicodedata.normalize('NFKC', requirement).lower())
+    pieces = []
+    parameters = []
+    pos = 0
+    for match in _NUMBER_RE.finditer(text):
+        pieces.append(_strip(text[pos:match.start()]))
+        parameters.append(_to_number(match.group()))
+        pos = match.end()
+    pieces.append(_strip(text[pos:]))
+    return PLACEHOLDER.join(pieces), parameters
+
+
+def bind_parameters(result: Dict, requirement: str, parameters: List[Number]) -> Dict:
+    """返回绑定到本次需求的查询结果（副本，缓存中的结果不变）
+
+    缓存的结果可能由模板相同、参数不同的另一条需求得到：requirement 字段改为本次需求原文，
+    由原需求得到的文本（与原需求相同的字符串；参数不同时还包括包含原需求或模板相同的字符串）改用本次需求，
+    结果中不会留下其他需求的数值；parameters 字段为本次需求的参数。
+    """
+    original = result.get('requirement')
+    if isinstance(original, str) and original and original != requirement:
+        template, original_parameters = normalize_requirement(original)
+        # 参数相同时只有写法不同，只替换完整的回显
+        if original_parameters == list(parameters) or PLACEHOLDER not in template:
+            template = ''
+        bound = _rebind_text(result, original, template, requirement)
+    else:
+        bound = dict(result)
+    bound['requirement'] = requirement
+    bound['parameters'] = list(parameters)
+    return bound
+
+
+def _rebind_text(value, original: str, template: str, requirement: str):
+    """把 value 中由原需求得到的字符串换成本次需求（字典和列表返回新的副本）
+
+    template 为空时只替换与原需求相同的字符串。
+    """
+    if isinstance(value, dict):
+        return {key: _rebind_text(item, original, template, requirement) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_rebind_text(item, original, template, requirement) for item in value]
+    if isinstance(value, str) and value:
+        if value == original:
+            return requirement
+        if template and original in value:
+            return value.replace(original, requirement)
+        if template and normalize_requirement(value)[0] == template:
+            return requirement
+    return value
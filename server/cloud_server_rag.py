@@ -5,18 +5,38 @@ CADChat 本地服务端 - RAG 版本
 """
 
 import os
+import sys
 import json
 import numpy as np
 import threading
 import time
 from typing import Dict, List, Optional
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify, send_file
 from flask_cors import CORS
 import requests
 from sklearn.metrics.pairwise import cosine_similarity
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from server_common.command_loader import CommandTable, load_command_file, load_command_rows
+from server_common.command_types import parse_command_types
+from server_common.pagination import list_response
+from server_common.blob_store import BlobStore
+from server_common.user_code_store import UserCodeStore, record_etag
+from server_common.single_flight import Flight, SingleFlight
+from server_common.bulk_import import import_user_codes
+from server_common.responses import (INDEX_VERSION_HEADER, enable_compression, enable_server_timing,
+                                    install_fast_json, record_timing, wants_compact)
+from server_common.jobs import Job, JobCancelled, JobConflict, JobManager
+from server_common.shards import ShardCache, request_namespace
+from server_common.admission import AdmissionController, DeadlineExceeded, admission_required, expired, remaining
+from server_common.popularity import PopularityStore
+from server_common.catalog import CatalogLog, encode_vector, table_entry_ids
+from server_common.index_generations import (
+    GenerationStore, commands_digest, evaluate, load_eval_queries, passes_eval, sample_eval_queries
+)
+
 # Ollama 配置
 OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'bge-m3')
@@ -25,11 +45,51 @@ EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'bge-m3')
 BASIC_COMMANDS_FILE = 'autocad_basic_commands.txt'
 LISP_COMMANDS_FILE = 'lisp_commands.txt'
 USER_CODES_DIR = 'user_codes'
-USER_CODES_FILE = os.path.join(USER_CODES_DIR, 'user_codes.txt')
-EMBEDDINGS_CACHE_FILE = 'command_embeddings_bge_m3.npy'
+USER_CODES_FILE = os.path.join(USER_CODES_DIR, 'user_codes.txt')  # 旧版索引文件，启动时一次性导入数据库
+USER_CODES_DB = os.getenv('USER_CODES_DB', os.path.join(USER_CODES_DIR, 'user_codes.sqlite3'))
+USER_CODES_BLOB_DIR = os.getenv('USER_CODES_BLOB_DIR', os.path.join(USER_CODES_DIR, 'blobs'))  # 按内容哈希保存的 LISP 代码
+EMBEDDINGS_CACHE_FILE = 'command_embeddings_bge_m3.npy'  # 旧版单文件缓存，启动时导入为索引版本
+LEGACY_CACHE_MODEL = 'bge-m3'  # 旧版缓存文件名对应的模型（旧版不记录模型，实际可能是当时的 EMBEDDING_MODEL）
+LEGACY_MATCH_SIMILARITY = 0.99  # 重新计算的向量与缓存向量的相似度达到该值才认为是同一模型
+
+# 索引版本与模型迁移配置
+INDEX_DIR = os.getenv('INDEX_DIR', 'embeddings')
+INDEX_EMBEDDINGS_FILE = 'embeddings.npy'
+EVAL_QUERIES_FILE = os.getenv('EVAL_QUERIES_FILE', 'eval_queries.txt')  # 每行: 查询文本|期望命令名
+EVAL_TOP_K = 5
+MIGRATION_MAX_REGRESSION = float(os.getenv('MIGRATION_MAX_REGRESSION', '0.02'))
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))  # 小于该字节数的响应不压缩
+
+# 命名空间分片配置（团队/项目的用户代码各自建立小索引）
+SHARD_DIR = os.getenv('SHARD_DIR', 'index_shards')
+SHARD_MAX_LOADED = int(os.getenv('SHARD_MAX_LOADED', '32'))  # 内存中最多保留的分片数
+SHARD_IDLE_SECONDS = int(os.getenv('SHARD_IDLE_SECONDS', '600'))  # 分片空闲超过该时间后从内存淘汰
+SHARD_META_FILE = 'meta.json'
+
+# 查询准入控制：超过并发数的查询排队，队列满或排队超时返回 429
+QUERY_MAX_CONCURRENT = int(os.getenv('QUERY_MAX_CONCURRENT', '4'))
+QUERY_MAX_QUEUE = int(os.getenv('QUERY_MAX_QUEUE', '16'))
+QUERY_QUEUE_TIMEOUT = float(os.getenv('QUERY_QUEUE_TIMEOUT', '5'))  # 最长排队时间（秒）
+QUERY_DEADLINE_SECONDS = float(os.getenv('QUERY_DEADLINE_SECONDS', '30'))  # 单个查询的截止时间（秒）
+EMBEDDING_TIMEOUT = 30
+
+# 命令热度：使用次数和反馈计数，检索时可按热度先验调整排序
+POPULARITY_DB = os.getenv('POPULARITY_DB', os.path.join(USER_CODES_DIR, 'popularity.sqlite3'))
+POPULARITY_WEIGHT = float(os.getenv('POPULARITY_WEIGHT', '0'))  # 热度先验的权重，0 表示只按相似度排序
+POPULARITY_POOL_FACTOR = 3  # 启用热度先验时多取的候选倍数
+POPULAR_TOP_N = int(os.getenv('POPULAR_TOP_N', '100'))  # 每个分类预先排好的热门命令数
+
+# 命令目录变更日志：客户端按版本增量同步命令目录和向量到本地镜像
+CATALOG_DB = os.getenv('CATALOG_DB', os.path.join(USER_CODES_DIR, 'catalog.sqlite3'))
+
+# 用户代码的命令类型名（aliserver 的 user_program 对应本服务端的 user_code）
+USER_CODE_TYPE = 'user_code'
 
 app = Flask(__name__)
 CORS(app)
+install_fast_json(app)
+enable_server_timing(app)
+enable_compression(app, min_size=COMPRESS_MIN_SIZE)
 
 class CommandsFileHandler(FileSystemEventHandler):
     """命令库文件变化处理器"""
@@ -46,8 +106,7 @@ class CommandsFileHandler(FileSystemEventHandler):
         
         filename = os.path.basename(event.src_path)
         if filename not in [os.path.basename(BASIC_COMMANDS_FILE), 
-                          os.path.basename(LISP_COMMANDS_FILE),
-                          os.path.basename(USER_CODES_FILE)]:
+                          os.path.basename(LISP_COMMANDS_FILE)]:
             return
         
         current_time = time.time()
@@ -69,252 +128,393 @@ class CommandsFileHandler(FileSystemEventHandler):
             import threading
             threading.Thread(target=self.callback, daemon=True).start()
 
+class IndexShard:
+    """一个命名空间的用户代码索引"""
+    
+    def __init__(self, namespace: str, commands: CommandTable, embeddings: Optional[np.ndarray], model: str):
+        self.namespace = namespace
+        self.commands = commands
+        self.embeddings = embeddings
+        self.model = model
+
 class CommandEmbeddings:
-    """命令嵌入管理器"""
+    """命令嵌入管理器
+
+    索引按版本保存在 INDEX_DIR 下，每个版本记录所用的嵌入模型。检索时查询向量使用
+    当前版本的模型计算，因此更换 EMBEDDING_MODEL 后旧版本仍可继续服务，
+    新模型的版本在后台建立并通过评测后再切换。
     
-    def __init__(self, cache_file: str):
-        self.cache_file = cache_file
-        self.temp_cache_file = cache_file + '.tmp'
-        self.commands = []
+    默认命名空间的用户代码在共享索引中；其他命名空间的用户代码各有一个分片（SHARD_DIR/<命名空间>），
+    查询指定命名空间时与共享索引一起检索。
+    """
+    
+    def __init__(self, cache_file: str, index_dir: str = None):
+        self.cache_file = cache_file  # 旧版单文件缓存，首次启动时导入为一个索引版本
+        self.store = GenerationStore(index_dir or INDEX_DIR)
+        self.commands = CommandTable()
         self.embeddings = None
+        self.type_indices = {}  # 命令类型 -> 行号数组，用于按类型过滤检索
+        self.model = EMBEDDING_MODEL  # 当前版本使用的嵌入模型
+        self.generation = None  # 当前版本ID
+        self.entry_ids = []  # 每行的目录条目ID（增量同步用）
+        self.catalog_version = 0  # 当前索引对应的目录变更日志序号
+        self.migration = {'status': 'idle'}  # 模型迁移进度
+        self.flights = SingleFlight()  # 合并同时到达的相同查询
+        self.shard_dir = SHARD_DIR
+        self.shards = ShardCache(self._load_shard, SHARD_MAX_LOADED, SHARD_IDLE_SECONDS)
         self.observer = None
+        self._state_lock = threading.Lock()  # 保护 commands/embeddings/type_indices/model 的整体替换
+        self._build_lock = threading.Lock()  # 重建、迁移、回滚互斥
         self._load_commands()
         self._load_or_create_embeddings()
         self._start_file_watcher()
     
     def _load_commands(self):
-        """加载命令库（基本命令 + LISP 命令）"""
-        try:
-            self.commands = []
-            
-            # 加载基本命令库
-            if os.path.exists(BASIC_COMMANDS_FILE):
-                with open(BASIC_COMMANDS_FILE, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line and not line.startswith('#'):
-                            parts = line.split('|')
-                            if len(parts) >= 4:
-                                self.commands.append({
-                                    'command': parts[0],
-                                    'description': parts[1],
-                                    'alias': parts[2],
-                                    'type': parts[3],
-                                    'text': f"{parts[1]} {parts[0]} {parts[2]}"
-                                })
-            
-            # 加载 LISP 命令库
-            if os.path.exists(LISP_COMMANDS_FILE):
-                with open(LISP_COMMANDS_FILE, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line and not line.startswith('#'):
-                            parts = line.split('|')
-                            if len(parts) >= 4:
-                                alias = parts[2] if parts[2] else ''
-                                self.commands.append({
-                                    'command': parts[0],
-                                    'description': parts[1],
-                                    'alias': alias,
-                                    'type': parts[3],
-                                    'text': f"{parts[1]} {parts[0]} {alias}"
-                                })
-            
-            # 加载用户代码
-            if os.path.exists(USER_CODES_FILE):
-                with open(USER_CODES_FILE, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line and not line.startswith('#'):
-                            parts = line.split('|')
-                            if len(parts) >= 4:
-                                self.commands.append({
-                                    'command': parts[1],
-                                    'description': parts[2],
-                                    'alias': '',
-                                    'type': 'user_code',
-                                    'code_id': parts[0],
-                                    'filename': parts[3],
-                                    'text': f"{parts[2]} {parts[1]}"
-                                })
-            
-            print(f"[命令库] 加载成功，共 {len(self.commands)} 个命令")
-            print(f"[命令库] 基本命令: {sum(1 for cmd in self.commands if cmd['type'] == 'basic')} 个")
-            print(f"[命令库] LISP 命令: {sum(1 for cmd in self.commands if cmd['type'] == 'lisp')} 个")
-            print(f"[命令库] 用户代码: {sum(1 for cmd in self.commands if cmd['type'] == 'user_code')} 个")
-        except Exception as e:
-            print(f"[命令库] 加载失败: {e}")
+        """加载命令库（基本命令 + LISP 命令 + 用户代码）"""
+        self.commands = self._load_commands_sync()
+        counts = self.commands.count_by_type()
+        print(f"[命令库] 基本命令: {counts.get('basic', 0)} 个")
+        print(f"[命令库] LISP 命令: {counts.get('lisp', 0)} 个")
+        print(f"[命令库] 用户代码: {counts.get('user_code', 0)} 个")
+        self.type_indices = self._build_type_indices(self.commands)
     
-    def _get_embedding(self, text: str) -> List[float]:
-        """获取文本嵌入"""
-        try:
-            response = requests.post(
-                f"{OLLAMA_HOST}/api/embeddings",
-                json={
-                    "model": EMBEDDING_MODEL,
-                    "prompt": text
-                },
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('embedding', [])
-            else:
-                print(f"[嵌入] 请求失败: {response.status_code}")
+    def _build_type_indices(self, commands: CommandTable) -> Dict[str, np.ndarray]:
+        """按命令类型建立子索引（行号数组）"""
+        return {cmd_type: np.array(rows, dtype=np.int64) for cmd_type, rows in commands.type_rows().items()}
+    
+    def _get_embedding(self, text: str, model: Optional[str] = None, flight: Optional[Flight] = None) -> List[float]:
+        """获取文本嵌入（默认使用当前版本的模型）
+        
+        flight 为合并查询的状态：嵌入调用的超时取仍在等待的请求中最晚的截止时间，
+        所有请求都已放弃时不再调用；调用期间有截止时间更晚的请求加入而本次调用超时时，按新的截止时间重新调用。
+        """
+        while True:
+            timeout = EMBEDDING_TIMEOUT
+            deadline = flight.deadline() if flight is not None else None
+            if deadline is not None:
+                timeout = min(timeout, remaining(deadline))
+                if timeout <= 0:
+                    print(f"[嵌入] 已没有请求在等待，跳过")
+                    return []
+            try:
+                response = requests.post(
+                    f"{OLLAMA_HOST}/api/embeddings",
+                    json={
+                        "model": model or self.model,
+                        "prompt": text
+                    },
+                    timeout=timeout
+                )
+                
+                if response.status_code == 200:
+                    result = response.json()
+                    return result.get('embedding', [])
+                else:
+                    print(f"[嵌入] 请求失败: {response.status_code}")
+                    return []
+            except requests.exceptions.Timeout as e:
+                if flight is not None and flight.deadline() != deadline:
+                    continue
+                print(f"[嵌入] 错误: {e}")
                 return []
-        except Exception as e:
-            print(f"[嵌入] 错误: {e}")
-            return []
+            except Exception as e:
+                print(f"[嵌入] 错误: {e}")
+                return []
+    
+    def _set_index(self, commands: CommandTable, embeddings: np.ndarray, model: str, generation: str):
+        """整体替换检索所用的数据，检索线程只会看到完整的旧版本或新版本
+        
+        同时把新的条目集合记入目录变更日志，目录版本与检索数据一起切换。
+        """
+        type_indices = self._build_type_indices(commands)
+        entry_ids = table_entry_ids(commands)
+        with self._state_lock:
+            self.commands = commands
+            self.embeddings = embeddings
+            self.type_indices = type_indices
+            self.model = model
+            self.generation = generation
+            self.entry_ids = entry_ids
+            self.catalog_version = catalog.record(model, entry_ids)
+    
+    def _snapshot(self):
+        with self._state_lock:
+            return self.commands, self.embeddings, self.type_indices, self.model
+    
+    def catalog_snapshot(self):
+        """(命令表, 向量, 模型, 条目ID列表, 目录版本)，各项属于同一个索引版本"""
+        with self._state_lock:
+            return self.commands, self.embeddings, self.model, self.entry_ids, self.catalog_version
     
     def _load_or_create_embeddings(self):
-        """加载或创建嵌入缓存"""
-        self.embeddings = []
+        """加载当前索引版本；没有可用版本时同步建立，模型变化时在后台迁移"""
+        generation = self.store.current()
+        if generation is None and os.path.exists(self.cache_file):
+            generation = self._import_legacy_cache()
         
-        if os.path.exists(self.cache_file):
+        stale = False
+        if generation is not None:
             try:
-                loaded = np.load(self.cache_file)
-                if isinstance(loaded, np.ndarray) and loaded.size > 0:
-                    self.embeddings = loaded
-                    print(f"[嵌入] 从缓存加载，共 {len(self.embeddings)} 个向量")
-                    return
+                meta = self.store.read_meta(generation)
+                embeddings = np.load(os.path.join(self.store.path(generation), INDEX_EMBEDDINGS_FILE))
+                self._set_index(self.commands, embeddings, meta['model'], generation)
+                print(f"[索引] 加载版本 {generation}（模型: {meta['model']}），共 {len(embeddings)} 个向量")
+                stale = meta.get('commands_digest') != commands_digest(self.commands)
+                if stale:
+                    print(f"[索引] 命令库已变化，将在后台重建")
             except Exception as e:
-                print(f"[嵌入] 缓存加载失败: {e}")
+                print(f"[索引] 版本 {generation} 加载失败: {e}")
+                generation = None
         
-        print(f"[嵌入] 创建新的嵌入缓存...")
-        self.embeddings = []
+        if generation is None:
+            print(f"[嵌入] 创建新的嵌入缓存...")
+            generation = self._build_generation(self.commands, EMBEDDING_MODEL)
+            if generation is None:
+                return
+            self.store.activate(generation)
+            embeddings = np.load(os.path.join(self.store.path(generation), INDEX_EMBEDDINGS_FILE))
+            self._set_index(self.commands, embeddings, EMBEDDING_MODEL, generation)
         
-        for i, cmd in enumerate(self.commands):
-            print(f"[嵌入] 处理 {i+1}/{len(self.commands)}: {cmd['command']}")
-            embedding = self._get_embedding(cmd['text'])
-            if embedding:
-                self.embeddings.append(embedding)
-            else:
-                print(f"[嵌入] 警告: 无法获取 {cmd['command']} 的嵌入")
+        migrate = self.model != EMBEDDING_MODEL
+        if migrate and self.store.is_rejected(EMBEDDING_MODEL):
+            print(f"[索引] 模型 {EMBEDDING_MODEL} 的索引曾未通过评测或被回滚，继续使用 {self.model}；"
+                  f"如需切换请调用 /api/index/migrate 并指定 force")
+            migrate = False
         
-        if self.embeddings:
-            self.embeddings = np.array(self.embeddings)
-            np.save(self.cache_file, self.embeddings)
-            print(f"[嵌入] 缓存已保存: {self.cache_file}")
-        else:
-            print(f"[嵌入] 错误: 没有成功创建任何嵌入")
-
-    def rebuild(self):
-        """重建嵌入缓存（在后台线程中运行），重建过程中不影响搜索"""
-        print(f"[嵌入] 开始重建缓存...")
-
-        # 保存当前有效的嵌入和命令，用于重建期间继续搜索
-        old_commands = self.commands
-        old_embeddings = self.embeddings
+        if stale or migrate:
+            def background():
+                if stale:
+                    self.rebuild()
+                if migrate:
+                    self.migrate(EMBEDDING_MODEL)
+            threading.Thread(target=background, daemon=True).start()
+    
+    def _legacy_cache_model(self, embeddings: np.ndarray) -> Optional[str]:
+        """找出旧版缓存实际使用的模型：用候选模型重新计算第一条命令的向量，与缓存中的向量比较
+        
+        旧版缓存不记录模型，文件名固定为 bge_m3，但内容由当时设置的 EMBEDDING_MODEL 生成。
+        """
+        if len(self.commands) == 0:
+            return None
+        cached = embeddings[0]
+        for model in dict.fromkeys((EMBEDDING_MODEL, LEGACY_CACHE_MODEL)):
+            vector = np.asarray(self._get_embedding(self.commands.text(0), model), dtype=np.float32)
+            if vector.shape != cached.shape:
+                continue
+            similarity = float(vector @ cached / max(np.linalg.norm(vector) * np.linalg.norm(cached), 1e-12))
+            if similarity >= LEGACY_MATCH_SIMILARITY:
+                return model
+        return None
+    
+    def _import_legacy_cache(self) -> Optional[str]:
+        """把旧版单文件缓存导入为索引版本，无法确认生成它的模型时不导入（重新建立索引）"""
+        try:
+            embeddings = np.load(self.cache_file)
+            if not isinstance(embeddings, np.ndarray) or embeddings.size == 0:
+                return None
+            model = self._legacy_cache_model(embeddings)
+            if model is None:
+                print(f"[索引] 无法确认旧版嵌入缓存 {self.cache_file} 所用的模型，不导入")
+                return None
+            generation, path = self.store.new_generation(model)
+            np.save(os.path.join(path, INDEX_EMBEDDINGS_FILE), embeddings)
+            # 只有数量一致时才认为与当前命令库对应，否则加载后在后台重建
+            digest = commands_digest(self.commands) if len(embeddings) == len(self.commands) else ''
+            self.store.write_meta(generation, {
+                'model': model,
+                'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'count': int(len(embeddings)),
+                'dim': int(embeddings.shape[1]),
+                'commands_digest': digest,
+                'imported_from': self.cache_file
+            })
+            self.store.activate(generation)
+            print(f"[索引] 已导入旧版嵌入缓存 {self.cache_file} 为版本 {generation}（模型: {model}）")
+            return generation
+        except Exception as e:
+            print(f"[索引] 旧版嵌入缓存导入失败: {e}")
+            return None
+    
+    def _build_generation(self, commands: CommandTable, model: str,
+                          reuse: Optional[Dict[str, np.ndarray]] = None,
+                          job: Optional[Job] = None) -> Optional[str]:
+        """用指定模型为命令库建立一个新的索引版本（不切换），失败返回 None"""
+        generation, path = self.store.new_generation(model)
+        try:
+            embeddings = self._create_embeddings_sync(commands, model, reuse, job)
+        except JobCancelled:
+            self.store.discard(generation)
+            raise
+        if embeddings is None:
+            self.store.discard(generation)
+            return None
+        np.save(os.path.join(path, INDEX_EMBEDDINGS_FILE), embeddings)
+        self.store.write_meta(generation, {
+            'model': model,
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'count': int(len(embeddings)),
+            'dim': int(embeddings.shape[1]),
+            'commands_digest': commands_digest(commands)
+        })
+        print(f"[索引] 版本 {generation} 已保存（模型: {model}）")
+        return generation
 
-        # 创建临时缓存
-        temp_cache = self.temp_cache_file
+    def rebuild(self, job: Optional[Job] = None) -> Optional[str]:
+        """重建嵌入缓存，重建过程中不影响搜索，返回新版本ID（失败返回 None）
 
-        # 重新加载命令
-        new_commands = self._load_commands_sync()
+        由任务执行时通过 job 报告进度，取消时抛出 JobCancelled 并保留当前版本。
+        """
+        with self._build_lock:
+            print(f"[嵌入] 开始重建缓存...")
+            old_commands, old_embeddings, _, model = self._snapshot()
 
-        # 重新创建嵌入（保存到临时文件）
-        temp_embeddings = self._create_embeddings_sync(new_commands, temp_cache)
+            # 文本未变化的命令直接复用当前版本的向量，只为新增或修改的命令计算嵌入
+            reuse = {}
+            if old_embeddings is not None and len(old_embeddings) == len(old_commands):
+                reuse = {old_commands.text(i): old_embeddings[i] for i in range(len(old_commands))}
 
-        if temp_embeddings is not None and len(temp_embeddings) > 0:
-            # 替换旧缓存
-            if os.path.exists(self.cache_file):
-                os.remove(self.cache_file)
-            os.rename(temp_cache, self.cache_file)
+            # 重新加载命令，用当前模型建立新版本，完成后再切换
+            new_commands = self._load_commands_sync()
+            try:
+                generation = self._build_generation(new_commands, model, reuse, job)
+            except JobCancelled:
+                print(f"[嵌入] 缓存重建已取消，继续使用版本 {self.generation}")
+                raise
 
-            # 更新内存中的数据（原子操作）
-            self.commands = new_commands
-            self.embeddings = temp_embeddings
+            if generation is not None:
+                self.store.activate(generation)
+                embeddings = np.load(os.path.join(self.store.path(generation), INDEX_EMBEDDINGS_FILE))
+                self._set_index(new_commands, embeddings, model, generation)
+                print(f"[嵌入] 缓存重建完成，共 {len(new_commands)} 条")
+            else:
+                print(f"[嵌入] 缓存重建失败，继续使用版本 {self.generation}")
+            return generation
+    
+    def migrate(self, model: str, force: bool = False) -> Dict:
+        """迁移到新的嵌入模型
 
-            print(f"[嵌入] 缓存重建完成，共 {len(self.commands)} 条")
-        else:
-            # 重建失败，恢复旧数据
-            self.commands = old_commands
-            self.embeddings = old_embeddings
-            # 清理临时文件
-            if os.path.exists(temp_cache):
-                os.remove(temp_cache)
-            print(f"[嵌入] 缓存重建失败")
-    
-    def _load_commands_sync(self):
-        """同步加载命令库"""
-        commands = []
-        
-        try:
-            # 加载基本命令库
-            if os.path.exists(BASIC_COMMANDS_FILE):
-                with open(BASIC_COMMANDS_FILE, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line and not line.startswith('#'):
-                            parts = line.split('|')
-                            if len(parts) >= 4:
-                                commands.append({
-                                    'command': parts[0],
-                                    'description': parts[1],
-                                    'alias': parts[2],
-                                    'type': parts[3],
-                                    'text': f"{parts[1]} {parts[0]} {parts[2]}"
-                                })
+        在后台用新模型建立索引版本，期间继续使用当前版本检索；建好后在评测查询集上
+        对比两个版本，新版本没有明显变差（或 force）时切换，否则保留当前版本。
+        """
+        with self._build_lock:
+            commands, embeddings, type_indices, old_model = self._snapshot()
+            self.migration = {'status': 'building', 'model': model, 'from_model': old_model,
+                              'started_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+            print(f"[迁移] 开始: {old_model} -> {model}")
+            
+            generation = self._build_generation(commands, model)
+            if generation is None:
+                self.migration.update(status='failed', reason='新模型嵌入创建失败')
+                print(f"[迁移] 失败: 新模型嵌入创建失败，继续使用 {old_model}")
+                return self.migration
+            new_embeddings = np.load(os.path.join(self.store.path(generation), INDEX_EMBEDDINGS_FILE))
             
-            # 加载 LISP 命令库
-            if os.path.exists(LISP_COMMANDS_FILE):
-                with open(LISP_COMMANDS_FILE, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line and not line.startswith('#'):
-                            parts = line.split('|')
-                            if len(parts) >= 4:
-                                alias = parts[2] if parts[2] else ''
-                                commands.append({
-                                    'command': parts[0],
-                                    'description': parts[1],
-                                    'alias': alias,
-                                    'type': parts[3],
-                                    'text': f"{parts[1]} {parts[0]} {alias}"
-                                })
+            self.migration['status'] = 'evaluating'
+            queries = load_eval_queries(EVAL_QUERIES_FILE) or sample_eval_queries(commands)
+            old_eval = evaluate(lambda q: self._rank_commands(commands, embeddings, old_model, q), queries)
+            new_eval = evaluate(lambda q: self._rank_commands(commands, new_embeddings, model, q), queries)
+            self.store.update_meta(generation, eval={'baseline': old_eval, 'candidate': new_eval})
+            self.migration.update(eval={'baseline': old_eval, 'candidate': new_eval})
+            print(f"[迁移] 评测 {len(queries)} 条查询: {old_model} recall@{EVAL_TOP_K}={old_eval['recall_at_k']:.3f} "
+                  f"MRR={old_eval['mrr']:.3f} / {model} recall@{EVAL_TOP_K}={new_eval['recall_at_k']:.3f} "
+                  f"MRR={new_eval['mrr']:.3f}")
             
-            # 加载用户代码
-            if os.path.exists(USER_CODES_FILE):
-                with open(USER_CODES_FILE, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line and not line.startswith('#'):
-                            parts = line.split('|')
-                            if len(parts) >= 4:
-                                commands.append({
-                                    'command': parts[1],
-                                    'description': parts[2],
-                                    'alias': '',
-                                    'type': 'user_code',
-                                    'code_id': parts[0],
-                                    'filename': parts[3],
-                                    'text': f"{parts[2]} {parts[1]}"
-                                })
+            if force or passes_eval(old_eval, new_eval, MIGRATION_MAX_REGRESSION):
+                self.store.activate(generation)
+                self._set_index(commands, new_embeddings, model, generation)
+                self.migration.update(status='cut_over', generation=generation)
+                print(f"[迁移] 已切换到版本 {generation}（模型: {model}）")
+            else:
+                self.store.reject(generation, '评测结果低于当前版本')
+                self.migration.update(status='rejected', reason='评测结果低于当前版本')
+                print(f"[迁移] 新模型评测结果低于当前版本，继续使用 {old_model}")
+            return self.migration
+    
+    def rollback(self) -> str:
+        """回滚到磁盘上保留的上一版本
+        
+        Raises:
+            ValueError: 没有上一版本，或上一版本与当前命令库不对应
+        """
+        with self._build_lock:
+            commands, _, _, current_model = self._snapshot()
+            previous = self.store.previous()
+            if not previous:
+                raise ValueError('没有可回滚的上一版本')
+            meta = self.store.read_meta(previous)
+            if meta.get('commands_digest') != commands_digest(commands):
+                raise ValueError(f"上一版本 {previous} 与当前命令库不对应，无法回滚")
+            embeddings = np.load(os.path.join(self.store.path(previous), INDEX_EMBEDDINGS_FILE))
             
+            current = self.store.rollback()
+            self._set_index(commands, embeddings, meta['model'], current)
+            if meta['model'] != current_model:
+                # 记录被回滚的模型，重启后不会再自动迁移到该模型
+                self.store.reject(self.store.previous(), '已回滚')
+            print(f"[索引] 已回滚到版本 {current}（模型: {meta['model']}）")
+            return current
+    
+    def index_status(self) -> Dict:
+        """索引版本与迁移状态"""
+        status = self.store.status()
+        status['serving_model'] = self.model
+        status['configured_model'] = EMBEDDING_MODEL
+        status['migration'] = self.migration
+        return status
+    
+    def _load_commands_sync(self) -> CommandTable:
+        """同步加载命令库"""
+        commands = CommandTable()
+        
+        try:
+            load_command_file(BASIC_COMMANDS_FILE, commands)
+            load_command_file(LISP_COMMANDS_FILE, commands, default_type='lisp')
+            load_command_rows(user_code_store.iter_codes(), commands, USER_CODES_DB, default_type='user_code')
             print(f"[命令库] 加载成功，共 {len(commands)} 个命令")
         except Exception as e:
             print(f"[命令库] 加载失败: {e}")
         
         return commands
     
-    def _create_embeddings_sync(self, commands: List[Dict], cache_path: str):
-        """同步创建嵌入缓存"""
+    def _create_embeddings_sync(self, commands: CommandTable, model: str,
+                                reuse: Optional[Dict[str, np.ndarray]] = None,
+                                job: Optional[Job] = None) -> Optional[np.ndarray]:
+        """同步创建嵌入，任一命令失败时返回 None（向量必须与命令逐行对应）
+        
+        reuse 为同一模型下 文本 -> 向量 的映射，命中的命令不再调用嵌入接口。
+        job 的进度按需要调用嵌入接口的条数计算，每条之前检查是否已取消。
+        """
         embeddings = []
+        reused = 0
+        reuse = reuse or {}
+        if job is not None:
+            job.set_total(sum(1 for i in range(len(commands)) if commands.text(i) not in reuse))
         
-        for i, cmd in enumerate(commands):
-            print(f"[嵌入] 处理 {i+1}/{len(commands)}: {cmd['command']}")
-            embedding = self._get_embedding(cmd['text'])
-            if embedding:
-                embeddings.append(embedding)
-            else:
-                print(f"[嵌入] 警告: 无法获取 {cmd['command']} 的嵌入")
+        for i in range(len(commands)):
+            command = commands.commands[i]
+            text = commands.text(i)
+            if text in reuse:
+                embeddings.append(reuse[text])
+                reused += 1
+                continue
+            if job is not None:
+                job.check_cancelled()
+            print(f"[嵌入] 处理 {i+1}/{len(commands)}: {command}")
+            embedding = self._get_embedding(text, model)
+            if not embedding:
+                print(f"[嵌入] 错误: 无法获取 {command} 的嵌入")
+                if job is not None:
+                    job.add_error(f"无法获取 {command} 的嵌入")
+                return None
+            embeddings.append(embedding)
+            if job is not None:
+                job.advance()
+        
+        if reused:
+            print(f"[嵌入] 复用 {reused} 个未变化命令的向量，新计算 {len(embeddings) - reused} 个")
         
         if embeddings:
-            embeddings = np.array(embeddings)
-            np.save(cache_path, embeddings)
-            print(f"[嵌入] 缓存已保存: {cache_path}")
-            return embeddings
+            return np.array(embeddings)
         else:
             print(f"[嵌入] 错误: 没有成功创建任何嵌入")
             return None
@@ -322,7 +522,8 @@ class CommandEmbeddings:
     def _start_file_watcher(self):
         """启动文件监控"""
         try:
-            event_handler = CommandsFileHandler(self.rebuild)
+            # 重建作为后台任务执行，可在 /api/jobs 查看进度；重建进行中再次变化时合并到该任务
+            event_handler = CommandsFileHandler(submit_rebuild)
             self.observer = Observer()
             
             # 监控命令库文件所在目录
@@ -332,17 +533,11 @@ class CommandEmbeddings:
             
             self.observer.schedule(event_handler, watch_dir, recursive=False)
             
-            # 创建用户代码目录（如果不存在）
-            if not os.path.exists(USER_CODES_DIR):
-                os.makedirs(USER_CODES_DIR)
-            
-            # 监控用户代码目录
-            self.observer.schedule(event_handler, USER_CODES_DIR, recursive=False)
-            
+            # 用户代码保存在数据库中，保存和删除接口会直接触发重建，不需要监控
             self.observer.start()
             
-            print(f"[文件监控] 已启动，监控目录: {watch_dir}, {USER_CODES_DIR}")
-            print(f"[文件监控] 监控文件: {os.path.basename(BASIC_COMMANDS_FILE)}, {os.path.basename(LISP_COMMANDS_FILE)}, {os.path.basename(USER_CODES_FILE)}")
+            print(f"[文件监控] 已启动，监控目录: {watch_dir}")
+            print(f"[文件监控] 监控文件: {os.path.basename(BASIC_COMMANDS_FILE)}, {os.path.basename(LISP_COMMANDS_FILE)}")
         except Exception as e:
             print(f"[文件监控] 启动失败: {e}")
     
@@ -353,50 +548,291 @@ class CommandEmbeddings:
             self.observer.join()
             print(f"[文件监控] 已停止")
     
-    def search(self, requirement: str, top_k: int = 5) -> List[Dict]:
-        """使用向量相似度搜索命令"""
-        if not self.commands or self.embeddings is None:
+    def search(self, requirement: str, top_k: int = 5, types: Optional[List[str]] = None,
+               namespace: str = '', deadline: Optional[float] = None) -> List[Dict]:
+        """使用向量相似度搜索命令，同时到达的相同查询只检索一次
+        
+        Args:
+            requirement: 查询文本
+            top_k: 返回结果数量
+            types: 命令类型过滤（basic/lisp/user_code），为空时检索全部命令
+            namespace: 命名空间，非空时同时检索该命名空间的用户代码分片
+            deadline: 截止时间（time.monotonic）：本请求等到截止时间为止；
+                合并的检索按仍在等待的请求中最晚的截止时间限制嵌入调用，所有请求都放弃后不再计算
+        
+        Raises:
+            DeadlineExceeded: 超过截止时间仍未得到结果
+        """
+        if expired(deadline):
+            raise DeadlineExceeded()
+        key = (requirement, top_k, tuple(types) if types else None, namespace, self.generation)
+        try:
+            results, shared = self.flights.do(
+                key, lambda flight: self._search(requirement, top_k, types, namespace, flight), deadline=deadline)
+        except TimeoutError:
+            raise DeadlineExceeded()
+        if shared:
+            print(f"[搜索] 合并相同查询: {requirement}")
+        # 每个请求拿到独立的副本，避免共享结果被调用方修改
+        return [dict(cmd) for cmd in results]
+    
+    def _search(self, requirement: str, top_k: int, types: Optional[List[str]], namespace: str = '',
+                flight: Optional[Flight] = None) -> List[Dict]:
+        """检索实现，flight 为合并查询的状态（限制查询嵌入调用的耗时）"""
+        # 取快照，避免重建或迁移线程在检索过程中替换数据
+        commands, embeddings, type_indices, model = self._snapshot()
+        
+        if not commands or embeddings is None:
             return []
 
         # 检查commands和embeddings是否同步
-        if len(self.commands) != len(self.embeddings):
-            print(f"[搜索] 嵌入缓存与命令库不同步 ({len(self.embeddings)}/{len(self.commands)})，跳过搜索")
+        if len(commands) != len(embeddings):
+            print(f"[搜索] 嵌入缓存与命令库不同步 ({len(embeddings)}/{len(commands)})，跳过搜索")
             return []
 
-        query_embedding = self._get_embedding(requirement)
+        # 按类型过滤时只在对应子索引上计算相似度
+        rows = None
+        search_shared = True
+        if types:
+            selected = [type_indices[t] for t in types if t in type_indices]
+            if selected:
+                rows = np.sort(np.concatenate(selected)) if len(selected) > 1 else selected[0]
+            else:
+                search_shared = False
+        search_shard = bool(namespace) and (not types or 'user_code' in types)
+        if not search_shared and not search_shard:
+            return []
+
+        query_embedding = self._get_embedding(requirement, model, flight)
         if not query_embedding:
+            if flight is not None and expired(flight.deadline()):
+                raise DeadlineExceeded()
             print(f"[搜索] 无法获取查询嵌入")
             return []
-
         query_embedding = np.array(query_embedding).reshape(1, -1)
-
-        similarities = cosine_similarity(query_embedding, self.embeddings)[0]
         
-        # 调试：显示所有命令的相似度
-        print(f"[搜索] 查询: {requirement}")
-        print(f"[搜索] 所有命令的相似度:")
-        for i, sim in enumerate(similarities):
-            if sim > 0.1 and i < len(self.commands):  # 只显示相似度大于 0.1 的命令
-                print(f"  {self.commands[i]['command']} ({self.commands[i]['description']}): {sim:.3f}")
+        results = []
+        if search_shared:
+            rows, similarities = self._similarities(query_embedding, embeddings, rows)
+            
+            # 调试：显示所有命令的相似度
+            print(f"[搜索] 查询: {requirement}" + (f" (类型: {', '.join(types)})" if types else ""))
+            print(f"[搜索] 所有命令的相似度:")
+            for pos, sim in enumerate(similarities):
+                if sim > 0.1:  # 只显示相似度大于 0.1 的命令
+                    row = rows[pos]
+                    print(f"  {commands.commands[row]} ({commands.descriptions[row]}): {sim:.3f}")
+            
+            results = self._top_rows(commands, rows, similarities, top_k)
         
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        if search_shard:
+            # 分片与共享索引使用同一模型和同一查询向量，余弦相似度可以直接比较
+            results.extend(self._search_shard(namespace, query_embedding, model, top_k))
+            results.sort(key=lambda cmd: cmd['similarity'], reverse=True)
+            results = results[:top_k]
         
+        return results
+    
+    def _search_shard(self, namespace: str, query_embedding: np.ndarray, model: str, top_k: int) -> List[Dict]:
+        """在命名空间分片中检索，分片加载失败时只返回空结果"""
+        try:
+            shard = self.shards.get(namespace)
+            if shard.model != model:
+                # 共享索引已切换嵌入模型，分片按新模型重建
+                self.shards.invalidate(namespace)
+                shard = self.shards.get(namespace)
+        except Exception as e:
+            print(f"[分片] 命名空间 {namespace} 加载失败: {e}")
+            return []
+        if shard.embeddings is None or shard.model != model:
+            return []
+        
+        rows, similarities = self._similarities(query_embedding, shard.embeddings)
+        results = self._top_rows(shard.commands, rows, similarities, top_k)
+        for cmd in results:
+            cmd['namespace'] = namespace
+        return results
+    
+    @staticmethod
+    def _similarities(query_embedding: np.ndarray, embeddings: np.ndarray, rows: Optional[np.ndarray] = None):
+        """计算查询向量与指定行的相似度，返回 (行号数组, 相似度数组)"""
+        if rows is None:
+            return np.arange(len(embeddings)), cosine_similarity(query_embedding, embeddings)[0]
+        return rows, cosine_similarity(query_embedding, embeddings[rows])[0]
+    
+    @staticmethod
+    def _top_rows(commands: CommandTable, rows: np.ndarray, similarities: np.ndarray, top_k: int) -> List[Dict]:
         results = []
-        for idx in top_indices:
-            cmd = self.commands[idx].copy()
-            cmd['similarity'] = float(similarities[idx])
+        for pos in np.argsort(similarities)[::-1][:top_k]:
+            cmd = commands.row(rows[pos])
+            cmd['similarity'] = float(similarities[pos])
             results.append(cmd)
-        
         return results
     
-    def get_all_commands(self) -> List[Dict]:
+    def _rank(self, embeddings: np.ndarray, model: str, requirement: str, rows: Optional[np.ndarray] = None):
+        """计算查询与指定行的相似度，返回 (行号数组, 相似度数组)，无法获取查询嵌入时返回 None"""
+        query_embedding = self._get_embedding(requirement, model)
+        if not query_embedding:
+            return None
+        return self._similarities(np.array(query_embedding).reshape(1, -1), embeddings, rows)
+    
+    def _load_shard(self, namespace: str) -> IndexShard:
+        """加载命名空间分片：磁盘上的向量与当前代码和模型一致时直接使用，否则只为变化的代码计算嵌入
+        
+        Raises:
+            RuntimeError: 嵌入创建失败（不缓存失败的分片，下次查询时重试）
+        """
+        commands = CommandTable()
+        load_command_rows(user_code_store.iter_codes(namespace=namespace), commands, USER_CODES_DB,
+                          default_type='user_code')
+        model = self.model
+        texts = [commands.text(i) for i in range(len(commands))]
+        path = os.path.join(self.shard_dir, namespace)
+        meta_path = os.path.join(path, SHARD_META_FILE)
+        
+        reuse = {}
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if meta.get('model') == model:
+                    saved = np.load(os.path.join(path, INDEX_EMBEDDINGS_FILE))
+                    if meta.get('texts') == texts:
+                        print(f"[分片] 已加载命名空间 {namespace}: {len(commands)} 条")
+                        return IndexShard(namespace, commands, saved, model)
+                    reuse = dict(zip(meta.get('texts', []), saved))
+            except (OSError, ValueError) as e:
+                print(f"[分片] 命名空间 {namespace} 的索引文件无法读取，重新建立: {e}")
+        
+        if not len(commands):
+            return IndexShard(namespace, commands, None, model)
+        
+        print(f"[分片] 建立命名空间 {namespace} 的索引: {len(commands)} 条")
+        embeddings = self._create_embeddings_sync(commands, model, reuse)
+        if embeddings is None:
+            raise RuntimeError('嵌入创建失败')
+        
+        # 先写临时文件再替换，读取方不会看到写了一半的分片
+        os.makedirs(path, exist_ok=True)
+        tmp_path = os.path.join(path, INDEX_EMBEDDINGS_FILE + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, embeddings)
+        os.replace(tmp_path, os.path.join(path, INDEX_EMBEDDINGS_FILE))
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'model': model, 'count': len(texts), 'texts': texts,
+                       'created_at': time.strftime('%Y-%m-%d %H:%M:%S')}, f, ensure_ascii=False)
+        os.replace(meta_path + '.tmp', meta_path)
+        return IndexShard(namespace, commands, embeddings, model)
+    
+    def _rank_commands(self, commands: CommandTable, embeddings: Optional[np.ndarray], model: str,
+                       requirement: str) -> List[str]:
+        """评测用：返回相似度最高的 EVAL_TOP_K 个命令名"""
+        if embeddings is None or len(embeddings) != len(commands):
+            return []
+        ranked = self._rank(embeddings, model, requirement)
+        if ranked is None:
+            return []
+        rows, similarities = ranked
+        return [commands.commands[rows[pos]] for pos in np.argsort(similarities)[::-1][:EVAL_TOP_K]]
+    
+    def get_all_commands(self) -> CommandTable:
         """获取所有命令"""
         return self.commands
 
+# 初始化用户代码存储（首次启动时导入旧的 user_codes.txt）
+user_code_store = UserCodeStore(USER_CODES_DB, BlobStore(USER_CODES_BLOB_DIR))
+_imported = user_code_store.import_txt(USER_CODES_FILE)
+if _imported:
+    print(f"[用户代码] 已从 {USER_CODES_FILE} 导入 {_imported} 条记录到 {USER_CODES_DB}")
+_backfilled = user_code_store.backfill_blobs(USER_CODES_DIR)
+if _backfilled:
+    print(f"[用户代码] 已将 {_backfilled} 条代码移入内容存储: {USER_CODES_BLOB_DIR}")
+
+# 命令目录变更日志（须在命令嵌入管理器之前创建，加载索引时即记录）
+catalog = CatalogLog(CATALOG_DB)
+
+# 后台任务（重建索引），同一时刻只运行一个重建任务
+jobs = JobManager()
+
+def _run_rebuild(job: Job) -> Dict:
+    generation = command_embeddings.rebuild(job)
+    if generation is None:
+        raise RuntimeError('嵌入创建失败，继续使用当前版本')
+    return {'generation': generation, 'total_commands': len(command_embeddings.commands)}
+
+def submit_rebuild() -> Job:
+    """提交重建索引任务；已有重建任务在运行时合并到该任务（结束后再重建一次），返回负责这次变更的任务"""
+    return jobs.submit('rebuild', _run_rebuild, coalesce=True)
+
+def _job_fields(job: Optional[Job]) -> Dict:
+    """响应中附带的索引更新任务信息"""
+    if job is None:
+        return {}
+    return {'job_id': job.id, 'status_url': f'/api/jobs/{job.id}'}
+
 # 初始化命令嵌入管理器
 command_embeddings = CommandEmbeddings(EMBEDDINGS_CACHE_FILE)
 
+# 查询接口的准入控制
+query_admission = AdmissionController(QUERY_MAX_CONCURRENT, QUERY_MAX_QUEUE, QUERY_QUEUE_TIMEOUT)
+
+# 命令热度计数（后台定期写入数据库）
+popularity = PopularityStore(POPULARITY_DB, top_n=POPULAR_TOP_N)
+
+def _popularity_weight(data: dict) -> float:
+    """请求中的 popularity_weight（0~1），未指定时使用 POPULARITY_WEIGHT
+    
+    Raises:
+        ValueError: 不是数字
+    """
+    value = data.get('popularity_weight')
+    if value is None:
+        return POPULARITY_WEIGHT
+    try:
+        return min(max(float(value), 0.0), 1.0)
+    except (TypeError, ValueError):
+        raise ValueError('popularity_weight 必须是 0~1 之间的数字')
+
+def _ranked_search(requirement: str, top_k: int, types: Optional[List[str]], namespace: str,
+                   weight: float) -> List[Dict]:
+    """检索命令，weight 大于 0 时多取候选并按相似度 + 热度先验重新排序"""
+    if weight <= 0:
+        return command_embeddings.search(requirement, top_k=top_k, types=types, namespace=namespace,
+                                         deadline=g.deadline)
+    results = command_embeddings.search(requirement, top_k=top_k * POPULARITY_POOL_FACTOR, types=types,
+                                        namespace=namespace, deadline=g.deadline)
+    return popularity.apply_prior(results, weight)[:top_k]
+
+def _index_version(namespace: str) -> str:
+    """索引版本：共享索引版本 + 命名空间用户代码的数据版本"""
+    return f"{command_embeddings.generation}.{user_code_store.version(namespace)}"
+
+# 带索引版本响应头的接口（查询结果对应的命令库 + 用户代码版本）
+VERSIONED_ENDPOINTS = ('query_requirement', 'search_commands', 'get_index_version', 'catalog_delta')
+
+@app.before_request
+def capture_index_version():
+    """检索前记下索引版本，结果不会被标记为比实际使用的索引更新的版本"""
+    if request.endpoint in VERSIONED_ENDPOINTS:
+        try:
+            g.index_version = _index_version(request_namespace(request, request.get_json(silent=True)))
+        except ValueError:
+            pass
+
+@app.after_request
+def add_index_version(response):
+    version = g.get('index_version')
+    if version and response.status_code == 200:
+        response.headers[INDEX_VERSION_HEADER] = version
+    return response
+
+@app.route('/api/index/version', methods=['GET'])
+def get_index_version():
+    """当前索引版本（客户端据此判断本地缓存是否过期）"""
+    return jsonify({'index_version': g.get('index_version')})
+
 @app.route('/api/search', methods=['POST'])
+@admission_required(query_admission, QUERY_DEADLINE_SECONDS)
 def search_commands():
     """搜索命令（兼容 aliserver API）"""
     data = request.json
@@ -406,9 +842,18 @@ def search_commands():
     if not query:
         return jsonify({'error': '查询不能为空'}), 400
     
+    try:
+        types = parse_command_types(data.get('types'), USER_CODE_TYPE)
+        namespace = request_namespace(request, data)
+        weight = _popularity_weight(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     print(f"[搜索] 查询: {query}")
     
-    results = command_embeddings.search(query, top_k=top_k)
+    search_start = time.perf_counter()
+    results = _ranked_search(query, top_k, types, namespace, weight)
+    record_timing('search', (time.perf_counter() - search_start) * 1000)
     
     return jsonify({
         'query': query,
@@ -417,7 +862,9 @@ def search_commands():
                 'command': cmd['command'],
                 'description': cmd['description'],
                 'similarity': cmd['similarity'],
-                'type': cmd.get('type', 'basic')
+                'type': cmd.get('type', 'basic'),
+                'namespace': cmd.get('namespace', ''),
+                'score': cmd.get('score', cmd['similarity'])
             }
             for cmd in results
         ],
@@ -425,6 +872,7 @@ def search_commands():
     })
 
 @app.route('/api/query', methods=['POST'])
+@admission_required(query_admission, QUERY_DEADLINE_SECONDS)
 def query_requirement():
     """查询需求，返回匹配的命令（RAG 方式）"""
     data = request.json
@@ -433,13 +881,21 @@ def query_requirement():
     if not requirement:
         return jsonify({'error': '需求不能为空'}), 400
     
-    print(f"[查询] 用户需求: {requirement}")
+    try:
+        types = parse_command_types(data.get('types'), USER_CODE_TYPE)
+        namespace = request_namespace(request, data)
+        weight = _popularity_weight(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    print(f"[查询] 用户需求: {requirement}" + (f" (命名空间: {namespace})" if namespace else ""))
     
     # 步骤 1: 使用向量相似度检索 Top-5 命令
     print(f"[RAG] 步骤 1/2: 向量检索...")
     rag_start_time = time.time()
-    rag_results = command_embeddings.search(requirement, top_k=3)
+    rag_results = _ranked_search(requirement, 3, types, namespace, weight)
     rag_time = (time.time() - rag_start_time) * 1000
+    record_timing('search', rag_time)
     
     if not rag_results:
         print(f"[性能] 步骤1 - 向量检索: {rag_time:.2f}ms")
@@ -461,6 +917,8 @@ def query_requirement():
     # 直接返回前3个结果，不设置相似度阈值
     best_command = rag_results[0]
     category = 'LISP 命令' if best_command.get('type') == 'lisp' else '基本命令'
+    popularity.record_usage(best_command['command'], best_command.get('type', ''), best_command['description'],
+                            best_command.get('namespace', ''))
 
     # 高相似度时记录日志
     HIGH_SIMILARITY_THRESHOLD = 0.80
@@ -471,35 +929,45 @@ def query_requirement():
     print(f"[性能] 步骤2 - LLM匹配: 跳过（已禁用）")
     print(f"[性能] 总耗时: {rag_time:.2f}ms")
 
+    code = {
+        'id': -1,
+        'type': 'basic_command',
+        'command': best_command['command'],
+        'description': best_command['description'],
+        'alias': best_command['alias'],
+        'final_alias': best_command['alias'],
+        'category': category,
+        'is_basic_command': best_command.get('type') == 'basic',
+        'source': 'rag'
+    }
+    result = {
+        'code': code,
+        'confidence': best_command['similarity'],
+        'reason': 'RAG 向量检索',
+        'llm_used': False,
+        'is_basic_command': best_command.get('type') == 'basic',
+        'rag_results': [
+            {
+                'command': cmd['command'],
+                'description': cmd['description'],
+                'similarity': cmd['similarity'],
+                'source_type': cmd.get('type', 'unknown'),
+                'namespace': cmd.get('namespace', ''),
+                'score': cmd.get('score', cmd['similarity'])
+            }
+            for cmd in rag_results
+        ]
+    }
+    
+    # 精简响应：去掉重复字段（final_alias 同 alias，外层 is_basic_command 同 code 中的值）和回显的需求
+    if wants_compact(request, data):
+        del code['type'], code['final_alias'], result['is_basic_command']
+        return jsonify({'matched': True, 'result': result})
+
     return jsonify({
         'requirement': requirement,
         'matched': True,
-        'result': {
-            'code': {
-                'id': -1,
-                'type': 'basic_command',
-                'command': best_command['command'],
-                'description': best_command['description'],
-                'alias': best_command['alias'],
-                'final_alias': best_command['alias'],
-                'category': category,
-                'is_basic_command': best_command.get('type') == 'basic',
-                'source': 'rag'
-            },
-            'confidence': best_command['similarity'],
-            'reason': 'RAG 向量检索',
-            'llm_used': False,
-            'is_basic_command': best_command.get('type') == 'basic',
-            'rag_results': [
-                {
-                    'command': cmd['command'],
-                    'description': cmd['description'],
-                    'similarity': cmd['similarity'],
-                    'source_type': cmd.get('type', 'unknown')
-                }
-                for cmd in rag_results
-            ]
-        }
+        'result': result
     })
 
 @app.route('/api/stats', methods=['GET'])
@@ -509,13 +977,41 @@ def get_stats():
     
     return jsonify({
         'total_codes': len(commands),
-        'total_usage': 0,
+        'total_usage': popularity.total_usage,
         'total_commands': len(commands),
-        'embedding_model': EMBEDDING_MODEL,
+        'embedding_model': command_embeddings.model,
+        'index_generation': command_embeddings.generation,
+        'single_flight': command_embeddings.flights.stats(),
+        'shards': command_embeddings.shards.stats(),
+        'admission': query_admission.stats(),
+        'popularity': popularity.stats(),
+        'catalog': catalog.stats(),
+        'namespaces': user_code_store.namespaces(),
         'rag_enabled': True,
-        'file_watcher_enabled': True
+        'file_watcher_enabled': True,
+        'type_counts': {cmd_type: len(rows) for cmd_type, rows in command_embeddings.type_indices.items()}
     })
 
+def _user_codes_changed(namespace: str) -> Optional[Job]:
+    """用户代码有增删：默认命名空间在后台任务中重建共享索引并返回该任务；
+    其他命名空间的分片失效，下次查询时只为变化的代码计算嵌入（返回 None）
+    """
+    if namespace:
+        command_embeddings.shards.invalidate(namespace)
+        return None
+    return submit_rebuild()
+
+def _get_namespaced_code(code_id: str) -> Optional[Dict]:
+    """按代码ID查找当前请求命名空间中的代码，其他命名空间的代码视为不存在
+    
+    Raises:
+        ValueError: 命名空间不合法
+    """
+    row = user_code_store.get(code_id)
+    if row is None or row['namespace'] != request_namespace(request):
+        return None
+    return row
+
 @app.route('/api/user_codes/save', methods=['POST'])
 def save_user_code():
     """保存用户代码"""
@@ -531,33 +1027,22 @@ def save_user_code():
         if not description:
             return jsonify({'success': False, 'message': '功能描述不能为空'}), 400
         
-        # 创建用户代码目录
-        if not os.path.exists(USER_CODES_DIR):
-            os.makedirs(USER_CODES_DIR)
-        
-        # 生成代码ID
-        code_id = str(int(time.time() * 1000) % 1000000).zfill(6)
-        filename = f"code_{code_id}.lsp"
-        
-        # 保存代码文件
-        filepath = os.path.join(USER_CODES_DIR, filename)
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(code)
-        
-        # 更新索引文件
-        created_at = time.strftime('%Y-%m-%d %H:%M:%S')
-        index_line = f"{code_id}|{command_name}|{description}|{filename}|{created_at}\n"
+        try:
+            namespace = request_namespace(request, data)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
-        with open(USER_CODES_FILE, 'a', encoding='utf-8') as f:
-            f.write(index_line)
+        # 代码按内容哈希保存，代码ID由内容生成；重复提交直接返回已有记录
+        record, created = user_code_store.save_code(command_name, description, code, namespace)
         
-        # 重建向量数据库
-        command_embeddings.rebuild()
+        # 更新索引：默认命名空间在后台重建共享索引（返回任务ID），其他命名空间的分片在下次查询时更新
+        job = _user_codes_changed(namespace) if created else None
         
         return jsonify({
             'success': True,
-            'code_id': code_id,
-            'message': '代码保存成功'
+            'code_id': record['id'],
+            'message': '代码保存成功' if created else '相同代码已存在',
+            **_job_fields(job)
         })
     except Exception as e:
         return jsonify({'success': False, 'message': f'保存失败: {e}'}), 500
@@ -608,121 +1093,178 @@ def _extract_code_info(code: str) -> Optional[Dict]:
         print(f"[提取] 错误: {e}")
         return None
 
+@app.route('/api/user_codes/import', methods=['POST'])
+def import_user_codes_bulk():
+    """批量导入用户代码（zip 包或 NDJSON），所有条目在一个事务中保存，结束后只重建一次索引"""
+    try:
+        namespace = request_namespace(request)
+        result = import_user_codes(request, user_code_store, namespace)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'导入失败: {e}'}), 500
+    
+    print(f"[导入] 共 {result['total']} 条: 新增 {result['created']}，已存在 {result['existing']}，失败 {result['failed']}")
+    
+    # 在后台任务中只为新增的代码计算嵌入，其余命令复用当前向量
+    job = _user_codes_changed(namespace) if result['created'] else None
+    
+    return jsonify(dict(result, **_job_fields(job)))
+
 @app.route('/api/user_codes/list', methods=['GET'])
 def list_user_codes():
-    """获取用户代码列表"""
+    """获取用户代码列表（当前命名空间）"""
     try:
-        codes = []
-        if os.path.exists(USER_CODES_FILE):
-            with open(USER_CODES_FILE, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        parts = line.split('|')
-                        if len(parts) >= 4:
-                            codes.append({
-                                'code_id': parts[0],
-                                'command': parts[1],
-                                'description': parts[2],
-                                'filename': parts[3],
-                                'created_at': parts[4]
-                            })
+        namespace = request_namespace(request)
+        codes = [
+            {
+                'code_id': row['id'],
+                'command': row['command'],
+                'description': row['description'],
+                'filename': row['filename'],
+                'created_at': row['created_at']
+            }
+            for row in user_code_store.iter_codes(namespace=namespace)
+        ]
         
         return jsonify({'success': True, 'codes': codes})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': f'获取失败: {e}'}), 500
 
 @app.route('/api/user_codes/get/<code_id>', methods=['GET'])
 def get_user_code(code_id):
-    """获取用户代码内容"""
+    """获取用户代码内容（ETag 为代码ID + 内容哈希）"""
     try:
-        if not os.path.exists(USER_CODES_FILE):
+        row = _get_namespaced_code(code_id)
+        if row is None:
             return jsonify({'success': False, 'message': '代码不存在'}), 404
         
-        with open(USER_CODES_FILE, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    parts = line.split('|')
-                    if len(parts) >= 4 and parts[0] == code_id:
-                        filename = parts[3]
-                        filepath = os.path.join(USER_CODES_DIR, filename)
-                        if os.path.exists(filepath):
-                            with open(filepath, 'r', encoding='utf-8') as f:
-                                code_content = f.read()
-                            return jsonify({
-                                'success': True,
-                                'code': code_content,
-                                'command': parts[1],
-                                'description': parts[2]
-                            })
+        etag = record_etag(row)
+        if etag and request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
         
-        return jsonify({'success': False, 'message': '代码不存在'}), 404
+        code_content = user_code_store.read_code(row)
+        if code_content is None:
+            return jsonify({'success': False, 'message': '代码不存在'}), 404
+        
+        response = jsonify({
+            'success': True,
+            'code': code_content,
+            'command': row['command'],
+            'description': row['description']
+        })
+        if etag:
+            response.set_etag(etag)
+        return response
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': f'获取失败: {e}'}), 500
 
+@app.route('/api/user_codes/raw/<code_id>', methods=['GET'])
+def get_user_code_raw(code_id):
+    """直接返回代码文件（text/plain，ETag 为代码内容哈希，支持 If-None-Match）"""
+    try:
+        row = _get_namespaced_code(code_id)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if row is None or not row['blob']:
+        return jsonify({'success': False, 'message': '代码不存在'}), 404
+    
+    path = user_code_store.blobs.path(row['blob'])
+    if not os.path.exists(path):
+        return jsonify({'success': False, 'message': '代码不存在'}), 404
+    
+    return send_file(os.path.abspath(path), mimetype='text/plain', etag=row['blob'], conditional=True,
+                     download_name=f"{row['command']}.lsp")
+
+@app.route('/api/user_codes/by_command/<path:command>', methods=['GET'])
+def get_user_code_by_command(command):
+    """按命令名获取最新的用户代码（先查当前命名空间，再查共享代码库）
+    
+    ETag 为代码ID + 内容哈希（代码ID随命令名、描述变化），客户端带 If-None-Match 请求时记录未变返回 304。
+    """
+    try:
+        namespace = request_namespace(request)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    row = user_code_store.latest_by_command(command, (namespace, '') if namespace else ('',))
+    if row is None:
+        return jsonify({'success': False, 'message': '未找到命令对应的用户代码'}), 404
+    
+    etag = record_etag(row)
+    if etag and request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
+    code_content = user_code_store.read_code(row)
+    if code_content is None:
+        return jsonify({'success': False, 'message': '代码不存在'}), 404
+    
+    response = jsonify({
+        'success': True,
+        'code_id': row['id'],
+        'command': row['command'],
+        'description': row['description'],
+        'namespace': row['namespace'],
+        'code': code_content
+    })
+    if etag:
+        response.set_etag(etag)
+    return response
+
 @app.route('/api/user_codes/delete/<code_id>', methods=['DELETE'])
 def delete_user_code(code_id):
     """删除用户代码"""
     try:
-        if not os.path.exists(USER_CODES_FILE):
-            return jsonify({'success': False, 'message': '代码不存在'}), 404
-        
-        lines = []
-        deleted = False
-        filename_to_delete = ''
-        
-        with open(USER_CODES_FILE, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    parts = line.split('|')
-                    if len(parts) >= 4 and parts[0] == code_id:
-                        filename_to_delete = parts[3]
-                        deleted = True
-                    else:
-                        lines.append(line)
-                else:
-                    lines.append(line)
-        
-        if not deleted:
+        try:
+            if _get_namespaced_code(code_id) is None:
+                return jsonify({'success': False, 'message': '代码不存在'}), 404
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        row = user_code_store.delete(code_id)
+        if row is None:
             return jsonify({'success': False, 'message': '代码不存在'}), 404
         
-        # 删除代码文件
-        if filename_to_delete:
-            filepath = os.path.join(USER_CODES_DIR, filename_to_delete)
+        # 删除旧版代码文件（内容存储中的文件由 delete 在无引用时删除）
+        if row['filename']:
+            filepath = os.path.join(USER_CODES_DIR, row['filename'])
             if os.path.exists(filepath):
                 os.remove(filepath)
         
-        # 更新索引文件
-        with open(USER_CODES_FILE, 'w', encoding='utf-8') as f:
-            f.writelines(lines)
-        
-        # 重建向量数据库
-        command_embeddings.rebuild()
+        # 更新索引（默认命名空间在后台重建）
+        job = _user_codes_changed(row['namespace'])
         
-        return jsonify({'success': True, 'message': '代码删除成功'})
+        return jsonify({'success': True, 'message': '代码删除成功', **_job_fields(job)})
     except Exception as e:
         return jsonify({'success': False, 'message': f'删除失败: {e}'}), 500
 
 @app.route('/api/codes', methods=['GET'])
 def list_codes():
-    """列出所有基本命令"""
+    """列出所有基本命令（支持 cursor/limit 分页和 format=ndjson 流式输出）"""
     commands = command_embeddings.get_all_commands()
     
-    codes = []
-    for cmd in commands:
-        code = {
-            'id': -1,
-            'type': 'basic_command',
-            'command': cmd['command'],
-            'description': cmd['description'],
-            'category': '基本命令',
-            'is_basic_command': True
-        }
-        codes.append(code)
+    def rows(start: int, stop: int):
+        for i in range(start, stop):
+            yield {
+                'id': -1,  # 与分页前一致，基本命令不返回行号
+                'type': 'basic_command',
+                'command': commands.commands[i],
+                'description': commands.descriptions[i],
+                'category': '基本命令',
+                'is_basic_command': True
+            }
     
-    return jsonify({'codes': codes})
+    try:
+        return list_response(request, 'codes', len(commands), rows)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 @app.route('/api/codes/<int:code_id>', methods=['GET'])
 def get_code(code_id):
@@ -755,12 +1297,165 @@ def add_code():
         'error': '暂不支持添加新命令，请编辑 autocad_basic_commands.txt 文件'
     }), 400
 
+def _catalog_entry(commands: CommandTable, row: int, eid: str, vector, namespace: str = '') -> Dict:
+    """目录条目：命令字段 + 条目ID + base64 编码的向量"""
+    entry = commands.row(row)
+    entry['id'] = eid
+    entry['namespace'] = namespace
+    entry['vector'] = encode_vector(vector)
+    return entry
+
+def _namespace_catalog(namespace: str, model: str) -> Optional[List[Dict]]:
+    """命名空间分片的全部条目，分片加载失败时返回 None"""
+    try:
+        shard = command_embeddings.shards.get(namespace)
+    except Exception as e:
+        print(f"[目录] 命名空间 {namespace} 的分片加载失败: {e}")
+        return None
+    if shard.embeddings is None or shard.model != model:
+        return [] if shard.embeddings is None else None
+    ids = table_entry_ids(shard.commands)
+    return [_catalog_entry(shard.commands, i, ids[i], shard.embeddings[i], namespace) for i in range(len(ids))]
+
+@app.route('/api/catalog/delta', methods=['GET'])
+def catalog_delta():
+    """命令目录和向量的增量同步
+    
+    ?since= 为客户端上次同步到的目录版本（0 或省略表示全量），?namespace_version= 为上次同步到的
+    命名空间用户代码版本。返回此后新增的条目（含向量）和删除的条目ID；since 早于变更日志起点
+    或嵌入模型已变化时返回全量（full 为 true，客户端替换整个镜像）。
+    命名空间的用户代码版本变化时 namespace_entries 为该命名空间的全部条目，未变化时不返回。
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        namespace = request_namespace(request)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    commands, embeddings, model, entry_ids, version = command_embeddings.catalog_snapshot()
+    if embeddings is None or len(embeddings) != len(commands):
+        return jsonify({'error': '索引尚未就绪'}), 503
+    
+    changes = catalog.changes(since, version) if since else None
+    if changes is None:
+        rows = range(len(commands))
+        removed = set()
+    else:
+        added, removed = changes
+        rows = [i for i, eid in enumerate(entry_ids) if eid in added]
+    
+    result = {
+        'model': model,
+        'version': version,
+        'full': changes is None,
+        'added': [_catalog_entry(commands, i, entry_ids[i], embeddings[i]) for i in rows],
+        'removed': sorted(removed)
+    }
+    if namespace:
+        namespace_version = user_code_store.version(namespace)
+        if request.args.get('namespace_version') != str(namespace_version):
+            entries = _namespace_catalog(namespace, model)
+            if entries is not None:
+                result['namespace_entries'] = entries
+                result['namespace_version'] = namespace_version
+        else:
+            result['namespace_version'] = namespace_version
+        result['namespace'] = namespace
+    print(f"[目录] 同步 {since} -> {version}: {'全量' if changes is None else '增量'} "
+          f"{len(result['added'])} 条，删除 {len(removed)} 条")
+    return jsonify(result)
+
+def _feedback_target(data: dict, namespace: str) -> Optional[Dict]:
+    """反馈对应的命令：优先使用 command 字段，其次按 code_id 查找用户代码
+    
+    返回 {'command', 'namespace'}；当前命名空间中有同名用户代码时计入该命名空间，否则计入共享命令。
+    """
+    command = str(data.get('command') or '').strip()
+    if command:
+        if namespace and user_code_store.find_by_command(command, namespace):
+            return {'command': command, 'namespace': namespace}
+        return {'command': command, 'namespace': ''}
+    
+    code_id = data.get('code_id')
+    if code_id is None or str(code_id) == '-1':
+        return None
+    row = user_code_store.get(str(code_id))
+    if row is None or row['namespace'] not in ('', namespace):
+        return None
+    return {'command': row['command'], 'namespace': row['namespace']}
+
+@app.route('/api/feedback', methods=['POST'])
+def submit_feedback():
+    """记录用户对匹配结果的反馈（成功/失败），计入命令的成功率"""
+    data = request.get_json(silent=True) or {}
+    success = data.get('success')
+    if not isinstance(success, bool):
+        return jsonify({'success': False, 'error': 'success 必须是 true 或 false'}), 400
+    
+    try:
+        namespace = request_namespace(request, data)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    target = _feedback_target(data, namespace)
+    if target is None:
+        return jsonify({'success': False, 'error': '缺少 command，或 code_id 对应的代码不存在'}), 400
+    
+    counts = popularity.record_feedback(target['command'], success, data.get('requirement', ''),
+                                        data.get('feedback'), target['namespace'])
+    print(f"[反馈] {target['command']}: {'成功' if success else '失败'}")
+    return jsonify({
+        'success': True,
+        'command': counts['command'],
+        'namespace': counts['namespace'],
+        'usage_count': counts['usage_count'],
+        'success_count': counts['success_count'],
+        'failure_count': counts['failure_count'],
+        'success_rate': counts['success_rate']
+    })
+
+@app.route('/api/popular', methods=['GET'])
+@app.route('/api/popular_codes', methods=['GET'])
+def popular_codes():
+    """热门命令（使用次数和成功率），从预先排好的列表中截取
+    
+    参数: limit（默认 10）、keyword（按命令名和描述过滤）、category（命令类型）
+    """
+    try:
+        limit = int(request.args.get('limit', 10))
+        categories = parse_command_types(request.args.get('category'), USER_CODE_TYPE)
+        namespace = request_namespace(request)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if categories and len(categories) > 1:
+        return jsonify({'success': False, 'error': 'category 只能指定一个类型'}), 400
+    
+    codes = popularity.top(max(limit, 0), categories[0] if categories else None, namespace,
+                           request.args.get('keyword', ''))
+    return jsonify({
+        'success': True,
+        'codes': [
+            {
+                'command': entry['command'],
+                'description': entry['description'],
+                'type': entry['type'],
+                'namespace': entry['namespace'],
+                'usage_count': entry['usage_count'],
+                'success_count': entry['success_count'],
+                'failure_count': entry['failure_count'],
+                'success_rate': entry['success_rate']
+            }
+            for entry in codes
+        ],
+        'total': len(codes)
+    })
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查"""
     return jsonify({
         'status': 'ok',
-        'embedding_model': EMBEDDING_MODEL,
+        'embedding_model': command_embeddings.model,
         'rag_enabled': True,
         'file_watcher_enabled': True
     })
@@ -775,19 +1470,71 @@ def health_check_simple():
 
 @app.route('/api/rebuild_embeddings', methods=['POST'])
 def rebuild_embeddings():
-    """手动重建嵌入缓存"""
+    """手动重建嵌入缓存：提交后台任务后立即返回任务ID，通过 /api/jobs/<job_id> 查询进度"""
     try:
-        command_embeddings.rebuild()
-        
-        return jsonify({
-            'success': True,
-            'message': '嵌入缓存重建成功'
-        })
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        job = jobs.submit('rebuild', _run_rebuild)
+    except JobConflict as e:
+        return jsonify({'success': False, 'error': str(e), 'job': e.job.to_dict()}), 409
+    
+    return jsonify({
+        'success': True,
+        'message': '已开始重建嵌入缓存',
+        'job_id': job.id,
+        'status_url': f'/api/jobs/{job.id}'
+    }), 202
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """最近的后台任务"""
+    return jsonify({'jobs': [job.to_dict() for job in jobs.list(request.args.get('kind'))]})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """任务状态和进度（已嵌入条数、预计剩余时间、错误）"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """取消任务：重建在处理下一条命令前停止，继续使用当前索引版本"""
+    try:
+        job = jobs.cancel(job_id)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e), 'job': jobs.get(job_id).to_dict()}), 409
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()}), 202
+
+@app.route('/api/index/status', methods=['GET'])
+def index_status():
+    """索引版本与模型迁移状态"""
+    return jsonify(command_embeddings.index_status())
+
+@app.route('/api/index/migrate', methods=['POST'])
+def migrate_index():
+    """在后台迁移到新的嵌入模型（建库、评测、切换），迁移期间继续使用当前版本"""
+    data = request.get_json(silent=True) or {}
+    model = data.get('model') or EMBEDDING_MODEL
+    force = bool(data.get('force', False))
+    
+    if command_embeddings.migration.get('status') in ('building', 'evaluating'):
+        return jsonify({'success': False, 'error': '已有迁移正在进行', 'migration': command_embeddings.migration}), 409
+    if model == command_embeddings.model and not force:
+        return jsonify({'success': False, 'error': f'当前已在使用模型 {model}'}), 400
+    
+    threading.Thread(target=command_embeddings.migrate, args=(model, force), daemon=True).start()
+    return jsonify({'success': True, 'message': f'已开始迁移到 {model}'}), 202
+
+@app.route('/api/index/rollback', methods=['POST'])
+def rollback_index():
+    """回滚到上一索引版本"""
+    try:
+        generation = command_embeddings.rollback()
+        return jsonify({'success': True, 'generation': generation, 'embedding_model': command_embeddings.model})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
 if __name__ == '__main__':
     print("=" * 60)
@@ -797,8 +1544,8 @@ if __name__ == '__main__':
     print(f"嵌入模型: {EMBEDDING_MODEL}")
     print(f"基本命令库: {BASIC_COMMANDS_FILE}")
     print(f"LISP命令库: {LISP_COMMANDS_FILE}")
-    print(f"用户代码库: {USER_CODES_FILE}")
-    print(f"嵌入缓存: {EMBEDDINGS_CACHE_FILE}")
+    print(f"用户代码库: {USER_CODES_DB}")
+    print(f"索引目录: {INDEX_DIR}")
     print(f"文件监控: 已启用")
     print("")
     
@@ -807,13 +1554,6 @@ if __name__ == '__main__':
         os.makedirs(USER_CODES_DIR)
         print(f"[初始化] 创建用户代码目录: {USER_CODES_DIR}")
     
-    # 确保用户代码索引文件存在
-    if not os.path.exists(USER_CODES_FILE):
-        with open(USER_CODES_FILE, 'w', encoding='utf-8') as f:
-            f.write("# 用户代码索引\n")
-            f.write("# 格式: 代码ID|命令名称|描述|文件名|创建时间\n")
-        print(f"[初始化] 创建用户代码索引文件: {USER_CODES_FILE}")
-    
     # 检查嵌入模型
     print("检查嵌入模型...")
     try:
@@ -859,3 +1599,5 @@ if __name__ == '__main__':
     finally:
         # 确保停止文件监控
         command_embeddings.stop_file_watcher()
+        popularity.close()
+        catalog.close()
@@ -0,0 +1,4 @@
+"""
+CADChat 服务端公共模块
+本地 Ollama 服务端（server/）与阿里云百炼服务端（aliserver/）共用的代码
+"""
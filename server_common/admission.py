@@ -0,0 +1,148 @@
+"""
+CADChat 查询接口的准入控制（两个服务端共用）
+限制同时处理的查询数，超出的请求有限排队；队列已满或排队超时时返回 429 和 Retry-After。
+每个请求带一个截止时间，传到嵌入调用中，调用方已经放弃的请求不再计算。
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Optional
+
+from flask import g, jsonify, request
+
+from server_common.responses import record_timing
+
+DEADLINE_HEADER = 'X-Request-Timeout'  # 客户端的等待时间（秒）
+
+
+class Overloaded(Exception):
+    """服务繁忙，请求未被接纳"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """请求在截止时间前未完成"""
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """距截止时间（time.monotonic）的剩余秒数，没有截止时间时返回 None"""
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def request_deadline(req, default_seconds: float) -> float:
+    """请求的截止时间：客户端声明的等待时间与服务端上限中较短的一个"""
+    seconds = default_seconds
+    value = req.headers.get(DEADLINE_HEADER)
+    if value:
+        try:
+            seconds = min(seconds, max(float(value), 0.0))
+        except ValueError:
+            pass
+    return time.monotonic() + seconds
+
+
+class AdmissionController:
+    """并发上限 + 有界等待队列"""
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_wait: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._avg_service = 0.5  # 平均处理时间（秒，指数滑动平均），用于估算 Retry-After
+
+    def retry_after(self) -> int:
+        """按排队长度和平均处理时间估算客户端应等待的秒数"""
+        backlog = self.waiting + self.active
+        return max(1, int(round(backlog / max(self.max_concurrent, 1) * self._avg_service)))
+
+    @contextmanager
+    def admit(self, deadline: Optional[float] = None):
+        """占用一个处理名额，必要时排队等待
+
+        Raises:
+            Overloaded: 队列已满，或排队超过 max_wait / 截止时间
+        """
+        with self._cond:
+            if self.active >= self.max_concurrent:
+                if self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise Overloaded('服务繁忙，排队已满', self.retry_after())
+                wait_until = time.monotonic() + self.max_wait
+                if deadline is not None:
+                    wait_until = min(wait_until, deadline)
+                self.waiting += 1
+                try:
+                    while self.active >= self.max_concurrent:
+                        timeout = wait_until - time.monotonic()
+                        if timeout <= 0:
+                            self.timed_out += 1
+                            raise Overloaded('服务繁忙，排队超时', self.retry_after())
+                        self._cond.wait(timeout)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._avg_service = 0.8 * self._avg_service + 0.2 * (time.monotonic() - started)
+                self._cond.notify()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'avg_service_ms': round(self._avg_service * 1000, 1)
+            }
+
+
+def admission_required(controller: AdmissionController, deadline_seconds: float):
+    """路由装饰器：请求经准入控制后处理，截止时间放在 g.deadline
+
+    未被接纳时返回 429（带 Retry-After），处理中超过截止时间（DeadlineExceeded）时返回 504。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.deadline = request_deadline(request, deadline_seconds)
+            queued_at = time.perf_counter()
+            try:
+                with controller.admit(g.deadline):
+                    record_timing('queue', (time.perf_counter() - queued_at) * 1000)
+                    return view(*args, **kwargs)
+            except Overloaded as e:
+                response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response
+            except DeadlineExceeded:
+                return jsonify({'error': '请求超时'}), 504
+        return wrapper
+    return decorator
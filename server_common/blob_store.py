@@ -0,0 +1,71 @@
+"""
+CADChat LISP 代码内容存储（两个服务端共用）
+代码按内容的 SHA-256 保存在分片目录中，相同的代码只保存一份；哈希值同时作为强 ETag。
+"""
+
+import os
+import re
+import hashlib
+import tempfile
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobStore:
+    """按内容寻址的文件存储
+
+    目录结构: <root>/<哈希前2位>/<哈希3-4位>/<哈希>.lsp
+    """
+
+    def __init__(self, root: str, suffix: str = '.lsp'):
+        self.root = root
+        self.suffix = suffix
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def path(self, digest: str) -> str:
+        """内容哈希对应的文件路径
+
+        Raises:
+            ValueError: 不是合法的 SHA-256 十六进制串
+        """
+        if not _DIGEST_RE.match(digest or ''):
+            raise ValueError(f"无效的内容哈希: {digest}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest + self.suffix)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def put(self, text: str) -> str:
+        """保存代码内容，返回内容哈希；内容已存在时不重复写入"""
+        data = text.encode('utf-8')
+        digest = self.digest(data)
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+
+        # 先写临时文件再改名，读取方不会看到写了一半的文件
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest
+
+    def read(self, digest: str) -> str:
+        with open(self.path(digest), 'r', encoding='utf-8', newline='') as f:
+            return f.read()
+
+    def remove(self, digest: str):
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.remove(path)
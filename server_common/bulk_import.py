@@ -0,0 +1,177 @@
+"""
+CADChat 用户代码批量导入（两个服务端共用）
+解析 zip 包或 NDJSON 流中的代码条目，逐条校验后交给 UserCodeStore 在一个事务中保存
+"""
+
+import io
+import os
+import re
+import json
+import zipfile
+from typing import Dict, Iterator, Optional
+
+MAX_IMPORT_ITEMS = 10000
+MAX_CODE_BYTES = 1024 * 1024
+MAX_COMMAND_LENGTH = 128
+
+ZIP_MIMETYPES = ('application/zip', 'application/x-zip-compressed')
+LISP_SUFFIXES = ('.lsp', '.lisp')
+NDJSON_SUFFIXES = ('.ndjson', '.jsonl')
+
+_DEFUN_RE = re.compile(r'\(defun\s+c:([\w\-]+)', re.IGNORECASE)
+_DEFUN_ANY_RE = re.compile(r'\(defun\s+([\w\-]+)', re.IGNORECASE)
+
+
+def extract_lisp_info(code: str) -> Optional[Dict]:
+    """从 LISP 代码中提取命令名（第一个 defun c:XXX）和描述（第一行 ; 注释）"""
+    match = _DEFUN_RE.search(code) or _DEFUN_ANY_RE.search(code)
+    if not match:
+        return None
+    command = match.group(1)
+    description = ''
+    for line in code.splitlines():
+        line = line.strip()
+        if line.startswith(';'):
+            description = line.lstrip(';').strip()
+            if description:
+                break
+        elif line:
+            break
+    return {'command': command, 'description': description or f"用户自定义命令: {command}"}
+
+
+def validate_item(item) -> Dict:
+    """校验一个导入条目，返回规范化后的 {code, command, description}
+
+    Raises:
+        ValueError: 条目无效
+    """
+    if not isinstance(item, dict):
+        raise ValueError('条目必须是 JSON 对象')
+    code = item.get('code')
+    if not isinstance(code, str) or not code.strip():
+        raise ValueError('代码不能为空')
+    if len(code.encode('utf-8')) > MAX_CODE_BYTES:
+        raise ValueError(f'代码超过 {MAX_CODE_BYTES // 1024} KB')
+
+    command = item.get('command')
+    description = item.get('description')
+    if not command or not description:
+        info = extract_lisp_info(code)
+        if info is None and not command:
+            raise ValueError('缺少命令名称，且无法从代码中提取')
+        command = command or info['command']
+        description = description or (info['description'] if info else '')
+    if not isinstance(command, str) or not isinstance(description, str):
+        raise ValueError('命令名称和描述必须是字符串')
+    command = command.strip()
+    description = description.strip()
+    if not command or len(command) > MAX_COMMAND_LENGTH:
+        raise ValueError(f'命令名称不能为空且不超过 {MAX_COMMAND_LENGTH} 个字符')
+    if not description:
+        raise ValueError('功能描述不能为空')
+    return {'code': code, 'command': command, 'description': description}
+
+
+def read_import_items(req) -> Iterator[Dict]:
+    """从请求中读取导入条目
+
+    支持三种上传方式：multipart 表单的 file 字段（.zip 或 .ndjson）、
+    Content-Type 为 application/zip 的请求体、Content-Type 为 application/x-ndjson 的请求体（按行流式读取）。
+    zip 包中的 .lsp 文件从代码中提取命令名和描述，.ndjson/.jsonl 文件按行读取。
+
+    每个条目为 {'source': 来源, 'item': 原始条目} 或 {'source': 来源, 'error': 错误信息}。
+
+    Raises:
+        ValueError: 上传格式无法识别或条目数超过上限
+    """
+    upload = req.files.get('file')
+    if upload is not None:
+        name = upload.filename or ''
+        if name.lower().endswith('.zip') or upload.mimetype in ZIP_MIMETYPES:
+            items = _read_zip(upload.stream.read())
+        else:
+            items = _read_ndjson(upload.stream, name or 'file')
+    elif req.mimetype in ZIP_MIMETYPES:
+        items = _read_zip(req.get_data())
+    elif req.mimetype in ('application/x-ndjson', 'application/jsonl', 'application/json-lines'):
+        items = _read_ndjson(req.stream, 'body')
+    else:
+        raise ValueError('请上传 zip 包或 NDJSON（application/x-ndjson）')
+
+    for count, entry in enumerate(items, 1):
+        if count > MAX_IMPORT_ITEMS:
+            raise ValueError(f'单次最多导入 {MAX_IMPORT_ITEMS} 条')
+        yield entry
+
+
+def _read_ndjson(stream, source: str) -> Iterator[Dict]:
+    for line_no, line in enumerate(stream, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8-sig' if line_no == 1 else 'utf-8', errors='replace')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield {'source': f'{source}:{line_no}', 'item': json.loads(line)}
+        except ValueError as e:
+            yield {'source': f'{source}:{line_no}', 'error': f'JSON 解析失败: {e}'}
+
+
+def _read_zip(data: bytes) -> Iterator[Dict]:
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise ValueError('无效的 zip 文件')
+    with archive:
+        for info in archive.infolist():
+            name = info.filename
+            lower = name.lower()
+            if info.is_dir() or os.path.basename(name).startswith('.'):
+                continue
+            if info.file_size > MAX_CODE_BYTES and not lower.endswith(NDJSON_SUFFIXES):
+                yield {'source': name, 'error': f'文件超过 {MAX_CODE_BYTES // 1024} KB'}
+                continue
+            if lower.endswith(NDJSON_SUFFIXES):
+                with archive.open(info) as f:
+                    yield from _read_ndjson(f, name)
+            elif lower.endswith(LISP_SUFFIXES):
+                raw = archive.read(info)
+                try:
+                    code = raw.decode('utf-8-sig')
+                except UnicodeDecodeError:
+                    code = raw.decode('gbk', errors='replace')  # AutoCAD 常见的本地编码
+                yield {'source': name, 'item': {'code': code}}
+
+
+def import_user_codes(req, store, namespace: str = '') -> Dict:
+    """解析、校验并在一个事务中把导入的代码保存到指定命名空间，返回逐条结果
+
+    Raises:
+        ValueError: 上传格式无法识别
+    """
+    results = []
+    valid = []
+    for entry in read_import_items(req):
+        result = {'index': len(results), 'source': entry['source']}
+        results.append(result)
+        if 'error' in entry:
+            result.update(status='error', error=entry['error'])
+            continue
+        try:
+            valid.append((result, validate_item(entry['item'])))
+        except ValueError as e:
+            result.update(status='error', error=str(e))
+
+    saved = store.save_codes([item for _, item in valid], namespace) if valid else []
+    for (result, item), (record, created) in zip(valid, saved):
+        result.update(status='created' if created else 'exists', code_id=record['id'], command=item['command'])
+
+    return {
+        'success': True,
+        'total': len(results),
+        'created': sum(1 for r in results if r['status'] == 'created'),
+        'existing': sum(1 for r in results if r['status'] == 'exists'),
+        'failed': sum(1 for r in results if r['status'] == 'error'),
+        'items': results
+    }
@@ -0,0 +1,161 @@
+"""
+CADChat 命令目录变更日志（增量同步用）
+客户端在本地镜像命令目录和向量。每个条目以内容哈希为ID；共享索引每次切换版本时，
+与上一版本的条目集合比较，把新增和删除的条目按递增序号记入日志，
+客户端带上次同步到的序号即可只取此后的变化。嵌入模型变化或日志已截断时客户端需全量同步。
+"""
+
+import os
+import base64
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from server_common.command_loader import CommandTable
+
+DEFAULT_MAX_LOG_ROWS = 200000
+
+
+def entry_id(cmd_type: str, command: str, description: str, alias: str = '', code_id: str = '') -> str:
+    """目录条目的ID：条目内容（决定嵌入文本）不变时ID不变"""
+    digest = hashlib.sha1('\0'.join((cmd_type, command, description, alias, code_id)).encode('utf-8'))
+    return digest.hexdigest()[:20]
+
+
+def table_entry_ids(commands: CommandTable) -> List[str]:
+    """命令表每一行的条目ID"""
+    return [entry_id(commands.types[i], commands.commands[i], commands.descriptions[i], commands.aliases[i],
+                     commands.code_ids[i])
+            for i in range(len(commands))]
+
+
+def encode_vector(vector) -> str:
+    """向量按 float32 小端序编码为 base64（比 JSON 数组小约一半，解码无需逐个解析数字）"""
+    try:
+        import numpy as np
+        data = np.asarray(vector, dtype='<f4').tobytes()
+    except ImportError:
+        import array
+        data = array.array('f', vector).tobytes()
+    return base64.b64encode(data).decode('ascii')
+
+
+class CatalogLog:
+    """共享索引的条目变更日志
+
+    catalog_entries 保存最近一次记录的条目集合，catalog_log 保存 (序号, 条目ID, 操作)，
+    操作为 + 新增、- 删除、* 模型变化的重置标记；
+    日志超过 max_rows 行时删除最早的部分，早于 floor 的序号只能全量同步。
+    """
+
+    def __init__(self, db_path: str, max_rows: int = DEFAULT_MAX_LOG_ROWS):
+        self.db_path = db_path
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS catalog_entries (
+                entry_id TEXT PRIMARY KEY
+            );
+            CREATE TABLE IF NOT EXISTS catalog_log (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                entry_id TEXT NOT NULL,
+                op TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS catalog_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        ''')
+        self._db.commit()
+
+    def _meta(self, key: str, default: str = '') -> str:
+        row = self._db.execute('SELECT value FROM catalog_meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key: str, value):
+        self._db.execute('INSERT OR REPLACE INTO catalog_meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def _last_seq(self) -> int:
+        row = self._db.execute('SELECT MAX(seq) FROM catalog_log').fetchone()
+        return row[0] or 0
+
+    @property
+    def model(self) -> str:
+        with self._lock:
+            return self._meta('model')
+
+    def version(self) -> int:
+        """当前序号"""
+        with self._lock:
+            return self._last_seq()
+
+    def record(self, model: str, entry_ids: Sequence[str]) -> int:
+        """记录共享索引的新条目集合，返回记录后的序号
+
+        模型变化时清空日志（向量不可比较）并写入重置标记，此前同步过的客户端必须全量同步。
+        """
+        current = set(entry_ids)
+        with self._lock, self._db:
+            previous = {row[0] for row in self._db.execute('SELECT entry_id FROM catalog_entries')}
+            if self._meta('model') != model:
+                self._db.execute('DELETE FROM catalog_log')
+                self._db.execute('DELETE FROM catalog_entries')
+                self._db.executemany('INSERT INTO catalog_entries (entry_id) VALUES (?)', ((e,) for e in current))
+                # 写一条重置标记占用一个序号：已同步过的客户端的序号都小于它，之后的变化序号都大于它
+                floor = self._db.execute("INSERT INTO catalog_log (entry_id, op) VALUES ('', '*')").lastrowid
+                self._set_meta('floor', floor)
+                self._set_meta('model', model)
+                return floor
+
+            added = current - previous
+            removed = previous - current
+            if added or removed:
+                self._db.executemany('INSERT INTO catalog_log (entry_id, op) VALUES (?, ?)',
+                                     [(e, '-') for e in removed] + [(e, '+') for e in added])
+                self._db.executemany('DELETE FROM catalog_entries WHERE entry_id = ?', ((e,) for e in removed))
+                self._db.executemany('INSERT INTO catalog_entries (entry_id) VALUES (?)', ((e,) for e in added))
+                self._truncate()
+            return self._last_seq()
+
+    def _truncate(self):
+        count = self._db.execute('SELECT COUNT(*) FROM catalog_log').fetchone()[0]
+        if count > self.max_rows:
+            cutoff = self._db.execute('SELECT seq FROM catalog_log ORDER BY seq LIMIT 1 OFFSET ?',
+                                      (count - self.max_rows,)).fetchone()[0]
+            self._db.execute('DELETE FROM catalog_log WHERE seq < ?', (cutoff,))
+            self._set_meta('floor', cutoff - 1)
+
+    def changes(self, since: int, until: int) -> Optional[Tuple[Set[str], Set[str]]]:
+        """序号 (since, until] 之间的净变化 (新增ID, 删除ID)；since 早于日志起点时返回 None（需全量同步）"""
+        with self._lock:
+            if since < int(self._meta('floor', '0')) or since > until:
+                return None
+            added, removed = set(), set()
+            for eid, op in self._db.execute('SELECT entry_id, op FROM catalog_log WHERE seq > ? AND seq <= ? '
+                                            'ORDER BY seq', (since, until)):
+                if op == '+':
+                    added.add(eid)
+                    removed.discard(eid)
+                elif op == '-':
+                    removed.add(eid)
+                    added.discard(eid)
+            return added, removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'version': self._last_seq(),
+                'floor': int(self._meta('floor', '0')),
+                'model': self._meta('model'),
+                'entries': self._db.execute('SELECT COUNT(*) FROM catalog_entries').fetchone()[0],
+                'log_rows': self._db.execute('SELECT COUNT(*) FROM catalog_log').fetchone()[0]
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,275 @@
+"""
+CADChat 命令库加载器（两个服务端共用）
+将竖线分隔的命令库文件解析为按列存储的命令表，避免每行一个字典带来的内存开销
+"""
+
+import os
+import sys
+import bisect
+from itertools import islice, repeat
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 文件布局
+LIBRARY_LAYOUT = 'library'        # 命令名|描述|别名|文件名|时间戳|命令类型（允许省略部分字段）
+USER_CODES_LAYOUT = 'user_codes'  # 代码ID|命令名称|描述|文件名|创建时间
+
+# 可识别的命令类型，用于判断4字段行的最后一列是否为类型
+KNOWN_TYPES = frozenset(('basic', 'lisp', 'user_program', 'user_code'))
+
+# 每次读取的块大小（字符）
+_CHUNK_CHARS = 4 * 1024 * 1024
+
+_intern = sys.intern
+
+
+class CommandTable:
+    """按列存储的命令表
+
+    每一列是一个列表，第 i 行的各字段分别位于各列表的第 i 个位置。
+    低基数字段（类型、文件名、时间戳）使用驻留字符串，多行共享同一对象；
+    来源文件按行区间记录。
+    """
+
+    __slots__ = ('commands', 'descriptions', 'aliases', 'filenames', 'timestamps',
+                 'types', 'code_ids', 'sources')
+
+    def __init__(self):
+        self.commands: List[str] = []
+        self.descriptions: List[str] = []
+        self.aliases: List[str] = []
+        self.filenames: List[str] = []
+        self.timestamps: List[str] = []
+        self.types: List[str] = []
+        self.code_ids: List[str] = []
+        self.sources: List[Tuple[int, str]] = []  # (起始行号, 来源文件)，按起始行号递增
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def __getitem__(self, i: int) -> Dict:
+        return self.row(i)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self.commands)):
+            yield self.row(i)
+
+    def row(self, i: int) -> Dict:
+        """按需构造第 i 行的字典表示"""
+        row = {
+            'command': self.commands[i],
+            'description': self.descriptions[i],
+            'alias': self.aliases[i],
+            'filename': self.filenames[i],
+            'timestamp': self.timestamps[i],
+            'type': self.types[i]
+        }
+        if self.code_ids[i]:
+            row['code_id'] = self.code_ids[i]
+        return row
+
+    def source_file(self, i: int) -> str:
+        """第 i 行所在的命令库文件"""
+        pos = bisect.bisect_right(self.sources, (i, '\uffff')) - 1
+        return self.sources[pos][1] if pos >= 0 else ''
+
+    def text(self, i: int) -> str:
+        """第 i 行用于计算嵌入的文本（按需拼接，不常驻内存）"""
+        alias = self.aliases[i]
+        text = f"{self.descriptions[i]} {self.commands[i]}"
+        return f"{text} {alias}" if alias else text
+
+    def type_rows(self) -> Dict[str, List[int]]:
+        """命令类型 -> 行号列表"""
+        grouped = {}
+        for i, cmd_type in enumerate(self.types):
+            rows = grouped.get(cmd_type)
+            if rows is None:
+                rows = grouped[cmd_type] = []
+            rows.append(i)
+        return grouped
+
+    def count_by_type(self) -> Dict[str, int]:
+        """各命令类型的数量"""
+        return {cmd_type: len(rows) for cmd_type, rows in self.type_rows().items()}
+
+
+def _canonical_library_row(parts: List[str]) -> List[str]:
+    """把不同字段数的命令库行规范为 [命令名, 描述, 别名, 文件名, 时间戳, 命令类型]"""
+    n = len(parts)
+    if n >= 6:
+        # 命令名|描述|别名|文件名|时间戳|命令类型（多余字段忽略，类型取最后一列）
+        return [parts[0], parts[1], parts[2], parts[3], parts[4], parts[-1]]
+    if n == 5:
+        # 命令名|描述|文件名|时间戳|命令类型
+        return [parts[0], parts[1], '', parts[2], parts[3], parts[4]]
+    if n == 4:
+        if parts[3].strip().lower() in KNOWN_TYPES:
+            # 命令名|描述|别名|命令类型
+            return [parts[0], parts[1], parts[2], '', '', parts[3]]
+        # 命令名|描述|文件名|时间戳
+        return [parts[0], parts[1], '', parts[2], parts[3], '']
+    if n == 3:
+        return [parts[0], parts[1], '', parts[2], '', '']
+    return [parts[0], parts[1], '', '', '', '']
+
+
+def load_command_file(path: str, table: Optional[CommandTable] = None,
+                      layout: str = LIBRARY_LAYOUT, default_type: str = 'basic') -> CommandTable:
+    """加载一个命令库文件并追加到命令表
+
+    按块读取文件。块内各行字段数一致时（命令库的常见情况）整块一次拆分，
+    再用切片取出各列，不执行逐行的 Python 代码。
+
+    Args:
+        path: 命令库文件路径，不存在时直接返回
+        table: 追加到的命令表，为空时新建
+        layout: 文件布局，LIBRARY_LAYOUT 或 USER_CODES_LAYOUT
+        default_type: 行中没有类型字段时使用的命令类型
+
+    Returns:
+        命令表
+    """
+    if table is None:
+        table = CommandTable()
+
+    if not os.path.exists(path):
+        return table
+
+    # 低基数字段：原始值 -> 规范化后的驻留字符串
+    shared = {}
+    types = {}
+    default_type = _intern(default_type)
+    start_row = len(table.commands)
+    user_codes = layout == USER_CODES_LAYOUT
+
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        for text in _read_text_blocks(f):
+
+            columns = _split_columns(text, user_codes)
+            if columns is None:
+                continue
+            commands = columns[0]
+            descriptions = columns[1]
+
+            # 丢弃命令名或描述为空的行（少见，只在出现时逐行过滤）
+            if '' in commands or '' in descriptions:
+                keep = [i for i in range(len(commands)) if commands[i] and descriptions[i]]
+                columns = [[column[i] for i in keep] for column in columns]
+                commands = [commands[i] for i in keep]
+                descriptions = [descriptions[i] for i in keep]
+
+            table.commands.extend(commands)
+            table.descriptions.extend(descriptions)
+            table.aliases.extend(columns[2])
+
+            for column, target in ((columns[3], table.filenames), (columns[4], table.timestamps)):
+                for value in set(column).difference(shared):
+                    shared[value] = _intern(value.strip())
+                target.extend(map(shared.__getitem__, column))
+
+            for value in set(columns[5]).difference(types):
+                types[value] = _intern(value.strip().lower()) or default_type
+            table.types.extend(map(types.__getitem__, columns[5]))
+
+            if user_codes:
+                table.code_ids.extend(columns[6])
+            else:
+                table.code_ids.extend([''] * len(commands))
+
+    if len(table.commands) > start_row:
+        table.sources.append((start_row, _intern(path)))
+    return table
+
+
+def _read_text_blocks(f) -> Iterator[str]:
+    """按块读取文件，产出以完整行结束、已去掉空行和注释行的文本块（块内以换行分隔，末尾不带换行）"""
+    remainder = ''
+    while True:
+        chunk = f.read(_CHUNK_CHARS)
+        if not chunk:
+            break
+        text = remainder + chunk
+        end = text.rfind('\n')
+        if end < 0:
+            remainder = text
+            continue
+        remainder = text[end + 1:]
+        text = _clean_block(text[:end])
+        if text:
+            yield text
+
+    text = _clean_block(remainder)
+    if text:
+        yield text
+
+
+def _clean_block(text: str) -> str:
+    """去掉文本块中的空行、注释行和行首尾空白，块本身已干净时原样返回"""
+    if '#' in text or '\r' in text or '\n\n' in text or text[:1].isspace() or text[-1:].isspace():
+        return '\n'.join(line for line in map(str.strip, text.split('\n')) if line and line[0] != '#')
+    return text
+
+
+def _split_columns(text: str, user_codes: bool) -> Optional[List[Sequence[str]]]:
+    """把一块文本拆分为列：[命令名, 描述, 别名, 文件名, 时间戳, 命令类型(, 代码ID)]
+
+    文件名、时间戳、命令类型三列可能带首尾空白，由调用方在驻留时统一处理。
+    """
+    width = 5 if user_codes else 6
+    line_count = text.count('\n') + 1
+
+    # 换行替换为 "|\n" 后整块拆分：若每行字段数都等于 width，
+    # 则字段总数为 width * 行数，且每行第一个字段（除第一行外）都以换行开头
+    fields = text.replace('\n', '|\n').split('|')
+    if len(fields) == width * line_count and all(map(str.startswith, islice(fields, width, None, width), repeat('\n'))):
+        columns = [fields[i::width] for i in range(width)]
+        if user_codes:
+            # 代码ID|命令名称|描述|文件名|创建时间
+            empty = [''] * line_count
+            columns = [columns[1], columns[2], empty, columns[3], columns[4], empty, columns[0]]
+    else:
+        rows = [line.split('|') for line in text.split('\n')]
+        if user_codes:
+            rows = [[p[1], p[2], '', p[3], p[4] if len(p) > 4 else '', '', p[0]] for p in rows if len(p) >= 4]
+        else:
+            rows = [_canonical_library_row(p) for p in rows if len(p) >= 2]
+        if not rows:
+            return None
+        columns = [list(column) for column in zip(*rows)]
+
+    # 文本列去掉首尾空白（快速路径下每行第一个字段带有换行前缀）
+    for i in (0, 1, 2, 6) if user_codes else (0, 1, 2):
+        columns[i] = list(map(str.strip, columns[i]))
+    return columns
+
+
+def load_command_rows(rows, table: Optional[CommandTable] = None, source: str = '',
+                      default_type: str = 'user_code') -> CommandTable:
+    """把用户代码记录（字典，含 id/command/description/filename/created_at）追加到命令表
+
+    用于从 UserCodeStore 加载用户代码，记录的来源统一记为 source。
+    """
+    if table is None:
+        table = CommandTable()
+
+    start_row = len(table.commands)
+    cmd_type = _intern(default_type)
+    shared = {}
+    for row in rows:
+        command = (row.get('command') or '').strip()
+        description = (row.get('description') or '').strip()
+        if not command or not description:
+            continue
+        table.commands.append(command)
+        table.descriptions.append(description)
+        table.aliases.append('')
+        filename = row.get('filename') or ''
+        created_at = row.get('created_at') or ''
+        table.filenames.append(shared.setdefault(filename, _intern(filename)))
+        table.timestamps.append(shared.setdefault(created_at, _intern(created_at)))
+        table.types.append(cmd_type)
+        table.code_ids.append(str(row.get('id') or ''))
+
+    if len(table.commands) > start_row:
+        table.sources.append((start_row, _intern(source)))
+    return table
@@ -0,0 +1,44 @@
+"""
+CADChat 命令类型（两个服务端共用）
+本地 Ollama 服务端把用户代码类型叫 user_code，阿里云百炼服务端叫 user_program，请求中两种写法都接受
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+BASE_COMMAND_TYPES = ('basic', 'lisp')
+USER_CODE_TYPES = ('user_code', 'user_program')
+
+
+def command_types(user_type: str) -> Tuple[str, ...]:
+    """服务端支持的命令类型，user_type 为该服务端的用户代码类型名"""
+    return BASE_COMMAND_TYPES + (user_type,)
+
+
+def command_type_aliases(user_type: str) -> Dict[str, str]:
+    """另一个服务端的用户代码类型名 -> 本服务端的类型名"""
+    return {name: user_type for name in USER_CODE_TYPES if name != user_type}
+
+
+def parse_command_types(value, user_type: str = 'user_code') -> Optional[List[str]]:
+    """解析请求中的命令类型过滤参数（列表或逗号分隔字符串），返回去重后的类型列表，为空时返回 None
+
+    Raises:
+        ValueError: 包含未知的命令类型
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    valid = command_types(user_type)
+    aliases = command_type_aliases(user_type)
+    types = []
+    for item in value:
+        cmd_type = str(item).strip().lower()
+        if not cmd_type:
+            continue
+        cmd_type = aliases.get(cmd_type, cmd_type)
+        if cmd_type not in valid:
+            raise ValueError(f"未知的命令类型: {item}，可选: {', '.join(valid)}")
+        if cmd_type not in types:
+            types.append(cmd_type)
+    return types or None
@@ -0,0 +1,269 @@
+"""
+CADChat 向量索引版本管理（两个服务端共用）
+每次建库生成一个新的索引版本目录，切换版本只改写状态文件；上一个版本保留在磁盘上用于回滚。
+更换嵌入模型时先在后台建立新版本，在评测查询集上与当前版本对比后再切换。
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from server_common.command_loader import CommandTable
+
+STATE_FILE = 'state.json'
+META_FILE = 'meta.json'
+
+# 未提供评测查询集时，从命令库中均匀抽取的查询条数
+DEFAULT_EVAL_SAMPLE_SIZE = 50
+
+_CLAUSE_RE = re.compile(r'[，,；;。]')
+
+
+def commands_digest(commands: CommandTable) -> str:
+    """命令库内容摘要：用于判断某个索引版本是否与当前命令库对应"""
+    digest = hashlib.sha1()
+    for i in range(len(commands)):
+        digest.update(commands.text(i).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(commands.types[i].encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+class GenerationStore:
+    """索引版本目录
+
+    目录结构::
+
+        <root>/state.json            当前版本、上一版本、被拒绝的模型
+        <root>/<版本ID>/meta.json    模型、命令数、命令库摘要、评测结果
+        <root>/<版本ID>/...          各服务端自己的索引文件
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    # ---- 状态文件 ----
+
+    def _read_state(self) -> Dict:
+        path = os.path.join(self.root, STATE_FILE)
+        if not os.path.exists(path):
+            return {'current': None, 'previous': None, 'rejected': {}}
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        state.setdefault('current', None)
+        state.setdefault('previous', None)
+        state.setdefault('rejected', {})
+        return state
+
+    def _write_state(self, state: Dict):
+        """先写临时文件再替换，保证切换是原子的"""
+        path = os.path.join(self.root, STATE_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    # ---- 版本 ----
+
+    def path(self, generation: str) -> str:
+        return os.path.join(self.root, generation)
+
+    def current(self) -> Optional[str]:
+        with self._lock:
+            return self._read_state()['current']
+
+    def previous(self) -> Optional[str]:
+        with self._lock:
+            return self._read_state()['previous']
+
+    def new_generation(self, model: str) -> Tuple[str, str]:
+        """创建新的版本目录，返回 (版本ID, 目录路径)"""
+        slug = re.sub(r'[^A-Za-z0-9._-]+', '_', model)
+        generation = f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}"
+        path = self.path(generation)
+        suffix = 1
+        while os.path.exists(path):
+            suffix += 1
+            path = self.path(f"{generation}-{suffix}")
+        os.makedirs(path)
+        return os.path.basename(path), path
+
+    def read_meta(self, generation: str) -> Dict:
+        with open(os.path.join(self.path(generation), META_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def write_meta(self, generation: str, meta: Dict):
+        path = os.path.join(self.path(generation), META_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def update_meta(self, generation: str, **fields):
+        meta = self.read_meta(generation)
+        meta.update(fields)
+        self.write_meta(generation, meta)
+
+    def activate(self, generation: str):
+        """切换到指定版本，原当前版本成为上一版本，其余版本从磁盘删除"""
+        with self._lock:
+            state = self._read_state()
+            if state['current'] != generation:
+                state['previous'] = state['current']
+                state['current'] = generation
+            model = self.read_meta(generation).get('model')
+            state['rejected'].pop(model, None)
+            self._write_state(state)
+            self._prune(state)
+
+    def rollback(self) -> str:
+        """回滚到上一版本，返回回滚后的当前版本ID
+
+        Raises:
+            ValueError: 没有可回滚的版本
+        """
+        with self._lock:
+            state = self._read_state()
+            previous = state['previous']
+            if not previous or not os.path.isdir(self.path(previous)):
+                raise ValueError('没有可回滚的上一版本')
+            state['previous'], state['current'] = state['current'], previous
+            self._write_state(state)
+            return previous
+
+    def reject(self, generation: str, reason: str):
+        """记录某个模型的版本未通过评测（或被回滚），并删除该版本目录
+
+        被拒绝的模型在重启后不会自动再次迁移，需要显式强制迁移。
+        """
+        with self._lock:
+            state = self._read_state()
+            try:
+                meta = self.read_meta(generation)
+            except (OSError, ValueError):
+                meta = {}
+            model = meta.get('model', '')
+            state['rejected'][model] = {
+                'generation': generation,
+                'reason': reason,
+                'eval': meta.get('eval'),
+                'rejected_at': time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+            self._write_state(state)
+            if generation not in (state['current'], state['previous']):
+                self.discard(generation)
+
+    def is_rejected(self, model: str) -> bool:
+        with self._lock:
+            return model in self._read_state()['rejected']
+
+    def discard(self, generation: str):
+        """删除一个版本目录"""
+        shutil.rmtree(self.path(generation), ignore_errors=True)
+
+    def _prune(self, state: Dict):
+        keep = {state['current'], state['previous']}
+        for name in os.listdir(self.root):
+            if name not in keep and os.path.isdir(self.path(name)):
+                self.discard(name)
+
+    def status(self) -> Dict:
+        """各版本的元信息，用于状态接口"""
+        with self._lock:
+            state = self._read_state()
+        result = {'current': None, 'previous': None, 'rejected': state['rejected']}
+        for key in ('current', 'previous'):
+            generation = state[key]
+            if generation:
+                try:
+                    meta = self.read_meta(generation)
+                except (OSError, ValueError):
+                    meta = {}
+                result[key] = dict(meta, generation=generation)
+        return result
+
+
+def load_eval_queries(path: str) -> List[Tuple[str, str]]:
+    """读取评测查询集，每行格式: 查询文本|期望命令名"""
+    queries = []
+    if not path or not os.path.exists(path):
+        return queries
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = line.split('|')
+            if len(parts) >= 2 and parts[0].strip() and parts[1].strip():
+                queries.append((parts[0].strip(), parts[1].strip()))
+    return queries
+
+
+def _partial_description(description: str) -> str:
+    """从描述中取一部分作为评测查询，避免查询与被检索的文本完全相同
+
+    描述有多个分句时取第一个分句之后的说明文字；只有一个分句时去掉开头的两个字（通常是“绘制”“创建”等动词）。
+    剩下不足两个字时返回空字符串。
+    """
+    clauses = [c.strip() for c in _CLAUSE_RE.split(description) if c.strip()]
+    if not clauses:
+        return ''
+    query = '，'.join(clauses[1:]) if len(clauses) > 1 else clauses[0][2:]
+    return query if len(query) >= 2 else ''
+
+
+def sample_eval_queries(commands: CommandTable, limit: int = DEFAULT_EVAL_SAMPLE_SIZE) -> List[Tuple[str, str]]:
+    """没有评测查询集时，从命令库中均匀抽取 (部分描述, 命令名) 作为查询
+
+    查询只取描述的一部分：用完整描述查询时两个模型几乎都能排在第一，评测比较不出差别。
+    抽样查询只是近似，正式迁移前应提供 EVAL_QUERIES_FILE。
+    """
+    candidates = []
+    for i in range(len(commands)):
+        query = _partial_description(commands.descriptions[i])
+        if query:
+            candidates.append((query, commands.commands[i]))
+    # 多个命令得到相同查询（如“对象”）时没有唯一正确答案，不用作评测
+    counts = Counter(query for query, _ in candidates)
+    candidates = [item for item in candidates if counts[item[0]] == 1]
+    if not candidates:
+        return []
+    step = max(1, len(candidates) // limit)
+    return candidates[::step][:limit]
+
+
+def evaluate(search: Callable[[str], Sequence[str]], queries: List[Tuple[str, str]]) -> Dict:
+    """在评测查询集上计算 recall@k 和 MRR
+
+    Args:
+        search: 查询文本 -> 按相关度排序的命令名列表（前 k 个）
+        queries: (查询文本, 期望命令名) 列表
+    """
+    hits = 0
+    reciprocal_rank = 0.0
+    for query, expected in queries:
+        ranked = [name.upper() for name in search(query)]
+        if expected.upper() in ranked:
+            hits += 1
+            reciprocal_rank += 1.0 / (ranked.index(expected.upper()) + 1)
+    count = len(queries)
+    return {
+        'queries': count,
+        'recall_at_k': hits / count if count else 0.0,
+        'mrr': reciprocal_rank / count if count else 0.0
+    }
+
+
+def passes_eval(old: Dict, new: Dict, max_regression: float) -> bool:
+    """新版本的 recall@k 和 MRR 都不低于当前版本减去允许的回退幅度时才切换"""
+    return (new['recall_at_k'] >= old['recall_at_k'] - max_regression
+            and new['mrr'] >= old['mrr'] - max_regression)
@@ -0,0 +1,194 @@
+"""
+CADChat 后台任务（两个服务端共用）
+耗时的操作（如重建索引）作为任务在后台线程中执行，接口立即返回任务ID，调用方轮询进度或取消。
+"""
+
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+# 保留的已结束任务数
+DEFAULT_MAX_HISTORY = 20
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class JobCancelled(Exception):
+    """任务被取消（由任务函数在检查点抛出）"""
+
+
+class JobConflict(Exception):
+    """同类任务已在运行"""
+
+    def __init__(self, job: 'Job'):
+        super().__init__(f"已有{job.kind}任务正在运行: {job.id}")
+        self.job = job
+
+
+class Job:
+    """一个后台任务的状态和进度
+
+    任务函数通过 set_total/advance 报告进度，并在适当位置调用 check_cancelled 响应取消。
+    """
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.total = 0
+        self.done = 0
+        self.errors: List[str] = []
+        self.result: Any = None
+        self.runs = 0  # 任务函数已执行的次数（合并的提交会让任务再执行一次）
+        self._cancel = threading.Event()
+        self._rerun = False
+
+    def set_total(self, total: int):
+        self.total = total
+
+    def advance(self, count: int = 1):
+        self.done += count
+
+    def add_error(self, message: str):
+        self.errors.append(message)
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """已请求取消时抛出 JobCancelled"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def eta_seconds(self) -> Optional[float]:
+        """按已完成部分的平均速度估算剩余时间"""
+        if self.status != 'running' or not self.done or not self.total:
+            return None
+        elapsed = time.time() - self.started_at
+        return elapsed / self.done * max(self.total - self.done, 0)
+
+    def to_dict(self) -> Dict:
+        end = self.finished_at or time.time()
+        eta = self.eta_seconds()
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'total': self.total,
+            'done': self.done,
+            'progress': self.done / self.total if self.total else (1.0 if self.status == 'succeeded' else 0.0),
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'elapsed_seconds': round(end - self.started_at, 1) if self.started_at else 0.0,
+            'cancel_requested': self.cancel_requested,
+            'errors': list(self.errors),
+            'result': self.result,
+            'runs': self.runs,
+            'rerun_pending': self._rerun,
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.created_at))
+        }
+
+
+class JobManager:
+    """任务表：同一类任务同一时刻只运行一个"""
+
+    def __init__(self, max_history: int = DEFAULT_MAX_HISTORY):
+        self.max_history = max_history
+        self._lock = threading.Lock()
+        self._jobs: 'OrderedDict[str, Job]' = OrderedDict()
+
+    def submit(self, kind: str, fn: Callable[[Job], Any], coalesce: bool = False) -> Job:
+        """在后台线程中运行 fn(job)，返回任务
+
+        fn 的返回值记为任务结果；抛出 JobCancelled 记为已取消，其他异常记为失败。
+        coalesce 为 True 时，同类任务正在运行则不新建任务：运行中的任务结束后再执行一次 fn
+        （正在执行的 fn 可能已经读过旧数据），返回该任务。多次合并的提交只多执行一次。
+
+        Raises:
+            JobConflict: 同类任务正在运行（coalesce 为 False 时）
+        """
+        with self._lock:
+            active = self._active(kind)
+            if active is not None:
+                if not coalesce:
+                    raise JobConflict(active)
+                active._rerun = True
+                return active
+            job = Job(kind)
+            self._jobs[job.id] = job
+            self._prune()
+
+        threading.Thread(target=self._run, args=(job, fn), daemon=True, name=f"job-{kind}-{job.id}").start()
+        return job
+
+    def _run(self, job: Job, fn: Callable[[Job], Any]):
+        job.started_at = time.time()
+        job.status = 'running'
+        try:
+            while True:
+                with self._lock:
+                    job._rerun = False  # 之前合并进来的提交由这次执行处理
+                job.runs += 1
+                status = 'succeeded'
+                try:
+                    job.result = fn(job)
+                except JobCancelled:
+                    status = 'cancelled'
+                except Exception as e:
+                    job.add_error(str(e))
+                    status = 'failed'
+                # 检查合并进来的提交与结束任务在同一个锁内完成，之后的提交会新建任务；
+                # 最后一次执行的结果决定任务状态
+                with self._lock:
+                    if job._rerun and status != 'cancelled' and not job.cancel_requested:
+                        job.done = 0
+                        continue
+                    job._rerun = False
+                    job.status = status
+                    break
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """请求取消任务（任务在下一个检查点停止），任务不存在时返回 None
+
+        Raises:
+            ValueError: 任务已经结束
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job.status not in ACTIVE_STATUSES:
+            raise ValueError(f'任务已结束（{job.status}）')
+        job._cancel.set()
+        return job
+
+    def active(self, kind: str) -> Optional[Job]:
+        with self._lock:
+            return self._active(kind)
+
+    def list(self, kind: Optional[str] = None) -> List[Job]:
+        """最近的任务，最新的在前"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in reversed(jobs) if kind is None or job.kind == kind]
+
+    def _active(self, kind: str) -> Optional[Job]:
+        for job in self._jobs.values():
+            if job.kind == kind and job.status in ACTIVE_STATUSES:
+                return job
+        return None
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status not in ACTIVE_STATUSES]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_history)]:
+            del self._jobs[job_id]
@@ -0,0 +1,94 @@
+"""
+CADChat 列表接口分页与流式输出（两个服务端共用）
+按游标分页返回 JSON，或以 NDJSON 逐行流式输出，响应不需要一次性构造完整列表
+"""
+
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from flask import Response, current_app, jsonify, stream_with_context
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# 按行号区间产出列表项：rows(start, stop) -> 字典迭代器
+RowsFunc = Callable[[int, int], Iterator[Dict]]
+
+
+def parse_page_args(args) -> Tuple[int, Optional[int]]:
+    """解析 cursor / limit 查询参数
+
+    游标是下一页起始位置，由上一页响应的 next_cursor 给出；未指定 limit 时返回 None。
+
+    Raises:
+        ValueError: 参数不是非负整数或 limit 超出范围
+    """
+    cursor = args.get('cursor') or '0'
+    limit = args.get('limit')
+    try:
+        start = int(cursor)
+        if start < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError(f"无效的游标: {cursor}")
+    if limit is None or limit == '':
+        return start, None
+    try:
+        size = int(limit)
+    except ValueError:
+        raise ValueError(f"无效的 limit: {limit}")
+    if not 1 <= size <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit 必须在 1 到 {MAX_PAGE_SIZE} 之间")
+    return start, size
+
+
+def wants_ndjson(req) -> bool:
+    """请求是否要求 NDJSON 流式输出（?format=ndjson 或 Accept: application/x-ndjson）"""
+    fmt = req.args.get('format', '').lower()
+    if fmt:
+        return fmt == 'ndjson'
+    return req.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def list_response(req, key: str, total: int, rows: RowsFunc, extra: Optional[Dict] = None):
+    """生成分页或流式的列表响应
+
+    JSON 模式每页最多 limit 条（只给出 cursor 时为 DEFAULT_PAGE_SIZE），响应带 next_cursor，最后一页为 null；
+    cursor 和 limit 都未指定时与分页前一样返回完整列表。
+    NDJSON 模式每行一个列表项，未指定 limit 时一直输出到末尾，总数和下一页游标放在响应头中。
+
+    Args:
+        req: Flask 请求对象
+        key: JSON 响应中列表字段的名称
+        total: 列表总条数
+        rows: 按行号区间产出列表项的函数
+        extra: JSON 响应中附带的其他字段
+
+    Raises:
+        ValueError: 分页参数无效
+    """
+    start, limit = parse_page_args(req.args)
+    start = min(start, total)
+
+    if wants_ndjson(req):
+        stop = total if limit is None else min(total, start + limit)
+
+        def generate():
+            for item in rows(start, stop):
+                yield current_app.json.dumps(item) + '\n'
+
+        response = Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+        response.headers['X-Total-Count'] = str(total)
+        if stop < total:
+            response.headers['X-Next-Cursor'] = str(stop)
+        return response
+
+    if limit is None:
+        # 不带分页参数的旧客户端仍拿到完整列表
+        limit = DEFAULT_PAGE_SIZE if req.args.get('cursor') else total
+    stop = min(total, start + limit)
+    result = dict(extra or {})
+    result[key] = list(rows(start, stop))
+    result['total'] = total
+    result['next_cursor'] = str(stop) if stop < total else None
+    return jsonify(result)
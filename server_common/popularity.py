@@ -0,0 +1,280 @@
+"""
+CADChat 命令热度统计（两个服务端共用）
+记录每个命令被作为最佳匹配返回的次数和用户反馈的成功/失败次数。
+计数在内存中累加，由后台线程定期批量写入 SQLite；每次写入后重新计算各分类的前 top_n 名，
+热门列表从预先排好的列表中截取，开销只与列表长度有关，与命令库大小无关。
+"""
+
+import os
+import math
+import time
+import heapq
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_TOP_N = 100
+DEFAULT_FLUSH_INTERVAL = 5.0  # 秒
+
+ALL_CATEGORIES = '*'
+
+
+def _rank_key(entry: Dict) -> Tuple:
+    """热门排序：使用次数优先，其次成功率"""
+    return entry['usage_count'], success_rate(entry)
+
+
+def success_rate(entry: Dict) -> float:
+    rated = entry['success_count'] + entry['failure_count']
+    return entry['success_count'] / rated if rated else 0.0
+
+
+class PopularityStore:
+    """命令热度计数
+
+    计数按 (命名空间, 命令名) 保存，共享命令使用空命名空间。
+    内存中的计数最多比数据库新 flush_interval 秒，热门列表同样最多滞后这么久。
+    """
+
+    def __init__(self, db_path: str, top_n: int = DEFAULT_TOP_N, flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.top_n = top_n
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._counters: Dict[Tuple[str, str], Dict] = {}
+        self._dirty = set()
+        self._pending_feedback: List[Tuple] = []
+        self._top: Dict[Tuple[str, str], List[Dict]] = {}
+        self._max_usage = 0
+        self.total_usage = 0
+        self.flushes = 0
+        self.last_flush: Optional[float] = None
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        # 只有初始化和写入线程使用该连接，由 _db_lock 串行化
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS popularity (
+                namespace TEXT NOT NULL DEFAULT '',
+                command TEXT NOT NULL,
+                type TEXT NOT NULL DEFAULT '',
+                description TEXT NOT NULL DEFAULT '',
+                usage_count INTEGER NOT NULL DEFAULT 0,
+                success_count INTEGER NOT NULL DEFAULT 0,
+                failure_count INTEGER NOT NULL DEFAULT 0,
+                last_used REAL,
+                PRIMARY KEY (namespace, command)
+            );
+            CREATE TABLE IF NOT EXISTS feedback (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                namespace TEXT NOT NULL DEFAULT '',
+                command TEXT NOT NULL,
+                requirement TEXT NOT NULL DEFAULT '',
+                success INTEGER NOT NULL,
+                feedback TEXT,
+                created_at TEXT NOT NULL
+            );
+        ''')
+        self._db.commit()
+
+        for row in self._db.execute('SELECT * FROM popularity'):
+            entry = dict(row)
+            self._counters[(entry['namespace'], entry['command'])] = entry
+            self._max_usage = max(self._max_usage, entry['usage_count'])
+            self.total_usage += entry['usage_count']
+        self._refresh_top()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True, name='popularity-flush')
+        self._thread.start()
+
+    # ---- 计数 ----
+
+    def _entry(self, namespace: str, command: str) -> Dict:
+        key = (namespace, command)
+        entry = self._counters.get(key)
+        if entry is None:
+            entry = {
+                'namespace': namespace,
+                'command': command,
+                'type': '',
+                'description': '',
+                'usage_count': 0,
+                'success_count': 0,
+                'failure_count': 0,
+                'last_used': None
+            }
+            self._counters[key] = entry
+        self._dirty.add(key)
+        return entry
+
+    def record_usage(self, command: str, cmd_type: str = '', description: str = '', namespace: str = ''):
+        """命令被作为最佳匹配返回一次"""
+        if not command:
+            return
+        with self._lock:
+            entry = self._entry(namespace, command)
+            entry['usage_count'] += 1
+            entry['last_used'] = time.time()
+            if cmd_type:
+                entry['type'] = cmd_type
+            if description:
+                entry['description'] = description
+            self._max_usage = max(self._max_usage, entry['usage_count'])
+            self.total_usage += 1
+
+    def record_feedback(self, command: str, success: bool, requirement: str = '', feedback: Optional[str] = None,
+                        namespace: str = '') -> Dict:
+        """记录一次用户反馈，返回该命令当前的计数"""
+        with self._lock:
+            entry = self._entry(namespace, command)
+            entry['success_count' if success else 'failure_count'] += 1
+            self._pending_feedback.append(
+                (namespace, command, requirement or '', int(bool(success)), feedback,
+                 time.strftime('%Y-%m-%d %H:%M:%S'))
+            )
+            return self._public(entry)
+
+    def get(self, command: str, namespace: str = '') -> Optional[Dict]:
+        with self._lock:
+            entry = self._counters.get((namespace, command))
+            return self._public(entry) if entry else None
+
+    # ---- 检索先验 ----
+
+    def prior(self, command: str, namespace: str = '') -> float:
+        """命令的热度先验（0~1）：使用次数（对数归一化）和平滑后的成功率各占一半
+
+        没有任何记录的命令为 0.25，收到较多失败反馈的命令低于该值。
+        """
+        entry = self._counters.get((namespace, command))
+        if entry is None:
+            return 0.25
+        usage = math.log1p(entry['usage_count']) / math.log1p(self._max_usage) if self._max_usage else 0.0
+        rate = (entry['success_count'] + 1) / (entry['success_count'] + entry['failure_count'] + 2)
+        return 0.5 * usage + 0.5 * rate
+
+    def apply_prior(self, results: List[Dict], weight: float, score_key: str = 'similarity') -> List[Dict]:
+        """在相似度上加热度先验后重新排序（原地修改并返回 results）
+
+        每个结果增加 popularity（先验）和 score（相似度 + weight × 先验）字段，相似度字段保持不变。
+        """
+        with self._lock:
+            for cmd in results:
+                prior = self.prior(cmd.get('command', ''), cmd.get('namespace', ''))
+                cmd['popularity'] = round(prior, 4)
+                cmd['score'] = float(cmd.get(score_key, 0.0)) + weight * prior
+        results.sort(key=lambda cmd: cmd['score'], reverse=True)
+        return results
+
+    # ---- 热门列表 ----
+
+    def top(self, limit: int = 10, category: Optional[str] = None, namespace: str = '',
+            keyword: str = '') -> List[Dict]:
+        """热门命令：共享命令和指定命名空间的命令按热度合并，最多 top_n 条
+
+        category 为命令类型，keyword 按命令名和描述过滤（不区分大小写），只在预先排好的列表中查找。
+        """
+        category = category or ALL_CATEGORIES
+        keyword = (keyword or '').lower()
+        with self._lock:
+            lists = [self._top.get(('', category), [])]
+            if namespace:
+                lists.append(self._top.get((namespace, category), []))
+        merged = heapq.merge(*lists, key=_rank_key, reverse=True) if len(lists) > 1 else lists[0]
+        results = []
+        for entry in merged:
+            if len(results) >= min(limit, self.top_n):
+                break
+            if keyword and keyword not in entry['command'].lower() and keyword not in entry['description'].lower():
+                continue
+            results.append(entry)
+        return results
+
+    def _refresh_top(self):
+        """重新计算各 (命名空间, 分类) 的前 top_n 名（只包含被使用过的命令）"""
+        with self._lock:
+            entries = [self._public(entry) for entry in self._counters.values() if entry['usage_count']]
+        groups: Dict[Tuple[str, str], List[Dict]] = {}
+        for entry in entries:
+            groups.setdefault((entry['namespace'], ALL_CATEGORIES), []).append(entry)
+            if entry['type']:
+                groups.setdefault((entry['namespace'], entry['type']), []).append(entry)
+        top = {key: heapq.nlargest(self.top_n, group, key=_rank_key) for key, group in groups.items()}
+        with self._lock:
+            self._top = top
+
+    @staticmethod
+    def _public(entry: Dict) -> Dict:
+        result = dict(entry)
+        result['success_rate'] = success_rate(entry)
+        return result
+
+    # ---- 持久化 ----
+
+    def flush(self) -> int:
+        """把变化的计数和新的反馈写入数据库（一个事务），并刷新热门列表，返回写入的计数条数"""
+        with self._lock:
+            rows = [dict(self._counters[key]) for key in self._dirty]
+            feedback = self._pending_feedback
+            self._dirty = set()
+            self._pending_feedback = []
+        if not rows and not feedback:
+            return 0
+
+        try:
+            with self._db_lock, self._db:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO popularity '
+                    '(namespace, command, type, description, usage_count, success_count, failure_count, last_used) '
+                    'VALUES (:namespace, :command, :type, :description, :usage_count, :success_count, '
+                    ':failure_count, :last_used)',
+                    rows
+                )
+                self._db.executemany(
+                    'INSERT INTO feedback (namespace, command, requirement, success, feedback, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    feedback
+                )
+        except sqlite3.Error:
+            # 写入失败时保留待写内容，下次重试
+            with self._lock:
+                self._dirty.update((row['namespace'], row['command']) for row in rows)
+                self._pending_feedback[:0] = feedback
+            raise
+
+        self._refresh_top()
+        self.flushes += 1
+        self.last_flush = time.time()
+        return len(rows)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'tracked_commands': len(self._counters),
+                'total_usage': self.total_usage,
+                'pending_writes': len(self._dirty) + len(self._pending_feedback),
+                'top_n': self.top_n,
+                'flushes': self.flushes,
+                'last_flush': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.last_flush))
+                if self.last_flush else None
+            }
+
+    def close(self):
+        """停止后台写入线程并写入剩余的计数"""
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+        with self._db_lock:
+            self._db.close()
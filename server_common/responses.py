@@ -0,0 +1,183 @@
+"""
+CADChat HTTP 响应编码（两个服务端共用）
+JSON 使用 orjson 序列化（未安装时退回标准库的紧凑输出），响应体按 Accept-Encoding 协商 gzip/deflate 压缩。
+响应带 Server-Timing 头（各处理阶段和总耗时），客户端据此区分网络耗时与服务端耗时。
+"""
+
+import json
+import time
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from flask import Flask, g, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 小于该字节数的响应不压缩（压缩头和 CPU 开销大于收益）
+DEFAULT_COMPRESS_MIN_SIZE = 1024
+DEFAULT_COMPRESS_LEVEL = 6
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html')
+
+# 查询响应所用索引的版本，客户端按它让本地缓存的旧结果失效
+INDEX_VERSION_HEADER = 'X-CADChat-Index-Version'
+
+SERVER_TIMING_HEADER = 'Server-Timing'
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """更快的 jsonify
+
+    与 Flask 默认实现相比：不排序键、不转义中文、不缩进；安装了 orjson 时用 orjson 序列化。
+    只覆盖 dumps / loads，jsonify 走 DefaultJSONProvider.response 的公开流程。
+    numpy 标量和数组按普通数值/列表输出。
+    """
+
+    ensure_ascii = False
+    sort_keys = False
+    compact = True
+
+    def _default(self, o):
+        if np is not None:
+            if isinstance(o, np.generic):
+                return o.item()
+            if isinstance(o, np.ndarray):
+                return o.tolist()
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs) -> str:
+        # DefaultJSONProvider.response 会传入紧凑的 separators（调试模式下为 indent），这两种情况 orjson 都能输出
+        if orjson is not None and set(kwargs) <= {'separators', 'indent'} \
+                and kwargs.get('separators', (',', ':')) == (',', ':'):
+            option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if kwargs.get('indent') else 0)
+            return orjson.dumps(obj, default=self._default, option=option).decode('utf-8')
+        kwargs.setdefault('default', self._default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('separators', (',', ':'))
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+
+def install_fast_json(app: Flask):
+    """让 jsonify / request.json 使用 FastJSONProvider"""
+    app.json = FastJSONProvider(app)
+
+
+def record_timing(stage: str, ms: float):
+    """记录当前请求一个处理阶段的耗时（毫秒），同名阶段累加"""
+    timings = g.get('server_timing')
+    if timings is None:
+        timings = g.server_timing = {}
+    timings[stage] = timings.get(stage, 0.0) + ms
+
+
+def enable_server_timing(app: Flask):
+    """在响应中加入 Server-Timing：record_timing 记录的阶段和 total（请求开始到响应完成）
+
+    应在 enable_compression 之前调用，total 才包含压缩的耗时。
+    """
+
+    @app.before_request
+    def start_timing():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        timings = dict(g.get('server_timing') or {})
+        timings['total'] = (time.perf_counter() - started) * 1000
+        response.headers[SERVER_TIMING_HEADER] = ', '.join(f'{stage};dur={ms:.1f}' for stage, ms in timings.items())
+        return response
+
+
+def wants_compact(req, data: Optional[dict] = None) -> bool:
+    """客户端是否要求精简响应（?compact=1 或请求体中 "compact": true）"""
+    if req.args.get('compact', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return bool(data and data.get('compact') is True)
+
+
+def _negotiate(accept_encodings) -> Optional[str]:
+    """按 Accept-Encoding 选择编码，优先 gzip"""
+    gzip_q = accept_encodings.quality('gzip')
+    deflate_q = accept_encodings.quality('deflate')
+    if gzip_q <= 0 and deflate_q <= 0:
+        return None
+    return 'gzip' if gzip_q >= deflate_q else 'deflate'
+
+
+def _compressor(encoding: str, level: int):
+    # gzip 与 deflate（zlib 格式）只是外层封装不同
+    wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+    return zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+
+def _compress_stream(chunks: Iterable, encoding: str, level: int) -> Iterator[bytes]:
+    """逐块压缩流式响应
+
+    每块之后做一次同步刷新（Z_SYNC_FLUSH），客户端收到一行 NDJSON 即可解压，不必等 zlib 的缓冲区填满；
+    压缩字典在块之间保留，重复的字段名仍能压缩。
+    """
+    compressor = _compressor(encoding, level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if not chunk:
+            continue
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def enable_compression(app: Flask, min_size: int = DEFAULT_COMPRESS_MIN_SIZE,
+                       level: int = DEFAULT_COMPRESS_LEVEL):
+    """为 JSON、NDJSON 和文本响应启用 gzip/deflate 压缩
+
+    文件下载（send_file）和已经编码过的响应不处理；压缩后的强 ETag 改为弱 ETag，
+    条件请求需用 request.if_none_match.contains_weak 比较。
+    """
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return response
+        if response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return response
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = _negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            # 流式响应（NDJSON）边生成边压缩，不等待全部内容
+            response.response = _compress_stream(response.response, encoding, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < min_size:
+                return response
+            compressor = _compressor(encoding, level)
+            response.set_data(compressor.compress(body) + compressor.flush())
+
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
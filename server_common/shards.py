@@ -0,0 +1,126 @@
+"""
+CADChat 命名空间索引分片（两个服务端共用）
+每个团队/项目的用户代码是一个独立的小索引分片，与共享的基本命令/LISP 索引一起检索；
+分片在第一次查询时加载，空闲超时或超出数量上限时从内存中淘汰。
+"""
+
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from server_common.single_flight import SingleFlight
+
+NAMESPACE_HEADER = 'X-CADChat-Namespace'
+
+DEFAULT_MAX_LOADED = 32
+DEFAULT_IDLE_SECONDS = 600
+
+_NAMESPACE_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+
+
+def parse_namespace(value) -> str:
+    """规范化命名空间名称，空值表示默认（共享）命名空间
+
+    Raises:
+        ValueError: 名称不合法
+    """
+    if value is None:
+        return ''
+    value = str(value).strip()
+    if not value:
+        return ''
+    if not _NAMESPACE_RE.match(value):
+        raise ValueError(f"无效的命名空间: {value}（只能包含字母、数字、_ . -，最长 64 个字符）")
+    return value
+
+
+def request_namespace(req, data: Optional[dict] = None) -> str:
+    """从请求中读取命名空间：X-CADChat-Namespace 请求头、?namespace= 或 JSON 中的 namespace
+
+    Raises:
+        ValueError: 名称不合法
+    """
+    value = req.headers.get(NAMESPACE_HEADER) or req.args.get('namespace')
+    if not value and isinstance(data, dict):
+        value = data.get('namespace')
+    return parse_namespace(value)
+
+
+class ShardCache:
+    """按命名空间懒加载的分片缓存
+
+    同一命名空间的并发加载只执行一次；访问时淘汰空闲超过 idle_seconds 的分片，
+    已加载的分片超过 max_loaded 个时淘汰最久未使用的。
+    """
+
+    def __init__(self, loader: Callable[[str], Any], max_loaded: int = DEFAULT_MAX_LOADED,
+                 idle_seconds: float = DEFAULT_IDLE_SECONDS):
+        self.loader = loader
+        self.max_loaded = max_loaded
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._shards: 'OrderedDict[str, Any]' = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._loads = SingleFlight()
+        self._generation: Dict[str, int] = {}  # 每次失效加一，丢弃失效前开始的加载结果
+        self.loads = 0
+        self.evicted = 0
+
+    def get(self, namespace: str) -> Any:
+        """返回命名空间的分片，未加载时调用 loader 加载"""
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            shard = self._shards.get(namespace)
+            if shard is not None:
+                self._shards.move_to_end(namespace)
+                self._last_used[namespace] = now
+                return shard
+            generation = self._generation.get(namespace, 0)
+
+        shard, _ = self._loads.do((namespace, generation), lambda flight: self.loader(namespace))
+
+        with self._lock:
+            if self._generation.get(namespace, 0) == generation:
+                if namespace not in self._shards:
+                    self.loads += 1
+                self._shards[namespace] = shard
+                self._shards.move_to_end(namespace)
+                self._last_used[namespace] = time.time()
+                while len(self._shards) > self.max_loaded:
+                    oldest, _ = self._shards.popitem(last=False)
+                    self._last_used.pop(oldest, None)
+                    self.evicted += 1
+        return shard
+
+    def invalidate(self, namespace: str):
+        """命名空间的代码有变化：丢弃内存中的分片，下次查询时重新加载"""
+        with self._lock:
+            self._generation[namespace] = self._generation.get(namespace, 0) + 1
+            self._shards.pop(namespace, None)
+            self._last_used.pop(namespace, None)
+
+    def evict_idle(self) -> int:
+        """淘汰空闲的分片，返回淘汰数量"""
+        with self._lock:
+            return self._evict_idle(time.time())
+
+    def _evict_idle(self, now: float) -> int:
+        idle = [ns for ns, used in self._last_used.items() if now - used > self.idle_seconds]
+        for namespace in idle:
+            self._shards.pop(namespace, None)
+            self._last_used.pop(namespace, None)
+        self.evicted += len(idle)
+        return len(idle)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'loaded': list(self._shards),
+                'max_loaded': self.max_loaded,
+                'idle_seconds': self.idle_seconds,
+                'total_loads': self.loads,
+                'evicted': self.evicted
+            }
@@ -0,0 +1,120 @@
+"""
+CADChat 相同请求合并（两个服务端共用）
+同一时刻到达的相同查询只执行一次检索（一次嵌入调用），其余请求等待并共享结果
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class Flight:
+    """一次合并调用的状态，传给被执行的函数
+
+    函数据 deadline() 限制耗时的后端调用：所有等待的请求都已放弃时不再做没有人等待的工作。
+    """
+
+    __slots__ = ('done', 'result', 'error', '_lock', '_waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._waiters: Dict[object, Optional[float]] = {}  # 等待的请求 -> 截止时间（time.monotonic）
+
+    def deadline(self) -> Optional[float]:
+        """仍在等待的请求中最晚的截止时间
+
+        有请求没有截止时间时返回 None（不限制）；没有请求在等待时返回当前时间（已过期）。
+        """
+        with self._lock:
+            if not self._waiters:
+                return time.monotonic()
+            deadlines = list(self._waiters.values())
+        return None if None in deadlines else max(deadlines)
+
+    @property
+    def abandoned(self) -> bool:
+        """等待的请求都已放弃"""
+        with self._lock:
+            return not self._waiters
+
+    def _join(self, deadline: Optional[float]) -> object:
+        token = object()
+        with self._lock:
+            self._waiters[token] = deadline
+        return token
+
+    def _leave(self, token: object):
+        with self._lock:
+            self._waiters.pop(token, None)
+
+
+class SingleFlight:
+    """按键合并并发调用
+
+    只合并正在执行的调用，不缓存结果：调用结束后，相同的键会重新执行。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Flight] = {}
+        self.executed = 0  # 实际执行次数
+        self.shared = 0    # 共享结果、省下的调用次数
+
+    def do(self, key: Hashable, fn: Callable[[Flight], Any], deadline: Optional[float] = None) -> Tuple[Any, bool]:
+        """执行 fn(flight) 或等待相同键的进行中调用，返回 (结果, 是否共享了其他请求的结果)
+
+        fn 在单独的线程中执行，发起调用的请求和后到的请求一样只是等待结果：
+        每个请求按自己的截止时间（time.monotonic）放弃等待，不会因为先到的请求超时而让其他请求失败。
+        fn 应按 flight.deadline()（仍在等待的请求中最晚的截止时间）限制后端调用，
+        所有请求都放弃后尽早停止。fn 抛出的异常会传给所有等待同一调用的请求。
+
+        Raises:
+            TimeoutError: 超过截止时间仍未得到结果
+        """
+        with self._lock:
+            flight = self._calls.get(key)
+            if flight is not None:
+                self.shared += 1
+                leader = False
+            else:
+                flight = self._calls[key] = Flight()
+                self.executed += 1
+                leader = True
+            token = flight._join(deadline)
+
+        if leader:
+            threading.Thread(target=self._run, args=(key, flight, fn), daemon=True, name='single-flight').start()
+
+        try:
+            if not flight.done.wait(None if deadline is None else max(deadline - time.monotonic(), 0.0)):
+                raise TimeoutError('等待查询结果超时')
+        finally:
+            flight._leave(token)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, not leader
+
+    def _run(self, key: Hashable, flight: Flight, fn: Callable[[Flight], Any]):
+        try:
+            flight.result = fn(flight)
+        except BaseException as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                del self._calls[key]
+            flight.done.set()
+
+    def stats(self) -> Dict:
+        """合并统计"""
+        with self._lock:
+            in_flight = len(self._calls)
+        total = self.executed + self.shared
+        return {
+            'executed': self.executed,
+            'shared': self.shared,
+            'in_flight': in_flight,
+            'saved_ratio': self.shared / total if total else 0.0
+        }
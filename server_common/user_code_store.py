@@ -0,0 +1,421 @@
+"""
+CADChat 用户代码存储（两个服务端共用）
+用户代码保存在 SQLite 中（WAL 模式），按代码ID和命令名建立索引；
+查找和删除不再扫描或重写 user_codes.txt。代码内容按哈希保存在 BlobStore 中。
+每条代码属于一个命名空间（团队/项目），空字符串为所有人共享的默认命名空间。
+"""
+
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from server_common.blob_store import BlobStore
+from server_common.command_loader import KNOWN_TYPES
+
+
+class UserCodeStore:
+    """用户代码表
+
+    每个线程使用独立的连接，读操作可以并发进行；写操作串行执行。
+    代码ID由命令名、描述和代码内容的哈希生成，相同的提交得到同一个ID，不会因并发保存而冲突。
+    """
+
+    def __init__(self, db_path: str, blobs: Optional[BlobStore] = None):
+        self.db_path = db_path
+        self.blobs = blobs
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS user_codes (
+                id TEXT PRIMARY KEY,
+                command TEXT NOT NULL,
+                description TEXT NOT NULL DEFAULT '',
+                filename TEXT NOT NULL DEFAULT '',
+                code TEXT,
+                created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_user_codes_command ON user_codes(command COLLATE NOCASE);
+            CREATE TABLE IF NOT EXISTS store_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        ''')
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(user_codes)')}
+        if 'blob' not in columns:
+            conn.execute('ALTER TABLE user_codes ADD COLUMN blob TEXT')
+        if 'namespace' not in columns:
+            conn.execute("ALTER TABLE user_codes ADD COLUMN namespace TEXT NOT NULL DEFAULT ''")
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_codes_blob ON user_codes(blob)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_codes_namespace ON user_codes(namespace)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_codes_namespace_command '
+                     'ON user_codes(namespace, command COLLATE NOCASE)')
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # ---- 查询 ----
+
+    def get(self, code_id: str) -> Optional[Dict]:
+        """按代码ID查找"""
+        row = self._conn().execute('SELECT * FROM user_codes WHERE id = ?', (code_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_by_command(self, command: str, namespace: str = '') -> List[Dict]:
+        """按命令名查找（不区分大小写），最新的在前"""
+        rows = self._conn().execute(
+            'SELECT * FROM user_codes WHERE command = ? COLLATE NOCASE AND namespace = ? '
+            'ORDER BY created_at DESC, rowid DESC',
+            (command, namespace)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def latest_by_command(self, command: str, namespaces: Tuple[str, ...] = ('',)) -> Optional[Dict]:
+        """按命令名查找最新的一条代码（不区分大小写），依次在 namespaces 中查找，走 (namespace, command) 索引"""
+        for namespace in namespaces:
+            row = self._conn().execute(
+                'SELECT * FROM user_codes WHERE namespace = ? AND command = ? COLLATE NOCASE '
+                'ORDER BY created_at DESC, rowid DESC LIMIT 1',
+                (namespace, command)
+            ).fetchone()
+            if row is not None:
+                return dict(row)
+        return None
+
+    def count(self, namespace: Optional[str] = None) -> int:
+        """代码条数（namespace 为 None 时统计全部命名空间）"""
+        if namespace is None:
+            return self._conn().execute('SELECT COUNT(*) FROM user_codes').fetchone()[0]
+        return self._conn().execute('SELECT COUNT(*) FROM user_codes WHERE namespace = ?', (namespace,)).fetchone()[0]
+
+    def version(self, namespace: str = '') -> int:
+        """命名空间的数据版本：每次保存或删除代码加一（持久化，重启后不归零）"""
+        row = self._conn().execute('SELECT value FROM store_meta WHERE key = ?', (_version_key(namespace),)).fetchone()
+        return int(row[0]) if row else 0
+
+    def namespaces(self) -> Dict[str, int]:
+        """各命名空间的代码条数"""
+        rows = self._conn().execute('SELECT namespace, COUNT(*) FROM user_codes GROUP BY namespace').fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def iter_codes(self, offset: int = 0, limit: int = -1, with_code: bool = False,
+                   namespace: str = '') -> Iterator[Dict]:
+        """按保存顺序逐行遍历一个命名空间的代码，不一次性读入全部记录"""
+        columns = '*' if with_code else 'id, command, description, filename, created_at, blob, namespace'
+        cursor = self._conn().execute(
+            f'SELECT {columns} FROM user_codes WHERE namespace = ? ORDER BY rowid LIMIT ? OFFSET ?',
+            (namespace, limit, offset)
+        )
+        for row in cursor:
+            yield dict(row)
+
+    # ---- 修改 ----
+
+    def save_code(self, command: str, description: str, code: str, namespace: str = '') -> Tuple[Dict, bool]:
+        """保存一段代码：内容写入 BlobStore，返回 (记录, 是否新建)
+
+        同一命名空间中相同命令名、描述和代码内容的重复提交返回已有记录。
+        """
+        with self._write_lock:
+            created_blobs = set()
+            blob = self._put_blob(code, created_blobs)
+            code_id = content_code_id(command, description, blob, namespace)
+            row = self.get(code_id)
+            if row is not None:
+                return row, False
+            record = {
+                'id': code_id,
+                'command': command,
+                'description': description,
+                'filename': '',
+                'code': None,
+                'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'blob': blob,
+                'namespace': namespace
+            }
+            conn = self._conn()
+            try:
+                conn.execute(
+                    'INSERT INTO user_codes (id, command, description, filename, code, created_at, blob, namespace) '
+                    'VALUES (:id, :command, :description, :filename, :code, :created_at, :blob, :namespace)',
+                    record
+                )
+                _bump_version(conn, namespace)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                self._discard_blobs(conn, created_blobs)
+                raise
+        return record, True
+
+    def save_codes(self, items: List[Dict], namespace: str = '') -> List[Tuple[Dict, bool]]:
+        """批量保存代码（每项含 command/description/code）到一个命名空间，所有记录在一个事务中写入
+
+        返回与 items 一一对应的 (记录, 是否新建)；已存在的记录（包括本批内重复的条目）不会重复写入。
+        事务回滚时删除本批新写入的代码文件，不留下没有记录引用的文件。
+        """
+        results = []
+        with self._write_lock:
+            conn = self._conn()
+            pending = {}
+            created_blobs = set()
+            now = time.strftime('%Y-%m-%d %H:%M:%S')
+            try:
+                for item in items:
+                    blob = self._put_blob(item['code'], created_blobs)
+                    code_id = content_code_id(item['command'], item['description'], blob, namespace)
+                    existing = pending.get(code_id) or self.get(code_id)
+                    if existing is not None:
+                        results.append((existing, False))
+                        continue
+                    record = {
+                        'id': code_id,
+                        'command': item['command'],
+                        'description': item['description'],
+                        'filename': '',
+                        'code': None,
+                        'created_at': now,
+                        'blob': blob,
+                        'namespace': namespace
+                    }
+                    pending[code_id] = record
+                    results.append((record, True))
+                conn.executemany(
+                    'INSERT INTO user_codes (id, command, description, filename, code, created_at, blob, namespace) '
+                    'VALUES (:id, :command, :description, :filename, :code, :created_at, :blob, :namespace)',
+                    list(pending.values())
+                )
+                if pending:
+                    _bump_version(conn, namespace)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                self._discard_blobs(conn, created_blobs)
+                raise
+        return results
+
+    def _put_blob(self, code: str, created: set) -> str:
+        """写入代码内容，本次新建的文件记入 created（调用方持有 _write_lock）"""
+        digest = self.blobs.digest(code.encode('utf-8'))
+        if not self.blobs.exists(digest):
+            created.add(digest)
+        return self.blobs.put(code)
+
+    def _discard_blobs(self, conn: sqlite3.Connection, digests: set):
+        """事务回滚后删除本次新建、且没有记录引用的代码文件（调用方持有 _write_lock）"""
+        for digest in digests:
+            if conn.execute('SELECT 1 FROM user_codes WHERE blob = ?', (digest,)).fetchone() is None:
+                self.blobs.remove(digest)
+
+    def read_code(self, row: Dict) -> Optional[str]:
+        """读取记录对应的代码内容"""
+        if row.get('blob') and self.blobs is not None:
+            try:
+                return self.blobs.read(row['blob'])
+            except OSError:
+                return None
+        return row.get('code')
+
+    def delete(self, code_id: str) -> Optional[Dict]:
+        """删除一条用户代码，返回被删除的记录（不存在时返回 None）
+
+        代码内容不再被任何记录引用时一并删除。
+        """
+        with self._write_lock:
+            conn = self._conn()
+            row = conn.execute('SELECT * FROM user_codes WHERE id = ?', (code_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('DELETE FROM user_codes WHERE id = ?', (code_id,))
+            _bump_version(conn, row['namespace'])
+            conn.commit()
+            blob = row['blob']
+            if blob and self.blobs is not None and \
+                    conn.execute('SELECT 1 FROM user_codes WHERE blob = ?', (blob,)).fetchone() is None:
+                self.blobs.remove(blob)
+        return dict(row)
+
+    def backfill_blobs(self, code_dir: str) -> int:
+        """把旧记录的代码内容（code_<id>.lsp 文件或内联的 code 列）移入 BlobStore，返回处理条数
+
+        原 .lsp 文件保留不动。
+        """
+        conn = self._conn()
+        rows = conn.execute('SELECT id, filename, code FROM user_codes WHERE blob IS NULL').fetchall()
+        updates = []
+        for row in rows:
+            code = row['code']
+            filepath = os.path.join(code_dir, row['filename']) if row['filename'] else ''
+            if filepath and os.path.exists(filepath):
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    code = f.read()
+            if code is None:
+                continue
+            updates.append((self.blobs.put(code), row['id']))
+        if updates:
+            with self._write_lock:
+                conn.executemany('UPDATE user_codes SET blob = ?, code = NULL WHERE id = ?', updates)
+                conn.commit()
+        return len(updates)
+
+    # ---- 从 user_codes.txt 迁移 ----
+
+    def import_txt(self, path: str) -> int:
+        """一次性导入旧的 user_codes.txt，返回导入条数
+
+        每个文件只导入一次（按绝对路径记录在 store_meta 中），原文件保留不动。支持三种行格式：
+        代码ID|命令名称|描述|文件名|创建时间（本地服务端）、
+        代码ID|命令名称|描述|文件名|代码内容（百炼服务端，代码内联）、
+        命令名|描述|文件名|时间戳|命令类型（aliserver 适配器，没有代码ID，用文件名中的编号代替）。
+        内联的代码可以有多行：不是新记录开头的行都是上一条记录代码的后续行。
+        """
+        if not os.path.exists(path):
+            return 0
+        marker = f"imported:{os.path.abspath(path)}"
+        conn = self._conn()
+        if conn.execute('SELECT 1 FROM store_meta WHERE key = ?', (marker,)).fetchone():
+            return 0
+
+        records = []
+        code_lines = None  # 上一条记录的代码行（没有内联代码的记录为 None）
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            for line in f:
+                line = line.rstrip('\r\n')
+                record = _parse_legacy_line(line.split('|')) if _RECORD_START.match(line) else None
+                if record:
+                    _finish_code(records, code_lines)
+                    records.append(record)
+                    code_lines = [record['code']] if record.pop('inline') else None
+                elif code_lines is not None:
+                    code_lines.append(line)
+                elif line.strip() and not line.lstrip().startswith('#'):
+                    print(f"[用户代码] 跳过无法解析的行: {line[:80]}")
+        _finish_code(records, code_lines)
+
+        with self._write_lock:
+            before = conn.total_changes
+            conn.executemany(
+                'INSERT OR IGNORE INTO user_codes (id, command, description, filename, code, created_at) '
+                'VALUES (:id, :command, :description, :filename, :code, :created_at)',
+                records
+            )
+            imported = conn.total_changes - before
+            if imported:
+                _bump_version(conn, '')
+            conn.execute('INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)',
+                         (marker, time.strftime('%Y-%m-%d %H:%M:%S')))
+            conn.commit()
+        return imported
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _version_key(namespace: str) -> str:
+    return f"version:{namespace}"
+
+
+def _bump_version(conn: sqlite3.Connection, namespace: str):
+    """在当前事务中把命名空间的数据版本加一"""
+    conn.execute(
+        "INSERT INTO store_meta (key, value) VALUES (?, '1') "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+        (_version_key(namespace),)
+    )
+
+
+def content_code_id(command: str, description: str, blob: str, namespace: str = '') -> str:
+    """由命令名、描述和代码内容哈希生成的代码ID（16位十六进制）
+
+    非默认命名空间的代码ID同时包含命名空间，不同团队保存相同的代码不会冲突。
+    """
+    key = f"{command}\0{description}\0{blob}"
+    if namespace:
+        key = f"{namespace}\0{key}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def record_etag(row: Dict) -> Optional[str]:
+    """返回整条记录（代码内容和命令名、描述等字段）的接口所用的 ETag：代码ID + 内容哈希
+
+    相同的代码可以保存在多条记录中，只用内容哈希时这些记录共用 ETag，客户端可能拿到 304 而保留其他记录的字段；
+    代码ID由命令名、描述、内容哈希和命名空间生成，记录字段不同则 ETag 不同。
+    只返回代码内容的接口（/raw）仍用内容哈希。没有内容哈希的旧记录返回 None。
+    """
+    if not row.get('blob'):
+        return None
+    return f"{row['id']}-{row['blob']}"
+
+
+# user_codes.txt 中新记录的开头：第一个字段是代码ID或命令名（不含空白和 LISP 的括号、引号），至少有 4 个字段
+_RECORD_START = re.compile(r'^[^\s|();"#]+\|[^|]*\|[^|]*\|')
+
+
+def _finish_code(records: List[Dict], code_lines: Optional[List[str]]):
+    """把收集的代码行合并为上一条记录的代码"""
+    if code_lines is None:
+        return
+    code = '\n'.join(line for line in code_lines if line is not None).strip('\n')
+    records[-1]['code'] = code or None
+
+
+def _parse_legacy_line(parts: List[str]) -> Optional[Dict]:
+    """解析 user_codes.txt 记录的第一行
+
+    返回的 inline 表示记录按代码内联格式保存（代码可能在后续行中继续）。
+    """
+    if len(parts) < 4:
+        return None
+    parts = [part.strip() for part in parts[:4]] + parts[4:]
+
+    if len(parts) == 5 and parts[4].strip().lower() in KNOWN_TYPES:
+        # 命令名|描述|文件名|时间戳|命令类型
+        command, description, filename, created_at = parts[:4]
+        code_id = os.path.splitext(filename)[0].replace('code_', '') or command
+        code, inline = None, False
+    else:
+        code_id, command, description, filename = parts[:4]
+        rest = '|'.join(parts[4:])
+        if _looks_like_timestamp(rest.strip()) or not rest:
+            created_at, code = rest.strip(), None
+        else:
+            created_at, code = '', rest
+        inline = not created_at
+
+    if not code_id or not command:
+        return None
+    return {
+        'id': code_id,
+        'command': command,
+        'description': description,
+        'filename': filename,
+        'code': code,
+        'created_at': created_at or time.strftime('%Y-%m-%d %H:%M:%S'),
+        'inline': inline
+    }
+
+
+def _looks_like_timestamp(value: str) -> bool:
+    """是否为 2024-01-01 或 2024-01-01 12:00:00 形式的时间"""
+    try:
+        time.strptime(value[:10], '%Y-%m-%d')
+        return len(value) in (10, 19)
+    except ValueError:
+        return False
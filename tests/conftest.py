@@ -0,0 +1,11 @@
+"""
+CADChat 测试公共配置
+测试直接导入仓库根目录下的客户端模块和 server_common，不需要 Ollama 或百炼服务
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+from flask import Flask, g, request
+
+from server_common.admission import (AdmissionController, DEADLINE_HEADER, DeadlineExceeded, Overloaded,
+                                     admission_required, expired, remaining, request_deadline)
+
+
+def test_remaining_and_expired():
+    assert remaining(None) is None
+    assert not expired(None)
+    assert remaining(time.monotonic() + 10) > 9
+    assert expired(time.monotonic() - 1)
+
+
+def test_request_deadline_uses_shorter_of_client_and_server_limit():
+    app = Flask(__name__)
+    with app.test_request_context(headers={DEADLINE_HEADER: '2'}):
+        assert 1.5 < remaining(request_deadline(request, 10)) <= 2
+    with app.test_request_context(headers={DEADLINE_HEADER: '60'}):
+        assert remaining(request_deadline(request, 10)) <= 10
+    with app.test_request_context(headers={DEADLINE_HEADER: 'abc'}):
+        assert 9 < remaining(request_deadline(request, 10)) <= 10
+
+
+def test_full_queue_is_rejected():
+    controller = AdmissionController(max_concurrent=1, max_queue=0, max_wait=1)
+    with controller.admit():
+        with pytest.raises(Overloaded) as info:
+            with controller.admit():
+                pass
+        assert info.value.retry_after >= 1
+    assert controller.stats()['rejected'] == 1
+    assert controller.stats()['active'] == 0
+
+
+def test_queued_request_times_out_at_deadline():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, max_wait=5)
+    with controller.admit():
+        started = time.monotonic()
+        with pytest.raises(Overloaded):
+            with controller.admit(deadline=time.monotonic() + 0.05):
+                pass
+        assert time.monotonic() - started < 1
+    assert controller.stats()['timed_out'] == 1
+
+
+def test_queued_request_is_admitted_when_slot_frees():
+    controller = AdmissionController(max_concurrent=1, max_queue=1, max_wait=5)
+    admitted = threading.Event()
+
+    def waiter():
+        with controller.admit():
+            admitted.set()
+
+    with controller.admit():
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        while controller.stats()['waiting'] < 1:
+            time.sleep(0.01)
+        assert not admitted.is_set()
+    thread.join(5)
+    assert admitted.is_set()
+    assert controller.stats()['admitted'] == 2
+
+
+def test_decorator_maps_errors_to_status_codes():
+    app = Flask(__name__)
+    controller = AdmissionController(max_concurrent=1, max_queue=0, max_wait=1)
+    busy = AdmissionController(max_concurrent=0, max_queue=0, max_wait=1)
+
+    @app.route('/ok')
+    @admission_required(controller, 5)
+    def ok():
+        return {'remaining': remaining(g.deadline)}
+
+    @app.route('/slow')
+    @admission_required(controller, 5)
+    def slow():
+        raise DeadlineExceeded()
+
+    @app.route('/busy')
+    @admission_required(busy, 5)
+    def rejected():
+        return {}
+
+    client = app.test_client()
+    response = client.get('/ok', headers={DEADLINE_HEADER: '1'})
+    assert response.status_code == 200
+    assert response.get_json()['remaining'] <= 1
+    assert client.get('/slow').status_code == 504
+    response = client.get('/busy')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
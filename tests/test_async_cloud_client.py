@@ -0,0 +1,184 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+import pytest
+import requests
+
+from async_cloud_client import AsyncCloudClient, BackgroundLoop
+from cloud_client import INDEX_VERSION_HEADER, CloudClient
+
+
+class StubTransport:
+    """代替 HttpTransport：应答 /api/query、/api/models 和 /api/index/version，记录收到的查询和同时进行的请求数"""
+
+    pool_size = 4
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.queries = []
+        self.active = 0
+        self.max_active = 0
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def request(self, method, path, timeout=None, **kwargs):
+        if path == '/api/index/version':
+            return self._response({'index_version': 'v1'})
+        if path == '/api/models':
+            return self._response({'models': ['qwen2.5']})
+        requirement = kwargs['json']['requirement']
+        with self._lock:
+            self.queries.append(requirement)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay(requirement) if callable(self.delay) else self.delay)
+        finally:
+            with self._lock:
+                self.active -= 1
+        return self._response({
+            'requirement': requirement,
+            'matched': True,
+            'result': {'rag_results': [{'command': 'CIRCLE'}]}
+        })
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def close(self):
+        self.closed = True
+
+    @staticmethod
+    def _response(body):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(body).encode('utf-8')
+        response.headers[INDEX_VERSION_HEADER] = 'v1'
+        return response
+
+
+@pytest.fixture
+def make_client(tmp_path, monkeypatch):
+    monkeypatch.setenv('CACHE_DB_PATH', str(tmp_path / 'cache.db'))
+    monkeypatch.setenv('TELEMETRY_DB_PATH', str(tmp_path / 'telemetry.db'))
+    monkeypatch.setenv('MIRROR_ENABLED', 'false')
+    monkeypatch.setenv('CACHE_REVALIDATE', 'false')
+    monkeypatch.delenv('CADCHAT_NAMESPACE', raising=False)
+    clients = []
+
+    def make(transport):
+        client = CloudClient(server_url='http://127.0.0.1:9', env_file=f'.env.test-{uuid.uuid4().hex}')
+        client.transport.close()
+        client.transport = transport
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
+
+
+def test_query_many_keeps_input_order(make_client):
+    requirements = [f'画第{i}个图形' for i in range(6)]
+    # 先发出的请求更晚完成，打乱完成顺序
+    transport = StubTransport(delay=lambda requirement: 0.05 * (6 - int(requirement[2])))
+    client = make_client(transport)
+
+    async def run():
+        async with AsyncCloudClient(client=client, max_concurrency=6) as async_client:
+            return await async_client.query_many(requirements, use_cache=False)
+
+    results = asyncio.run(run())
+    assert [result['requirement'] for result in results] == requirements
+    assert transport.max_active > 1
+
+
+def test_query_many_sends_each_template_once(make_client):
+    transport = StubTransport(delay=0.02)
+    client = make_client(transport)
+    requirements = ['画一个半径为5的圆', '画一条直线', '画一个半径为10的圆', '画一个半径为20的圆']
+
+    async def run():
+        async with AsyncCloudClient(client=client) as async_client:
+            return await async_client.query_many(requirements)
+
+    results = asyncio.run(run())
+    assert sorted(transport.queries) == sorted(['画一个半径为5的圆', '画一条直线'])
+    assert [result['parameters'] for result in results] == [[5], [], [10], [20]]
+    # 共用缓存结果的需求拿到的是自己的原文
+    assert [result['requirement'] for result in results] == requirements
+    assert all(result['matched'] for result in results)
+
+
+def test_max_concurrency_is_respected(make_client):
+    transport = StubTransport(delay=0.05)
+    client = make_client(transport)
+
+    async def run():
+        async with AsyncCloudClient(client=client, max_concurrency=2) as async_client:
+            return await async_client.query_many([f'需求{i}' for i in range(6)], use_cache=False)
+
+    assert len(asyncio.run(run())) == 6
+    assert len(transport.queries) == 6
+    assert transport.max_active == 2
+
+
+def test_aclose_flushes_shared_client_without_closing_it(make_client, monkeypatch):
+    transport = StubTransport()
+    client = make_client(transport)
+    flushes = []
+    flush = client.cache.flush
+    monkeypatch.setattr(client.cache, 'flush', lambda: (flushes.append(1), flush())[1])
+
+    async def run():
+        async_client = AsyncCloudClient(client=client)
+        await async_client.query_requirement('画一个圆')
+        await async_client.aclose()
+        with pytest.raises(RuntimeError):
+            await async_client.query_requirement('画一个圆')
+
+    asyncio.run(run())
+    assert flushes == [1]
+    assert not transport.closed
+    # 共享的 client 仍可使用
+    assert client.query_requirement('画一条直线')['matched']
+
+
+def test_aclose_closes_own_client(make_client):
+    transport = StubTransport()
+
+    async def run():
+        async_client = AsyncCloudClient(server_url='http://127.0.0.1:9', env_file=f'.env.test-{uuid.uuid4().hex}')
+        async_client.client.transport.close()
+        async_client.client.transport = transport
+        await async_client.query_requirement('画一个圆')
+        await async_client.aclose()
+
+    asyncio.run(run())
+    assert transport.closed
+
+
+def test_background_loop_runs_coroutines_from_sync_code(make_client):
+    transport = StubTransport(delay=0.01)
+    client = make_client(transport)
+    loop = BackgroundLoop()
+    try:
+        async_client = AsyncCloudClient(client=client)
+        results = loop.run(async_client.query_many(['画一个圆', '画一条直线'], use_cache=False), timeout=5)
+        assert [result['requirement'] for result in results] == ['画一个圆', '画一条直线']
+
+        done = threading.Event()
+        future = loop.submit(async_client.get_ollama_models())
+        future.add_done_callback(lambda _: done.set())
+        assert done.wait(5)
+        assert future.result() == ['qwen2.5']
+        loop.run(async_client.aclose(), timeout=5)
+    finally:
+        loop.stop()
+    assert loop.loop.is_closed()
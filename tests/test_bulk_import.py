@@ -0,0 +1,69 @@
+import io
+import json
+import zipfile
+
+import pytest
+from flask import Flask, request
+
+from server_common.blob_store import BlobStore
+from server_common.bulk_import import extract_lisp_info, import_user_codes, validate_item
+from server_common.user_code_store import UserCodeStore
+
+app = Flask(__name__)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = UserCodeStore(str(tmp_path / 'codes.sqlite3'), BlobStore(str(tmp_path / 'blobs')))
+    yield store
+    store.close()
+
+
+def run_import(store, **request_kwargs):
+    with app.test_request_context('/api/user_codes/import', method='POST', **request_kwargs):
+        return import_user_codes(request, store, namespace='team-a')
+
+
+def test_extract_lisp_info_reads_command_and_comment():
+    info = extract_lisp_info('; 画一个五角星\n(defun c:STAR () (princ))')
+    assert info == {'command': 'STAR', 'description': '画一个五角星'}
+    assert extract_lisp_info('(defun helper () 1)')['command'] == 'helper'
+    assert extract_lisp_info('(princ)') is None
+
+
+def test_validate_item_fills_missing_fields_from_code():
+    item = validate_item({'code': '(defun c:QQ () 1)', 'description': ' 描述 '})
+    assert item == {'code': '(defun c:QQ () 1)', 'command': 'QQ', 'description': '描述'}
+    for bad in ({'code': ''}, {'code': '(princ)'}, [], {'code': '(defun c:QQ () 1)', 'command': 'x' * 200}):
+        with pytest.raises(ValueError):
+            validate_item(bad)
+
+
+def test_ndjson_import_reports_each_line(store):
+    lines = [
+        {'code': '; 画圆\n(defun c:C1 () 1)'},
+        {'code': ''},
+        {'code': '; 画圆\n(defun c:C1 () 1)'},
+    ]
+    body = '\n'.join(json.dumps(line, ensure_ascii=False) for line in lines) + '\nnot json\n'
+    result = run_import(store, data=body.encode('utf-8'), content_type='application/x-ndjson')
+    assert [item['status'] for item in result['items']] == ['created', 'error', 'exists', 'error']
+    assert (result['created'], result['existing'], result['failed']) == (1, 1, 2)
+    assert store.count('team-a') == 1
+
+
+def test_zip_import_reads_lisp_and_ndjson_members(store):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('a.lsp', '; 画矩形\n(defun c:R1 () 1)')
+        archive.writestr('b.lsp', '; 画直线\n(defun c:L1 () 1)'.encode('gbk'))
+        archive.writestr('more.ndjson', json.dumps({'command': 'X1', 'description': '其他', 'code': '(princ)'}))
+        archive.writestr('readme.txt', 'ignored')
+    result = run_import(store, data=buffer.getvalue(), content_type='application/zip')
+    assert result['created'] == 3
+    assert {item['command'] for item in result['items']} == {'R1', 'L1', 'X1'}
+
+
+def test_unknown_upload_format_is_rejected(store):
+    with pytest.raises(ValueError):
+        run_import(store, data=b'{}', content_type='application/json')
@@ -0,0 +1,65 @@
+import base64
+
+import numpy as np
+
+from server_common.catalog import CatalogLog, encode_vector, entry_id, table_entry_ids
+from server_common.command_loader import load_command_rows
+
+
+def test_entry_id_depends_on_content():
+    assert entry_id('basic', 'CIRCLE', '画圆') == entry_id('basic', 'CIRCLE', '画圆')
+    assert entry_id('basic', 'CIRCLE', '画圆') != entry_id('basic', 'CIRCLE', '画一个圆')
+    assert len(entry_id('basic', 'CIRCLE', '画圆')) == 20
+
+
+def test_table_entry_ids():
+    table = load_command_rows([{'id': 'x', 'command': 'QQ', 'description': '画星形'}])
+    assert table_entry_ids(table) == [entry_id('user_code', 'QQ', '画星形', '', 'x')]
+
+
+def test_encode_vector_is_float32_little_endian():
+    encoded = encode_vector([1.0, -0.5])
+    assert np.frombuffer(base64.b64decode(encoded), dtype='<f4').tolist() == [1.0, -0.5]
+
+
+def test_changes_between_versions(tmp_path):
+    log = CatalogLog(str(tmp_path / 'catalog.db'))
+    try:
+        v1 = log.record('bge-m3', ['a', 'b'])
+        assert log.changes(0, v1) is None  # 模型首次记录：早于重置标记的客户端需全量同步
+        v2 = log.record('bge-m3', ['b', 'c'])
+        assert log.changes(v1, v2) == ({'c'}, {'a'})
+        v3 = log.record('bge-m3', ['a', 'b'])
+        # 按顺序合并多次变化：在 v1 的条目集合上应用后得到 v3 的集合
+        added, removed = log.changes(v1, v3)
+        assert ({'a', 'b'} - removed) | added == {'a', 'b'}
+        assert log.changes(v2, v3) == ({'a'}, {'c'})
+        assert log.record('bge-m3', ['a', 'b']) == v3  # 条目不变时序号不变
+        assert log.stats()['entries'] == 2
+    finally:
+        log.close()
+
+
+def test_model_change_resets_log(tmp_path):
+    log = CatalogLog(str(tmp_path / 'catalog.db'))
+    try:
+        v1 = log.record('bge-m3', ['a'])
+        v2 = log.record('nomic', ['a'])
+        assert v2 > v1
+        assert log.model == 'nomic'
+        assert log.changes(v1, v2) is None
+        assert log.changes(v2, log.version()) == (set(), set())
+    finally:
+        log.close()
+
+
+def test_truncated_log_requires_full_sync(tmp_path):
+    log = CatalogLog(str(tmp_path / 'catalog.db'), max_rows=3)
+    try:
+        v1 = log.record('m', ['a'])
+        log.record('m', ['a', 'b', 'c'])
+        v3 = log.record('m', ['d'])
+        assert log.changes(v1, v3) is None
+        assert log.stats()['log_rows'] <= 3
+    finally:
+        log.close()
@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import client_cache
+from client_cache import LocalCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = LocalCache(str(tmp_path / 'cache.db'), batch_size=4, flush_interval=0.02)
+    yield cache
+    cache.close()
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_put_is_visible_before_and_after_flush(cache):
+    cache.put('画圆', {'command': 'CIRCLE'}, version='v1')
+    assert cache.get('画圆', 'v1') == {'command': 'CIRCLE'}
+    assert cache.flush() == 1
+    assert cache.get('画圆', 'v1') == {'command': 'CIRCLE'}
+
+
+def test_background_flush_commits_pending_writes(cache):
+    cache.put('画圆', {'command': 'CIRCLE'})
+    wait_until(lambda: not cache._pending)
+    row = sqlite3.connect(cache.db_path).execute('SELECT matched_code FROM cache').fetchone()
+    assert row == ('{"command": "CIRCLE"}',)
+
+
+def test_version_change_invalidates_entry(cache):
+    cache.put('画圆', {'command': 'CIRCLE'}, version='v1')
+    cache.flush()
+    assert cache.lookup('画圆', 'v2') == ({'command': 'CIRCLE'}, True)
+    assert cache.get('画圆', 'v2') is None
+    assert cache.get('画圆') is None
+    assert cache.invalidated == 1
+
+
+def test_max_age_marks_entry_stale_without_deleting(cache):
+    cache.put('画圆', {'command': 'CIRCLE'})
+    time.sleep(0.05)
+    assert cache.lookup('画圆', max_age=0.01) == ({'command': 'CIRCLE'}, True)
+    assert cache.lookup('画圆') == ({'command': 'CIRCLE'}, False)
+
+
+def test_eviction_keeps_recently_accessed_entries(tmp_path):
+    cache = LocalCache(str(tmp_path / 'cache.db'), batch_size=100, flush_interval=10, max_entries=2)
+    try:
+        for key in ('a', 'b'):
+            cache.put(key, {'command': key})
+            cache.flush()
+            time.sleep(0.01)
+        cache.lookup('a')  # a 比 b 更近访问
+        cache.put('c', {'command': 'c'})
+        cache.flush()
+        assert cache.get('a') is not None
+        assert cache.get('b') is None
+        assert cache.evicted == 1
+    finally:
+        cache.close()
+
+
+def test_user_code_cache(cache):
+    cache.put_user_code('k', 'etag-1', {'code': '(defun c:QQ () 1)'})
+    assert cache.get_user_code('k') == ('etag-1', {'code': '(defun c:QQ () 1)'})
+    cache.flush()
+    cache.delete_user_code('k')
+    assert cache.get_user_code('k') is None
+    cache.flush()
+    assert cache.get_user_code('k') is None
+
+
+def test_repeated_flushes_reuse_one_writer_connection(tmp_path, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+
+    def counting_connect(*args, **kwargs):
+        opened.append(threading.current_thread().name)
+        return connect(*args, **kwargs)
+
+    monkeypatch.setattr(client_cache.sqlite3, 'connect', counting_connect)
+    cache = LocalCache(str(tmp_path / 'cache.db'), batch_size=100, flush_interval=0.01)
+    try:
+        for i in range(5):
+            cache.put(f'q{i}', {'command': str(i)})
+            wait_until(lambda: not cache._pending)
+        # 写入连接 + 读连接（本线程），多次后台提交不再新建连接
+        cache.lookup('q0')
+        assert len(opened) == 2
+    finally:
+        cache.close()
+
+
+def test_lookup_does_not_start_flush_thread(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    writer = LocalCache(path)
+    writer.put('画圆', {'command': 'CIRCLE'})
+    writer.close()
+
+    cache = LocalCache(path, batch_size=100, flush_interval=10)
+    try:
+        before = threading.active_count()
+        for _ in range(20):
+            assert cache.lookup('画圆') is not None
+        assert threading.active_count() == before
+        # 访问时间随下一次提交写入
+        assert cache.flush() == 0
+        last_access = sqlite3.connect(path).execute('SELECT last_access FROM cache').fetchone()[0]
+        assert last_access > time.time() - 5
+    finally:
+        cache.close()
@@ -0,0 +1,130 @@
+import socket
+import threading
+import time
+
+import pytest
+import requests
+from flask import Flask, jsonify
+from werkzeug.serving import make_server
+
+from client_endpoints import HEALTH_PATH, LEGACY_HEALTH_PATH, EndpointPool
+from client_transport import HttpTransport
+
+
+class Server:
+    def __init__(self, name, health_delay=0.0, legacy=False, post_delay=0.0):
+        self.name = name
+        self.posts = 0
+        app = Flask(name)
+
+        def health():
+            time.sleep(health_delay)
+            return jsonify({'status': 'ok'})
+
+        app.add_url_rule(LEGACY_HEALTH_PATH if legacy else HEALTH_PATH, 'health', health)
+
+        @app.route('/api/query', methods=['POST'])
+        def query():
+            self.posts += 1
+            time.sleep(post_delay)
+            return jsonify({'server': name})
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def dead_url():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f'http://127.0.0.1:{port}'
+
+
+def make_transport(url):
+    return HttpTransport(url, read_timeout=0.5, connect_timeout=0.5, retries=0)
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(*args, **kwargs):
+        server = Server(*args, **kwargs)
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.server.shutdown()
+
+
+def test_requires_at_least_one_url():
+    with pytest.raises(ValueError):
+        EndpointPool([], make_transport)
+
+
+def test_probe_orders_endpoints_by_latency(servers):
+    slow = servers('slow', health_delay=0.1)
+    fast = servers('fast')
+    pool = EndpointPool([slow.url, fast.url], make_transport)
+    try:
+        pool.probe_all()
+        assert [e.url for e in pool.ordered()] == [fast.url, slow.url]
+        assert pool.post('/api/query').json() == {'server': 'fast'}
+        assert pool.stats()['active'] == fast.url
+    finally:
+        pool.close()
+
+
+def test_legacy_health_path_is_used_when_api_health_missing(servers):
+    legacy = servers('legacy', legacy=True)
+    pool = EndpointPool([legacy.url, dead_url()], make_transport)
+    try:
+        pool.probe_all()
+        endpoint = pool.endpoints[0]
+        assert endpoint.healthy is True
+        assert endpoint.health_path == LEGACY_HEALTH_PATH
+        assert pool.endpoints[1].healthy is False
+        assert pool.ordered()[0] is endpoint
+    finally:
+        pool.close()
+
+
+def test_connection_failure_fails_over_for_post(servers):
+    alive = servers('alive')
+    down = dead_url()
+    pool = EndpointPool([down, alive.url], make_transport)
+    try:
+        assert pool.post('/api/query').json() == {'server': 'alive'}
+        stats = {e['url']: e for e in pool.stats()['endpoints']}
+        assert stats[down]['healthy'] is False
+        assert stats[down]['failovers'] == 1
+        # 不健康的服务端排在后面
+        assert pool.ordered()[0].url == alive.url
+    finally:
+        pool.close()
+
+
+def test_post_is_not_resent_after_read_timeout(servers):
+    slow = servers('slow', post_delay=1.0)
+    other = servers('other')
+    pool = EndpointPool([slow.url, other.url], make_transport)
+    try:
+        with pytest.raises(requests.exceptions.Timeout):
+            pool.post('/api/query')
+        assert slow.posts == 1
+        assert other.posts == 0
+    finally:
+        pool.close()
+
+
+def test_all_endpoints_down_raises():
+    pool = EndpointPool([dead_url(), dead_url()], make_transport)
+    try:
+        with pytest.raises(requests.exceptions.ConnectionError):
+            pool.get('/api/query')
+        assert all(e.healthy is False for e in pool.endpoints)
+    finally:
+        pool.close()
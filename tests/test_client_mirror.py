@@ -0,0 +1,66 @@
+import pytest
+
+from client_mirror import CatalogMirror
+from server_common.catalog import encode_vector
+
+
+def entry(entry_id, command, description, vector, cmd_type='basic', **extra):
+    return dict({'id': entry_id, 'command': command, 'description': description, 'type': cmd_type,
+                 'vector': encode_vector(vector)}, **extra)
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    mirror = CatalogMirror(str(tmp_path / 'mirror.db'))
+    yield mirror
+    mirror.close()
+
+
+def test_full_sync_then_delta(mirror):
+    assert mirror.is_empty() and mirror.version == 0
+    result = mirror.apply({'model': 'bge-m3', 'version': 1, 'full': True,
+                           'added': [entry('a', 'CIRCLE', '画圆', [1, 0]), entry('b', 'LINE', '画直线', [0, 1])]},
+                          index_version='g1')
+    assert result == {'added': 2, 'removed': 0, 'entries': 2}
+    assert (mirror.model, mirror.version, mirror.index_version) == ('bge-m3', 1, 'g1')
+
+    mirror.apply({'model': 'bge-m3', 'version': 2, 'removed': ['b'],
+                  'added': [entry('c', 'RECTANG', '画矩形', [0.7, 0.7])]})
+    assert [cmd['command'] for cmd in mirror.search([1, 0], top_k=5)] == ['CIRCLE', 'RECTANG']
+
+
+def test_search_by_cosine_similarity_and_type(mirror):
+    mirror.apply({'model': 'm', 'version': 1, 'full': True, 'added': [
+        entry('a', 'CIRCLE', '画圆', [1, 0]),
+        entry('b', 'STAR', '画星形', [0.9, 0.1], cmd_type='user_code', code_id='x1'),
+    ]})
+    results = mirror.search([1, 0], top_k=2)
+    assert [cmd['command'] for cmd in results] == ['CIRCLE', 'STAR']
+    assert results[0]['similarity'] == pytest.approx(1.0)
+    # 服务端的 user_program 类型即 user_code
+    assert [cmd['command'] for cmd in mirror.search([1, 0], types=['user_program'])] == ['STAR']
+    assert mirror.search([1, 0, 0]) == []  # 维度不同（模型不同）时不检索
+
+
+def test_namespace_entries_replaced_and_model_change_clears(mirror):
+    shared = {'model': 'm', 'version': 1, 'full': True, 'added': [entry('a', 'CIRCLE', '画圆', [1, 0])]}
+    mirror.apply(dict(shared, namespace_entries=[entry('t1', 'TEAM', '团队命令', [0, 1], cmd_type='user_code')],
+                      namespace_version='n1'), namespace='team-a')
+    assert mirror.namespace_version('team-a') == 'n1'
+    assert {cmd['command'] for cmd in mirror.search([0, 1], top_k=5, namespace='team-a')} == {'CIRCLE', 'TEAM'}
+    assert [cmd['command'] for cmd in mirror.search([0, 1], top_k=5)] == ['CIRCLE']
+
+    mirror.apply({'model': 'other', 'version': 5, 'full': True, 'added': [entry('z', 'ARC', '画圆弧', [1, 0])],
+                  'namespace_version': 'n2'}, namespace='team-a')
+    assert mirror.namespace_version('team-a') is None  # 命名空间条目已随模型变化清空
+    assert [cmd['command'] for cmd in mirror.search([1, 0], top_k=5, namespace='team-a')] == ['ARC']
+
+
+def test_keyword_search(mirror):
+    mirror.apply({'model': 'm', 'version': 1, 'full': True, 'added': [
+        entry('a', 'CIRCLE', '画一个圆', [1, 0]),
+        entry('b', 'RECTANG', '画矩形', [0, 1], cmd_type='lisp'),
+    ]})
+    assert mirror.keyword_search('画矩形')[0]['command'] == 'RECTANG'
+    assert [cmd['command'] for cmd in mirror.keyword_search('画一个', types=['basic'])] == ['CIRCLE']
+    assert mirror.keyword_search('完全无关') == []
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+from flask import Flask, jsonify
+
+from client_telemetry import TelemetryStore, parse_server_timing, parse_time, percentile
+from server_common.responses import enable_compression, enable_server_timing, record_timing
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TelemetryStore(str(tmp_path / 'telemetry.db'), flush_interval=10)
+    yield store
+    store.close()
+
+
+def test_parse_server_timing():
+    header = 'queue;dur=0.5, search;desc="向量检索";dur=12.25, total;dur=13, broken;dur=x, cache'
+    assert parse_server_timing(header) == {'queue': 0.5, 'search': 12.25, 'total': 13.0}
+    assert parse_server_timing(None) == {}
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([7.0], 99) == 7.0
+
+
+def test_parse_time():
+    assert parse_time(None) is None
+    assert abs(parse_time('2h') - (time.time() - 7200)) < 5
+    assert parse_time('2026-10-19') == pytest.approx(time.mktime((2026, 10, 19, 0, 0, 0, 0, 0, -1)))
+
+
+def test_server_timing_header_feeds_client_stages(store):
+    # 服务端记录的阶段经 Server-Timing 响应头传到客户端，网络耗时 = 往返 - 服务端 total
+    app = Flask(__name__)
+    enable_server_timing(app)
+    enable_compression(app)
+
+    @app.route('/api/query', methods=['POST'])
+    def query():
+        record_timing('search', 3.0)
+        record_timing('search', 2.0)
+        return jsonify({'matched': True})
+
+    response = app.test_client().post('/api/query', json={})
+    server = parse_server_timing(response.headers['Server-Timing'])
+    assert server['search'] == 5.0
+    assert 'total' in server
+
+    with store.action('query') as timer:
+        timer.add_http(server['total'] + 40.0, response)
+    assert timer.stages['http'] == pytest.approx(server['total'] + 40.0)
+    assert timer.stages['server_search'] == 5.0
+    assert timer.stages['network'] == pytest.approx(40.0)
+    assert 'total' in timer.stages
+
+
+def test_report_percentiles_per_action_and_stage(store):
+    for ms in range(1, 11):
+        store.write('query', {'http': float(ms), 'cache': 0.5})
+    store.write('execute', {'cad_run': 100.0})
+    rows = {(row['action'], row['stage']): row for row in store.report()}
+    assert rows[('query', 'http')]['count'] == 10
+    assert rows[('query', 'http')]['p50'] == 5.0
+    assert rows[('query', 'http')]['p99'] == 10.0
+    assert rows[('query', 'http')]['max'] == 10.0
+    assert rows[('query', 'cache')]['p95'] == 0.5
+    assert [row['stage'] for row in store.report(action='execute')] == ['cad_run']
+    assert store.report(since=time.time() + 60) == []
+
+
+def test_action_timer_writes_once(store):
+    timer = store.action('generate')
+    timer.add('kimi', 10.0)
+    timer.finish()
+    timer.finish()
+    assert store.flush() == 2  # kimi + total
+
+
+def test_disabled_store_does_not_record(tmp_path):
+    store = TelemetryStore(str(tmp_path / 'telemetry.db'), enabled=False)
+    with store.action('query') as timer:
+        timer.add('http', 1.0)
+    assert store.flush() == 0
+    store.close()
@@ -0,0 +1,110 @@
+import threading
+import time
+import uuid
+
+import pytest
+from flask import Flask, jsonify
+from werkzeug.serving import make_server
+
+from cloud_client import INDEX_VERSION_HEADER, CloudClient
+
+
+class FakeServer:
+    """在本机端口上运行的最小服务端：/api/query 和 /api/index/version"""
+
+    def __init__(self):
+        self.version = 'v1'
+        self.command = 'CIRCLE'
+        self.queries = 0
+        self.version_release = threading.Event()
+        self.version_release.set()
+        app = Flask(__name__)
+
+        @app.route('/api/query', methods=['POST'])
+        def query():
+            self.queries += 1
+            response = jsonify({'matched': True, 'result': {'rag_results': [{'command': self.command}]}})
+            response.headers[INDEX_VERSION_HEADER] = self.version
+            return response
+
+        @app.route('/api/index/version')
+        def index_version():
+            self.version_release.wait(5)
+            return jsonify({'index_version': self.version})
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def server():
+    server = FakeServer()
+    yield server
+    server.version_release.set()
+    server.server.shutdown()
+
+
+@pytest.fixture
+def client(server, tmp_path, monkeypatch):
+    monkeypatch.setenv('CACHE_DB_PATH', str(tmp_path / 'cache.db'))
+    monkeypatch.setenv('TELEMETRY_DB_PATH', str(tmp_path / 'telemetry.db'))
+    monkeypatch.setenv('MIRROR_ENABLED', 'false')
+    monkeypatch.setenv('CACHE_REVALIDATE', 'true')
+    monkeypatch.setenv('HTTP_RETRIES', '0')
+    monkeypatch.delenv('CADCHAT_NAMESPACE', raising=False)
+    client = CloudClient(server_url=server.url, env_file=f'.env.test-{uuid.uuid4().hex}')
+    yield client
+    client.close()
+
+
+def test_cache_hit_does_not_wait_for_version_check(server, client):
+    first = client.query_requirement('画一个圆')
+    assert first['result']['rag_results'][0]['command'] == 'CIRCLE'
+
+    # 索引已更新，而确认版本的请求很慢：命中缓存仍应立即返回，版本在后台确认
+    server.version = 'v2'
+    server.command = 'ELLIPSE'
+    server.version_release.clear()
+    client._version_checked_at = 0.0
+    updates = []
+    updated = threading.Event()
+
+    def on_update(result):
+        updates.append(result)
+        updated.set()
+
+    started = time.perf_counter()
+    cached = client.query_requirement('画一个圆', on_update=on_update)
+    assert time.perf_counter() - started < 0.5
+    assert cached['result']['rag_results'][0]['command'] == 'CIRCLE'
+    assert server.queries == 1
+
+    server.version_release.set()
+    assert updated.wait(5)
+    assert updates[0]['result']['rag_results'][0]['command'] == 'ELLIPSE'
+    assert client.index_version == 'v2'
+
+
+def test_background_version_check_skips_query_when_unchanged(server, client):
+    client.query_requirement('画一个圆')
+    client._version_checked_at = 0.0
+    client.query_requirement('画一个圆')
+    client._revalidator.shutdown(wait=True)
+    client._revalidator = None
+    assert server.queries == 1
+    assert client._version_checked_at > 0
+
+
+def test_endpoint_pool_transports_do_not_retry(server, tmp_path, monkeypatch):
+    monkeypatch.setenv('CADCHAT_SERVER_URLS', f'{server.url},{server.url}/')
+    monkeypatch.setenv('CACHE_DB_PATH', str(tmp_path / 'cache.db'))
+    monkeypatch.setenv('TELEMETRY_DB_PATH', str(tmp_path / 'telemetry.db'))
+    monkeypatch.setenv('MIRROR_ENABLED', 'false')
+    monkeypatch.setenv('HTTP_RETRIES', '3')
+    client = CloudClient(env_file=f'.env.test-{uuid.uuid4().hex}')
+    try:
+        # 多服务端时由切换代替重试
+        assert [e.transport.retries for e in client.transport.endpoints] == [0, 0]
+    finally:
+        client.close()
@@ -0,0 +1,62 @@
+from server_common.command_loader import USER_CODES_LAYOUT, load_command_file, load_command_rows
+
+
+def write(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_uniform_library_file(tmp_path):
+    path = write(tmp_path / 'basic.txt',
+                 '# 注释\n'
+                 'CIRCLE|画圆|C|basic.txt|basic|basic\n'
+                 '\n'
+                 'LINE|画直线|L|basic.txt|basic|BASIC\n')
+    table = load_command_file(path)
+    assert len(table) == 2
+    assert table[0] == {'command': 'CIRCLE', 'description': '画圆', 'alias': 'C', 'filename': 'basic.txt',
+                        'timestamp': 'basic', 'type': 'basic'}
+    assert table.types[1] == 'basic'
+    assert table.types[0] is table.types[1]  # 低基数字段共享驻留字符串
+    assert table.text(0) == '画圆 CIRCLE C'
+    assert table.source_file(1) == path
+
+
+def test_mixed_field_counts(tmp_path):
+    path = write(tmp_path / 'lisp.txt',
+                 'A|描述A|a.lsp|2024|lisp\n'          # 5 字段：无别名
+                 'B|描述B|bb|lisp\n'                  # 4 字段，最后一列是类型
+                 'C|描述C|c.lsp|2024\n'               # 4 字段：文件名|时间戳
+                 'D|描述D\n'                          # 只有命令名和描述
+                 '|没有命令名\n')
+    table = load_command_file(path, default_type='lisp')
+    assert [row['command'] for row in table] == ['A', 'B', 'C', 'D']
+    assert table[1]['alias'] == 'bb'
+    assert table[2]['filename'] == 'c.lsp'
+    assert table.count_by_type() == {'lisp': 4}
+
+
+def test_user_codes_layout_and_append(tmp_path):
+    basic = load_command_file(write(tmp_path / 'basic.txt', 'CIRCLE|画圆|C|f|t|basic\n'))
+    path = write(tmp_path / 'user.txt', 'id1|QQ|画星形|qq.lsp|2024-01-01\nid2|WW|画方形|ww.lsp|2024-01-02\n')
+    table = load_command_file(path, basic, layout=USER_CODES_LAYOUT, default_type='user_code')
+    assert len(table) == 3
+    assert table[1]['code_id'] == 'id1'
+    assert table.type_rows() == {'basic': [0], 'user_code': [1, 2]}
+    assert table.source_file(0) != table.source_file(2)
+
+
+def test_missing_file_returns_table(tmp_path):
+    assert len(load_command_file(str(tmp_path / 'missing.txt'))) == 0
+
+
+def test_load_command_rows_skips_incomplete_records():
+    rows = [
+        {'id': 'a1', 'command': 'QQ', 'description': '画星形', 'filename': 'qq.lsp', 'created_at': '2024'},
+        {'id': 'a2', 'command': 'WW', 'description': ''},
+    ]
+    table = load_command_rows(rows, source='db')
+    assert len(table) == 1
+    assert table[0]['code_id'] == 'a1'
+    assert table[0]['type'] == 'user_code'
+    assert table.source_file(0) == 'db'
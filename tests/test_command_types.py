@@ -0,0 +1,29 @@
+import pytest
+
+from server_common.command_types import command_types, parse_command_types
+
+
+def test_empty_value_means_no_filter():
+    assert parse_command_types(None) is None
+    assert parse_command_types('') is None
+    assert parse_command_types([' ', '']) is None
+
+
+def test_comma_string_and_list_are_deduplicated_in_order():
+    assert parse_command_types('lisp, Basic,lisp') == ['lisp', 'basic']
+    assert parse_command_types(['user_code', 'basic']) == ['user_code', 'basic']
+
+
+def test_other_server_user_type_is_an_alias():
+    assert parse_command_types('user_program') == ['user_code']
+    assert parse_command_types('user_code,user_program', 'user_program') == ['user_program']
+
+
+def test_unknown_type_raises():
+    with pytest.raises(ValueError, match='未知的命令类型'):
+        parse_command_types('macro')
+
+
+def test_command_types_per_server():
+    assert command_types('user_code') == ('basic', 'lisp', 'user_code')
+    assert command_types('user_program') == ('basic', 'lisp', 'user_program')
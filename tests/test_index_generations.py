@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from server_common.command_loader import CommandTable
+from server_common.index_generations import (
+    GenerationStore, commands_digest, evaluate, load_eval_queries, passes_eval, sample_eval_queries
+)
+
+
+def make_table(rows):
+    table = CommandTable()
+    for command, description, cmd_type in rows:
+        table.commands.append(command)
+        table.descriptions.append(description)
+        table.aliases.append('')
+        table.filenames.append('')
+        table.timestamps.append('')
+        table.types.append(cmd_type)
+    return table
+
+
+def new_generation(store, model):
+    generation, _ = store.new_generation(model)
+    store.write_meta(generation, {'model': model})
+    return generation
+
+
+def test_activate_keeps_current_and_previous_only(tmp_path):
+    store = GenerationStore(str(tmp_path))
+    first = new_generation(store, 'bge-m3')
+    store.activate(first)
+    second = new_generation(store, 'bge-m3')
+    store.activate(second)
+    third = new_generation(store, 'nomic')
+    store.activate(third)
+
+    assert store.current() == third
+    assert store.previous() == second
+    assert not os.path.exists(store.path(first))
+
+
+def test_rollback_swaps_current_and_previous(tmp_path):
+    store = GenerationStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        store.rollback()
+    old = new_generation(store, 'bge-m3')
+    store.activate(old)
+    new = new_generation(store, 'nomic')
+    store.activate(new)
+
+    assert store.rollback() == old
+    assert (store.current(), store.previous()) == (old, new)
+
+
+def test_reject_remembers_model_until_activated(tmp_path):
+    store = GenerationStore(str(tmp_path))
+    candidate = new_generation(store, 'nomic')
+    store.reject(candidate, '评测结果低于当前版本')
+    assert store.is_rejected('nomic')
+    assert not os.path.exists(store.path(candidate))
+
+    forced = new_generation(store, 'nomic')
+    store.activate(forced)
+    assert not store.is_rejected('nomic')
+
+
+def test_commands_digest_tracks_text_and_type():
+    table = make_table([('CIRCLE', '绘制圆', 'basic')])
+    same = make_table([('CIRCLE', '绘制圆', 'basic')])
+    retyped = make_table([('CIRCLE', '绘制圆', 'lisp')])
+    assert commands_digest(table) == commands_digest(same)
+    assert commands_digest(table) != commands_digest(retyped)
+
+
+def test_sampled_queries_are_not_the_indexed_descriptions():
+    table = make_table([
+        ('LINE', '绘制直线', 'basic'),
+        ('COPY', '复制对象', 'basic'),
+        ('MOVE', '移动对象', 'basic'),
+        ('POINT', '绘制点', 'basic'),
+        ('ACADINFO', '收集安装信息，生成系统配置报告', 'lisp'),
+    ])
+    queries = sample_eval_queries(table)
+    # “对象”对应两个命令、“点”不足两个字，都不作为查询
+    assert queries == [('直线', 'LINE'), ('生成系统配置报告', 'ACADINFO')]
+    assert all(query not in table.descriptions for query, _ in queries)
+
+
+def test_load_eval_queries_skips_comments_and_bad_lines(tmp_path):
+    path = tmp_path / 'eval.txt'
+    path.write_text('# 注释\n画一个圆|CIRCLE\n没有命令名\n|LINE\n删掉|ERASE|多余\n', encoding='utf-8')
+    assert load_eval_queries(str(path)) == [('画一个圆', 'CIRCLE'), ('删掉', 'ERASE')]
+    assert load_eval_queries(str(tmp_path / 'missing.txt')) == []
+
+
+def test_evaluate_and_gate():
+    ranking = {'圆': ['ARC', 'CIRCLE'], '线': ['LINE'], '删': ['MOVE']}
+    result = evaluate(lambda q: ranking[q], [('圆', 'circle'), ('线', 'LINE'), ('删', 'ERASE')])
+    assert result['queries'] == 3
+    assert result['recall_at_k'] == pytest.approx(2 / 3)
+    assert result['mrr'] == pytest.approx((0.5 + 1) / 3)
+
+    baseline = {'recall_at_k': 0.8, 'mrr': 0.6}
+    assert passes_eval(baseline, {'recall_at_k': 0.79, 'mrr': 0.6}, 0.02)
+    assert not passes_eval(baseline, {'recall_at_k': 0.9, 'mrr': 0.5}, 0.02)
@@ -0,0 +1,135 @@
+import threading
+import time
+
+import pytest
+
+from server_common.jobs import JobCancelled, JobConflict, JobManager
+
+
+def wait_finished(job, timeout=5.0):
+    deadline = time.time() + timeout
+    while job.status in ('queued', 'running'):
+        assert time.time() < deadline, f'任务未结束: {job.to_dict()}'
+        time.sleep(0.01)
+    return job
+
+
+def test_job_reports_progress_and_result():
+    def run(job):
+        job.set_total(3)
+        for _ in range(3):
+            job.advance()
+        return {'total_commands': 3}
+
+    job = wait_finished(JobManager().submit('rebuild', run))
+    info = job.to_dict()
+    assert info['status'] == 'succeeded'
+    assert info['done'] == info['total'] == 3
+    assert info['progress'] == 1.0
+    assert info['result'] == {'total_commands': 3}
+    assert info['runs'] == 1
+
+
+def test_failure_is_recorded():
+    def run(job):
+        raise RuntimeError('嵌入创建失败')
+
+    job = wait_finished(JobManager().submit('rebuild', run))
+    assert job.status == 'failed'
+    assert job.errors == ['嵌入创建失败']
+
+
+def test_cancel_stops_job_at_checkpoint():
+    started = threading.Event()
+
+    def run(job):
+        started.set()
+        while True:
+            job.check_cancelled()
+            time.sleep(0.01)
+
+    manager = JobManager()
+    job = manager.submit('rebuild', run)
+    assert started.wait(5)
+    manager.cancel(job.id)
+    assert wait_finished(job).status == 'cancelled'
+    with pytest.raises(ValueError):
+        manager.cancel(job.id)
+
+
+def test_second_submit_conflicts_without_coalesce():
+    release = threading.Event()
+    manager = JobManager()
+    job = manager.submit('rebuild', lambda job: release.wait(5))
+    try:
+        with pytest.raises(JobConflict) as info:
+            manager.submit('rebuild', lambda job: None)
+        assert info.value.job is job
+        # 其他类型的任务不受影响
+        other = manager.submit('import', lambda job: None)
+        assert wait_finished(other).status == 'succeeded'
+    finally:
+        release.set()
+    wait_finished(job)
+
+
+def test_coalesced_submits_rerun_active_job_once():
+    started = threading.Event()
+    release = threading.Event()
+    seen = []
+    data = {'version': 1}
+
+    def run(job):
+        seen.append(data['version'])
+        started.set()
+        release.wait(5)
+        return data['version']
+
+    manager = JobManager()
+    job = manager.submit('rebuild', run, coalesce=True)
+    assert started.wait(5)
+    # 运行期间数据又变了两次：返回同一个任务，结束后只再执行一次，结果反映最新数据
+    data['version'] = 2
+    assert manager.submit('rebuild', run, coalesce=True) is job
+    data['version'] = 3
+    assert manager.submit('rebuild', run, coalesce=True) is job
+    assert job.to_dict()['rerun_pending'] is True
+    release.set()
+
+    wait_finished(job)
+    assert job.status == 'succeeded'
+    assert seen == [1, 3]
+    assert job.runs == 2
+    assert job.result == 3
+    assert job.to_dict()['rerun_pending'] is False
+
+    # 任务结束后的提交新建任务
+    later = manager.submit('rebuild', lambda job: 'later', coalesce=True)
+    assert later is not job
+    assert wait_finished(later).result == 'later'
+
+
+def test_cancelled_job_is_not_rerun():
+    started = threading.Event()
+
+    def run(job):
+        started.set()
+        while True:
+            job.check_cancelled()
+            time.sleep(0.01)
+
+    manager = JobManager()
+    job = manager.submit('rebuild', run, coalesce=True)
+    assert started.wait(5)
+    manager.submit('rebuild', run, coalesce=True)
+    manager.cancel(job.id)
+    wait_finished(job)
+    assert job.status == 'cancelled'
+    assert job.runs == 1
+
+
+def test_job_cancelled_exception_from_fn_marks_cancelled():
+    def run(job):
+        raise JobCancelled()
+
+    assert wait_finished(JobManager().submit('rebuild', run)).status == 'cancelled'
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+from flask import Flask, request
+
+from server_common.pagination import DEFAULT_PAGE_SIZE, list_response, parse_page_args
+
+TOTAL = 250
+
+
+def rows(start, stop):
+    for i in range(start, stop):
+        yield {'id': i}
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+
+    @app.route('/items')
+    def items():
+        try:
+            return list_response(request, 'items', TOTAL, rows, extra={'source': 'test'})
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+    return app.test_client()
+
+
+def test_no_paging_args_returns_full_list(client):
+    data = client.get('/items').get_json()
+    assert len(data['items']) == TOTAL
+    assert data['next_cursor'] is None
+    assert data['source'] == 'test'
+
+
+def test_cursor_only_uses_default_page_size(client):
+    data = client.get('/items?cursor=0').get_json()
+    assert len(data['items']) == DEFAULT_PAGE_SIZE
+    assert data['next_cursor'] == str(DEFAULT_PAGE_SIZE)
+
+
+def test_pages_follow_next_cursor(client):
+    seen, cursor = [], '0'
+    while cursor is not None:
+        data = client.get(f'/items?cursor={cursor}&limit=60').get_json()
+        seen.extend(item['id'] for item in data['items'])
+        cursor = data['next_cursor']
+    assert seen == list(range(TOTAL))
+
+
+def test_ndjson_streams_rows_with_headers(client):
+    response = client.get('/items?format=ndjson&cursor=200&limit=30')
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [item['id'] for item in lines] == list(range(200, 230))
+    assert response.headers['X-Total-Count'] == str(TOTAL)
+    assert response.headers['X-Next-Cursor'] == '230'
+
+
+def test_invalid_args_are_rejected(client):
+    assert client.get('/items?limit=0').status_code == 400
+    assert client.get('/items?cursor=-1').status_code == 400
+    with pytest.raises(ValueError):
+        parse_page_args({'cursor': 'abc'})
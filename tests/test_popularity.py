@@ -0,0 +1,80 @@
+import sqlite3
+
+import pytest
+
+from server_common.popularity import PopularityStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PopularityStore(str(tmp_path / 'popularity.db'), top_n=3, flush_interval=60)
+    yield store
+    store.close()
+
+
+def test_usage_and_feedback_counts(store):
+    store.record_usage('CIRCLE', 'basic', '画圆')
+    store.record_usage('CIRCLE')
+    counts = store.record_feedback('CIRCLE', success=False, requirement='画圆')
+    assert counts['usage_count'] == 2
+    assert counts['failure_count'] == 1
+    assert counts['success_rate'] == 0.0
+    assert store.get('CIRCLE')['description'] == '画圆'
+    assert store.get('LINE') is None
+    store.record_usage('')
+    assert store.stats()['total_usage'] == 2
+
+
+def test_top_lists_refresh_on_flush(store):
+    for command, uses in (('A', 3), ('B', 1), ('C', 2), ('D', 5)):
+        for _ in range(uses):
+            store.record_usage(command, 'lisp' if command in 'AB' else 'basic')
+    assert store.top() == []  # 热门列表在写入后刷新
+    assert store.flush() == 4
+    assert [entry['command'] for entry in store.top(limit=10)] == ['D', 'A', 'C']  # 最多 top_n 条
+    assert [entry['command'] for entry in store.top(category='lisp')] == ['A', 'B']
+    assert [entry['command'] for entry in store.top(keyword='c')] == ['C']
+
+
+def test_namespace_lists_merge_with_shared(store):
+    store.record_usage('SHARED', namespace='')
+    store.record_usage('TEAM', namespace='team-a')
+    store.record_usage('TEAM', namespace='team-a')
+    store.record_usage('OTHER', namespace='team-b')
+    store.flush()
+    assert [entry['command'] for entry in store.top(namespace='team-a')] == ['TEAM', 'SHARED']
+    assert [entry['command'] for entry in store.top()] == ['SHARED']
+
+
+def test_prior_reorders_results(store):
+    for _ in range(10):
+        store.record_usage('POPULAR')
+    store.record_feedback('POPULAR', success=True)
+    store.record_feedback('BAD', success=False)
+    store.record_feedback('BAD', success=False)
+    assert store.prior('UNKNOWN') == 0.25
+    assert store.prior('BAD') < 0.25 < store.prior('POPULAR')
+
+    results = [{'command': 'BAD', 'similarity': 0.80}, {'command': 'POPULAR', 'similarity': 0.75}]
+    ranked = store.apply_prior(results, weight=0.2)
+    assert [cmd['command'] for cmd in ranked] == ['POPULAR', 'BAD']
+    assert ranked[0]['similarity'] == 0.75
+    assert ranked[0]['score'] == pytest.approx(0.75 + 0.2 * ranked[0]['popularity'], abs=1e-4)
+    assert [cmd['command'] for cmd in store.apply_prior(results, weight=0.0)] == ['BAD', 'POPULAR']
+
+
+def test_counts_persist_across_restart(tmp_path):
+    path = str(tmp_path / 'popularity.db')
+    store = PopularityStore(path, flush_interval=60)
+    store.record_usage('CIRCLE', 'basic', '画圆')
+    store.record_feedback('CIRCLE', success=True, feedback='好用')
+    store.close()
+
+    feedback = sqlite3.connect(path).execute('SELECT command, success, feedback FROM feedback').fetchall()
+    assert feedback == [('CIRCLE', 1, '好用')]
+    reopened = PopularityStore(path, flush_interval=60)
+    try:
+        assert reopened.get('CIRCLE')['usage_count'] == 1
+        assert [entry['command'] for entry in reopened.top()] == ['CIRCLE']
+    finally:
+        reopened.close()
@@ -0,0 +1,95 @@
+import itertools
+
+import pytest
+
+from aliserver import query_embedding_cache
+from aliserver.query_embedding_cache import CachedQueryEmbeddings, QueryEmbeddingCache, normalize_query
+
+MODEL = 'text-embedding-v2'
+VECTOR = [0.25, -0.5, 1.0]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'query_embeddings.sqlite3')
+
+
+def test_hit_survives_restart(db_path):
+    cache = QueryEmbeddingCache(db_path)
+    assert cache.get(MODEL, '画一个圆') is None
+    cache.put(MODEL, '画一个圆', VECTOR)
+    cache.close()
+
+    reopened = QueryEmbeddingCache(db_path)
+    try:
+        assert reopened.get(MODEL, '画一个圆') == VECTOR
+        assert reopened.stats()['entries'] == 1
+        assert reopened.stats()['hits'] == 1
+    finally:
+        reopened.close()
+
+
+def test_same_query_with_other_model_misses(db_path):
+    cache = QueryEmbeddingCache(db_path)
+    try:
+        cache.put(MODEL, '画一个圆', VECTOR)
+        assert cache.get('text-embedding-v3', '画一个圆') is None
+        assert cache.get(MODEL, '画一个圆') == VECTOR
+        assert cache.stats()['misses'] == 1
+    finally:
+        cache.close()
+
+
+def test_width_case_and_whitespace_variants_share_key(db_path):
+    assert normalize_query('  ＬＩＮＥ　画线 ') == normalize_query('line 画线')
+    cache = QueryEmbeddingCache(db_path)
+    try:
+        cache.put(MODEL, 'Draw  ＣＩＲＣＬＥ', VECTOR)
+        assert cache.get(MODEL, 'draw circle') == VECTOR
+        assert cache.get(MODEL, 'ＤＲＡＷ　Circle') == VECTOR
+        assert cache.stats()['entries'] == 1
+    finally:
+        cache.close()
+
+
+def test_oldest_entries_are_evicted_past_cap(db_path, monkeypatch):
+    # 每次读取时钟都更晚，淘汰顺序确定
+    clock = itertools.count(1_000_000)
+    monkeypatch.setattr(query_embedding_cache.time, 'time', lambda: float(next(clock)))
+    cache = QueryEmbeddingCache(db_path, max_entries=10)
+    try:
+        for i in range(10):
+            cache.put(MODEL, f'查询{i}', VECTOR)
+        # 最早写入的条目被再次使用，淘汰时保留
+        assert cache.get(MODEL, '查询0') == VECTOR
+        cache.put(MODEL, '查询10', VECTOR)
+
+        # 超出容量后淘汰到 90%，最久未使用的先淘汰
+        assert cache.stats()['entries'] == 9
+        assert cache.get(MODEL, '查询1') is None
+        assert cache.get(MODEL, '查询2') is None
+        assert cache.get(MODEL, '查询0') == VECTOR
+        assert cache.get(MODEL, '查询10') == VECTOR
+    finally:
+        cache.close()
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.queries = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return VECTOR
+
+
+def test_cached_embeddings_call_model_once_per_query(db_path):
+    cache = QueryEmbeddingCache(db_path)
+    embeddings = CountingEmbeddings()
+    try:
+        cached = CachedQueryEmbeddings(embeddings, MODEL, cache)
+        assert cached.embed_query('画一个圆') == VECTOR
+        assert cached.embed_query('画一个圆 ') == VECTOR
+        assert embeddings.queries == ['画一个圆']
+    finally:
+        cache.close()
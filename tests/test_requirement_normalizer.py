@@ -0,0 +1,77 @@
+import pytest
+
+from requirement_normalizer import PLACEHOLDER, bind_parameters, normalize_requirement
+
+
+def test_parameters_and_spacing_share_template():
+    assert normalize_requirement('画一个半径为50的圆') == ('画一个半径为#的圆', [50])
+    assert normalize_requirement('画一个半径为 60.5 的圆。') == ('画一个半径为#的圆', [60.5])
+
+
+def test_full_width_and_case_are_normalized():
+    assert normalize_requirement('画一个半径为５０ＭＭ的圆')[0] == normalize_requirement('画一个半径为50mm的圆')[0]
+
+
+def test_dimensions_are_two_parameters():
+    for text in ('50x30的矩形', '50*30的矩形', '50 × 30 的矩形'):
+        assert normalize_requirement(text) == ('#x#的矩形', [50, 30])
+
+
+@pytest.mark.parametrize('text', ['画3d实体', '升级到r2018', '用2p画圆'])
+def test_numbers_inside_names_stay_in_template(text):
+    template, parameters = normalize_requirement(text)
+    assert PLACEHOLDER not in template
+    assert parameters == []
+
+
+@pytest.mark.parametrize('first, second', [
+    ('3点画圆', '2点画圆'),
+    ('画6边形', '画5边形'),
+    ('画 3 个圆', '画 4 个圆'),
+    ('阵列4行5列', '阵列3行5列'),
+    ('把线段4等分', '把线段3等分'),
+])
+def test_counts_stay_in_template(first, second):
+    assert normalize_requirement(first)[0] != normalize_requirement(second)[0]
+    assert normalize_requirement(first)[1] == []
+
+
+def test_punctuation_only_gives_empty_template():
+    assert normalize_requirement('，。 ！') == ('', [])
+
+
+def test_bind_parameters_returns_copy_with_parameters():
+    cached = {'matched': True, 'command': 'CIRCLE', 'parameters': [50]}
+    bound = bind_parameters(cached, '画一个半径为60的圆', [60])
+    assert bound == {'matched': True, 'command': 'CIRCLE', 'requirement': '画一个半径为60的圆', 'parameters': [60]}
+    assert cached['parameters'] == [50]
+
+
+def test_bind_parameters_rebinds_text_from_other_requirement():
+    # 缓存的结果来自另一条模板相同的需求，不能带回那条需求的原文和数值
+    cached = {
+        'requirement': '画一个半径为50的圆',
+        'matched': True,
+        'result': {
+            'reason': '需求“画一个半径为50的圆”匹配 CIRCLE',
+            'query': '画一个半径为 50 的圆。',
+            'rag_results': [{'command': 'CIRCLE', 'description': '画圆', 'similarity': 0.9}]
+        }
+    }
+    bound = bind_parameters(cached, '画一个半径为60的圆', [60])
+    assert bound['requirement'] == '画一个半径为60的圆'
+    assert bound['parameters'] == [60]
+    assert bound['result']['reason'] == '需求“画一个半径为60的圆”匹配 CIRCLE'
+    assert bound['result']['query'] == '画一个半径为60的圆'
+    assert bound['result']['rag_results'] == cached['result']['rag_results']
+    assert '50' not in str(bound)
+    # 缓存中的结果不变
+    assert cached['requirement'] == '画一个半径为50的圆'
+    assert cached['result']['reason'] == '需求“画一个半径为50的圆”匹配 CIRCLE'
+
+
+def test_bind_parameters_with_same_parameters_only_replaces_echo():
+    cached = {'requirement': '画圆', 'result': {'query': '画圆', 'description': '画圆命令'}}
+    bound = bind_parameters(cached, '画 圆', [])
+    assert bound['requirement'] == '画 圆'
+    assert bound['result'] == {'query': '画 圆', 'description': '画圆命令'}
@@ -0,0 +1,102 @@
+import json
+import zlib
+
+import numpy as np
+import pytest
+from flask import Flask, Response, jsonify, stream_with_context
+
+from server_common.responses import (SERVER_TIMING_HEADER, enable_compression, enable_server_timing,
+                                     install_fast_json, record_timing)
+
+ROWS = 50
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    install_fast_json(app)
+    enable_server_timing(app)
+    enable_compression(app, min_size=64)
+
+    @app.route('/json')
+    def json_view():
+        record_timing('search', 1.5)
+        record_timing('search', 1.0)
+        return jsonify({'名称': '圆', 'score': np.float32(0.5), 'vector': np.arange(3), 'pad': 'x' * 200})
+
+    @app.route('/small')
+    def small():
+        response = jsonify(ok=True)
+        response.set_etag('abc')
+        return response
+
+    @app.route('/stream')
+    def stream():
+        def generate():
+            for i in range(ROWS):
+                yield json.dumps({'id': i, 'command': f'CMD{i}'}) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    return app
+
+
+def test_jsonify_handles_numpy_and_keeps_chinese(app):
+    response = app.test_client().get('/json')
+    body = response.get_data(as_text=True)
+    assert '名称' in body
+    data = json.loads(body)
+    assert data['score'] == 0.5 and data['vector'] == [0, 1, 2]
+
+
+def test_jsonify_arguments_follow_flask(app):
+    with app.app_context():
+        assert app.json.loads(jsonify(1, 2).get_data()) == [1, 2]
+        assert app.json.loads(jsonify(a=1).get_data()) == {'a': 1}
+        assert app.json.loads(jsonify().get_data()) is None
+        assert app.json.dumps({'b': 1, 'a': 2}) == '{"b":1,"a":2}'
+        assert app.json.dumps({'a': 1}, separators=(', ', ': ')) == '{"a": 1}'
+
+
+def test_server_timing_lists_recorded_stages_and_total(app):
+    header = app.test_client().get('/json').headers[SERVER_TIMING_HEADER]
+    stages = dict(part.split(';dur=') for part in header.split(', '))
+    assert float(stages['search']) == 2.5
+    assert float(stages['total']) >= 0
+
+
+def test_large_json_is_gzipped_small_is_not(app):
+    client = app.test_client()
+    response = client.get('/json', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(zlib.decompress(response.get_data(), 16 + zlib.MAX_WBITS))['名称'] == '圆'
+
+    small = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+    assert small.headers['ETag'] == '"abc"'
+
+
+def test_deflate_weakens_strong_etag(app):
+    def large():
+        response = jsonify(pad='y' * 500)
+        response.set_etag('abc')
+        return response
+
+    app.view_functions['small'] = large
+    response = app.test_client().get('/small', headers={'Accept-Encoding': 'deflate'})
+    assert response.headers['Content-Encoding'] == 'deflate'
+    assert response.headers['ETag'] == 'W/"abc"'
+    assert json.loads(zlib.decompress(response.get_data()))['pad'] == 'y' * 500
+
+
+def test_streamed_rows_decompress_as_they_arrive(app):
+    response = app.test_client().get('/stream', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    rows = []
+    for chunk in response.response:
+        text = decompressor.decompress(chunk).decode('utf-8')
+        if text:
+            rows.append(json.loads(text))
+    # 每个压缩块都能立即解压出完整的一行，而不是在最后一块中一次性给出
+    assert [row['id'] for row in rows] == list(range(ROWS))
+    response.close()
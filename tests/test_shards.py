@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+from flask import Flask, request
+
+from server_common.shards import NAMESPACE_HEADER, ShardCache, parse_namespace, request_namespace
+
+
+def test_parse_namespace():
+    assert parse_namespace(None) == ''
+    assert parse_namespace('  ') == ''
+    assert parse_namespace(' team-a.v2 ') == 'team-a.v2'
+    for bad in ('-team', 'team a', 'x' * 65, '团队'):
+        with pytest.raises(ValueError):
+            parse_namespace(bad)
+
+
+def test_request_namespace_sources():
+    app = Flask(__name__)
+    with app.test_request_context(headers={NAMESPACE_HEADER: 'hdr'}, query_string={'namespace': 'arg'}):
+        assert request_namespace(request, {'namespace': 'body'}) == 'hdr'
+    with app.test_request_context(query_string={'namespace': 'arg'}):
+        assert request_namespace(request, {'namespace': 'body'}) == 'arg'
+    with app.test_request_context():
+        assert request_namespace(request, {'namespace': 'body'}) == 'body'
+        assert request_namespace(request) == ''
+
+
+def test_concurrent_gets_load_once():
+    release = threading.Event()
+    loads = []
+
+    def loader(namespace):
+        loads.append(namespace)
+        release.wait(5)
+        return {'namespace': namespace}
+
+    cache = ShardCache(loader)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('team-a'))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert loads == ['team-a']
+    assert results == [{'namespace': 'team-a'}] * 3
+    assert cache.get('team-a') is results[0]
+    assert cache.stats()['total_loads'] == 1
+
+
+def test_invalidate_reloads():
+    version = {'n': 0}
+
+    def loader(namespace):
+        version['n'] += 1
+        return version['n']
+
+    cache = ShardCache(loader)
+    assert cache.get('a') == 1
+    assert cache.get('a') == 1
+    cache.invalidate('a')
+    assert cache.get('a') == 2
+
+
+def test_evicts_least_recently_used_and_idle():
+    cache = ShardCache(lambda namespace: namespace.upper(), max_loaded=2, idle_seconds=0.05)
+    cache.get('a')
+    cache.get('b')
+    cache.get('a')
+    cache.get('c')  # b 最久未使用
+    assert cache.stats()['loaded'] == ['a', 'c']
+    time.sleep(0.1)
+    assert cache.evict_idle() == 2
+    assert cache.stats()['loaded'] == []
+    assert cache.stats()['evicted'] == 3
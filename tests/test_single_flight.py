@@ -0,0 +1,142 @@
+import threading
+import time
+
+import pytest
+
+from server_common.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn(flight):
+        calls.append(1)
+        release.wait(5)
+        return ['圆']
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do('画圆', fn, deadline=time.monotonic() + 5)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while flights.stats()['executed'] + flights.stats()['shared'] < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert all(result == ['圆'] for result, _ in results)
+    stats = flights.stats()
+    assert stats['executed'] == 1 and stats['shared'] == 3 and stats['in_flight'] == 0
+    assert stats['saved_ratio'] == 0.75
+
+
+def test_finished_call_is_not_cached():
+    flights = SingleFlight()
+    assert flights.do('k', lambda flight: 1) == (1, False)
+    assert flights.do('k', lambda flight: 2) == (2, False)
+
+
+def test_error_is_passed_to_all_waiters():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def fn(flight):
+        release.wait(5)
+        raise RuntimeError('嵌入失败')
+
+    errors = []
+
+    def call():
+        try:
+            flights.do('k', fn, deadline=time.monotonic() + 5)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while flights.stats()['shared'] < 1:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert errors == ['嵌入失败', '嵌入失败']
+
+
+def test_leader_timeout_does_not_fail_followers():
+    # 先到的请求截止时间很短，后到的请求仍应拿到同一次调用的结果
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def fn(flight):
+        release.wait(5)
+        return 'ok'
+
+    with pytest.raises(TimeoutError):
+        flights.do('k', fn, deadline=time.monotonic() + 0.05)
+    assert flights.stats()['in_flight'] == 1
+
+    follower = []
+    thread = threading.Thread(target=lambda: follower.append(flights.do('k', lambda flight: 'again', deadline=time.monotonic() + 5)))
+    thread.start()
+    while flights.stats()['shared'] < 1:
+        time.sleep(0.01)
+    release.set()
+    thread.join(5)
+
+    assert follower == [('ok', True)]
+    assert flights.stats()['executed'] == 1
+
+
+def test_flight_deadline_is_latest_among_waiters():
+    flights = SingleFlight()
+    release = threading.Event()
+    seen = {}
+    now = time.monotonic()
+
+    def fn(flight):
+        release.wait(5)
+        seen['deadline'] = flight.deadline()
+        return 'ok'
+
+    threads = [threading.Thread(target=flights.do, args=('k', fn), kwargs={'deadline': now + d})
+               for d in (3, 5)]
+    for thread in threads:
+        thread.start()
+    while flights.stats()['shared'] < 1:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert seen['deadline'] == now + 5
+
+    # 有不限时的请求在等待时不限制
+    assert flights.do('k', lambda flight: flight.deadline(), deadline=None) == (None, False)
+
+
+def test_abandoned_call_stops_early():
+    # 所有等待的请求都超时放弃后，被执行的函数看到已过期的截止时间并提前结束
+    flights = SingleFlight()
+    stopped = threading.Event()
+    steps = []
+
+    def fn(flight):
+        while not flight.abandoned:
+            steps.append(1)
+            time.sleep(0.01)
+        assert flight.deadline() <= time.monotonic()
+        stopped.set()
+
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        flights.do('k', fn, deadline=time.monotonic() + 0.05)
+    assert stopped.wait(1)
+    assert time.monotonic() - started < 1
+    assert steps
+    while flights.stats()['in_flight']:
+        time.sleep(0.01)
@@ -0,0 +1,139 @@
+import os
+
+import pytest
+
+from server_common.blob_store import BlobStore
+from server_common.user_code_store import UserCodeStore, record_etag
+
+CODE = '(defun c:QQ () (princ))'
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = UserCodeStore(str(tmp_path / 'codes.sqlite3'), BlobStore(str(tmp_path / 'blobs')))
+    yield store
+    store.close()
+
+
+def test_blob_store_is_content_addressed(tmp_path):
+    blobs = BlobStore(str(tmp_path))
+    digest = blobs.put(CODE)
+    assert blobs.put(CODE) == digest
+    assert blobs.read(digest) == CODE
+    assert blobs.path(digest).endswith(os.path.join(digest[:2], digest[2:4], digest + '.lsp'))
+    with pytest.raises(ValueError):
+        blobs.path('../../etc/passwd')
+
+
+def test_repeated_save_returns_existing_record(store):
+    first, created = store.save_code('QQ', '画星形', CODE)
+    again, created_again = store.save_code('QQ', '画星形', CODE)
+    assert created and not created_again
+    assert again['id'] == first['id']
+    assert store.count() == 1
+    assert store.read_code(store.get(first['id'])) == CODE
+
+
+def test_version_counts_changes_per_namespace(store):
+    assert store.version('') == 0
+    record, _ = store.save_code('QQ', '画星形', CODE)
+    store.save_code('QQ', '画星形', CODE)
+    store.save_code('QQ', '画星形', CODE, namespace='team-a')
+    assert store.version('') == 1
+    assert store.version('team-a') == 1
+    store.delete(record['id'])
+    assert store.version('') == 2
+    assert store.namespaces() == {'team-a': 1}
+
+
+def test_iter_codes_pages_in_save_order(store):
+    ids = [store.save_code(f'C{i}', f'命令{i}', f'(defun c:C{i} () {i})')[0]['id'] for i in range(5)]
+    assert [row['id'] for row in store.iter_codes(1, 2)] == ids[1:3]
+    assert [row['id'] for row in store.iter_codes(3)] == ids[3:]
+    assert 'code' not in next(store.iter_codes())
+
+
+def test_latest_by_command_prefers_namespace(store):
+    store.save_code('QQ', '共享版本', CODE)
+    store.save_code('qq', '团队版本', CODE + ' ', namespace='team-a')
+    assert store.latest_by_command('QQ', ('team-a', ''))['description'] == '团队版本'
+    assert store.latest_by_command('QQ', ('team-b', ''))['description'] == '共享版本'
+    assert store.latest_by_command('XX', ('',)) is None
+
+
+def test_delete_removes_blob_only_when_unreferenced(store):
+    first, _ = store.save_code('QQ', '画星形', CODE)
+    second, _ = store.save_code('QQ2', '另一个命令', CODE)
+    path = store.blobs.path(first['blob'])
+
+    store.delete(first['id'])
+    assert os.path.exists(path)
+    store.delete(second['id'])
+    assert not os.path.exists(path)
+    assert store.delete(second['id']) is None
+
+
+def test_record_etag_differs_for_records_sharing_a_blob(store):
+    first, _ = store.save_code('QQ', '画星形', CODE)
+    second, _ = store.save_code('QQ', '画五角星', CODE)
+    assert first['blob'] == second['blob']
+    assert record_etag(first) != record_etag(second)
+    assert record_etag(first).endswith(first['blob'])
+    assert record_etag({'id': 'legacy', 'blob': None}) is None
+
+
+def blob_files(store):
+    return [name for _, _, files in os.walk(store.blobs.root) for name in files]
+
+
+def test_save_codes_writes_batch_and_skips_duplicates(store):
+    existing, _ = store.save_code('QQ', '画星形', CODE)
+    items = [
+        {'command': 'QQ', 'description': '画星形', 'code': CODE},
+        {'command': 'A1', 'description': '命令一', 'code': '(defun c:A1 () 1)'},
+        {'command': 'A1', 'description': '命令一', 'code': '(defun c:A1 () 1)'},
+    ]
+    results = store.save_codes(items)
+    assert [created for _, created in results] == [False, True, False]
+    assert results[0][0]['id'] == existing['id']
+    assert results[1][0]['id'] == results[2][0]['id']
+    assert store.count() == 2
+    assert store.version('') == 2
+
+
+def test_failed_batch_leaves_no_orphan_blobs(store, monkeypatch):
+    store.save_code('QQ', '画星形', CODE)
+    before = sorted(blob_files(store))
+
+    def fail(conn, namespace):
+        raise RuntimeError('写入失败')
+
+    monkeypatch.setattr('server_common.user_code_store._bump_version', fail)
+    items = [{'command': 'QQ2', 'description': '同一份代码', 'code': CODE},
+             {'command': 'NEW', 'description': '新代码', 'code': '(defun c:NEW () 1)'}]
+    with pytest.raises(RuntimeError):
+        store.save_codes(items)
+    with pytest.raises(RuntimeError):
+        store.save_code('NEW', '新代码', '(defun c:NEW () 2)')
+
+    # 已被其他记录引用的文件保留，本次新建的文件删除
+    assert sorted(blob_files(store)) == before
+    assert store.count() == 1
+
+
+def test_import_txt_keeps_multiline_legacy_code(store, tmp_path):
+    # 百炼服务端按 f"{code_id}|{command}|{description}||{code}\n" 写入，多行代码的后续行不能丢
+    code = '(defun c:RECT2 ()\n  (command "RECTANG" pause pause)\n\n  (princ)\n)'
+    path = tmp_path / 'user_codes.txt'
+    path.write_text(
+        f"a1|RECT2|两点矩形||{code}\n"
+        f"a2|QQ|单行||{CODE}\n"
+        "a3|OLD|本地服务端|code_a3.lsp|2024-01-01 12:00:00\n",
+        encoding='utf-8'
+    )
+    assert store.import_txt(str(path)) == 3
+    assert store.read_code(store.get('a1')) == code
+    assert store.read_code(store.get('a2')) == CODE
+    assert store.get('a3')['created_at'] == '2024-01-01 12:00:00'
+    # 每个文件只导入一次
+    assert store.import_txt(str(path)) == 0